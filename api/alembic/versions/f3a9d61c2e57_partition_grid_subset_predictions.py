@@ -0,0 +1,89 @@
+"""Partition grid subset predictions
+
+Revision ID: f3a9d61c2e57
+Revises: e2d7a4c91b38
+Create Date: 2023-05-22 09:42:10.517384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d61c2e57'
+down_revision = 'e2d7a4c91b38'
+branch_labels = None
+depends_on = None
+
+TABLE = 'model_run_grid_subset_predictions'
+COLUMNS = ('id, prediction_model_run_timestamp_id, prediction_model_grid_subset_id, prediction_timestamp, '
+           'tmp_tgl_2, rh_tgl_2, apcp_sfc_0, wdir_tgl_10, wind_tgl_10')
+
+
+def create_table(primary_key, **kwargs):
+    """ Create the grid subset predictions table (without indexes or constraints other than the primary key) """
+    op.create_table(TABLE,
+                    sa.Column('id', sa.Integer(), nullable=False,
+                              server_default=sa.text(f"nextval('{TABLE}_id_seq'::regclass)")),
+                    sa.Column('prediction_model_run_timestamp_id', sa.Integer(), nullable=False),
+                    sa.Column('prediction_model_grid_subset_id', sa.Integer(), nullable=False),
+                    sa.Column('prediction_timestamp', sa.TIMESTAMP(timezone=True), nullable=False),
+                    sa.Column('tmp_tgl_2', postgresql.ARRAY(sa.Float()), nullable=True),
+                    sa.Column('rh_tgl_2', postgresql.ARRAY(sa.Float()), nullable=True),
+                    sa.Column('apcp_sfc_0', postgresql.ARRAY(sa.Float()), nullable=True),
+                    sa.Column('wdir_tgl_10', postgresql.ARRAY(sa.Float()), nullable=True),
+                    sa.Column('wind_tgl_10', postgresql.ARRAY(sa.Float()), nullable=True),
+                    sa.PrimaryKeyConstraint(*primary_key),
+                    comment='The prediction for a grid subset of a particular model run.',
+                    **kwargs)
+
+
+def create_constraints():
+    """ Create the foreign keys, unique constraint and indexes of the grid subset predictions table """
+    op.create_unique_constraint(None, TABLE, [
+        'prediction_model_run_timestamp_id', 'prediction_model_grid_subset_id', 'prediction_timestamp'])
+    op.create_foreign_key(None, TABLE, 'prediction_model_run_timestamps',
+                          ['prediction_model_run_timestamp_id'], ['id'])
+    op.create_foreign_key(None, TABLE, 'prediction_model_grid_subsets', ['prediction_model_grid_subset_id'], ['id'])
+    for column in ('id', 'prediction_model_grid_subset_id', 'prediction_model_run_timestamp_id',
+                   'prediction_timestamp'):
+        op.create_index(op.f(f'ix_{TABLE}_{column}'), TABLE, [column], unique=False)
+
+
+def swap_table(primary_key, **kwargs):
+    """ Replace the grid subset predictions table with a new one, copying the predictions over """
+    op.rename_table(TABLE, f'{TABLE}_old')
+    # The sequence would be dropped along with the old table.
+    op.execute(f'ALTER SEQUENCE {TABLE}_id_seq OWNED BY NONE')
+    create_table(primary_key, **kwargs)
+    if 'postgresql_partition_by' in kwargs:
+        # A partition per week (starting on a Monday, UTC), from the oldest prediction to three weeks
+        # ahead, after which the jobs create them as needed.
+        op.execute(f"""
+            DO $$
+            DECLARE
+                week TIMESTAMP;
+            BEGIN
+                week := date_trunc('week',
+                    COALESCE((SELECT MIN(prediction_timestamp) FROM {TABLE}_old), now()) AT TIME ZONE 'UTC');
+                WHILE week <= date_trunc('week', now() AT TIME ZONE 'UTC') + INTERVAL '3 weeks' LOOP
+                    EXECUTE format('CREATE TABLE %I PARTITION OF {TABLE} FOR VALUES FROM (%L) TO (%L)',
+                                   '{TABLE}_p' || to_char(week, 'YYYYMMDD'),
+                                   week AT TIME ZONE 'UTC', (week + INTERVAL '1 week') AT TIME ZONE 'UTC');
+                    week := week + INTERVAL '1 week';
+                END LOOP;
+            END $$""")
+    op.execute(f'INSERT INTO {TABLE} ({COLUMNS}) SELECT {COLUMNS} FROM {TABLE}_old')
+    # Dropping the old table (and its partitions) frees up the names of its indexes and constraints.
+    op.drop_table(f'{TABLE}_old')
+    op.execute(f'ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id')
+    create_constraints()
+
+
+def upgrade():
+    # The partition key has to be part of the primary key.
+    swap_table(['id', 'prediction_timestamp'], postgresql_partition_by='RANGE (prediction_timestamp)')
+
+
+def downgrade():
+    swap_table(['id'])
@@ -0,0 +1,216 @@
+""" Calculate fire behaviour (ROS, HFI and CFB) for every pixel of the SFMS fuel type layer, from gridded
+fire weather inputs.
+
+SFMS uploads the HFI rasters that we classify (see classify_hfi.py), so we can't produce HFI for a day, or a
+what-if scenario, that SFMS hasn't. This module produces an equivalent GeoTIFF of our own: the FBP equations
+in app.fire_behaviour.fbp are evaluated with numpy, one window of the fuel type raster at a time, so that
+memory use is bounded no matter the size of the raster.
+
+Weather rasters (BUI, FFMC, wind speed and optionally ISI) need not be on the same grid as the fuel type
+raster, they are warped (lazily, window by window) to match it.
+"""
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+import json
+import logging
+import os
+from time import perf_counter
+import numpy as np
+from osgeo import gdal
+from pyproj import CRS, Transformer
+from app import config
+from app.fire_behaviour import fbp
+from app.fire_behaviour.fuel_types import FUEL_TYPE_DEFAULTS, FuelTypeEnum
+from app.geospatial import NAD83_CRS
+
+logger = logging.getLogger(__name__)
+
+# Value written for pixels without fire behaviour (non fuel, water, missing weather etc.). process_hfi
+# classifies anything below 4000 kW/m as no advisory, so these pixels are ignored.
+NODATA = -1
+DEFAULT_BLOCK_SIZE = 1024
+
+# The fuel type of each value of the fuel type raster (fbp2021.tif), as used by SFMS.
+SFMS_FUEL_TYPE_LOOKUP_TABLE = os.path.join(os.path.dirname(__file__), '..', 'data',
+                                           'bc_fbp_fuel_type_lookup_table_sfms.json')
+
+
+def load_sfms_fuel_types(filename: str = SFMS_FUEL_TYPE_LOOKUP_TABLE) -> Dict[int, FuelTypeEnum]:
+    """ Load the fuel type of each value of the fuel type raster from the SFMS lookup table. Values that stand
+    for more than one fuel type (D-1/D-2, O-1a/O-1b, M-1/M-2) are calculated as the first of them, with the
+    default percentage conifer. Values that aren't a fuel type (non fuel, water) have no fire behaviour. """
+    with open(filename, encoding='utf-8') as file:
+        entries = json.load(file)
+    fuel_types = {}
+    for entry in entries:
+        name = entry['fuel_type'].split('/')[0].replace('-', '').upper()
+        if name in FuelTypeEnum.__members__:
+            fuel_types[entry['grid_value']] = FuelTypeEnum[name]
+    return fuel_types
+
+
+SFMS_FUEL_TYPES: Dict[int, FuelTypeEnum] = load_sfms_fuel_types()
+
+
+class FireBehaviourWindow(NamedTuple):
+    """ Fire behaviour for a window of the fuel type raster, NODATA where it can't be calculated. """
+    ros: np.ndarray
+    hfi: np.ndarray
+    cfb: np.ndarray
+
+
+def _fuel_type_lookup(fuel_type_codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Map raster values to fuel types, returning the fuel type (as a string) of each pixel, and a mask
+    of the pixels with a known fuel type. """
+    fuel_types = np.full(fuel_type_codes.shape, '', dtype='<U3')
+    for code, fuel_type in SFMS_FUEL_TYPES.items():
+        fuel_types[fuel_type_codes == code] = fuel_type.value
+    return fuel_types, fuel_types != ''
+
+
+def _fuel_type_default(fuel_types: np.ndarray, name: str) -> np.ndarray:
+    """ Look up a fuel type default (e.g. PC, CBH) for each fuel type, NaN if there is none. """
+    values = np.full(fuel_types.shape, np.nan)
+    for fuel_type in np.unique(fuel_types):
+        default = FUEL_TYPE_DEFAULTS[FuelTypeEnum(fuel_type)].get(name)
+        if default is not None:
+            values[fuel_types == fuel_type] = default
+    return values
+
+
+def calculate_fire_behaviour_window(fuel_type_codes: np.ndarray,
+                                    bui: np.ndarray,
+                                    ffmc: np.ndarray,
+                                    wind_speed: np.ndarray,
+                                    fmc: np.ndarray,
+                                    grass_cure: float,
+                                    isi: Optional[np.ndarray] = None) -> FireBehaviourWindow:
+    """ Calculate ROS, HFI and CFB for a window of the fuel type raster, given weather arrays of the same
+    shape. Only pixels with a known fuel type and valid weather are evaluated. """
+    fuel_types, valid = _fuel_type_lookup(fuel_type_codes)
+    if isi is None:
+        isi = fbp.initial_spread_index(ffmc, wind_speed)
+    bui, ffmc, wind_speed, isi, fmc = (np.broadcast_to(fbp.as_array(value), fuel_type_codes.shape)
+                                       for value in (bui, ffmc, wind_speed, isi, fmc))
+    valid &= ~(np.isnan(bui) | np.isnan(ffmc) | np.isnan(isi) | np.isnan(fmc))
+
+    result = FireBehaviourWindow(*(np.full(fuel_type_codes.shape, NODATA, dtype=np.float32) for _ in range(3)))
+    if not valid.any():
+        return result
+    fuel_types = fuel_types[valid]
+    bui, ffmc, wind_speed, isi, fmc = (value[valid] for value in (bui, ffmc, wind_speed, isi, fmc))
+    pc, pdf, cbh, cfl = (_fuel_type_default(fuel_types, name) for name in ('PC', 'PDF', 'CBH', 'CFL'))
+    sfc = fbp.surface_fuel_consumption(fuel_types, bui, ffmc, pc)
+    ros = fbp.rate_of_spread(fuel_types, isi, bui, fmc, sfc, pc, grass_cure, pdf, cbh)
+    cfb = np.where(np.isin(fuel_types, fbp.NO_CROWN_FUEL_TYPES), 0.0,
+                   fbp.crown_fraction_burned(fuel_types, fmc, sfc, ros, cbh))
+    hfi = fbp.head_fire_intensity(fuel_types, pc, pdf, ros, cfb, cfl, sfc)
+    for target, values in zip(result, (ros, hfi, cfb)):
+        target[valid] = np.where(np.isnan(values), NODATA, values)
+    return result
+
+
+def _windows(x_size: int, y_size: int, block_size: int) -> Iterator[Tuple[int, int, int, int]]:
+    """ Yield (x offset, y offset, x size, y size) of the windows covering a raster. """
+    for y_offset in range(0, y_size, block_size):
+        for x_offset in range(0, x_size, block_size):
+            yield x_offset, y_offset, min(block_size, x_size - x_offset), min(block_size, y_size - y_offset)
+
+
+def _warp_to_match(source_path: str, reference: gdal.Dataset) -> gdal.Dataset:
+    """ Lazily (as a VRT) warp the source raster to the grid of the reference raster. """
+    x_min, pixel_width, _, y_max, _, pixel_height = reference.GetGeoTransform()
+    x_max = x_min + reference.RasterXSize * pixel_width
+    y_min = y_max + reference.RasterYSize * pixel_height
+    return gdal.Warp('', source_path, format='VRT', dstSRS=reference.GetProjection(),
+                     outputBounds=(x_min, y_min, x_max, y_max),
+                     width=reference.RasterXSize, height=reference.RasterYSize,
+                     resampleAlg=gdal.GRA_Bilinear, dstNodata=np.nan, outputType=gdal.GDT_Float32)
+
+
+def _read_window(dataset: gdal.Dataset, window: Tuple[int, int, int, int]) -> np.ndarray:
+    """ Read a window of the first band of a dataset as floats, with NaN for no data. """
+    band = dataset.GetRasterBand(1)
+    values = band.ReadAsArray(*window).astype(float)
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        values[values == nodata] = np.nan
+    return values
+
+
+def _window_lat_long(transformer: Transformer, geo_transform, window: Tuple[int, int, int, int]):
+    """ Latitude and longitude of the centre of every pixel in a window. """
+    x_offset, y_offset, x_size, y_size = window
+    x_min, pixel_width, _, y_max, _, pixel_height = geo_transform
+    x = x_min + (np.arange(x_offset, x_offset + x_size) + 0.5) * pixel_width
+    y = y_max + (np.arange(y_offset, y_offset + y_size) + 0.5) * pixel_height
+    x, y = np.meshgrid(x, y)
+    long, lat = transformer.transform(x, y)
+    return lat, long
+
+
+def calculate_fire_behaviour_raster(fuel_type_path: str,
+                                    bui_path: str,
+                                    ffmc_path: str,
+                                    wind_speed_path: str,
+                                    target_path: str,
+                                    day_of_year: int,
+                                    grass_cure: float,
+                                    isi_path: Optional[str] = None,
+                                    block_size: int = DEFAULT_BLOCK_SIZE):
+    """ Calculate fire behaviour for every pixel of the fuel type raster, writing a GeoTIFF on the fuel type
+    grid with HFI (kW/m) in band 1 (as the SFMS HFI rasters that process_hfi consumes), ROS (m/min) in band 2
+    and CFB in band 3.
+
+    :param day_of_year: The day of year that the weather is for, used for foliar moisture content.
+    :param grass_cure: Percentage grass curing, for O-1a/O-1b.
+    :param isi_path: Optional ISI raster, calculated from FFMC and wind speed if not given.
+    """
+    perf_start = perf_counter()
+    gdal.SetConfigOption('AWS_SECRET_ACCESS_KEY', config.get('OBJECT_STORE_SECRET'))
+    gdal.SetConfigOption('AWS_ACCESS_KEY_ID', config.get('OBJECT_STORE_USER_ID'))
+    gdal.SetConfigOption('AWS_S3_ENDPOINT', config.get('OBJECT_STORE_SERVER'))
+    gdal.SetConfigOption('AWS_VIRTUAL_HOSTING', 'FALSE')
+
+    fuel_type_tiff: gdal.Dataset = gdal.Open(fuel_type_path, gdal.GA_ReadOnly)
+    x_size, y_size = fuel_type_tiff.RasterXSize, fuel_type_tiff.RasterYSize
+    geo_transform = fuel_type_tiff.GetGeoTransform()
+    fuel_type_band = fuel_type_tiff.GetRasterBand(1)
+    weather = {name: _warp_to_match(path, fuel_type_tiff) for name, path in
+               (('bui', bui_path), ('ffmc', ffmc_path), ('wind_speed', wind_speed_path), ('isi', isi_path))
+               if path is not None}
+    transformer = Transformer.from_crs(CRS.from_wkt(fuel_type_tiff.GetProjection()), NAD83_CRS, always_xy=True)
+
+    output_driver = gdal.GetDriverByName('GTiff')
+    target_tiff = output_driver.Create(target_path, xsize=x_size, ysize=y_size, bands=3, eType=gdal.GDT_Float32,
+                                       options=['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'])
+    target_tiff.SetGeoTransform(geo_transform)
+    target_tiff.SetProjection(fuel_type_tiff.GetProjection())
+    target_bands = [target_tiff.GetRasterBand(band) for band in (1, 2, 3)]
+    for target_band in target_bands:
+        target_band.SetNoDataValue(NODATA)
+
+    for window in _windows(x_size, y_size, block_size):
+        fuel_type_codes = fuel_type_band.ReadAsArray(*window)
+        if not np.isin(fuel_type_codes, list(SFMS_FUEL_TYPES)).any():
+            # Nothing to burn (e.g. ocean), no need to read the weather.
+            result = FireBehaviourWindow(*(np.full(fuel_type_codes.shape, NODATA, dtype=np.float32)
+                                           for _ in range(3)))
+        else:
+            values = {name: _read_window(dataset, window) for name, dataset in weather.items()}
+            lat, long = _window_lat_long(transformer, geo_transform, window)
+            # No elevation, so the FMC is based on latitude and longitude alone.
+            fmc = fbp.foliar_moisture_content(lat, long, 0, day_of_year)
+            result = calculate_fire_behaviour_window(fuel_type_codes, values['bui'], values['ffmc'],
+                                                     values['wind_speed'], fmc, grass_cure, values.get('isi'))
+        for target_band, values in zip(target_bands, (result.hfi, result.ros, result.cfb)):
+            target_band.WriteArray(values, xoff=window[0], yoff=window[1])
+
+    # Important to make sure data is flushed to disk!
+    target_tiff.FlushCache()
+    # Explicit delete to make sure underlying resources are cleared up!
+    del target_bands
+    del target_tiff
+    del weather
+    del fuel_type_band
+    del fuel_type_tiff
+    logger.info('%f seconds to calculate fire behaviour raster %s', perf_counter() - perf_start, target_path)
@@ -21,8 +21,9 @@ import app.utils.time as time_utils
 from app.weather_models import ModelEnum, ProjectionEnum
 from app.geospatial import WGS84
 from app.jobs.env_canada import (get_model_run_hours,
-                                 get_file_date_part, adjust_model_day, download,
+                                 get_file_date_part, adjust_model_day,
                                  UnhandledPredictionModelType)
+from app.jobs.common_model_fetchers import download
 from app.utils.s3 import get_client
 from app.c_haines import get_severity_string
 from app.c_haines.c_haines_index import CHainesGenerator
@@ -1,8 +1,8 @@
 """ CRUD operations relating to observed readings (a.k.a "hourlies")
 """
 import datetime
-from typing import List
-from sqlalchemy import and_
+from typing import Dict, List
+from sqlalchemy import Integer, and_, column, func, values
 from sqlalchemy.orm import Session
 from app.db.models.weather_models import ModelRunGridSubsetPrediction, PredictionModelRunTimestamp
 from app.db.models.observations import HourlyActual
@@ -29,6 +29,14 @@ def get_hourly_actuals(
     return query
 
 
+def _prediction_partition_filter(start_date: datetime, end_date: datetime):
+    """ Conditions on the prediction timestamp of grid subset predictions joined to actuals in a date range.
+    They're implied by the join, but postgres only limits the query to the partitions of the predictions
+    in the date range if they're spelled out. """
+    return (ModelRunGridSubsetPrediction.prediction_timestamp >= start_date,
+            ModelRunGridSubsetPrediction.prediction_timestamp <= end_date)
+
+
 def get_actuals_left_outer_join_with_predictions(
         session: Session, model_id: int, grid_id: int, station_code: int,
         start_date: datetime, end_date: datetime):
@@ -39,7 +47,8 @@ def get_actuals_left_outer_join_with_predictions(
     return session.query(HourlyActual, ModelRunGridSubsetPrediction)\
         .outerjoin(ModelRunGridSubsetPrediction,
                    and_(ModelRunGridSubsetPrediction.prediction_timestamp == HourlyActual.weather_date,
-                        ModelRunGridSubsetPrediction.prediction_model_grid_subset_id == grid_id))\
+                        ModelRunGridSubsetPrediction.prediction_model_grid_subset_id == grid_id,
+                        *_prediction_partition_filter(start_date, end_date)))\
         .outerjoin(PredictionModelRunTimestamp,
                    and_(PredictionModelRunTimestamp.id ==
                         ModelRunGridSubsetPrediction.prediction_model_run_timestamp_id,
@@ -58,3 +67,43 @@ def save_hourly_actual(session: Session, hourly_actual: HourlyActual):
     """ Abstraction for writing HourlyActual to database. """
     session.add(hourly_actual)
     session.commit()
+
+
+def get_latest_actual_dates(session: Session, station_codes: List[int], start_date: datetime, end_date: datetime):
+    """ Get the date of the most recent valid actual of each station in the date range.
+    Yields (station_code, weather_date). """
+    return session.query(HourlyActual.station_code, func.max(HourlyActual.weather_date))\
+        .filter(HourlyActual.station_code.in_(station_codes))\
+        .filter(HourlyActual.weather_date >= start_date)\
+        .filter(HourlyActual.weather_date <= end_date)\
+        .filter(HourlyActual.temp_valid == True)\
+        .filter(HourlyActual.rh_valid == True)\
+        .group_by(HourlyActual.station_code)
+
+
+def get_actuals_paired_with_predictions(
+        session: Session, model_id: int, station_grids: Dict[int, int],
+        start_date: datetime, end_date: datetime):
+    """ Get the valid actuals of many stations in one query, each paired with the most recent prediction of
+    the model for the grid subset of the station (station_grids is station code -> grid subset id), or None
+    if there isn't one. Ordered by station and date. """
+    stations = values(column('station_code', Integer), column('grid_id', Integer), name='station_grids')\
+        .data(list(station_grids.items()))
+    return session.query(HourlyActual, ModelRunGridSubsetPrediction)\
+        .join(stations, stations.c.station_code == HourlyActual.station_code)\
+        .outerjoin(ModelRunGridSubsetPrediction,
+                   and_(ModelRunGridSubsetPrediction.prediction_timestamp == HourlyActual.weather_date,
+                        ModelRunGridSubsetPrediction.prediction_model_grid_subset_id == stations.c.grid_id,
+                        *_prediction_partition_filter(start_date, end_date)))\
+        .outerjoin(PredictionModelRunTimestamp,
+                   and_(PredictionModelRunTimestamp.id ==
+                        ModelRunGridSubsetPrediction.prediction_model_run_timestamp_id,
+                        PredictionModelRunTimestamp.prediction_model_id == model_id))\
+        .filter(HourlyActual.weather_date >= start_date)\
+        .filter(HourlyActual.temp_valid == True)\
+        .filter(HourlyActual.rh_valid == True)\
+        .filter(HourlyActual.weather_date <= end_date)\
+        .distinct(HourlyActual.station_code, HourlyActual.weather_date)\
+        .order_by(HourlyActual.station_code)\
+        .order_by(HourlyActual.weather_date)\
+        .order_by(PredictionModelRunTimestamp.prediction_run_timestamp.desc().nulls_last())
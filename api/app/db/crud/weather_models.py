@@ -2,17 +2,22 @@
 """
 import logging
 import datetime
-from typing import List, Union
-from sqlalchemy import or_, and_, func
+from typing import Dict, List, Tuple, Union
+from sqlalchemy import or_, and_, func, text
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 from app.weather_models import ModelEnum, ProjectionEnum
 from app.db.models.weather_models import (
     ProcessedModelRunUrl, PredictionModel, PredictionModelRunTimestamp, PredictionModelGridSubset,
-    ModelRunGridSubsetPrediction, WeatherStationModelPrediction)
+    ModelRunGridSubsetPrediction, ModelRunGridSubsetPredictionArray, WeatherStationModelPrediction,
+    PredictionModelStationGridIndex, PredictionModelBiasCoefficient)
 import app.utils.time as time_utils
 
 logger = logging.getLogger(__name__)
 
+# Grid subset predictions are partitioned on prediction timestamp, a partition per week.
+PREDICTION_PARTITION_DAYS = 7
+
 # --------------  COMMON UTILITY FUNCTIONS ---------------------------
 
 
@@ -117,24 +122,213 @@ def get_grids_for_coordinate(session: Session,
     return query
 
 
+def get_grid_subsets(session: Session, grid_subset_ids: List[int]) -> List[PredictionModelGridSubset]:
+    """ Get the grid subsets with the given ids. """
+    return session.query(PredictionModelGridSubset).\
+        filter(PredictionModelGridSubset.id.in_(grid_subset_ids))
+
+
+def get_station_grid_indexes(session: Session, prediction_model_id: int) -> List[PredictionModelStationGridIndex]:
+    """ Get the location of every station in the grid of the prediction model. """
+    return session.query(PredictionModelStationGridIndex).\
+        filter(PredictionModelStationGridIndex.prediction_model_id == prediction_model_id)
+
+
+def save_station_grid_indexes(session: Session,
+                              prediction_model_id: int,
+                              grid_geometry: str,
+                              station_grid_indexes: List[dict]):
+    """ Insert or update the location of stations in the grid of the prediction model, in a single statement.
+    Stations located in any other geometry of the grid are removed. Doesn't commit. """
+    session.query(PredictionModelStationGridIndex).\
+        filter(PredictionModelStationGridIndex.prediction_model_id == prediction_model_id).\
+        filter(PredictionModelStationGridIndex.grid_geometry != grid_geometry).\
+        delete()
+    if not station_grid_indexes:
+        return
+    stmt = insert(PredictionModelStationGridIndex).values(station_grid_indexes)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PredictionModelStationGridIndex.prediction_model_id,
+                        PredictionModelStationGridIndex.station_code],
+        set_={name: stmt.excluded[name] for name in station_grid_indexes[0]
+              if name not in ('prediction_model_id', 'station_code')})
+    session.execute(stmt)
+
+
 def get_model_run_predictions_for_grid(session: Session,
                                        prediction_run: PredictionModelRunTimestamp,
                                        grid: PredictionModelGridSubset) -> List:
-    """ Get all the predictions for a provided model run and grid. """
+    """ Get all the predictions for a provided model run and grid. The predictions of a model run are never
+    from before the run, which limits the query to the partitions from the run on. """
     logger.info("Getting model predictions for grid %s", grid)
     return session.query(ModelRunGridSubsetPrediction).\
         filter(ModelRunGridSubsetPrediction.prediction_model_grid_subset_id == grid.id).\
         filter(ModelRunGridSubsetPrediction.prediction_model_run_timestamp_id ==
-               prediction_run.id)
+               prediction_run.id).\
+        filter(ModelRunGridSubsetPrediction.prediction_timestamp >= prediction_run.prediction_run_timestamp)
+
+
+def upsert_model_run_grid_subset_predictions(session: Session,
+                                             prediction_model_run_timestamp_id: int,
+                                             prediction_timestamp: datetime.datetime,
+                                             predictions: Dict[int, Dict[str, List[float]]]):
+    """ Insert or update the predictions for many grid subsets in a single statement, without committing.
+    predictions is keyed on prediction_model_grid_subset_id, each value a dict of variable name to grid values
+    (e.g. {'tmp_tgl_2': [...], 'rh_tgl_2': [...]}). Only the variables given are updated on existing records. """
+    # All the rows of a multi-row insert have to have the same columns, so rows are grouped on the
+    # variables they carry.
+    groups: Dict[tuple, list] = {}
+    for grid_subset_id, variables in predictions.items():
+        row = dict(variables,
+                   prediction_model_run_timestamp_id=prediction_model_run_timestamp_id,
+                   prediction_model_grid_subset_id=grid_subset_id,
+                   prediction_timestamp=prediction_timestamp)
+        groups.setdefault(tuple(sorted(variables)), []).append(row)
+    for variable_names, rows in groups.items():
+        stmt = insert(ModelRunGridSubsetPrediction).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ModelRunGridSubsetPrediction.prediction_model_run_timestamp_id,
+                            ModelRunGridSubsetPrediction.prediction_model_grid_subset_id,
+                            ModelRunGridSubsetPrediction.prediction_timestamp],
+            set_={name: stmt.excluded[name] for name in variable_names})
+        session.execute(stmt)
+
+
+def get_model_run_grid_subset_predictions(session: Session, prediction_run: PredictionModelRunTimestamp):
+    """ Get all the grid subset predictions of a model run, ordered by grid subset and prediction timestamp. """
+    return session.query(ModelRunGridSubsetPrediction).\
+        filter(ModelRunGridSubsetPrediction.prediction_model_run_timestamp_id == prediction_run.id).\
+        filter(ModelRunGridSubsetPrediction.prediction_timestamp >= prediction_run.prediction_run_timestamp).\
+        order_by(ModelRunGridSubsetPrediction.prediction_model_grid_subset_id,
+                 ModelRunGridSubsetPrediction.prediction_timestamp)
 
 
-def delete_model_run_grid_subset_predictions(session: Session, older_than: datetime):
-    """ Delete any grid subset prediction older than a certain date.
-    """
-    logger.info('Deleting grid subset data older than %s...', older_than)
-    session.query(ModelRunGridSubsetPrediction)\
-        .filter(ModelRunGridSubsetPrediction.prediction_timestamp < older_than)\
-        .delete()
+def delete_model_run_grid_subset_predictions(session: Session, prediction_run: PredictionModelRunTimestamp):
+    """ Delete all the grid subset predictions of a model run, without committing. """
+    session.query(ModelRunGridSubsetPrediction).\
+        filter(ModelRunGridSubsetPrediction.prediction_model_run_timestamp_id == prediction_run.id).\
+        filter(ModelRunGridSubsetPrediction.prediction_timestamp >= prediction_run.prediction_run_timestamp).\
+        delete(synchronize_session=False)
+
+
+def get_model_run_grid_subset_prediction_array(
+        session: Session,
+        prediction_run: PredictionModelRunTimestamp,
+        grid: PredictionModelGridSubset) -> ModelRunGridSubsetPredictionArray:
+    """ Get the packed predictions of a model run for a grid subset (None if the run isn't packed). """
+    return session.query(ModelRunGridSubsetPredictionArray).\
+        filter(ModelRunGridSubsetPredictionArray.prediction_model_run_timestamp_id == prediction_run.id).\
+        filter(ModelRunGridSubsetPredictionArray.prediction_model_grid_subset_id == grid.id).first()
+
+
+def get_model_run_grid_subset_prediction_arrays_for_run(session: Session,
+                                                        prediction_run: PredictionModelRunTimestamp):
+    """ Get the packed predictions of a model run, for all of its grid subsets. """
+    return session.query(ModelRunGridSubsetPredictionArray).\
+        filter(ModelRunGridSubsetPredictionArray.prediction_model_run_timestamp_id == prediction_run.id)
+
+
+def get_model_run_grid_subset_prediction_arrays(session: Session,
+                                                prediction_model_id: int,
+                                                grid_subset_ids: List[int],
+                                                start_date: datetime.datetime,
+                                                end_date: datetime.datetime):
+    """ Get the packed predictions of the grid subsets, of all the runs of a model with predictions between
+    start_date and end_date. Yields (ModelRunGridSubsetPredictionArray, prediction run timestamp). """
+    return session.query(ModelRunGridSubsetPredictionArray, PredictionModelRunTimestamp.prediction_run_timestamp).\
+        join(PredictionModelRunTimestamp,
+             PredictionModelRunTimestamp.id == ModelRunGridSubsetPredictionArray.prediction_model_run_timestamp_id).\
+        filter(PredictionModelRunTimestamp.prediction_model_id == prediction_model_id).\
+        filter(PredictionModelRunTimestamp.prediction_run_timestamp <= end_date).\
+        filter(ModelRunGridSubsetPredictionArray.last_prediction_timestamp >= start_date).\
+        filter(ModelRunGridSubsetPredictionArray.prediction_model_grid_subset_id.in_(grid_subset_ids))
+
+
+def upsert_model_run_grid_subset_prediction_arrays(session: Session, arrays: List[Dict], batch_size: int = 1000):
+    """ Insert or update the packed predictions of grid subsets (dicts of column name to value), in batches,
+    without committing. """
+    for start in range(0, len(arrays), batch_size):
+        stmt = insert(ModelRunGridSubsetPredictionArray).values(arrays[start:start + batch_size])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ModelRunGridSubsetPredictionArray.prediction_model_run_timestamp_id,
+                            ModelRunGridSubsetPredictionArray.prediction_model_grid_subset_id],
+            set_={name: stmt.excluded[name] for name in ('prediction_timestamps', 'last_prediction_timestamp',
+                                                         'values')})
+        session.execute(stmt)
+
+
+def delete_model_run_grid_subset_prediction_arrays(session: Session, older_than: datetime.datetime):
+    """ Delete the packed predictions of the model runs that only predict for before a certain date. """
+    logger.info('Deleting packed grid subset data older than %s...', older_than)
+    session.query(ModelRunGridSubsetPredictionArray)\
+        .filter(ModelRunGridSubsetPredictionArray.last_prediction_timestamp < older_than)\
+        .delete(synchronize_session=False)
+
+
+def get_prediction_run_timestamps(session: Session, prediction_run_ids: List[int]) -> Dict[int, datetime.datetime]:
+    """ Get the run timestamps of prediction model runs, keyed on id. """
+    return dict(session.query(PredictionModelRunTimestamp.id, PredictionModelRunTimestamp.prediction_run_timestamp)
+                .filter(PredictionModelRunTimestamp.id.in_(prediction_run_ids)))
+
+
+def get_prediction_partition_start(timestamp: datetime.datetime) -> datetime.datetime:
+    """ Get the start of the partition of grid subset predictions a prediction timestamp falls in. Partitions
+    are a week long, starting on a Monday (UTC), the same as postgres' date_trunc('week', ...). """
+    timestamp = timestamp.astimezone(datetime.timezone.utc)
+    return datetime.datetime(timestamp.year, timestamp.month, timestamp.day, tzinfo=datetime.timezone.utc) - \
+        datetime.timedelta(days=timestamp.weekday())
+
+
+def get_prediction_partition_name(start: datetime.datetime) -> str:
+    """ Get the name of the partition of grid subset predictions starting at start. """
+    return f'{ModelRunGridSubsetPrediction.__tablename__}_p{start:%Y%m%d}'
+
+
+def get_model_run_grid_subset_prediction_partitions(session: Session) -> List[Tuple[str, datetime.datetime]]:
+    """ Get the partitions of the grid subset predictions, as (name, start of the partition). """
+    rows = session.execute(text(
+        'SELECT child.relname FROM pg_inherits '
+        'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+        'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+        'WHERE parent.relname = :table_name ORDER BY child.relname'),
+        {'table_name': ModelRunGridSubsetPrediction.__tablename__})
+    prefix = f'{ModelRunGridSubsetPrediction.__tablename__}_p'
+    return [(name, datetime.datetime.strptime(name[len(prefix):], '%Y%m%d').replace(tzinfo=datetime.timezone.utc))
+            for name, in rows if name.startswith(prefix)]
+
+
+def create_model_run_grid_subset_prediction_partitions(session: Session,
+                                                       start: datetime.datetime,
+                                                       end: datetime.datetime) -> List[str]:
+    """ Create the (weekly) partitions of the grid subset predictions from start up to end that don't exist yet,
+    without committing. Returns the names of the partitions created. """
+    existing = {name for name, _ in get_model_run_grid_subset_prediction_partitions(session)}
+    created = []
+    partition_start = get_prediction_partition_start(start)
+    while partition_start <= end:
+        partition_end = partition_start + datetime.timedelta(days=PREDICTION_PARTITION_DAYS)
+        name = get_prediction_partition_name(partition_start)
+        if name not in existing:
+            logger.info('Creating partition %s', name)
+            session.execute(text(
+                f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {ModelRunGridSubsetPrediction.__tablename__} '
+                f"FOR VALUES FROM ('{partition_start.isoformat()}') TO ('{partition_end.isoformat()}')"))
+            created.append(name)
+        partition_start = partition_end
+    return created
+
+
+def drop_model_run_grid_subset_prediction_partitions(session: Session, older_than: datetime.datetime) -> List[str]:
+    """ Detach and drop the partitions of the grid subset predictions that only hold predictions older than a
+    certain date, without committing. Returns the names of the partitions dropped. """
+    dropped = []
+    for name, start in get_model_run_grid_subset_prediction_partitions(session):
+        if start + datetime.timedelta(days=PREDICTION_PARTITION_DAYS) <= older_than:
+            logger.info('Dropping partition %s (grid subset data older than %s)', name, older_than)
+            session.execute(text(f'ALTER TABLE {ModelRunGridSubsetPrediction.__tablename__} DETACH PARTITION {name}'))
+            session.execute(text(f'DROP TABLE {name}'))
+            dropped.append(name)
+    return dropped
 
 
 def get_model_run_predictions(
@@ -435,3 +629,62 @@ def get_weather_station_model_prediction(session: Session,
                prediction_model_run_timestamp_id).\
         filter(WeatherStationModelPrediction.prediction_timestamp ==
                prediction_timestamp).first()
+
+
+def get_weather_station_model_precipitation(session: Session,
+                                            prediction_model_run_timestamp_id: int,
+                                            station_codes: List[int]):
+    """ Get the accumulated precipitation of every existing prediction of a model run for the stations, in one
+    query. Yields (station_code, prediction_timestamp, apcp_sfc_0). """
+    return session.query(WeatherStationModelPrediction.station_code,
+                         WeatherStationModelPrediction.prediction_timestamp,
+                         WeatherStationModelPrediction.apcp_sfc_0).\
+        filter(WeatherStationModelPrediction.prediction_model_run_timestamp_id ==
+               prediction_model_run_timestamp_id).\
+        filter(WeatherStationModelPrediction.station_code.in_(station_codes))
+
+
+def upsert_weather_station_model_predictions(session: Session, predictions: List[Dict], batch_size: int = 1000):
+    """ Insert or update weather station model predictions (dicts of column name to value, all with the same
+    columns), without committing. Values that are None don't overwrite the temperature and wind of an existing
+    prediction. The rows are written in batches, to stay well clear of the limit on statement parameters. """
+    if not predictions:
+        return
+    table = WeatherStationModelPrediction.__table__
+    for start in range(0, len(predictions), batch_size):
+        stmt = insert(WeatherStationModelPrediction).values(predictions[start:start + batch_size])
+        update = {name: stmt.excluded[name] for name in predictions[0]
+                  if name not in ('station_code', 'prediction_model_run_timestamp_id', 'prediction_timestamp',
+                                  'create_date')}
+        for name in ('tmp_tgl_2', 'wdir_tgl_10', 'wind_tgl_10'):
+            if name in update:
+                update[name] = func.coalesce(stmt.excluded[name], table.c[name])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[WeatherStationModelPrediction.station_code,
+                            WeatherStationModelPrediction.prediction_model_run_timestamp_id,
+                            WeatherStationModelPrediction.prediction_timestamp],
+            set_=update)
+        session.execute(stmt)
+
+
+def get_bias_coefficients(session: Session,
+                          prediction_model_id: int,
+                          station_codes: List[int]) -> List[PredictionModelBiasCoefficient]:
+    """ Get the bias adjustment coefficients of the prediction model for the stations. """
+    return session.query(PredictionModelBiasCoefficient).\
+        filter(PredictionModelBiasCoefficient.prediction_model_id == prediction_model_id).\
+        filter(PredictionModelBiasCoefficient.station_code.in_(station_codes))
+
+
+def save_bias_coefficients(session: Session,
+                           prediction_model_id: int,
+                           station_codes: List[int],
+                           coefficients: List[Dict]):
+    """ Replace the bias adjustment coefficients of the prediction model for the stations, without
+    committing. """
+    session.query(PredictionModelBiasCoefficient).\
+        filter(PredictionModelBiasCoefficient.prediction_model_id == prediction_model_id).\
+        filter(PredictionModelBiasCoefficient.station_code.in_(station_codes)).\
+        delete()
+    if coefficients:
+        session.execute(insert(PredictionModelBiasCoefficient).values(coefficients))
@@ -11,7 +11,7 @@ from app.db.models.observations import HourlyActual
 from app.db.models.api_access_audits import APIAccessAudit
 from app.db.models.weather_models import (ProcessedModelRunUrl, PredictionModel, PredictionModelRunTimestamp,
                                           PredictionModelGridSubset, ModelRunGridSubsetPrediction,
-                                          WeatherStationModelPrediction)
+                                          ModelRunGridSubsetPredictionArray, WeatherStationModelPrediction)
 from app.db.models.hfi_calc import (FireCentre, FuelType, PlanningArea, PlanningWeatherStation)
 from app.db.models.auto_spatial_advisory import (Shape, ShapeType, HfiClassificationThreshold,
                                                  ClassifiedHfi, RunTypeEnum, ShapeTypeEnum, FuelType, HighHfiArea, RunParameters)
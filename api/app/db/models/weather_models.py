@@ -1,7 +1,7 @@
 """ Class models that reflect resources and map to database tables relating to weather models.
 """
 import logging
-from sqlalchemy import (Column, String, Integer, Float, Boolean,
+from sqlalchemy import (Column, String, Integer, Float, Boolean, LargeBinary,
                         Sequence, ForeignKey, UniqueConstraint, Index)
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import ARRAY
@@ -119,14 +119,104 @@ Index('idx_prediction_model_grid_subsets_geom',
       PredictionModelGridSubset.geom, postgresql_using='gist')
 
 
+class PredictionModelStationGridIndex(Base):
+    """ The location of a weather station in the grid of a prediction model: the grid subset the station
+    falls in, where that subset is in the raster, and how to interpolate its vertices to the station.
+    Model grids don't move, so this is calculated once, instead of on every file of every model run. """
+    __tablename__ = 'prediction_model_station_grid_indexes'
+    __table_args__ = (
+        UniqueConstraint('prediction_model_id', 'station_code'),
+        {'comment': 'The location of a weather station in the grid of a prediction model'}
+    )
+
+    id = Column(Integer, Sequence('prediction_model_station_grid_indexes_id_seq'),
+                primary_key=True, nullable=False, index=True)
+    # Which model grid is this? e.g. GDPS latlon.15x.15
+    prediction_model_id = Column(Integer, ForeignKey(
+        'prediction_models.id'), nullable=False, index=True)
+    # The 3-digit code of the weather station.
+    station_code = Column(Integer, nullable=False)
+    # Identifies the geometry (transform, projection and size) of the model grid the index was calculated for.
+    grid_geometry = Column(String, nullable=False)
+    # The location of the station the index was calculated for.
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    # The grid subset surrounding the station.
+    prediction_model_grid_subset_id = Column(Integer, ForeignKey(
+        'prediction_model_grid_subsets.id'), nullable=False)
+    # Raster coordinates of the top left vertex of the grid subset.
+    x_index = Column(Integer, nullable=False)
+    y_index = Column(Integer, nullable=False)
+    # Linear interpolation weights of the grid subset vertices (in the order of the vertices).
+    weights = Column(ARRAY(Float), nullable=True)
+    # Index of the grid subset vertex closest to the station.
+    closest_index = Column(Integer, nullable=False)
+    # Date this record was updated.
+    update_date = Column(TZTimeStamp, nullable=False)
+
+    def __str__(self):
+        return ('prediction_model_id: {self.prediction_model_id}, '
+                'station_code: {self.station_code}, '
+                'prediction_model_grid_subset_id: {self.prediction_model_grid_subset_id}'
+                ).format(self=self)
+
+
+class PredictionModelBiasCoefficient(Base):
+    """ Coefficients of the linear regression (observed = intercept + slope * predicted) used to bias adjust
+    the predictions of a model for a weather station, for an hour of the day and a weather variable.
+    Refitted (or updated incrementally) when new actuals for the station come in. """
+    __tablename__ = 'prediction_model_bias_coefficients'
+    __table_args__ = (
+        UniqueConstraint('prediction_model_id', 'station_code', 'hour', 'variable'),
+        {'comment': 'Bias adjustment coefficients of a prediction model for a weather station'}
+    )
+
+    id = Column(Integer, Sequence('prediction_model_bias_coefficients_id_seq'),
+                primary_key=True, nullable=False, index=True)
+    prediction_model_id = Column(Integer, ForeignKey(
+        'prediction_models.id'), nullable=False, index=True)
+    # The 3-digit code of the weather station.
+    station_code = Column(Integer, nullable=False)
+    # The grid subset the predictions were interpolated from.
+    prediction_model_grid_subset_id = Column(Integer, ForeignKey(
+        'prediction_model_grid_subsets.id'), nullable=False)
+    # Hour of the day (UTC).
+    hour = Column(Integer, nullable=False)
+    # The observed value, e.g. temperature or relative_humidity.
+    variable = Column(String, nullable=False)
+    intercept = Column(Float, nullable=False)
+    slope = Column(Float, nullable=False)
+    # Number of (prediction, actual) samples the coefficients were fitted to.
+    sample_count = Column(Integer, nullable=False)
+    # Sufficient statistics of the regression when updated incrementally (null when refitted): the decayed
+    # weight of the samples, and the weighted sums of the predicted (x) and observed (y) values, x² and xy.
+    sample_weight = Column(Float, nullable=True)
+    sum_x = Column(Float, nullable=True)
+    sum_y = Column(Float, nullable=True)
+    sum_xx = Column(Float, nullable=True)
+    sum_xy = Column(Float, nullable=True)
+    # Date of the most recent actual of the station at the time of fitting.
+    latest_actual_date = Column(TZTimeStamp, nullable=False)
+    # Date this record was updated.
+    update_date = Column(TZTimeStamp, nullable=False)
+
+    def __str__(self):
+        return ('prediction_model_id: {self.prediction_model_id}, station_code: {self.station_code}, '
+                'hour: {self.hour}, variable: {self.variable}').format(self=self)
+
+
 class ModelRunGridSubsetPrediction(Base):
     """ The prediction for a particular model grid subset.
-    Each value is an array that corresponds to the vertex in the prediction bounding polygon. """
+    Each value is an array that corresponds to the vertex in the prediction bounding polygon.
+    The table is partitioned by week of prediction timestamp (see
+    app.db.crud.weather_models.create_model_run_grid_subset_prediction_partitions), so old predictions
+    are dropped a partition at a time. """
     __tablename__ = 'model_run_grid_subset_predictions'
     __table_args__ = (
         UniqueConstraint('prediction_model_run_timestamp_id', 'prediction_model_grid_subset_id',
                          'prediction_timestamp'),
-        {'comment': 'The prediction for a grid subset of a particular model run.'}
+        {'comment': 'The prediction for a grid subset of a particular model run.',
+         'postgresql_partition_by': 'RANGE (prediction_timestamp)'}
     )
 
     id = Column(Integer, Sequence('model_run_grid_subset_predictions_id_seq'),
@@ -140,8 +230,8 @@ class ModelRunGridSubsetPrediction(Base):
     prediction_model_grid_subset_id = Column(Integer, ForeignKey(
         'prediction_model_grid_subsets.id'), nullable=False, index=True)
     prediction_model_grid_subset = relationship("PredictionModelGridSubset")
-    # The date and time to which the prediction applies.
-    prediction_timestamp = Column(TZTimeStamp, nullable=False, index=True)
+    # The date and time to which the prediction applies. Part of the primary key, as it's the partition key.
+    prediction_timestamp = Column(TZTimeStamp, primary_key=True, nullable=False, index=True)
     # Temperature 2m above model layer.
     tmp_tgl_2 = Column(ARRAY(Float), nullable=True)
     # Relative humidity 2m above model layer.
@@ -165,6 +255,37 @@ class ModelRunGridSubsetPrediction(Base):
                 'wind_tgl_10={self.wind_tgl_10}').format(self=self)
 
 
+class ModelRunGridSubsetPredictionArray(Base):
+    """ All the predictions of a model run for a grid subset, packed into a single record: the values of every
+    prediction timestamp and variable, as one array of float32. Model runs are packed once they've been
+    interpolated (see app.weather_models.grid_predictions), which takes a fraction of the space of a
+    ModelRunGridSubsetPrediction per prediction timestamp. """
+    __tablename__ = 'model_run_grid_subset_prediction_arrays'
+    __table_args__ = (
+        UniqueConstraint('prediction_model_run_timestamp_id', 'prediction_model_grid_subset_id'),
+        {'comment': 'The predictions for a grid subset of a particular model run, packed into arrays.'}
+    )
+
+    id = Column(Integer, Sequence('model_run_grid_subset_prediction_arrays_id_seq'),
+                primary_key=True, nullable=False, index=True)
+    prediction_model_run_timestamp_id = Column(Integer, ForeignKey(
+        'prediction_model_run_timestamps.id'), nullable=False, index=True)
+    prediction_model_grid_subset_id = Column(Integer, ForeignKey(
+        'prediction_model_grid_subsets.id'), nullable=False, index=True)
+    # The date and time to which each prediction applies, in order.
+    prediction_timestamps = Column(ARRAY(TZTimeStamp), nullable=False)
+    # The last of the prediction timestamps.
+    last_prediction_timestamp = Column(TZTimeStamp, nullable=False, index=True)
+    # Little endian float32 values, of shape (prediction timestamp, variable, vertex), with the variables in
+    # the order of app.weather_models.grid_predictions.PACKED_VARIABLES. Missing values are NaN.
+    values = Column(LargeBinary, nullable=False)
+
+    def __str__(self):
+        return ('prediction_model_run_timestamp_id:{self.prediction_model_run_timestamp_id}, '
+                'prediction_model_grid_subset_id:{self.prediction_model_grid_subset_id}, '
+                'last_prediction_timestamp:{self.last_prediction_timestamp}').format(self=self)
+
+
 class WeatherStationModelPrediction(Base):
     """ The model prediction for a particular weather station.
     Based on values from ModelRunGridSubsetPrediction, but captures linear interpolations based on weather
@@ -1,14 +1,20 @@
 """ Code relating to fire behaviour advisories """
 
+import logging
+import math
 from datetime import date
-from typing import Optional
-from app.fire_behaviour import cffdrs
+from typing import List, NamedTuple, Optional, Tuple
+import numpy as np
+from app.fire_behaviour import cffdrs, fbp, fwi
 from app.fire_behaviour.fuel_types import FUEL_TYPE_DEFAULTS, FuelTypeEnum
 from app.fire_behaviour.prediction import (
-    FireTypeEnum, calculate_cfb, get_approx_flame_length, get_critical_hours, get_fire_size, get_fire_type)
+    FireTypeEnum, calculate_cfb, get_approx_flame_length, get_critical_hours, get_critical_hours_for_stations,
+    get_fire_size, get_fire_type)
 from app.schemas.fba_calc import CriticalHoursHFI
 from app.utils.time import get_hour_20_from_date, get_julian_date
 
+logger = logging.getLogger(__name__)
+
 
 class FBACalculatorWeatherStation():
     """ Inputs for Fire Behaviour Advisory Calculator """
@@ -171,3 +177,148 @@ def calculate_fire_behaviour_advisory(station: FBACalculatorWeatherStation) -> F
         critical_hours_hfi_4000=critical_hours_4000,
         critical_hours_hfi_10000=critical_hours_10000,
         hfi_t=hfi_t, ros_t=ros_t, cfb_t=cfb_t, sixty_minute_fire_size_t=sixty_minute_fire_size_t)
+
+
+def calculate_fire_behaviour_advisories(
+        stations: List[FBACalculatorWeatherStation]) -> List[Optional[FireBehaviourAdvisory]]:
+    """ Calculate the fire behaviour advisory for many stations at once. The fire behaviour is evaluated
+    with one batched call per cffdrs equation (or one numpy pass, depending on the configured backend),
+    rather than once per station.
+    Advisories that can't be calculated are None.
+    """
+    if len(stations) == 0:
+        return []
+    engine = fbp if cffdrs.use_native_backend() else cffdrs.CFFDRS.instance()
+
+    def column(name: str) -> list:
+        return [getattr(station, name) for station in stations]
+
+    fuel_types = [station.fuel_type.value for station in stations]
+    pc = column('percentage_conifer')
+    pdf = column('percentage_dead_balsam_fir')
+    cbh = column('crown_base_height')
+    # Get the default crown fuel load, if none specified.
+    cfl = [FUEL_TYPE_DEFAULTS[station.fuel_type].get('CFL', None) if station.crown_fuel_load is None
+           else station.crown_fuel_load for station in stations]
+
+    fmc = engine.foliar_moisture_content(
+        column('lat'), column('long'), column('elevation'),
+        [get_julian_date(get_hour_20_from_date(station.time_of_interest)) for station in stations])
+    result = engine.calculate_fire_behaviour(fuel_types, column('isi'), column('bui'), column('ffmc'),
+                                             column('wind_speed'), fmc, pc, column('grass_cure'), pdf, cbh, cfl)
+    # Calculate rate of spread assuming 60 minutes since ignition.
+    ros_t = engine.rate_of_spread_t(fuel_types, result.ros, 60, result.cfb)
+    cfb_t = np.where(np.isin(fuel_types, fbp.NO_CROWN_FUEL_TYPES), 0.0,
+                     engine.crown_fraction_burned(fuel_types, result.fmc, result.sfc, ros_t, cbh))
+    hfi_t = engine.head_fire_intensity(fuel_types, pc, pdf, ros_t, cfb_t, cfl, result.sfc)
+
+    def fire_size(ros: np.ndarray, minutes: int, cfb: np.ndarray) -> np.ndarray:
+        """ As get_fire_size, for all the stations at once. """
+        fire_spread_distance = engine.fire_distance(fuel_types, ros + result.bros, minutes, cfb)
+        length_to_breadth_at_time = engine.length_to_breadth_ratio_t(fuel_types, result.lb, minutes, cfb)
+        return math.pi / (4.0 * length_to_breadth_at_time) * fire_spread_distance ** 2 / 10000.0
+
+    sixty_minute_fire_size = fire_size(result.ros, 60, result.cfb)
+    sixty_minute_fire_size_t = fire_size(ros_t, 60, cfb_t)
+    thirty_minute_fire_size = fire_size(result.ros, 30, result.cfb)
+
+    # The FFMC at which each station reaches the target HFI is found station by station, but the hours of the day
+    # at which that FFMC is reached are then determined for all the stations at once.
+    target_hfis = (4000, 10000)
+    valid: List[int] = []
+    critical_ffmc: List[List[Tuple[float, float]]] = []
+    for index, station in enumerate(stations):
+        values = [float(array[index]) for array in (
+            result.fmc, result.ros, result.cfb, result.hfi, ros_t, cfb_t, hfi_t,
+            sixty_minute_fire_size, sixty_minute_fire_size_t, thirty_minute_fire_size)]
+        if any(math.isnan(value) for value in values):
+            logger.error('Failed to calculate fire behaviour advisory for %s', station)
+            continue
+        try:
+            critical_ffmc.append([cffdrs.get_ffmc_for_target_hfi(
+                station.fuel_type, station.percentage_conifer, station.percentage_dead_balsam_fir, station.bui,
+                station.wind_speed, station.grass_cure, station.crown_base_height, float(result.fmc[index]),
+                float(result.cfb[index]), cfl[index], target_hfi) for target_hfi in target_hfis])
+            valid.append(index)
+        except Exception as exception:
+            # One station failing shouldn't take down the rest of the batch.
+            logger.critical(exception, exc_info=True)
+
+    critical_hours = []
+    missing_rh = np.zeros(len(valid), dtype=bool)
+    for target_index, target_hfi in enumerate(target_hfis):
+        target_critical_hours, target_missing_rh = get_critical_hours_for_stations(
+            target_hfi,
+            [station_critical_ffmc[target_index][0] for station_critical_ffmc in critical_ffmc],
+            [station_critical_ffmc[target_index][1] for station_critical_ffmc in critical_ffmc],
+            [stations[index].ffmc for index in valid],
+            [stations[index].prev_day_daily_ffmc for index in valid],
+            [stations[index].last_observed_morning_rh_values for index in valid])
+        critical_hours.append(target_critical_hours)
+        missing_rh |= target_missing_rh
+
+    advisories: List[Optional[FireBehaviourAdvisory]] = [None] * len(stations)
+    for valid_index, index in enumerate(valid):
+        station = stations[index]
+        if missing_rh[valid_index]:
+            logger.error('Missing morning RH observation, failed to calculate critical hours for %s', station)
+            continue
+        ros, cfb, hfi = float(result.ros[index]), float(result.cfb[index]), float(result.hfi[index])
+        advisories[index] = FireBehaviourAdvisory(
+            hfi=hfi, ros=ros, fire_type=get_fire_type(fuel_type=station.fuel_type, crown_fraction_burned=cfb),
+            cfb=cfb, flame_length=get_approx_flame_length(hfi),
+            sixty_minute_fire_size=float(sixty_minute_fire_size[index]),
+            thirty_minute_fire_size=float(thirty_minute_fire_size[index]),
+            critical_hours_hfi_4000=critical_hours[0][valid_index],
+            critical_hours_hfi_10000=critical_hours[1][valid_index],
+            hfi_t=float(hfi_t[index]), ros_t=float(ros_t[index]), cfb_t=float(cfb_t[index]),
+            sixty_minute_fire_size_t=float(sixty_minute_fire_size_t[index]))
+    return advisories
+
+
+class FireBehaviourSweep(NamedTuple):
+    """ Fire behaviour over a sensitivity sweep, shaped (station, wind speed, swept value). """
+    hfi: np.ndarray
+    ros: np.ndarray
+    cfb: np.ndarray
+
+
+def calculate_fire_behaviour_sweep(stations: List[FBACalculatorWeatherStation],
+                                   wind_speed, ffmc, grass_cure) -> FireBehaviourSweep:
+    """ Calculate the fire behaviour of every station over a grid of weather scenarios, in a single
+    batched evaluation.
+    wind_speed, ffmc and grass_cure must broadcast to (number of stations, number of wind speeds,
+    number of swept values), e.g. wind speeds shaped (1, n, 1) and FFMC values shaped (1, 1, m).
+    Values that can't be calculated are NaN.
+    """
+    shape = np.broadcast_shapes((len(stations), 1, 1), np.shape(wind_speed), np.shape(ffmc), np.shape(grass_cure))
+    if len(stations) == 0:
+        empty = np.empty(shape)
+        return FireBehaviourSweep(hfi=empty, ros=empty, cfb=empty)
+    engine = fbp if cffdrs.use_native_backend() else cffdrs.CFFDRS.instance()
+
+    def expand(values) -> list:
+        """ Broadcast values to the shape of the sweep, flattened to one row per scenario. """
+        return np.broadcast_to(fbp.as_array(values), shape).ravel().tolist()
+
+    def column(name: str) -> list:
+        return expand(np.reshape(fbp.as_array([getattr(station, name) for station in stations]), (-1, 1, 1)))
+
+    fuel_types = np.broadcast_to(np.reshape([station.fuel_type.value for station in stations], (-1, 1, 1)),
+                                 shape).ravel().tolist()
+    fmc = engine.foliar_moisture_content(
+        [station.lat for station in stations], [station.long for station in stations],
+        [station.elevation for station in stations],
+        [get_julian_date(get_hour_20_from_date(station.time_of_interest)) for station in stations])
+    cfl = [FUEL_TYPE_DEFAULTS[station.fuel_type].get('CFL', None) if station.crown_fuel_load is None
+           else station.crown_fuel_load for station in stations]
+    wind_speed = expand(wind_speed)
+    ffmc = expand(ffmc)
+    isi = fwi.initial_spread_index(ffmc, wind_speed)
+    result = engine.calculate_fire_behaviour(
+        fuel_types, isi, column('bui'), ffmc, wind_speed, expand(np.reshape(fmc, (-1, 1, 1))),
+        column('percentage_conifer'), expand(grass_cure), column('percentage_dead_balsam_fir'),
+        column('crown_base_height'), expand(np.reshape(fbp.as_array(cfl), (-1, 1, 1))))
+    return FireBehaviourSweep(hfi=np.reshape(result.hfi, shape),
+                              ros=np.reshape(result.ros, shape),
+                              cfb=np.reshape(result.cfb, shape))
@@ -5,85 +5,150 @@ Updated (formatting, layout) by D. Perrakis, 2014
 
 The spreadsheet can be found in the Predictive Services Unit Sharepoint site,
 search for "NewC7b - C7 with curing3.xls"
+
+C7b is C7 with a curing factor applied to the surface rate of spread. The spreadsheet only covers the head
+fire rate of spread, everything else (back fire rate of spread, length to breadth ratio, fuel consumption,
+crown fraction burned and fire size) is calculated as it is for C7, with the curing factor also applied
+to the back fire rate of spread.
+
+Functions accept scalars, or arrays with one element per station-day.
 """
-import math
+from typing import Union
+import numpy as np
+from app.fire_behaviour import fbp
 
+# The fuel type used for the parts of the calculation that C7b shares with C7.
+C7 = 'C7'
 
-def rate_of_spread(ffmc: float,  # excel column: C29
-                   bui: float,  # excel column: C30
-                   wind_speed: float,  # excel column: C37
-                   percentage_slope: float,  # excel column: C38
-                   cc: float,  # excel column: C17 (% curing)
-                   ):
-    ''' Compute the rate of spread for the C7b fuel type
-    Based on:
-    Spreadsheet originally created by J. Beck, 2003,
-    Updated (formatting, layout) by D. Perrakis, 2014
 
-    TODO: This function can be further simplified by using only the caclulations that differ
-    from the standard cffdrs R calculations.
-    '''
-    # we're using weird variable names to make debugging against excel spreadsheet easier:
+def _result(value: np.ndarray) -> Union[float, np.ndarray]:
+    """ Return a float for scalar input, and an array otherwise. """
+    return float(value) if np.ndim(value) == 0 else value
+
+
+def _f_f(ffmc: np.ndarray) -> np.ndarray:
+    """ Fine fuel moisture function, f(F) """
+    # Calculated m
+    # C46: =147.2*(101-C29)/(59.5+C29)
+    calculated_m = 147.2 * (101 - ffmc) / (59.5 + ffmc)
+    # Calculated f(F)
+    # C47: =91.9*EXP(-0.1386*C46)*(1+(C46^5.31)/(4.93*10^7))
+    return 91.9 * np.exp(-0.1386 * calculated_m) * (1 + np.power(calculated_m, 5.31) / (4.93 * np.power(10, 7)))
+
+
+def _surface_rate_of_spread(isi: np.ndarray, calculated_curing_factor: np.ndarray) -> np.ndarray:
+    """ C7 surface rate of spread, with the curing factor applied """
+    # C52: =(45*(1-EXP(-0.0305*C51))^2)*C25
+    return (45 * np.power((1 - np.exp(-0.0305 * isi)), 2)) * calculated_curing_factor
+
+
+def _buildup_effect(bui: np.ndarray) -> np.ndarray:
+    # BE
+    # C53: BE=EXP(50*LN(0.85)*(1/C30-1/106))
+    return np.exp(50 * np.log(0.85) * (1 / bui - 1 / 106))
 
-    # Calculated Curing Factor
+
+def curing_factor(cc):
+    """ Calculated Curing Factor """
     # C25: =1.25924/(1+EXP(-0.075*(C17-82)))
-    calculated_curing_factor = 1.25924 / (1 + math.exp(-0.075 * (cc - 82)))
+    return 1.25924 / (1 + np.exp(-0.075 * (fbp.as_array(cc) - 82)))
+
+
+def net_effective_wind_speed(ffmc,  # excel column: C29
+                             wind_speed,  # excel column: C37
+                             percentage_slope,  # excel column: C38
+                             cc,  # excel column: C17 (% curing)
+                             ):
+    """ Net effective wind speed, combining the wind speed with the wind speed equivalent of the slope """
+    # we're using weird variable names to make debugging against excel spreadsheet easier:
+    ffmc = fbp.as_array(ffmc)
+    calculated_curing_factor = curing_factor(cc)
+    calculated_f_f = _f_f(ffmc)
 
     # SF
     # C39: =EXP(3.533*(C38/100)^1.2)
-    SF = math.exp(3.533 * math.pow((percentage_slope / 100), 1.2))
+    SF = np.exp(3.533 * np.power((fbp.as_array(percentage_slope) / 100), 1.2))
 
     # No Wind ISI
     # C42: =0.208*(91.9*EXP(-0.1386*(147.2*(101-C29)/(59.5+C29)))*(1+
     # (147.2*(101-C29)/(59.5+C29))^5.31/(4.93*10^7)))*EXP(0.05038*0)
-    no_wind_isi = 0.208 * (91.9 * math.exp(-0.1386 * (147.2 * (101 - ffmc) / (59.5 + ffmc))) * (1 +
-                           math.pow((147.2 * (101 - ffmc) / (59.5 + ffmc)), 5.31) / (4.93 * math.pow(10, 7)))
-                           ) * math.exp(0.05038 * 0)
+    no_wind_isi = 0.208 * calculated_f_f * np.exp(0.05038 * 0)
 
     # RSF with CF applied
     # C40: (45*(1-EXP(-0.0305*C42))^2)*C25*C39
-    rsf_with_cf_applied = (45 * math.pow((1 - math.exp(-0.0305 * no_wind_isi)), 2)) * \
-        calculated_curing_factor * SF
+    rsf_with_cf_applied = _surface_rate_of_spread(no_wind_isi, calculated_curing_factor) * SF
 
     # Calculated ISF with CF
     # C45: =LN(1-(C40/(C25*45))^(1/2))/-0.0305
-    calculated_isf_with_cf = math.log(
-        1 - math.pow((rsf_with_cf_applied / (calculated_curing_factor * 45)), (1 / 2))) / -0.0305
-
-    # Calculated m
-    # C46: =147.2*(101-C29)/(59.5+C29)
-    calculated_m = 147.2 * (101 - ffmc) / (59.5 + ffmc)
-
-    # Calculated f(F)
-    # C47: =91.9*EXP(-0.1386*C46)*(1+(C46^5.31)/(4.93*10^7))
-    calculated_f_f = 91.9 * math.exp(-0.1386 * calculated_m) * \
-        (1 + (math.pow(calculated_m, 5.31)) / (4.93 * math.pow(10, 7)))
+    calculated_isf_with_cf = np.log(
+        1 - np.power((rsf_with_cf_applied / (calculated_curing_factor * 45)), (1 / 2))) / -0.0305
 
     # Calculated WSE with CF
     # C49: =LN(C45/(0.208*C47))/0.05039
-    calculated_wse_with_cf = math.log(calculated_isf_with_cf / (0.208 * calculated_f_f)) / 0.05039
+    calculated_wse_with_cf = np.log(calculated_isf_with_cf / (0.208 * calculated_f_f)) / 0.05039
 
     # Net Effective Wind Speed
     # C50: =C49+C37
-    net_effective_wind_speed = calculated_wse_with_cf + wind_speed
+    return _result(calculated_wse_with_cf + fbp.as_array(wind_speed))
+
+
+def rate_of_spread(ffmc,  # excel column: C29
+                   bui,  # excel column: C30
+                   wind_speed,  # excel column: C37
+                   percentage_slope,  # excel column: C38
+                   cc,  # excel column: C17 (% curing)
+                   ):
+    ''' Compute the rate of spread for the C7b fuel type
+    Based on:
+    Spreadsheet originally created by J. Beck, 2003,
+    Updated (formatting, layout) by D. Perrakis, 2014
+    '''
+    ffmc = fbp.as_array(ffmc)
 
     # ISI adjusted for Slope and Wind
     # C51: =0.208*(91.9*EXP(-0.1386*(147.2*(101-C29)/(59.5+C29)))*(1+(147.2*(101-C29)/(59.5+C29))
     # ^5.31/(4.93*10^7)))*EXP(0.05038*C50)
-    isi_adjusted_for_slope_and_wind = 0.208 * (91.9 * math.exp(
-        -0.1386 * (147.2 * (101 - ffmc) / (59.5 + ffmc))) * (1 + math.pow(
-            (147.2 * (101 - ffmc) / (59.5 + ffmc)), 5.31) / (4.93 * math.pow(10, 7)))) * math.exp(
-                0.05038 * net_effective_wind_speed)
+    isi_adjusted_for_slope_and_wind = 0.208 * _f_f(ffmc) * np.exp(
+        0.05038 * net_effective_wind_speed(ffmc, wind_speed, percentage_slope, cc))
 
     # Slope and Wind adjusted RSI
     # C52: =(45*(1-EXP(-0.0305*C51))^2)*C25
-    slope_and_wind_adjusted_rsi = (
-        45 * math.pow((1 - math.exp(
-            -0.0305 * isi_adjusted_for_slope_and_wind)), 2)) * calculated_curing_factor
-
-    # BE
-    # C53: BE=EXP(50*LN(0.85)*(1/C30-1/106))
-    BE = math.exp(50 * math.log(0.85) * (1 / bui - 1 / 106))
+    slope_and_wind_adjusted_rsi = _surface_rate_of_spread(isi_adjusted_for_slope_and_wind, curing_factor(cc))
 
     # C54: =C52*C53
-    return slope_and_wind_adjusted_rsi * BE
+    return _result(slope_and_wind_adjusted_rsi * _buildup_effect(fbp.as_array(bui)))
+
+
+def back_rate_of_spread(ffmc, bui, wsv, cc):
+    """ Back fire rate of spread in m/min (Eqs. 75-77, FCFDG 1992), with the curing factor applied """
+    ffmc = fbp.as_array(ffmc)
+    # ISI associated with the back fire spread rate (Eqs. 75, 76)
+    bisi = 0.208 * np.exp(-0.05039 * fbp.as_array(wsv)) * _f_f(ffmc)
+    return _result(_surface_rate_of_spread(bisi, curing_factor(cc)) * _buildup_effect(fbp.as_array(bui)))
+
+
+def calculate_fire_behaviour(ffmc, bui, wind_speed, fmc, cc, cbh, cfl,
+                             percentage_slope=0.0) -> fbp.FireBehaviourArrays:
+    """ Compute SFC, ROS, CFB, HFI, BROS and L/B for arrays of C7b station-day inputs in one pass,
+    as fbp.calculate_fire_behaviour does for the other fuel types. """
+    ros = fbp.as_array(rate_of_spread(ffmc, bui, wind_speed, percentage_slope, cc))
+    wsv = net_effective_wind_speed(ffmc, wind_speed, percentage_slope, cc)
+    sfc = fbp.surface_fuel_consumption(C7, bui, ffmc, None)
+    cfb = fbp.crown_fraction_burned(C7, fmc, sfc, ros, cbh)
+    values = {'fmc': fmc,
+              'sfc': sfc,
+              'ros': ros,
+              'cfb': cfb,
+              'hfi': fbp.head_fire_intensity(C7, None, None, ros, cfb, cfl, sfc),
+              'bros': back_rate_of_spread(ffmc, bui, wsv, cc),
+              'lb': fbp.length_to_breadth_ratio(C7, wsv)}
+    shape = np.broadcast_shapes(*(np.shape(value) for value in values.values()))
+    return fbp.FireBehaviourArrays(**{name: np.broadcast_to(fbp.as_array(value), shape)
+                                      for name, value in values.items()})
+
+
+def sixty_minute_fire_size(ros, bros, lb, cfb):
+    """ Fire size (ha) 60 minutes after ignition, as in app.fire_behaviour.prediction.get_fire_size """
+    fire_spread_distance = fbp.fire_distance(C7, fbp.as_array(ros) + fbp.as_array(bros), 60, cfb)
+    length_to_breadth_at_time = fbp.length_to_breadth_ratio_t(C7, lb, 60, cfb)
+    return _result(np.pi / (4.0 * length_to_breadth_at_time) * fire_spread_distance ** 2 / 10000.0)
@@ -2,12 +2,17 @@
 """
 import logging
 import math
-from typing import Optional
+from enum import Enum
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+import numpy as np
 import rpy2.robjects as robjs
 from rpy2.robjects import DataFrame
 import rpy2.robjects.conversion as cv
 from rpy2.rinterface import NULL
 import app.utils.r_importer
+from app import config
+from app.fire_behaviour import fbp, fwi
 from app.utils.singleton import Singleton
 from app.schemas.fba_calc import FuelTypeEnum
 
@@ -25,16 +30,149 @@ none_converter.py2rpy.register(type(None), _none2null)
 
 @Singleton
 class CFFDRS():
-    """ Singleton that loads CFFDRS R lib once in memory for reuse."""
+    """ Singleton that loads CFFDRS R lib once in memory for reuse.
+
+    Besides giving access to the R package, it offers a batched interface: the cffdrs functions are
+    vectorized, so many station-days can be evaluated with a single call per function (and a single
+    round of rpy2 conversions) instead of one call per station-day. The batched methods have the same
+    signatures as their app.fire_behaviour.fbp equivalents, take scalars or sequences (None meaning
+    missing) and return numpy arrays, with NaN wherever R returns NA.
+    """
 
     def __init__(self):
         self.cffdrs = app.utils.r_importer.import_cffsdrs()
 
+    @staticmethod
+    def _float_vectors(*values) -> List[robjs.FloatVector]:
+        """ Turn each value into an R vector, broadcast to a common length """
+        arrays = np.broadcast_arrays(*(np.atleast_1d(fbp.as_array(value)) for value in values))
+        return [robjs.FloatVector(array) for array in arrays]
+
+    @staticmethod
+    def _vectors(fuel_type, *values) -> Tuple[robjs.StrVector, List[robjs.FloatVector]]:
+        """ Turn the fuel type(s) and each value into R vectors, broadcast to a common length """
+        arrays = np.broadcast_arrays(np.atleast_1d(fbp.as_fuel_type_array(fuel_type)),
+                                     *(np.atleast_1d(fbp.as_array(value)) for value in values))
+        return robjs.StrVector(list(arrays[0])), [robjs.FloatVector(array) for array in arrays[1:]]
+
+    @staticmethod
+    def _as_array(result) -> np.ndarray:
+        return np.asarray(result, dtype=float)
+
+    def foliar_moisture_content(self, lat, long, elv, day_of_year,
+                                date_of_minimum_foliar_moisture_content=0) -> np.ndarray:
+        """ Batched _FMCcalc. Negative longitudes are flipped, as FMCcalc expects them to be positive. """
+        lat, long, elv, day_of_year, d0 = self._float_vectors(
+            lat, np.abs(fbp.as_array(long)), elv, day_of_year, date_of_minimum_foliar_moisture_content)
+        return self._as_array(self.cffdrs._FMCcalc(LAT=lat, LONG=long, ELV=elv, DJ=day_of_year, D0=d0))
+
+    def crown_fraction_burned(self, fuel_type, fmc, sfc, ros, cbh) -> np.ndarray:
+        """ Batched _CFBcalc """
+        fuel_type, (fmc, sfc, ros, cbh) = self._vectors(fuel_type, fmc, sfc, ros, cbh)
+        return self._as_array(self.cffdrs._CFBcalc(FUELTYPE=fuel_type, FMC=fmc, SFC=sfc, ROS=ros, CBH=cbh))
+
+    def head_fire_intensity(self, fuel_type, percentage_conifer, percentage_dead_balsam_fir, ros, cfb, cfl,
+                            sfc) -> np.ndarray:
+        """ Batched _TFCcalc followed by _FIcalc """
+        fuel_type, (pc, pdf, ros, cfb, cfl, sfc) = self._vectors(
+            fuel_type, percentage_conifer, percentage_dead_balsam_fir, ros, cfb, cfl, sfc)
+        tfc = self.cffdrs._TFCcalc(FUELTYPE=fuel_type, CFL=cfl, CFB=cfb, SFC=sfc, PC=pc, PDF=pdf)
+        return self._as_array(self.cffdrs._FIcalc(FC=tfc, ROS=ros))
+
+    def rate_of_spread_t(self, fuel_type, ros_eq, minutes_since_ignition, cfb) -> np.ndarray:
+        """ Batched _ROStcalc """
+        fuel_type, (ros_eq, minutes_since_ignition, cfb) = self._vectors(
+            fuel_type, ros_eq, minutes_since_ignition, cfb)
+        return self._as_array(self.cffdrs._ROStcalc(FUELTYPE=fuel_type, ROSeq=ros_eq, HR=minutes_since_ignition,
+                                                    CFB=cfb))
+
+    def fire_distance(self, fuel_type, ros_eq, minutes_since_ignition, cfb) -> np.ndarray:
+        """ Batched _DISTtcalc """
+        fuel_type, (ros_eq, minutes_since_ignition, cfb) = self._vectors(
+            fuel_type, ros_eq, minutes_since_ignition, cfb)
+        return self._as_array(self.cffdrs._DISTtcalc(fuel_type, ros_eq, minutes_since_ignition, cfb))
+
+    def length_to_breadth_ratio_t(self, fuel_type, lb, minutes_since_ignition, cfb) -> np.ndarray:
+        """ Batched _LBtcalc """
+        fuel_type, (lb, minutes_since_ignition, cfb) = self._vectors(fuel_type, lb, minutes_since_ignition, cfb)
+        return self._as_array(self.cffdrs._LBtcalc(FUELTYPE=fuel_type, LB=lb, HR=minutes_since_ignition, CFB=cfb))
+
+    def hourly_fine_fuel_moisture_code(self, ffmc_old, temp, rh, ws, prec, time_step=1) -> np.ndarray:
+        """ Batched hffmc, evaluating a single time step for every value (batch=FALSE). Takes arrays of any
+        (broadcastable) shape, and returns an array of the same shape. """
+        arrays = np.broadcast_arrays(*(fbp.as_array(value) for value in (ffmc_old, temp, rh, ws, prec, time_step)))
+        ffmc_old, temp, rh, ws, prec, time_step = self._float_vectors(*(array.ravel() for array in arrays))
+        weather_data = DataFrame({'temp': temp, 'rh': rh, 'ws': ws, 'prec': prec})
+        result = self.cffdrs.hffmc(weatherstream=weather_data, ffmc_old=ffmc_old, time_step=time_step, batch=False)
+        return self._as_array(result).reshape(arrays[0].shape)
+
+    def calculate_hourly_ffmc(self, ffmc_start, temp, rh, ws, prec, time_step=1) -> np.ndarray:
+        """ Batched equivalent of fwi.calculate_hourly_ffmc: a single hffmc call for a weather stream of
+        all the stations, ordered by hour and then station as hffmc requires. """
+        temp, rh, ws, prec = (np.atleast_2d(fbp.as_array(value)) for value in (temp, rh, ws, prec))
+        shape = np.broadcast_shapes(temp.shape, rh.shape, ws.shape, prec.shape)
+        station_id = np.broadcast_to(np.arange(shape[0])[:, np.newaxis], shape)
+        station_id, temp, rh, ws, prec = self._float_vectors(
+            *(np.broadcast_to(value, shape).T.ravel() for value in (station_id, temp, rh, ws, prec)))
+        ffmc_start, = self._float_vectors(np.broadcast_to(fbp.as_array(ffmc_start), shape[:1]))
+        weather_data = DataFrame({'id': station_id, 'temp': temp, 'rh': rh, 'ws': ws, 'prec': prec})
+        result = self.cffdrs.hffmc(weatherstream=weather_data, ffmc_old=ffmc_start, time_step=time_step)
+        return self._as_array(result).reshape(shape[1], shape[0]).T
+
+    def calculate_fire_behaviour(self, fuel_type, isi, bui, ffmc, wind_speed, fmc, pc, cc, pdf, cbh,
+                                 cfl) -> fbp.FireBehaviourArrays:
+        """ Batched equivalent of fbp.calculate_fire_behaviour, making one call to each of _SFCcalc,
+        _ROScalc, _CFBcalc, _TFCcalc, _FIcalc, _BROScalc and _LBcalc. """
+        fuel_type, (isi, bui, ffmc, wind_speed, fmc, pc, cc, pdf, cbh, cfl) = self._vectors(
+            fuel_type, isi, bui, ffmc, wind_speed, fmc, pc, cc, pdf, cbh, cfl)
+        sfc = self.cffdrs._SFCcalc(FUELTYPE=fuel_type, BUI=bui, FFMC=ffmc, PC=pc, GFL=0.35)
+        ros = self.cffdrs._ROScalc(FUELTYPE=fuel_type, ISI=isi, BUI=bui, FMC=fmc, SFC=sfc, PC=pc,
+                                   PDF=pdf, CC=cc, CBH=cbh)
+        # Fuel types without a crown have no crown fraction burned, but it's needed for other
+        # calculations, so we go with 0 (see app.fire_behaviour.prediction.calculate_cfb).
+        cfb = np.where(np.isin(list(fuel_type), fbp.NO_CROWN_FUEL_TYPES), 0.0,
+                       self.crown_fraction_burned(fuel_type, fmc, sfc, ros, cbh))
+        hfi = self.head_fire_intensity(fuel_type, pc, pdf, ros, cfb, cfl, sfc)
+        # Ground slope is assumed to be 0, so the net effective wind speed is the wind speed.
+        bros = self.cffdrs._BROScalc(FUELTYPE=fuel_type, FFMC=ffmc, BUI=bui, WSV=wind_speed, FMC=fmc,
+                                     SFC=sfc, PC=pc, PDF=pdf, CC=cc, CBH=cbh)
+        lb = self.cffdrs._LBcalc(FUELTYPE=fuel_type, WSV=wind_speed)
+        return fbp.FireBehaviourArrays(fmc=self._as_array(fmc), sfc=self._as_array(sfc),
+                                       ros=self._as_array(ros), cfb=cfb, hfi=hfi,
+                                       bros=self._as_array(bros), lb=self._as_array(lb))
+
 
 class CFFDRSException(Exception):
     """ CFFDRS contextual exception """
 
 
+class FireBehaviourBackendEnum(str, Enum):
+    """ Implementations available for computing fire behaviour. """
+    # The cffdrs R package, called through rpy2. This is the reference implementation.
+    R = 'R'
+    # Vectorized port of the cffdrs equations (app.fire_behaviour.fbp).
+    NUMPY = 'NUMPY'
+
+
+def get_backend() -> FireBehaviourBackendEnum:
+    """ Returns the fire behaviour backend configured with FIRE_BEHAVIOUR_BACKEND (defaults to R). """
+    return FireBehaviourBackendEnum(config.get('FIRE_BEHAVIOUR_BACKEND', FireBehaviourBackendEnum.R.value).upper())
+
+
+def use_native_backend() -> bool:
+    """ True if calculations should be done with numpy instead of R """
+    return get_backend() == FireBehaviourBackendEnum.NUMPY
+
+
+def _native_scalar(function: Callable[..., np.ndarray], *args, error_message: str) -> float:
+    """ Evaluate a vectorized fbp function for a single set of inputs, raising a CFFDRSException
+    if the result can't be computed (i.e. is NaN), the same way a failed R call does. """
+    value = float(np.ravel(function(*args))[0])
+    if math.isnan(value):
+        raise CFFDRSException(error_message)
+    return value
+
+
 # Computable: SFC, FMC
 # To store in DB: PC, PDF, CC, CBH (attached to fuel type, red book)
 PARAMS_ERROR_MESSAGE = "One or more params passed to R call is None."
@@ -185,6 +323,8 @@ def flank_rate_of_spread(ros: float, bros: float, lb: float):
     #   FROS:   Flank Fire Spread Rate (m/min)
     #
     """
+    if use_native_backend():
+        return _native_scalar(fbp.flank_rate_of_spread, ros, bros, lb, error_message="Failed to calculate FROS")
     result = CFFDRS.instance().cffdrs._FROScalc(ROS=ros, BROS=bros, LB=lb)
     if isinstance(result[0], float):
         return result[0]
@@ -232,6 +372,9 @@ def back_rate_of_spread(fuel_type: FuelTypeEnum,
             f"_BROScalc ; fuel_type: {fuel_type.value}, ffmc: {ffmc}, bui: {bui}, fmc: {fmc}, sfc: {sfc}"
         raise CFFDRSException(message)
 
+    if use_native_backend():
+        return _native_scalar(fbp.back_rate_of_spread, fuel_type, ffmc, bui, wsv, fmc, sfc, pc, cc, pdf, cbh,
+                              error_message="Failed to calculate BROS")
     if pc is None:
         pc = NULL
     if cc is None:
@@ -283,6 +426,8 @@ def bui_calc(dmc: float, dc: float):
     #
     # Returns: A single bui value
     """
+    if use_native_backend():
+        return _native_scalar(fwi.build_up_index, dmc, dc, error_message="Failed to calculate bui")
     result = CFFDRS.instance().cffdrs._buiCalc(dmc=dmc, dc=dc)
     if isinstance(result[0], float):
         return result[0]
@@ -315,6 +460,9 @@ def rate_of_spread_t(fuel_type: FuelTypeEnum,
     """
     # NOTE: CFFDRS documentation incorrectly states that HR is hours since ignition, it's actually
     # minutes.
+    if use_native_backend():
+        return _native_scalar(fbp.rate_of_spread_t, fuel_type, ros_eq, minutes_since_ignition, cfb,
+                              error_message="Failed to calculate ROSt")
     result = CFFDRS.instance().cffdrs._ROStcalc(FUELTYPE=fuel_type.value,
                                                 ROSeq=ros_eq,
                                                 HR=minutes_since_ignition,
@@ -357,6 +505,9 @@ def rate_of_spread(fuel_type: FuelTypeEnum,
             f"_ROScalc ; fuel_type: {fuel_type.value}, isi: {isi}, bui: {bui}, fmc: {fmc}, sfc: {sfc}"
         raise CFFDRSException(message)
 
+    if use_native_backend():
+        return _native_scalar(fbp.rate_of_spread, fuel_type, isi, bui, fmc, sfc, pc, cc, pdf, cbh,
+                              error_message="Failed to calculate ROS")
     # For some reason, the registered converter can't turn a None to a NULL, but we need to
     # set these to NULL, despite setting a converter for None to NULL, because it it can only
     # convert a NULL to NULL. Doesn't make sense? Exactly.
@@ -404,6 +555,9 @@ def surface_fuel_consumption(
         message = PARAMS_ERROR_MESSAGE + \
             f"_SFCcalc; fuel_type: {fuel_type.value}, bui: {bui}, ffmc: {ffmc}"
         raise CFFDRSException(message)
+    if use_native_backend():
+        return _native_scalar(fbp.surface_fuel_consumption, fuel_type, bui, ffmc, pc,
+                              error_message="Failed to calculate SFC")
     if pc is None:
         pc = NULL
     result = CFFDRS.instance().cffdrs._SFCcalc(FUELTYPE=fuel_type.value,
@@ -436,6 +590,8 @@ def fire_distance(fuel_type: FuelTypeEnum, ros_eq: float, hr: int, cfb: float):
     # Returns:
     #   DISTt:    Head fire spread distance at time t
     """
+    if use_native_backend():
+        return _native_scalar(fbp.fire_distance, fuel_type, ros_eq, hr, cfb, error_message="Failed to calculate DISTt")
     result = CFFDRS.instance().cffdrs._DISTtcalc(fuel_type.value, ros_eq, hr, cfb)
     if isinstance(result[0], float):
         return result[0]
@@ -464,6 +620,9 @@ def foliar_moisture_content(lat: int, long: int, elv: float, day_of_year: int,
     # FMCcalc expects longitude to always be a positive number.
     if long < 0:
         long = -long
+    if use_native_backend():
+        return _native_scalar(fbp.foliar_moisture_content, lat, long, elv, day_of_year,
+                              date_of_minimum_foliar_moisture_content, error_message="Failed to calculate FMC")
     result = CFFDRS.instance().cffdrs._FMCcalc(LAT=lat, LONG=long, ELV=elv,
                                                DJ=day_of_year, D0=date_of_minimum_foliar_moisture_content)
     if isinstance(result[0], float):
@@ -482,6 +641,8 @@ def length_to_breadth_ratio(fuel_type: FuelTypeEnum, wind_speed: float):
     """
     if wind_speed is None or fuel_type is None:
         return CFFDRSException()
+    if use_native_backend():
+        return _native_scalar(fbp.length_to_breadth_ratio, fuel_type, wind_speed, error_message="Failed to calculate LB")
     result = CFFDRS.instance().cffdrs._LBcalc(FUELTYPE=fuel_type.value, WSV=wind_speed)
     if isinstance(result[0], float):
         return result[0]
@@ -518,6 +679,9 @@ def length_to_breadth_ratio_t(fuel_type: FuelTypeEnum,
     #   LBt: Length to Breadth ratio at time since ignition
     #
     """
+    if use_native_backend():
+        return _native_scalar(fbp.length_to_breadth_ratio_t, fuel_type, lb, time_since_ignition, cfb,
+                              error_message="Failed to calculate LBt")
     result = CFFDRS.instance().cffdrs._LBtcalc(FUELTYPE=fuel_type.value, LB=lb,
                                                HR=time_since_ignition, CFB=cfb)
     if isinstance(result[0], float):
@@ -541,6 +705,9 @@ def fine_fuel_moisture_code(ffmc: float, temperature: float, relative_humidity:
     # Returns: A single ffmc value
     """
 
+    if use_native_backend():
+        return _native_scalar(fwi.fine_fuel_moisture_code, ffmc, temperature, relative_humidity, wind_speed,
+                              precipitation, error_message="Failed to calculate ffmc")
     if ffmc is None:
         ffmc = NULL
     result = CFFDRS.instance().cffdrs._ffmcCalc(ffmc_yda=ffmc, temp=temperature, rh=relative_humidity,
@@ -563,6 +730,8 @@ def initial_spread_index(ffmc: float, wind_speed: float, fbpMod: bool = False):
     # Returns:
     #   ISI:    Intial Spread Index
     """
+    if use_native_backend():
+        return _native_scalar(fbp.initial_spread_index, ffmc, wind_speed, fbpMod, error_message="Failed to calculate ISI")
     if ffmc is None:
         ffmc = NULL
     result = CFFDRS.instance().cffdrs._ISIcalc(ffmc=ffmc, ws=wind_speed, fbpMod=fbpMod)
@@ -580,6 +749,8 @@ def fire_weather_index(isi: float, bui: float):
         Returns: A single fwi value
     """
 
+    if use_native_backend():
+        return _native_scalar(fwi.fire_weather_index, isi, bui, error_message="Failed to calculate fwi")
     result = CFFDRS.instance().cffdrs._fwiCalc(isi=isi, bui=bui)
     if isinstance(result[0], float):
         return result[0]
@@ -608,6 +779,9 @@ def crown_fraction_burned(fuel_type: FuelTypeEnum, fmc: float, sfc: float,
         message = PARAMS_ERROR_MESSAGE + \
             f"_CFBcalc; fuel_type: {fuel_type.value}, cbh: {cbh}, fmc: {fmc}"
         raise CFFDRSException(message)
+    if use_native_backend():
+        return _native_scalar(fbp.crown_fraction_burned, fuel_type, fmc, sfc, ros, cbh,
+                              error_message="Failed to calculate CFB")
     result = CFFDRS.instance().cffdrs._CFBcalc(FUELTYPE=fuel_type.value, FMC=fmc, SFC=sfc,
                                                ROS=ros, CBH=cbh)
     if isinstance(result[0], float):
@@ -639,6 +813,9 @@ def total_fuel_consumption(
         raise CFFDRSException(message)
     # According to fbp.Rd in cffdrs R package, Crown Fuel Load (CFL) can use default value of 1.0
     # without causing major impacts on final output.
+    if use_native_backend():
+        return _native_scalar(fbp.total_fuel_consumption, fuel_type, cfb, sfc, pc, pdf, cfl,
+                              error_message="Failed to calculate TFC")
     if pc is None:
         pc = NULL
     if pdf is None:
@@ -672,6 +849,8 @@ def head_fire_intensity(fuel_type: FuelTypeEnum,
     # Returns:
     #   FI:   Fire Intensity (kW/m)
 
+    if use_native_backend():
+        return _native_scalar(fbp.fire_intensity, tfc, ros, error_message="Failed to calculate FI")
     result = CFFDRS.instance().cffdrs._FIcalc(FC=tfc, ROS=ros)
     if isinstance(result[0], float):
         return result[0]
@@ -730,6 +909,9 @@ def get_hourly_ffmc_on_diurnal_curve(ffmc_solar_noon: float, target_hour: float,
         # take the mean amount of precip for the past 24 hours. This is a liberal approximation
         # with a lot of hand-waving.
     }
+    if use_native_backend():
+        return _native_scalar(fwi.hourly_fine_fuel_moisture_code, ffmc_solar_noon, temperature, relative_humidity,
+                              wind_speed, weather_data['prec'], time_offset, error_message="Failed to calculate hffmc")
     weather_data = DataFrame(weather_data)
     result = CFFDRS.instance().cffdrs.hffmc(weatherstream=weather_data,
                                             ffmc_old=ffmc_solar_noon, time_step=time_offset)
@@ -738,6 +920,83 @@ def get_hourly_ffmc_on_diurnal_curve(ffmc_solar_noon: float, target_hour: float,
     raise CFFDRSException("Failed to calculate hffmc")
 
 
+def get_hourly_ffmc_on_diurnal_curves(ffmc_solar_noon, temperature, relative_humidity, wind_speed, precip,
+                                      hours=range(24)) -> np.ndarray:
+    """ Vectorized get_hourly_ffmc_on_diurnal_curve: computes the hourly FFMC at each of the given hours
+    (on 24 hour clock) for many stations at once, returning a station x hour matrix.
+
+    Station values (ffmc_solar_noon and the solar noon weather) are given one per station. The whole
+    matrix is computed with a single numpy pass or a single hffmc call, depending on the configured backend.
+    """
+    engine = fwi if use_native_backend() else CFFDRS.instance()
+    ffmc_solar_noon, temperature, relative_humidity, wind_speed, precip = (
+        np.atleast_1d(fbp.as_array(value))[:, np.newaxis]
+        for value in (ffmc_solar_noon, temperature, relative_humidity, wind_speed, precip))
+    time_offset = np.asarray(hours, dtype=float) - 13  # solar noon
+    # As for a single hour, the precip is the mean hourly amount over the past 24 hours.
+    return engine.hourly_fine_fuel_moisture_code(ffmc_solar_noon, temperature, relative_humidity, wind_speed,
+                                                 precip / 24, time_offset)
+
+
+def _head_fire_intensity_for_ffmc(fuel_type: FuelTypeEnum, percentage_conifer: float,
+                                  percentage_dead_balsam_fir: float, bui: float, wind_speed: float,
+                                  grass_cure: float, crown_base_height: float,
+                                  ffmc: float, fmc: float, cfb: float, cfl: float) -> float:
+    """ HFI for the given FFMC, holding all other values constant. """
+    sfc = surface_fuel_consumption(fuel_type, bui, ffmc, percentage_conifer)
+    isi = initial_spread_index(ffmc, wind_speed)
+    ros = rate_of_spread(fuel_type, isi, bui, fmc, sfc, percentage_conifer,
+                         grass_cure, percentage_dead_balsam_fir, crown_base_height)
+    return head_fire_intensity(fuel_type, percentage_conifer, percentage_dead_balsam_fir, ros, cfb, cfl, sfc)
+
+
+# The search for the FFMC at which HFI reaches a target stops once HFI is within this relative error of
+# the target, or once the FFMC has been narrowed down to within FFMC_FOR_TARGET_HFI_TOLERANCE.
+HFI_TARGET_RELATIVE_ERROR = 0.01
+FFMC_FOR_TARGET_HFI_TOLERANCE = 0.01
+FFMC_FOR_TARGET_HFI_MAX_ITERATIONS = 50
+
+
+def _quantize(value: Optional[float], digits: int) -> Optional[float]:
+    return None if value is None else round(value, digits)
+
+
+@lru_cache(maxsize=4096)
+def _solve_ffmc_for_target_hfi(fuel_type: FuelTypeEnum, percentage_conifer: float,
+                               percentage_dead_balsam_fir: float, bui: float, wind_speed: float,
+                               grass_cure: float, crown_base_height: float,
+                               fmc: float, cfb: float, cfl: float, target_hfi: float) -> Tuple[float, float]:
+    """ Bisect [0, 101] for the FFMC at which HFI reaches target_hfi. HFI increases with FFMC (through
+    ISI and SFC), so the root is bracketed as long as HFI at the bounds is on either side of the target. """
+    def hfi_at(ffmc: float) -> float:
+        return _head_fire_intensity_for_ffmc(fuel_type, percentage_conifer, percentage_dead_balsam_fir, bui,
+                                             wind_speed, grass_cure, crown_base_height, ffmc, fmc, cfb, cfl)
+
+    # FFMC has upper bound 101
+    # exit condition 1: FFMC of 101 still causes HFI < target_hfi
+    upper_ffmc, upper_hfi = 101.0, hfi_at(101.0)
+    if upper_hfi < target_hfi:
+        return (upper_ffmc, upper_hfi)
+    # exit condition 2: FFMC of 0 still causes HFI >= target_hfi
+    lower_ffmc, lower_hfi = 0.0, hfi_at(0.0)
+    if lower_hfi >= target_hfi:
+        return (lower_ffmc, lower_hfi)
+    # exit condition 3: relative error within 1% (or FFMC narrowed down as far as it makes sense to)
+    for _ in range(FFMC_FOR_TARGET_HFI_MAX_ITERATIONS):
+        if upper_ffmc - lower_ffmc <= FFMC_FOR_TARGET_HFI_TOLERANCE:
+            break
+        experimental_ffmc = (lower_ffmc + upper_ffmc) / 2
+        experimental_hfi = hfi_at(experimental_ffmc)
+        if abs((target_hfi - experimental_hfi) / target_hfi) <= HFI_TARGET_RELATIVE_ERROR:
+            return (experimental_ffmc, experimental_hfi)
+        if experimental_hfi < target_hfi:
+            lower_ffmc = experimental_ffmc
+        else:
+            upper_ffmc, upper_hfi = experimental_ffmc, experimental_hfi
+    # HFI >= target_hfi at the upper end of the bracket.
+    return (upper_ffmc, upper_hfi)
+
+
 def get_ffmc_for_target_hfi(
         fuel_type: FuelTypeEnum,
         percentage_conifer: float,
@@ -746,47 +1005,21 @@ def get_ffmc_for_target_hfi(
         wind_speed: float,
         grass_cure: int,
         crown_base_height: float,
-        ffmc: float, fmc: float, cfb: float, cfl: float, target_hfi: float):
+        fmc: float, cfb: float, cfl: float, target_hfi: float):
     """ Returns a floating point value for minimum FFMC required (holding all other values constant)
-        before HFI reaches the target_hfi (in kW/m).
-        """
-    # start off using the actual FFMC value
-    experimental_ffmc = ffmc
-    experimental_sfc = surface_fuel_consumption(fuel_type, bui, experimental_ffmc, percentage_conifer)
-    experimental_isi = initial_spread_index(experimental_ffmc, wind_speed)
-    experimental_ros = rate_of_spread(fuel_type, experimental_isi, bui, fmc, experimental_sfc,
-                                      percentage_conifer,
-                                      grass_cure, percentage_dead_balsam_fir, crown_base_height)
-    experimental_hfi = head_fire_intensity(fuel_type,
-                                           percentage_conifer,
-                                           percentage_dead_balsam_fir,
-                                           experimental_ros, cfb,
-                                           cfl, experimental_sfc)
-    error_hfi = (target_hfi - experimental_hfi) / target_hfi
-
-   # FFMC has upper bound 101
-   # exit condition 1: FFMC of 101 still causes HFI < target_hfi
-   # exit condition 2: FFMC of 0 still causes HFI > target_hfi
-   # exit condition 3: relative error within 1%
-
-    while abs(error_hfi) > 0.01:
-        if experimental_ffmc >= 100.9 and experimental_hfi < target_hfi:
-            break
-        if experimental_ffmc <= 0.1:
-            break
-        if error_hfi > 0:  # if the error value is a positive number, make experimental FFMC value bigger
-            experimental_ffmc = min(101, experimental_ffmc + ((101 - experimental_ffmc) / 2))
-        else:  # if the error value is a negative number, need to make experimental FFMC value smaller
-            experimental_ffmc = max(0, experimental_ffmc - ((101 - experimental_ffmc) / 2))
-        experimental_isi = initial_spread_index(experimental_ffmc, wind_speed)
-        experimental_sfc = surface_fuel_consumption(fuel_type, bui, experimental_ffmc, percentage_conifer)
-        experimental_ros = rate_of_spread(fuel_type, experimental_isi, bui, fmc,
-                                          experimental_sfc, percentage_conifer,
-                                          grass_cure, percentage_dead_balsam_fir, crown_base_height)
-        experimental_hfi = head_fire_intensity(fuel_type,
-                                               percentage_conifer,
-                                               percentage_dead_balsam_fir, experimental_ros,
-                                               cfb, cfl, experimental_sfc)
-        error_hfi = (target_hfi - experimental_hfi) / target_hfi
-
-    return (experimental_ffmc, experimental_hfi)
+    before HFI reaches the target_hfi (in kW/m), along with the HFI at that FFMC.
+
+    The inputs are rounded (to a precision well within that of the weather data), so that results can be
+    cached and reused across stations, requests and the two critical hours targets.
+    """
+    return _solve_ffmc_for_target_hfi(fuel_type,
+                                      _quantize(percentage_conifer, 1),
+                                      _quantize(percentage_dead_balsam_fir, 1),
+                                      _quantize(bui, 1),
+                                      _quantize(wind_speed, 1),
+                                      _quantize(grass_cure, 1),
+                                      _quantize(crown_base_height, 1),
+                                      _quantize(fmc, 1),
+                                      _quantize(cfb, 3),
+                                      _quantize(cfl, 2),
+                                      target_hfi)
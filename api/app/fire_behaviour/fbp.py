@@ -0,0 +1,365 @@
+""" Vectorized (NumPy) implementation of the Fire Behaviour Prediction (FBP) System equations.
+
+Every function in this module accepts either scalars or arrays (one element per station-day), and
+returns an array of the broadcast shape. The equations, constants and variable names are a direct
+port of the cffdrs R package (which is what app.fire_behaviour.cffdrs delegates to), so that results
+can be checked for parity against the R implementation.
+
+Forestry Canada Fire Danger Group (FCFDG) (1992). "Development and Structure of the Canadian Forest Fire
+Behavior Prediction System." Technical Report ST-X-3, Forestry Canada, Ottawa, Ontario.
+
+Wotton, B.M., Alexander, M.E., Taylor, S.W. 2009. Updates and revisions to the 1992 Canadian forest fire
+behavior prediction system. Nat. Resour. Can., Can. For. Serv., Great Lakes For. Cent., Sault Ste. Marie,
+Ontario, Canada. Information Report GLC-X-10, 45p.
+
+Missing (None) inputs are treated as NaN, and propagate through to the result wherever they are
+actually required by the equation for that fuel type.
+"""
+from typing import NamedTuple
+import numpy as np
+
+# Fuel types as ordered in the cffdrs R package.
+FUEL_TYPES = ('C1', 'C2', 'C3', 'C4', 'C5', 'C6', 'C7', 'D1', 'M1', 'M2', 'M3', 'M4',
+              'S1', 'S2', 'S3', 'O1A', 'O1B')
+
+# Rate of spread equation parameters, Table 6 (FCFDG 1992).
+_A = dict(zip(FUEL_TYPES, (90, 110, 110, 110, 30, 30, 45, 30, 0, 0, 120, 100, 75, 40, 55, 190, 250)))
+_B = dict(zip(FUEL_TYPES, (0.0649, 0.0282, 0.0444, 0.0293, 0.0697, 0.0800, 0.0305, 0.0232, 0, 0,
+                           0.0572, 0.0404, 0.0297, 0.0438, 0.0829, 0.0310, 0.0350)))
+_C0 = dict(zip(FUEL_TYPES, (4.5, 1.5, 3.0, 1.5, 4.0, 3.0, 2.0, 1.6, 0, 0, 1.4, 1.48, 1.3, 1.7, 3.2, 1.4, 1.7)))
+# Buildup effect parameters, Table 7 (FCFDG 1992).
+_BUI0 = dict(zip(FUEL_TYPES, (72, 64, 62, 66, 56, 62, 106, 32, 50, 50, 50, 50, 38, 63, 31, 1, 1)))
+_Q = dict(zip(FUEL_TYPES, (0.9, 0.7, 0.75, 0.8, 0.8, 0.8, 0.85, 0.9, 0.8, 0.8, 0.8, 0.8,
+                           0.75, 0.75, 0.75, 1.0, 1.0)))
+
+# Fuel types without a crown. CFB is taken to be 0 for these (app.fire_behaviour.prediction.calculate_cfb).
+NO_CROWN_FUEL_TYPES = ('D1', 'O1A', 'O1B', 'S1', 'S2', 'S3')
+
+# Fuel types for which acceleration is independent of crown fraction burned.
+_CONSTANT_ACCELERATION_FUEL_TYPES = ('C1', 'O1A', 'O1B', 'S1', 'S2', 'S3', 'D1')
+
+# Standard grass fuel load (kg/m^2)
+DEFAULT_GRASS_FUEL_LOAD = 0.35
+
+
+class FireBehaviourArrays(NamedTuple):
+    """ Primary and secondary FBP outputs, one element per input row. """
+    fmc: np.ndarray
+    sfc: np.ndarray
+    ros: np.ndarray
+    cfb: np.ndarray
+    hfi: np.ndarray
+    bros: np.ndarray
+    lb: np.ndarray
+
+
+def as_array(value, dtype=float) -> np.ndarray:
+    """ Turn a scalar, list or array (possibly containing None) into a numpy array, with None mapped
+    to NaN. """
+    if value is None:
+        return np.array(np.nan, dtype=dtype)
+    array = np.asarray(value)
+    if array.dtype == object:
+        array = np.where(np.equal(array, None), np.nan, array)
+    return array.astype(dtype)
+
+
+def as_fuel_type_array(fuel_type) -> np.ndarray:
+    """ Turn a fuel type (or list of fuel types) into an upper case string array. FuelTypeEnum values
+    are accepted. """
+    if isinstance(fuel_type, np.ndarray) and fuel_type.dtype.kind == 'U':
+        return np.char.upper(fuel_type)
+    if isinstance(fuel_type, str):
+        return np.array(getattr(fuel_type, 'value', fuel_type).upper())
+    return np.array([getattr(item, 'value', item).upper() for item in fuel_type])
+
+
+def _lookup(table: dict, fuel_type: np.ndarray) -> np.ndarray:
+    """ Map an array of fuel types to their parameter values (NaN for unknown fuel types) """
+    return np.vectorize(lambda code: table.get(code, np.nan), otypes=[float])(fuel_type)
+
+
+def _is(fuel_type: np.ndarray, *codes: str) -> np.ndarray:
+    return np.isin(fuel_type, codes)
+
+
+def _nan_if_missing(result: np.ndarray, *inputs: np.ndarray) -> np.ndarray:
+    """ Branches selected with np.where silently swallow NaN inputs (NaN comparisons are False), so
+    restore NaN wherever any of the inputs is missing (mirroring NA propagation in R). """
+    missing = np.zeros(np.shape(result), dtype=bool)
+    for value in inputs:
+        missing = missing | np.isnan(value)
+    return np.where(missing, np.nan, result)
+
+
+def _rsi(fuel_type: np.ndarray, isi: np.ndarray) -> np.ndarray:
+    """ Basic rate of spread equation (Eq. 26, FCFDG 1992) """
+    return _lookup(_A, fuel_type) * (1 - np.exp(-_lookup(_B, fuel_type) * isi)) ** _lookup(_C0, fuel_type)
+
+
+def _rsi_for(code: str, isi: np.ndarray) -> np.ndarray:
+    return _A[code] * (1 - np.exp(-_B[code] * isi)) ** _C0[code]
+
+
+def buildup_effect(fuel_type, bui) -> np.ndarray:
+    """ The Buildup Effect (Eq. 54, FCFDG 1992) """
+    fuel_type = as_fuel_type_array(fuel_type)
+    bui = as_array(bui)
+    bui0 = _lookup(_BUI0, fuel_type)
+    q = _lookup(_Q, fuel_type)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        be = np.where((bui > 0) & (bui0 > 0), np.exp(50 * np.log(q) * (1 / bui - 1 / bui0)), 1.0)
+    return _nan_if_missing(be, bui)
+
+
+def initial_spread_index(ffmc, wind_speed, fbp_mod: bool = False) -> np.ndarray:
+    """ Initial Spread Index (Eqs. 24-26, Van Wagner 1987; Eq. 53a FCFDG 1992 when fbp_mod is set) """
+    ffmc = as_array(ffmc)
+    wind_speed = as_array(wind_speed)
+    fm = 147.2 * (101 - ffmc) / (59.5 + ffmc)
+    if fbp_mod:
+        fw = np.where(wind_speed >= 40, 12 * (1 - np.exp(-0.0818 * (wind_speed - 28))),
+                      np.exp(0.05039 * wind_speed))
+    else:
+        fw = np.exp(0.05039 * wind_speed)
+    ff = 91.9 * np.exp(-0.1386 * fm) * (1 + (fm ** 5.31) / 49300000)
+    return 0.208 * fw * ff
+
+
+def foliar_moisture_content(lat, long, elv, day_of_year, date_of_minimum_foliar_moisture_content=0) -> np.ndarray:
+    """ Foliar Moisture Content (Eqs. 1-8, FCFDG 1992). Longitude is expected to be positive (degrees
+    west); negative values are flipped, as is done for the R call. """
+    lat = as_array(lat)
+    long = np.abs(as_array(long))
+    elv = as_array(elv)
+    day_of_year = as_array(day_of_year)
+    d0 = as_array(date_of_minimum_foliar_moisture_content)
+    # Normalized latitude (Eqs. 1 & 3)
+    latn = np.where(elv <= 0, 46 + 23.4 * np.exp(-0.0360 * (150 - long)),
+                    43 + 33.7 * np.exp(-0.0351 * (150 - long)))
+    # Date of minimum foliar moisture content (Eqs. 2 & 4), rounded because it's a date.
+    d0 = np.where(d0 <= 0, np.where(elv <= 0, 151 * (lat / latn), 142.1 * (lat / latn) + 0.0172 * elv), d0)
+    d0 = np.round(d0)
+    # Number of days between day of year and date of min FMC (Eq. 5)
+    nd = np.abs(day_of_year - d0)
+    # Eqs. 6, 7 & 8
+    fmc = np.where(nd < 30, 85 + 0.0189 * nd ** 2,
+                   np.where(nd < 50, 32.9 + 3.17 * nd - 0.0288 * nd ** 2, 120.0))
+    return _nan_if_missing(fmc, nd)
+
+
+def surface_fuel_consumption(fuel_type, bui, ffmc, pc, gfl=DEFAULT_GRASS_FUEL_LOAD) -> np.ndarray:
+    """ Surface Fuel Consumption in kg/m^2 (Eqs. 9-25, FCFDG 1992; Eq. 9 Wotton et al. 2009) """
+    fuel_type = as_fuel_type_array(fuel_type)
+    bui = as_array(bui)
+    ffmc = as_array(ffmc)
+    pc = as_array(pc)
+    gfl = as_array(gfl)
+    with np.errstate(invalid='ignore'):
+        c1 = np.where(ffmc > 84, 0.75 + 0.75 * (1 - np.exp(-0.23 * (ffmc - 84))) ** 0.5,
+                      0.75 - 0.75 * (1 - np.exp(-0.23 * (84 - ffmc))) ** 0.5)
+        c7 = _nan_if_missing(np.where(ffmc > 70, 2 * (1 - np.exp(-0.104 * (ffmc - 70))), 0), ffmc) + \
+            1.5 * (1 - np.exp(-0.0201 * bui))
+    c2 = 5.0 * (1 - np.exp(-0.0115 * bui))
+    d1 = 1.5 * (1 - np.exp(-0.0183 * bui))
+    sfc = np.select(
+        [_is(fuel_type, 'C1'),
+         _is(fuel_type, 'C2', 'M3', 'M4'),
+         _is(fuel_type, 'C3', 'C4'),
+         _is(fuel_type, 'C5', 'C6'),
+         _is(fuel_type, 'C7'),
+         _is(fuel_type, 'D1'),
+         _is(fuel_type, 'M1', 'M2'),
+         _is(fuel_type, 'O1A', 'O1B'),
+         _is(fuel_type, 'S1'),
+         _is(fuel_type, 'S2'),
+         _is(fuel_type, 'S3')],
+        [c1,
+         c2,
+         5.0 * (1 - np.exp(-0.0164 * bui)) ** 2.24,
+         5.0 * (1 - np.exp(-0.0149 * bui)) ** 2.48,
+         c7,
+         d1,
+         pc / 100 * c2 + (100 - pc) / 100 * d1,
+         gfl,
+         4.0 * (1 - np.exp(-0.025 * bui)) + 4.0 * (1 - np.exp(-0.034 * bui)),
+         10.0 * (1 - np.exp(-0.013 * bui)) + 6.0 * (1 - np.exp(-0.060 * bui)),
+         12.0 * (1 - np.exp(-0.0166 * bui)) + 20.0 * (1 - np.exp(-0.0210 * bui))],
+        default=-999.0)
+    return np.where(sfc <= 0, 0.000001, sfc)
+
+
+def critical_surface_intensity(fmc, cbh) -> np.ndarray:
+    """ Critical surface intensity (Eq. 56, FCFDG 1992) """
+    return 0.001 * (as_array(cbh) ** 1.5) * (460 + 25.9 * as_array(fmc)) ** 1.5
+
+
+def crown_fraction_burned(fuel_type, fmc, sfc, ros, cbh) -> np.ndarray:
+    """ Crown Fraction Burned, between 0 and 1 (Eqs. 56-58, FCFDG 1992).
+
+    NOTE: As with the R package, this does not zero out CFB for fuel types without a crown, that is left
+    up to the caller (see app.fire_behaviour.prediction.calculate_cfb).
+    """
+    del fuel_type  # CFB is independent of fuel type, the argument is kept for parity with cffdrs.
+    ros = as_array(ros)
+    csi = critical_surface_intensity(fmc, cbh)
+    with np.errstate(divide='ignore'):
+        # Surface fire critical rate of spread (Eq. 57)
+        rso = csi / (300 * as_array(sfc))
+    with np.errstate(invalid='ignore'):
+        cfb = np.where(ros > rso, 1 - np.exp(-0.23 * (ros - rso)), 0.0)
+    return _nan_if_missing(cfb, ros, rso)
+
+
+def _c6_rates(fuel_type, isi, bui, fmc, sfc, cbh):
+    """ C6 (conifer plantation) surface, crown and final rate of spread (Eqs. 59-65, FCFDG 1992).
+    Returns (rsi, ros, cfb) """
+    isi = as_array(isi)
+    fmc = as_array(fmc)
+    fme_avg = 0.778
+    # Average foliar moisture effect (Eq. 61)
+    fme = ((1.5 - 0.00275 * fmc) ** 4.) / (460 + 25.9 * fmc) * 1000
+    # Intermediate surface rate of spread (Eq. 62)
+    rsi = 30 * (1 - np.exp(-0.08 * isi)) ** 3.0
+    # Surface spread rate (Eq. 63)
+    rss = rsi * buildup_effect(fuel_type, bui)
+    # Crown spread rate (Eq. 64)
+    rsc = 60 * (1 - np.exp(-0.0497 * isi)) * fme / fme_avg
+    cfb = np.where(rsc > rss, crown_fraction_burned(fuel_type, fmc, sfc, rss, cbh), 0.0)
+    # Eq. 65
+    ros = np.where(rsc > rss, rss + cfb * (rsc - rss), rss)
+    return rsi, ros, cfb
+
+
+def rate_of_spread(fuel_type, isi, bui, fmc, sfc, pc, cc, pdf, cbh) -> np.ndarray:
+    """ Rate of spread in m/min (Eqs. 26-35 and 65, FCFDG 1992; Wotton et al. 2009).
+
+    pc: Percent Conifer (%)
+    cc: Degree of curing (%) (just "C" in FCFDG 1992)
+    pdf: Percent Dead Balsam Fir (%)
+    cbh: Crown base height (m)
+    """
+    fuel_type = as_fuel_type_array(fuel_type)
+    isi = as_array(isi)
+    pc = as_array(pc)
+    cc = as_array(cc)
+    pdf = as_array(pdf)
+
+    rsi = np.where(_is(fuel_type, 'C1', 'C2', 'C3', 'C4', 'C5', 'C6', 'C7', 'D1', 'S1', 'S2', 'S3'),
+                   _rsi(fuel_type, isi), -1.0)
+    # Mixedwood and dead balsam fir fuel types are a blend of their components (Eqs. 27-32), with
+    # no buildup effect applied to the components.
+    rsi_c2 = _rsi_for('C2', isi)
+    rsi_d1 = _rsi_for('D1', isi)
+    rsi = np.where(_is(fuel_type, 'M1'), pc / 100 * rsi_c2 + (100 - pc) / 100 * rsi_d1, rsi)
+    rsi = np.where(_is(fuel_type, 'M2'), pc / 100 * rsi_c2 + 0.2 * (100 - pc) / 100 * rsi_d1, rsi)
+    rsi = np.where(_is(fuel_type, 'M3'), pdf / 100 * _rsi_for('M3', isi) + (1 - pdf / 100) * rsi_d1, rsi)
+    rsi = np.where(_is(fuel_type, 'M4'), pdf / 100 * _rsi_for('M4', isi) + 0.2 * (1 - pdf / 100) * rsi_d1, rsi)
+    # Grass curing factor (Eqs. 35a, 35b)
+    curing_factor = np.where(cc < 58.8, 0.005 * (np.exp(0.061 * cc) - 1), 0.176 + 0.02 * (cc - 58.8))
+    rsi = np.where(_is(fuel_type, 'O1A', 'O1B'), _rsi(fuel_type, isi) * curing_factor, rsi)
+
+    ros = buildup_effect(fuel_type, bui) * rsi
+    is_c6 = _is(fuel_type, 'C6')
+    if np.any(is_c6):
+        _, c6_ros, _ = _c6_rates(fuel_type, isi, bui, fmc, sfc, cbh)
+        ros = np.where(is_c6, c6_ros, ros)
+    return np.where(ros <= 0, 0.000001, ros)
+
+
+def back_rate_of_spread(fuel_type, ffmc, bui, wsv, fmc, sfc, pc, cc, pdf, cbh) -> np.ndarray:
+    """ Back fire rate of spread in m/min (Eqs. 75-77, FCFDG 1992) """
+    ffmc = as_array(ffmc)
+    m = 147.2 * (101 - ffmc) / (59.5 + ffmc)
+    ff = 91.9 * np.exp(-.1386 * m) * (1.0 + (m ** 5.31) / 4.93e7)
+    # Back fire wind function (Eq. 75)
+    bfw = np.exp(-.05039 * as_array(wsv))
+    # ISI associated with the back fire spread rate (Eq. 76)
+    bisi = 0.208 * bfw * ff
+    return rate_of_spread(fuel_type, bisi, bui, fmc, sfc, pc, cc, pdf, cbh)
+
+
+def flank_rate_of_spread(ros, bros, lb) -> np.ndarray:
+    """ Flank fire rate of spread in m/min (Eq. 89, FCFDG 1992) """
+    return (as_array(ros) + as_array(bros)) / as_array(lb) / 2
+
+
+def length_to_breadth_ratio(fuel_type, wsv) -> np.ndarray:
+    """ Length to breadth ratio (Eqs. 79-81, FCFDG 1992; Eq. 80a Wotton et al. 2009) """
+    fuel_type = as_fuel_type_array(fuel_type)
+    wsv = as_array(wsv)
+    with np.errstate(invalid='ignore'):
+        lb = np.where(_is(fuel_type, 'O1A', 'O1B'),
+                      np.where(wsv >= 1.0, 1.1 * wsv ** 0.464, 1.0),
+                      1.0 + 8.729 * (1 - np.exp(-0.030 * wsv)) ** 2.155)
+    return _nan_if_missing(lb, wsv)
+
+
+def _acceleration(fuel_type, cfb) -> np.ndarray:
+    """ Acceleration parameter alpha (Eqs. 70-72, FCFDG 1992) """
+    fuel_type = as_fuel_type_array(fuel_type)
+    cfb = as_array(cfb)
+    return np.where(_is(fuel_type, *_CONSTANT_ACCELERATION_FUEL_TYPES), 0.115,
+                    0.115 - 18.8 * (cfb ** 2.5) * np.exp(-8 * cfb))
+
+
+def length_to_breadth_ratio_t(fuel_type, lb, minutes_since_ignition, cfb) -> np.ndarray:
+    """ Length to breadth ratio at elapsed time since ignition (Eq. 81, Wotton et al. 2009) """
+    alpha = _acceleration(fuel_type, cfb)
+    return (as_array(lb) - 1) * (1 - np.exp(-alpha * as_array(minutes_since_ignition))) + 1
+
+
+def rate_of_spread_t(fuel_type, ros_eq, minutes_since_ignition, cfb) -> np.ndarray:
+    """ Rate of spread at elapsed time since ignition (Eq. 70, FCFDG 1992) """
+    alpha = _acceleration(fuel_type, cfb)
+    return as_array(ros_eq) * (1 - np.exp(-alpha * as_array(minutes_since_ignition)))
+
+
+def fire_distance(fuel_type, ros_eq, minutes_since_ignition, cfb) -> np.ndarray:
+    """ Head fire spread distance at elapsed time since ignition (Eq. 71, FCFDG 1992) """
+    alpha = _acceleration(fuel_type, cfb)
+    minutes = as_array(minutes_since_ignition)
+    return as_array(ros_eq) * (minutes + np.exp(-alpha * minutes) / alpha - 1 / alpha)
+
+
+def crown_fuel_consumption(fuel_type, cfl, cfb, pc, pdf) -> np.ndarray:
+    """ Crown Fuel Consumption in kg/m^2 (Eqs. 66a, 66b, 66c, FCFDG 1992) """
+    fuel_type = as_fuel_type_array(fuel_type)
+    cfc = as_array(cfl) * as_array(cfb)
+    return np.where(_is(fuel_type, 'M1', 'M2'), as_array(pc) / 100 * cfc,
+                    np.where(_is(fuel_type, 'M3', 'M4'), as_array(pdf) / 100 * cfc, cfc))
+
+
+def total_fuel_consumption(fuel_type, cfb, sfc, pc, pdf, cfl) -> np.ndarray:
+    """ Total (surface + crown) Fuel Consumption in kg/m^2 """
+    return as_array(sfc) + crown_fuel_consumption(fuel_type, cfl, cfb, pc, pdf)
+
+
+def fire_intensity(fuel_consumption, ros) -> np.ndarray:
+    """ Byram's fire intensity in kW/m (Eq. 69, FCFDG 1992) """
+    return 300 * as_array(fuel_consumption) * as_array(ros)
+
+
+def head_fire_intensity(fuel_type, percentage_conifer, percentage_dead_balsam_fir, ros, cfb, cfl, sfc) -> np.ndarray:
+    """ Head Fire Intensity in kW/m, computing the total fuel consumption along the way. """
+    tfc = total_fuel_consumption(fuel_type, cfb, sfc, percentage_conifer, percentage_dead_balsam_fir, cfl)
+    return fire_intensity(tfc, ros)
+
+
+def calculate_fire_behaviour(fuel_type, isi, bui, ffmc, wind_speed, fmc, pc, cc, pdf, cbh, cfl) -> FireBehaviourArrays:
+    """ Compute SFC, ROS, CFB, HFI, BROS and L/B for arrays of station-day inputs in one pass.
+
+    Ground slope is assumed to be 0, so the net effective wind speed is the wind speed (as is the case in
+    app.fire_behaviour.cffdrs.calculate_wind_speed). CFB is reported as 0 for fuel types that don't have a
+    crown, consistent with app.fire_behaviour.prediction.calculate_cfb.
+    """
+    fuel_type = as_fuel_type_array(fuel_type)
+    sfc = surface_fuel_consumption(fuel_type, bui, ffmc, pc)
+    ros = rate_of_spread(fuel_type, isi, bui, fmc, sfc, pc, cc, pdf, cbh)
+    cfb = np.where(_is(fuel_type, *NO_CROWN_FUEL_TYPES), 0.0,
+                   crown_fraction_burned(fuel_type, fmc, sfc, ros, cbh))
+    hfi = head_fire_intensity(fuel_type, pc, pdf, ros, cfb, cfl, sfc)
+    bros = back_rate_of_spread(fuel_type, ffmc, bui, wind_speed, fmc, sfc, pc, cc, pdf, cbh)
+    lb = length_to_breadth_ratio(fuel_type, wind_speed)
+    return FireBehaviourArrays(fmc=np.broadcast_to(as_array(fmc), np.shape(ros)),
+                               sfc=sfc, ros=ros, cfb=cfb, hfi=hfi, bros=bros, lb=lb)
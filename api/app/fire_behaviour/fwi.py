@@ -0,0 +1,275 @@
+""" Vectorized (NumPy) implementation of the daily Canadian Forest Fire Weather Index (FWI) System.
+
+As with app.fire_behaviour.fbp, every function accepts scalars or arrays and the equations are a
+direct port of the cffdrs R package, so results can be checked for parity against R.
+
+Van Wagner, C.E. and Pickett, T.L. 1985. Equations and FORTRAN program for the Canadian Forest Fire
+Weather Index System. Canadian Forestry Service, Petawawa National Forestry Institute, Chalk River,
+Ontario. Forestry Technical Report 33. 18 p.
+
+Van Wagner, C.E. 1987. Development and structure of the Canadian Forest Fire Weather Index System.
+Canadian Forestry Service, Headquarters, Ottawa. Forestry Technical Report 35. 35 p.
+
+calculate_daily_fwi evaluates a whole station x day matrix, carrying each day's codes forward as the
+next day's "yesterday" values, which is what is needed to compute indices for a multi-day forecast.
+calculate_hourly_ffmc does the same for the hourly FFMC (Van Wagner 1977) over a station x hour matrix.
+
+Van Wagner, C.E. 1977. A method of computing fine fuel moisture content throughout the diurnal cycle.
+Environment Canada, Canadian Forestry Service, Petawawa Forest Experiment Station, Chalk River, Ontario.
+Information Report PS-X-69.
+"""
+from typing import NamedTuple
+import numpy as np
+from app.fire_behaviour.fbp import _nan_if_missing, as_array, initial_spread_index
+
+# Effective day length (DMC), by month, for latitudes 30N-90N, 10N-30N, 10S-30S and 30S-90S.
+_ELL01 = np.array([6.5, 7.5, 9, 12.8, 13.9, 13.9, 12.4, 10.9, 9.4, 8, 7, 6])
+_ELL02 = np.array([7.9, 8.4, 8.9, 9.5, 9.9, 10.2, 10.1, 9.7, 9.1, 8.6, 8.1, 7.8])
+_ELL03 = np.array([10.1, 9.6, 9.1, 8.5, 8.1, 7.8, 7.9, 8.3, 8.9, 9.4, 9.9, 10.2])
+_ELL04 = np.array([11.5, 10.5, 9.2, 7.9, 6.8, 6.2, 6.5, 7.4, 8.7, 10, 11.2, 11.8])
+# Day length adjustment factor (DC), by month, for latitudes north of 20N and south of 20S.
+_FL01 = np.array([-1.6, -1.6, -1.6, 0.9, 3.8, 5.8, 6.4, 5, 2.4, 0.4, -1.6, -1.6])
+_FL02 = np.array([6.4, 5, 2.4, 0.4, -1.6, -1.6, -1.6, -1.6, -1.6, 0.9, 3.8, 5.8])
+
+
+class FWIArrays(NamedTuple):
+    """ Daily FWI System codes and indices, in the shape of the weather inputs. """
+    ffmc: np.ndarray
+    dmc: np.ndarray
+    dc: np.ndarray
+    isi: np.ndarray
+    bui: np.ndarray
+    fwi: np.ndarray
+
+
+def _by_month(table: np.ndarray, month: np.ndarray) -> np.ndarray:
+    """ Look up a monthly table (month 1-12), NaN for a missing month. """
+    valid = (month >= 1) & (month <= 12)
+    index = np.where(valid, month, 1).astype(int) - 1
+    return np.where(valid, table[index], np.nan)
+
+
+def fine_fuel_moisture_code(ffmc_yda, temp, rh, ws, prec) -> np.ndarray:
+    """ Fine Fuel Moisture Code (Eqs. 1-10, Van Wagner and Pickett 1985) """
+    ffmc_yda = as_array(ffmc_yda)
+    temp = as_array(temp)
+    rh = as_array(rh)
+    ws = as_array(ws)
+    prec = as_array(prec)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Eq. 1
+        mo = 147.2 * (101 - ffmc_yda) / (59.5 + ffmc_yda)
+        # Eq. 2 Rain reduction to allow for loss in overhead canopy
+        rf = np.where(prec > 0.5, prec - 0.5, -1)
+        # Eqs. 3a & 3b
+        wetting = mo + 42.5 * rf * np.exp(-100 / (251 - mo)) * (1 - np.exp(-6.93 / rf))
+        wetting = np.where(mo > 150, wetting + 0.0015 * ((mo - 150) ** 2) * np.sqrt(rf), wetting)
+        mo = np.where(prec > 0.5, wetting, mo)
+        # The real moisture content of pine litter ranges up to about 250 percent.
+        mo = np.minimum(mo, 250)
+        # Eq. 4 Equilibrium moisture content from drying
+        ed = 0.942 * (rh ** 0.679) + (11 * np.exp((rh - 100) / 10)) + 0.18 * \
+            (21.1 - temp) * (1 - 1 / np.exp(rh * 0.115))
+        # Eq. 5 Equilibrium moisture content from wetting
+        ew = 0.618 * (rh ** 0.753) + (10 * np.exp((rh - 100) / 10)) + 0.18 * \
+            (21.1 - temp) * (1 - 1 / np.exp(rh * 0.115))
+        # Eqs. 7a, 7b & 9 (wetting)
+        absorbing = (mo < ed) & (mo < ew)
+        kl = 0.424 * (1 - ((100 - rh) / 100) ** 1.7) + 0.0694 * np.sqrt(ws) * (1 - ((100 - rh) / 100) ** 8)
+        kw = kl * 0.581 * np.exp(0.0365 * temp)
+        m = np.where(absorbing, ew - (ew - mo) / (10 ** kw), mo)
+        # Eqs. 6a, 6b & 8 (drying)
+        ko = 0.424 * (1 - (rh / 100) ** 1.7) + 0.0694 * np.sqrt(ws) * (1 - (rh / 100) ** 8)
+        kd = ko * 0.581 * np.exp(0.0365 * temp)
+        m = np.where(mo > ed, ed + (mo - ed) / (10 ** kd), m)
+        # Eq. 10
+        ffmc = (59.5 * (250 - m)) / (147.2 + m)
+    return _nan_if_missing(np.clip(ffmc, 0, 101), ffmc_yda, temp, rh, ws, prec)
+
+
+def hourly_fine_fuel_moisture_code(ffmc_old, temp, rh, ws, prec, time_step=1) -> np.ndarray:
+    """ Hourly Fine Fuel Moisture Code (Van Wagner 1977), time_step hours after ffmc_old, as cffdrs hffmc.
+    prec is the rainfall over the last hour. """
+    ffmc_old = as_array(ffmc_old)
+    temp = as_array(temp)
+    rh = as_array(rh)
+    ws = as_array(ws)
+    prec = as_array(prec)
+    time_step = as_array(time_step)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Eq. 1 (with a more precise multiplier than the daily)
+        mo = 147.27723 * (101 - ffmc_old) / (59.5 + ffmc_old)
+        # Eq. 3 Precipitation
+        wetting = mo + 42.5 * prec * np.exp(-100 / (251 - mo)) * (1 - np.exp(-6.93 / prec))
+        wetting = np.where(mo > 150, wetting + 0.0015 * ((mo - 150) ** 2) * np.sqrt(prec), wetting)
+        mo = np.where(prec > 0, wetting, mo)
+        mo = np.minimum(mo, 250)
+        # Eq. 2a Equilibrium moisture content from drying
+        ed = 0.942 * (rh ** 0.679) + (11 * np.exp((rh - 100) / 10)) + 0.18 * \
+            (21.1 - temp) * (1 - 1 / np.exp(0.115 * rh))
+        # Eq. 2b Equilibrium moisture content from wetting
+        ew = 0.618 * (rh ** 0.753) + (10 * np.exp((rh - 100) / 10)) + 0.18 * \
+            (21.1 - temp) * (1 - 1 / np.exp(0.115 * rh))
+        # Eqs. 7a & 7b Log wetting rate, adjusted for temperature
+        absorbing = (mo < ed) & (mo < ew)
+        ko = 0.424 * (1 - ((100 - rh) / 100) ** 1.7) + 0.0694 * np.sqrt(ws) * (1 - ((100 - rh) / 100) ** 8)
+        kw = ko * 0.0579 * np.exp(0.0365 * temp)
+        # Eq. 8
+        m = np.where(absorbing, ew - (ew - mo) / (10 ** (kw * time_step)), mo)
+        # Eqs. 7c & 7d Log drying rate, adjusted for temperature
+        ko = 0.424 * (1 - (rh / 100) ** 1.7) + 0.0694 * np.sqrt(ws) * (1 - (rh / 100) ** 8)
+        kd = ko * 0.0579 * np.exp(0.0365 * temp)
+        # Eq. 8
+        m = np.where(mo > ed, ed + (mo - ed) / (10 ** (kd * time_step)), m)
+        # Eq. 1 Conversion from moisture content to hourly FFMC
+        ffmc = 59.5 * (250 - m) / (147.27723 + m)
+    return _nan_if_missing(np.maximum(ffmc, 0), ffmc_old, temp, rh, ws, prec, time_step)
+
+
+def duff_moisture_code(dmc_yda, temp, rh, prec, lat, month, lat_adjust: bool = True) -> np.ndarray:
+    """ Duff Moisture Code (Eqs. 11-17, Van Wagner and Pickett 1985) """
+    dmc_yda = as_array(dmc_yda)
+    temp = np.maximum(as_array(temp), -1.1)
+    rh = as_array(rh)
+    prec = as_array(prec)
+    lat = as_array(lat)
+    month = as_array(month)
+    # Eq. 16 The log drying rate, with day length adjusted for latitude.
+    ell = _by_month(_ELL01, month)
+    if lat_adjust:
+        ell = np.where((lat <= 30) & (lat > 10), _by_month(_ELL02, month), ell)
+        ell = np.where((lat <= -10) & (lat > -30), _by_month(_ELL03, month), ell)
+        ell = np.where((lat <= -30) & (lat >= -90), _by_month(_ELL04, month), ell)
+        ell = np.where((lat <= 10) & (lat > -10), 9, ell)
+    rk = 1.894 * (temp + 1.1) * (100 - rh) * ell * 1e-04
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Eq. 11 Net rain amount
+        rw = 0.92 * prec - 1.27
+        # Alteration to Eq. 12 to calculate more accurately
+        wmi = 20 + 280 / np.exp(0.023 * dmc_yda)
+        # Eqs. 13a, 13b & 13c
+        b = np.where(dmc_yda <= 33, 100 / (0.5 + 0.3 * dmc_yda),
+                     np.where(dmc_yda <= 65, 14 - 1.3 * np.log(dmc_yda), 6.2 * np.log(dmc_yda) - 17.2))
+        # Eq. 14 Moisture content after rain
+        wmr = wmi + 1000 * rw / (48.77 + b * rw)
+        # Alteration to Eq. 15 to calculate more accurately
+        pr = np.where(prec <= 1.5, dmc_yda, 43.43 * (5.6348 - np.log(wmr - 20)))
+    pr = np.where(pr < 0, 0, pr)
+    # Eq. 17
+    dmc = pr + rk
+    return _nan_if_missing(np.where(dmc < 0, 0, dmc), dmc_yda, prec, lat, month)
+
+
+def drought_code(dc_yda, temp, rh, prec, lat, month, lat_adjust: bool = True) -> np.ndarray:
+    """ Drought Code (Eqs. 18-23, Van Wagner and Pickett 1985) """
+    dc_yda = as_array(dc_yda)
+    temp = np.maximum(as_array(temp), -2.8)
+    # Relative humidity doesn't affect the drought code, but a missing value should still mean a
+    # missing result (as it does in R).
+    rh = as_array(rh)
+    prec = as_array(prec)
+    lat = as_array(lat)
+    month = as_array(month)
+    # Eq. 22 Potential evapotranspiration, with day length adjusted for latitude.
+    fl = _by_month(_FL01, month)
+    if lat_adjust:
+        fl = np.where(lat <= -20, _by_month(_FL02, month), fl)
+        fl = np.where((lat > -20) & (lat <= 20), 1.4, fl)
+    pe = (0.36 * (temp + 2.8) + fl) / 2
+    # Cap potential evapotranspiration at 0 for negative winter DC values
+    pe = np.where(pe < 0, 0, pe)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Eq. 18 Effective rainfall
+        rw = 0.83 * prec - 1.27
+        # Eq. 19
+        smi = 800 * np.exp(-1 * dc_yda / 400)
+        # Alteration to Eq. 21
+        dr0 = dc_yda - 400 * np.log(1 + 3.937 * rw / smi)
+    dr0 = np.where(dr0 < 0, 0, dr0)
+    # If precipitation is less than 2.8 then use yesterday's DC
+    dr = np.where(prec <= 2.8, dc_yda, dr0)
+    # Alteration to Eq. 23
+    dc = dr + pe
+    return _nan_if_missing(np.where(dc < 0, 0, dc), dc_yda, rh, prec, lat, month)
+
+
+def build_up_index(dmc, dc) -> np.ndarray:
+    """ Buildup Index (Eqs. 27a & 27b, Van Wagner and Pickett 1985) """
+    dmc = as_array(dmc)
+    dc = as_array(dc)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bui1 = np.where((dmc == 0) & (dc == 0), 0, 0.8 * dc * dmc / (dmc + 0.4 * dc))
+        p = np.where(dmc == 0, 0, (dmc - bui1) / dmc)
+    cc = 0.92 + ((0.0114 * dmc) ** 1.7)
+    bui0 = dmc - cc * p
+    bui0 = np.where(bui0 < 0, 0, bui0)
+    return _nan_if_missing(np.where(bui1 < dmc, bui0, bui1), dmc, dc)
+
+
+def fire_weather_index(isi, bui) -> np.ndarray:
+    """ Fire Weather Index (Eqs. 28-30, Van Wagner and Pickett 1985) """
+    isi = as_array(isi)
+    bui = as_array(bui)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bb = np.where(bui > 80, 0.1 * isi * (1000 / (25 + 108.64 / np.exp(0.023 * bui))),
+                      0.1 * isi * (0.626 * (bui ** 0.809) + 2))
+        fwi = np.where(bb <= 1, bb, np.exp(2.72 * ((0.434 * np.log(bb)) ** 0.647)))
+    return _nan_if_missing(fwi, isi, bui)
+
+
+def calculate_fwi(ffmc_yda, dmc_yda, dc_yda, temp, rh, ws, prec, lat, month) -> FWIArrays:
+    """ Calculate all the codes and indices of the FWI System for a single day. Relative humidity
+    above 100% is capped, as is done by cffdrs. """
+    rh = np.minimum(as_array(rh), 100)
+    ffmc = fine_fuel_moisture_code(ffmc_yda, temp, rh, ws, prec)
+    dmc = duff_moisture_code(dmc_yda, temp, rh, prec, lat, month)
+    dc = drought_code(dc_yda, temp, rh, prec, lat, month)
+    isi = initial_spread_index(ffmc, ws)
+    bui = build_up_index(dmc, dc)
+    fwi = fire_weather_index(isi, bui)
+    return FWIArrays(ffmc=ffmc, dmc=dmc, dc=dc, isi=isi, bui=bui, fwi=fwi)
+
+
+def calculate_daily_fwi(ffmc_start, dmc_start, dc_start, temp, rh, ws, prec, lat, month) -> FWIArrays:
+    """ Calculate the FWI System over consecutive days for many stations at once.
+
+    Weather (temp, rh, ws, prec) is given as station x day matrices, month as a matrix or one value
+    per day, lat as one value per station and the starting codes (the day before the first day) as
+    one value per station. Each day's codes are carried forward as the next day's starting codes,
+    so a missing value makes the remaining days for that station NaN.
+    """
+    temp, rh, ws, prec = (np.atleast_2d(as_array(value)) for value in (temp, rh, ws, prec))
+    shape = np.broadcast_shapes(temp.shape, rh.shape, ws.shape, prec.shape)
+    temp, rh, ws, prec = (np.broadcast_to(value, shape) for value in (temp, rh, ws, prec))
+    month = np.broadcast_to(as_array(month), shape)
+    lat = np.broadcast_to(as_array(lat), shape[:1])
+    ffmc_yda, dmc_yda, dc_yda = (np.broadcast_to(as_array(value), shape[:1])
+                                 for value in (ffmc_start, dmc_start, dc_start))
+    result = FWIArrays(*(np.full(shape, np.nan) for _ in FWIArrays._fields))
+    for day in range(shape[1]):
+        codes = calculate_fwi(ffmc_yda, dmc_yda, dc_yda,
+                              temp[:, day], rh[:, day], ws[:, day], prec[:, day], lat, month[:, day])
+        for matrix, values in zip(result, codes):
+            matrix[:, day] = values
+        ffmc_yda, dmc_yda, dc_yda = codes.ffmc, codes.dmc, codes.dc
+    return result
+
+
+def calculate_hourly_ffmc(ffmc_start, temp, rh, ws, prec, time_step=1) -> np.ndarray:
+    """ Calculate the hourly FFMC over consecutive hours for many stations at once, as cffdrs hffmc
+    does for a weather stream.
+
+    Weather (temp, rh, ws, prec) is given as station x hour matrices, and the starting FFMC (the hour
+    before the first hour) as one value per station. Each hour's FFMC is carried forward to the next,
+    so a missing value makes the remaining hours for that station NaN.
+    """
+    temp, rh, ws, prec = (np.atleast_2d(as_array(value)) for value in (temp, rh, ws, prec))
+    shape = np.broadcast_shapes(temp.shape, rh.shape, ws.shape, prec.shape)
+    temp, rh, ws, prec = (np.broadcast_to(value, shape) for value in (temp, rh, ws, prec))
+    ffmc = np.broadcast_to(as_array(ffmc_start), shape[:1])
+    result = np.full(shape, np.nan)
+    for hour in range(shape[1]):
+        ffmc = hourly_fine_fuel_moisture_code(ffmc, temp[:, hour], rh[:, hour], ws[:, hour], prec[:, hour],
+                                              time_step)
+        result[:, hour] = ffmc
+    return result
@@ -3,19 +3,23 @@
 from enum import Enum
 import math
 import os
-from typing import List
+from typing import List, NamedTuple, Optional, Tuple
 import logging
+import numpy as np
 import pandas as pd
 from app.fire_behaviour.fuel_types import is_grass_fuel_type
 from app.schemas.fba_calc import FuelTypeEnum
 from app.schemas.observations import WeatherReading
 from app.schemas.fba_calc import CriticalHoursHFI
 from app.utils.singleton import Singleton
-from app.fire_behaviour import cffdrs, c7b
+from app.fire_behaviour import cffdrs, c7b, fbp
 from app.utils.time import convert_utc_to_pdt, get_julian_date_now
 
 logger = logging.getLogger(__name__)
 
+# The hours (PDT) of the morning RH observations used for determining critical hours.
+MORNING_RH_HOURS = (7.0, 8.0, 9.0, 10.0, 11.0, 12.0)
+
 
 class FireTypeEnum(str, Enum):
     """ Enumerator for the three different fire types. """
@@ -38,6 +42,11 @@ class DiurnalFFMCLookupTable():
     """ Singleton that loads diurnal FFMC lookup tables from Red Book once, for reuse.
     afternoon_overnight.csv is Table 4.1 from Red Book, 3rd ed., 2018;
     morning.csv is Table 4.2 from Red Book, 3rd ed., 2018.
+
+    The tables are compiled into numpy arrays, so that lookups can be done for many stations and hours at once:
+    afternoon_ffmc[row, column] is the FFMC at afternoon_hours[column] for a daily FFMC of afternoon_daily_ffmc[row];
+    morning_ffmc[row, hour, rh_bin] is the FFMC at morning_hours[hour] for a previous day's daily FFMC of
+    morning_daily_ffmc[row], with RH between morning_rh_lower[hour, rh_bin] and morning_rh_upper[hour, rh_bin].
     """
 
     def __init__(self):
@@ -48,30 +57,32 @@ class DiurnalFFMCLookupTable():
         afternoon_df.columns = afternoon_df.columns.astype(int)
         afternoon_df.set_index(17, inplace=True)
 
+        self.afternoon_daily_ffmc = afternoon_df.index.values.astype(float)
+        self.afternoon_hours = afternoon_df.columns.values.astype(float)
+        self.afternoon_ffmc = afternoon_df.values.astype(float)
+
         morning_filename = os.path.join(os.path.dirname(__file__),
                                         '../data/diurnal_ffmc_lookups/morning.csv')
         with open(morning_filename, 'rb') as morning_file:
             morning_df = pd.read_csv(morning_file, header=[0, 1])
-        prev_days_daily_ffmc_keys = morning_df.iloc[:, 0].values
-        df_col_labels = morning_df.columns.values
-        hour_lookup_keys = ['']
-        rh_lookup_keys = ['']
 
-        for level_1, level_2 in df_col_labels:
-            if 'Unnamed' in str(level_2):
-                continue
+        # The first row of the header holds the hour (only filled in for the first of its RH columns), the second
+        # row holds the RH range, e.g. "0-68".
+        hours = []
+        rh_bounds = []
+        for level_1, level_2 in morning_df.columns.values[1:]:
             if 'Unnamed' not in str(level_1):
-                hour = int(level_1)
-                hour_lookup_keys += 3 * [hour]
-            rh_lookup_keys += [level_2]
-
-        morning_df.set_index(prev_days_daily_ffmc_keys, inplace=True)
-        header = pd.MultiIndex.from_tuples(list(zip(hour_lookup_keys, rh_lookup_keys)), names=['hour', 'RH'])
-        morning_df.columns = header
-        morning_df.drop(columns=[('', '')], inplace=True)
+                hours.append(int(level_1))
+                rh_bounds.append([])
+            rh_bounds[-1].append([int(bound) for bound in str(level_2).split('-')])
+        rh_bounds = np.array(rh_bounds, dtype=float)
 
-        self.afternoon_df = afternoon_df
-        self.morning_df = morning_df
+        self.morning_daily_ffmc = morning_df.iloc[:, 0].values.astype(float)
+        self.morning_hours = np.array(hours, dtype=float)
+        self.morning_rh_lower = rh_bounds[:, :, 0]
+        self.morning_rh_upper = rh_bounds[:, :, 1]
+        self.morning_ffmc = morning_df.iloc[:, 1:].values.astype(float).reshape(
+            len(self.morning_daily_ffmc), *self.morning_rh_lower.shape)
 
 
 def calculate_cfb(fuel_type: FuelTypeEnum, fmc: float, sfc: float, ros: float, cbh: float):
@@ -145,44 +156,116 @@ def get_approx_flame_length(head_fire_intensity: float):
     return math.sqrt(head_fire_intensity / 300)
 
 
-def get_afternoon_overnight_diurnal_ffmc(hour_of_interest: int, daily_ffmc: float):
+def _nearest_rows(table_daily_ffmc: np.ndarray, daily_ffmc) -> np.ndarray:
+    """ Index of the lookup table row with the daily FFMC nearest to daily_ffmc (for each value of daily_ffmc) """
+    difference = np.abs(table_daily_ffmc - np.asarray(daily_ffmc, dtype=float)[..., np.newaxis])
+    return np.argsort(difference, axis=-1)[..., 0]
+
+
+def _afternoon_columns(hours) -> np.ndarray:
+    """ Index of the afternoon/overnight lookup table column nearest to hour (for each hour). When an hour is
+    equally near two columns, the later one is used. """
+    afternoon_hours = DiurnalFFMCLookupTable.instance().afternoon_hours
+    hours = np.asarray(hours, dtype=float)
+    hours = np.where(hours >= 23.5, hours - 24.0, hours)[..., np.newaxis]
+    distance = np.abs(afternoon_hours - hours)
+    nearest = distance == distance.min(axis=-1, keepdims=True)
+    later = nearest & (afternoon_hours >= hours)
+    return np.where(later.any(axis=-1), later.argmax(axis=-1), nearest.argmax(axis=-1))
+
+
+def get_afternoon_overnight_diurnal_ffmc(hour_of_interest, daily_ffmc):
     """ Returns the diurnal FFMC (an approximation) estimated for the given hour_of_interest,
     based on the daily_ffmc.
     Hour_of_interest should be expressed in PDT time zone, and can only be between the hours
     1300 and 0700 the next morning. Otherwise, must use different function.
+    Takes either scalars or arrays (which are broadcast against each other).
     """
+    lookup_table = DiurnalFFMCLookupTable.instance()
+    return lookup_table.afternoon_ffmc[_nearest_rows(lookup_table.afternoon_daily_ffmc, daily_ffmc),
+                                       _afternoon_columns(hour_of_interest)]
 
-    afternoon_df = DiurnalFFMCLookupTable.instance().afternoon_df
 
-    # find index (solar noon FFMC) of afternoon_df that is nearest to solar_noon_ffmc value
-    row = afternoon_df.iloc[abs((afternoon_df.index - daily_ffmc)).argsort()[:1]]
-    if hour_of_interest >= 23.5:
-        hour_of_interest = hour_of_interest - 24.0
-    # determine minimum absolute value difference between hour_of_interest and column labels
-    min_abs_diff = abs(row.columns - hour_of_interest).sort_values()[0]
-    row_index = row.columns.get_loc(min_abs_diff + hour_of_interest)
-    return row.iloc[:, row_index].values[0]
-
-
-def get_morning_diurnal_ffmc(hour_of_interest: int, prev_day_daily_ffmc: float, hourly_rh: float):
+def get_morning_diurnal_ffmc(hour_of_interest, prev_day_daily_ffmc, hourly_rh):
     """ Returns the diurnal FFMC (an approximation) estimated for the given hour_of_interest,
     based on the estimated RH value for the hour_of_interest.
+    Takes either scalars or arrays (which are broadcast against each other). The result is NaN where the RH
+    is missing or out of range.
     """
-    morning_df = DiurnalFFMCLookupTable.instance().morning_df
+    lookup_table = DiurnalFFMCLookupTable.instance()
+    hour = np.searchsorted(lookup_table.morning_hours, hour_of_interest)
+    hourly_rh = np.asarray(hourly_rh, dtype=float)
+    rh_upper = lookup_table.morning_rh_upper[hour]
+    # the RH ranges are contiguous, so the RH falls in the first range with an upper bound >= RH
+    rh_bin = np.sum(rh_upper < hourly_rh[..., np.newaxis], axis=-1)
+    in_range = (rh_bin < rh_upper.shape[-1]) & (hourly_rh >= lookup_table.morning_rh_lower[hour, 0])
+    ffmc = lookup_table.morning_ffmc[_nearest_rows(lookup_table.morning_daily_ffmc, prev_day_daily_ffmc),
+                                     hour, np.minimum(rh_bin, rh_upper.shape[-1] - 1)]
+    return np.where(in_range, ffmc, np.nan)
+
+
+def get_morning_rh_array(last_observed_morning_rh_values: List[Optional[dict]]) -> np.ndarray:
+    """ Arrange the last observed morning RH values (see build_hourly_rh_dict) of many stations in an array,
+    with a row per station and a column per hour in MORNING_RH_HOURS. Missing values are NaN. """
+    return np.array([[np.nan if rh_values is None or rh_values.get(hour) is None else rh_values[hour]
+                      for hour in MORNING_RH_HOURS]
+                     for rh_values in last_observed_morning_rh_values], dtype=float).reshape(-1, len(MORNING_RH_HOURS))
+
+
+def get_critical_hours_starts(critical_ffmc, daily_ffmc, prev_day_daily_ffmc,
+                              morning_rh: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Returns the hour of day (on 24H clock) at which the hourly FFMC crosses the
+    threshold of critical_ffmc, for many stations at once. morning_rh is as returned by get_morning_rh_array.
+    The hour is NaN where the hourly FFMC never reaches critical_ffmc.
+    Also returns a mask of the stations for which the start of critical hours can't be determined, because
+    an RH observation it depends on is missing.
+    """
+    critical_ffmc, daily_ffmc, prev_day_daily_ffmc = np.broadcast_arrays(
+        *(np.asarray(value, dtype=float) for value in (critical_ffmc, daily_ffmc, prev_day_daily_ffmc)))
+    morning_rh = np.asarray(morning_rh, dtype=float)
+    # Daily FFMC represents peak burning, so diurnal hourly FFMC will never be higher than daily FFMC
+    # if daily FFMC < critical FFMC, station will never reach critical FFMC at any hour of the day
+    reaches_critical = daily_ffmc >= critical_ffmc
+    solar_noon_diurnal_ffmc = get_afternoon_overnight_diurnal_ffmc(13, daily_ffmc)
 
-    # find index (previous day's daily FFMC) of morning_df that is nearest to prev_day_daily_ffmc
-    row = morning_df.iloc[abs((morning_df.index - prev_day_daily_ffmc)).argsort()[:1]]
+    # If the solar noon FFMC is critical, walk back through the morning (from 12:00 to 07:00) to find the
+    # first hour that isn't.
+    morning_hours = np.array(MORNING_RH_HOURS[::-1])
+    morning_ffmc = get_morning_diurnal_ffmc(morning_hours, prev_day_daily_ffmc[:, np.newaxis], morning_rh[:, ::-1])
+    below_critical = ~(morning_ffmc >= critical_ffmc[:, np.newaxis])
+    first_below = below_critical.argmax(axis=1)
+    # add back the hour that caused FFMC to drop below critical_ffmc
+    morning_start = np.where(below_critical.any(axis=1), morning_hours[first_below] + 1.0, morning_hours[-1])
+    missing_rh = np.isnan(morning_ffmc[np.arange(len(morning_ffmc)), first_below]) & below_critical.any(axis=1)
+
+    # Otherwise the start of critical hours is sometime in the afternoon (between 12:00 and 17:00)
+    afternoon_hours = np.array([16.0, 15.0, 14.0, 13.0])
+    afternoon_ffmc = get_afternoon_overnight_diurnal_ffmc(afternoon_hours, daily_ffmc[:, np.newaxis])
+    # 13:00 is known to be below critical, so there is always an hour below critical
+    afternoon_start = afternoon_hours[(afternoon_ffmc < critical_ffmc[:, np.newaxis]).argmax(axis=1)] + 1.0
 
-    # the RH column labels are strings expressing ranges. Must extract lower and upper bounds
-    for range_rh_value in row[hour_of_interest].columns:
-        bounds = str(range_rh_value).split('-')
-        lower_bound = int(bounds[0])
-        upper_bound = int(bounds[1])
-        if lower_bound <= hourly_rh <= upper_bound:
-            return row[hour_of_interest][range_rh_value].values[0]
+    in_morning = solar_noon_diurnal_ffmc >= critical_ffmc
+    starts = np.where(reaches_critical, np.where(in_morning, morning_start, afternoon_start), np.nan)
+    return starts, reaches_critical & in_morning & missing_rh
 
-    # we should never actually reach this return statement
-    return None
+
+def get_critical_hours_ends(critical_ffmc, solar_noon_ffmc, critical_hour_start) -> np.ndarray:
+    """ Returns the hour of day (on 24H clock) at which the hourly FFMC drops below
+    the threshold of critical_ffmc, for many stations at once. NaN where critical_hour_start is NaN.
+    """
+    critical_ffmc, solar_noon_ffmc, critical_hour_start = np.broadcast_arrays(
+        *(np.asarray(value, dtype=float) for value in (critical_ffmc, solar_noon_ffmc, critical_hour_start)))
+    # if critical_hour_start is in the morning, we know that based on the diurnal curve,
+    # the critical hour is going to extend into the afternoon, so start looking from then
+    first_hour = np.where(critical_hour_start < 13, 14.0, critical_hour_start + 1.0)
+    # look through to 08:00 of the next day
+    hours = np.arange(13.0, 32.0)
+    ffmc = get_afternoon_overnight_diurnal_ffmc(hours, solar_noon_ffmc[:, np.newaxis])
+    below_critical = (ffmc < critical_ffmc[:, np.newaxis]) & (hours >= first_hour[:, np.newaxis])
+    # subtract the hour that caused FFMC to drop below critical_ffmc
+    ends = np.where(below_critical.any(axis=1), hours[below_critical.argmax(axis=1)], 32.0) - 1.0
+    ends = np.where(ends >= 24.0, ends - 24.0, ends)
+    return np.where(np.isnan(critical_hour_start), np.nan, ends)
 
 
 def get_critical_hours_start(critical_ffmc: float, daily_ffmc: float,
@@ -193,32 +276,11 @@ def get_critical_hours_start(critical_ffmc: float, daily_ffmc: float,
     """
     if last_observed_morning_rh_values is None:
         return None
-    if daily_ffmc < critical_ffmc:
-        logger.debug('Daily FFMC %s < critical FFMC %s', daily_ffmc, critical_ffmc)
-        # Daily FFMC represents peak burning, so diurnal hourly FFMC will never be higher than daily FFMC
-        # if daily FFMC < critical FFMC, station will never reach critical FFMC at any hour of the day
-        return None
-    # else daily_ffmc >= critical_ffmc
-    logger.debug('Daily FFMC %s >= critical FFMC %s', daily_ffmc, critical_ffmc)
-    solar_noon_diurnal_ffmc = get_afternoon_overnight_diurnal_ffmc(13, daily_ffmc)
-    if solar_noon_diurnal_ffmc >= critical_ffmc:
-        clock_time = 12.0
-        hourly_rh = last_observed_morning_rh_values[clock_time]
-        while get_morning_diurnal_ffmc(clock_time, prev_day_daily_ffmc, hourly_rh) >= critical_ffmc:
-            clock_time -= 1.0
-            if clock_time < 7.0:
-                break
-            hourly_rh = last_observed_morning_rh_values[clock_time]
-        # add back the hour that caused FFMC to drop below critical_ffmc
-        clock_time += 1.0
-        return clock_time
-    # else the start of critical hours is sometime in the afternoon (between 12:00 and 17:00)
-    clock_time = 16.0
-    while get_afternoon_overnight_diurnal_ffmc(clock_time, daily_ffmc) >= critical_ffmc:
-        clock_time -= 1.0
-    # add back the hour that caused FFMC to drop below critical_ffmc
-    clock_time += 1.0
-    return clock_time
+    starts, missing_rh = get_critical_hours_starts([critical_ffmc], [daily_ffmc], [prev_day_daily_ffmc],
+                                                   get_morning_rh_array([last_observed_morning_rh_values]))
+    if missing_rh[0]:
+        raise FireBehaviourPredictionInputError('Missing morning RH observation')
+    return None if np.isnan(starts[0]) else float(starts[0])
 
 
 def get_critical_hours_end(critical_ffmc: float, solar_noon_ffmc: float, critical_hour_start: float):
@@ -228,22 +290,46 @@ def get_critical_hours_end(critical_ffmc: float, solar_noon_ffmc: float, critica
     """
     if critical_hour_start is None:
         return None
-    if critical_hour_start < 13:
-        # if critical_hour_start is in the morning, we know that based on the diurnal curve,
-        # the critical hour is going to extend into the afternoon, so set clock_time to then
-        clock_time = 14.0
-    else:
-        clock_time = critical_hour_start + 1.0    # increase time in increments of 1 hours
+    return float(get_critical_hours_ends([critical_ffmc], [solar_noon_ffmc], [critical_hour_start])[0])
 
-    while get_afternoon_overnight_diurnal_ffmc(clock_time, solar_noon_ffmc) >= critical_ffmc:
-        clock_time += 1.0
-        if clock_time >= 32:  # break if clock_time is now 08:00 of the next day
-            break
-    # subtract the hour that caused FFMC to drop below critical_ffmc
-    clock_time -= 1.0
-    if clock_time >= 24.0:
-        clock_time = clock_time - 24.0
-    return clock_time
+
+def get_critical_hours_for_stations(
+        target_hfi: int, critical_ffmc: List[float], resulting_hfi: List[float],
+        daily_ffmc: List[float], prev_daily_ffmc: List[float],
+        last_observed_morning_rh_values: List[Optional[dict]]) -> Tuple[List[Optional[CriticalHoursHFI]], np.ndarray]:
+    """ Determines the range of critical hours on a 24H clock for many stations at once, given the FFMC
+    (and resulting HFI) at which each station reaches target_hfi (see cffdrs.get_ffmc_for_target_hfi).
+    Also returns a mask of the stations for which critical hours can't be determined, because of
+    missing morning RH observations.
+    """
+    critical_ffmc, resulting_hfi, daily_ffmc = (np.asarray(value, dtype=float)
+                                                for value in (critical_ffmc, resulting_hfi, daily_ffmc))
+    # Scenario 1 (resulting_hfi < target_hfi) - will happen when it's impossible to get
+    # a HFI value large enough to >= target_hfi, because FFMC influences the HFI value,
+    # and FFMC has an upper bound of 101. So basically, in this scenario the resulting_hfi
+    # would equal the resulting HFI when FFMC is set to 101.
+    never_critical = (critical_ffmc >= 100.9) & (resulting_hfi < target_hfi)
+    # Scenario 2: the HFI is always >= target_hfi, even when FFMC = 0. In this case, all hours
+    # of the day will be critical hours.
+    always_critical = (critical_ffmc == 0.0) & (resulting_hfi >= target_hfi)
+    # Scenario 3: there is a critical_ffmc between (0, 101) that corresponds to
+    # resulting_hfi >= target_hfi. Now have to determine what hours of the day (if any)
+    # will see hourly FFMC (adjusted according to diurnal curve) >= critical_ffmc.
+    has_morning_rh = np.array([rh_values is not None for rh_values in last_observed_morning_rh_values], dtype=bool)
+    starts, missing_rh = get_critical_hours_starts(critical_ffmc, daily_ffmc, prev_daily_ffmc,
+                                                   get_morning_rh_array(last_observed_morning_rh_values))
+    ends = get_critical_hours_ends(critical_ffmc, daily_ffmc, starts)
+    scenario_3 = ~never_critical & ~always_critical & has_morning_rh
+
+    critical_hours: List[Optional[CriticalHoursHFI]] = []
+    for index, start in enumerate(starts):
+        if always_critical[index]:
+            critical_hours.append(CriticalHoursHFI(start=13.0, end=7.0))
+        elif scenario_3[index] and not np.isnan(start):
+            critical_hours.append(CriticalHoursHFI(start=float(start), end=float(ends[index])))
+        else:
+            critical_hours.append(None)
+    return critical_hours, scenario_3 & missing_rh
 
 
 def get_critical_hours(
@@ -260,34 +346,15 @@ def get_critical_hours(
     """
     critical_ffmc, resulting_hfi = cffdrs.get_ffmc_for_target_hfi(
         fuel_type, percentage_conifer, percentage_dead_balsam_fir, bui, wind_speed,
-        grass_cure, crown_base_height, daily_ffmc, fmc, cfb, cfl, target_hfi)
+        grass_cure, crown_base_height, fmc, cfb, cfl, target_hfi)
     logger.debug('Critical FFMC %s, resulting HFI %s; target HFI %s', critical_ffmc,
                  resulting_hfi, target_hfi)
-    # Scenario 1 (resulting_hfi < target_hfi) - will happen when it's impossible to get
-    # a HFI value large enough to >= target_hfi, because FFMC influences the HFI value,
-    # and FFMC has an upper bound of 101. So basically, in this scenario the resulting_hfi
-    # would equal the resulting HFI when FFMC is set to 101.
-    if critical_ffmc >= 100.9 and resulting_hfi < target_hfi:
-        logger.debug('No critical hours for HFI %s. Critical FFMC %s has HFI %s',
-                     target_hfi, critical_ffmc, resulting_hfi)
-        return None
-    # Scenario 2: the HFI is always >= target_hfi, even when FFMC = 0. In this case, all hours
-    # of the day will be critical hours.
-    if critical_ffmc == 0.0 and resulting_hfi >= target_hfi:
-        logger.info('All hours critical for HFI %s. FFMC %s has HFI %s',
-                    target_hfi, critical_ffmc, resulting_hfi)
-        return CriticalHoursHFI(start=13.0, end=7.0)
-    # Scenario 3: there is a critical_ffmc between (0, 101) that corresponds to
-    # resulting_hfi >= target_hfi. Now have to determine what hours of the day (if any)
-    # will see hourly FFMC (adjusted according to diurnal curve) >= critical_ffmc.
-    critical_hours_start = get_critical_hours_start(
-        critical_ffmc, daily_ffmc, prev_daily_ffmc, last_observed_morning_rh_values)
-    if critical_hours_start is None:
-        return None
-    critical_hours_end = get_critical_hours_end(
-        critical_ffmc, daily_ffmc, critical_hours_start)
-
-    return CriticalHoursHFI(start=critical_hours_start, end=critical_hours_end)
+    critical_hours, missing_rh = get_critical_hours_for_stations(
+        target_hfi, [critical_ffmc], [resulting_hfi], [daily_ffmc], [prev_daily_ffmc],
+        [last_observed_morning_rh_values])
+    if missing_rh[0]:
+        raise FireBehaviourPredictionInputError('Missing morning RH observation')
+    return critical_hours[0]
 
 
 def build_hourly_rh_dict(hourly_observations: List[WeatherReading]):
@@ -295,7 +362,7 @@ def build_hourly_rh_dict(hourly_observations: List[WeatherReading]):
     for a station. Returns the dictionary.
     """
     hourly_observations.sort(key=lambda x: x.datetime, reverse=True)
-    relevant_hours = [7.0, 8.0, 9.0, 10.0, 11.0, 12.0]
+    relevant_hours = list(MORNING_RH_HOURS)
     rh_dict = {
         7.0: None,
         8.0: None,
@@ -432,36 +499,30 @@ def calculate_fire_behaviour_prediction_using_c7b(latitude: float,
     if cc is None:
         raise FireBehaviourPredictionInputError("CC is required for C7B calculation.")
 
-    ros = c7b.rate_of_spread(ffmc=ffmc, bui=bui, wind_speed=wind_speed, percentage_slope=0.0, cc=cc)
-
     fmc = cffdrs.foliar_moisture_content(latitude, longitude, elevation, get_julian_date_now())
+    result = c7b.calculate_fire_behaviour(ffmc=ffmc, bui=bui, wind_speed=wind_speed, fmc=fmc, cc=cc, cbh=cbh, cfl=cfl)
+    ros, hfi, cfb = float(result.ros), float(result.hfi), float(result.cfb)
 
-    sfc = cffdrs.surface_fuel_consumption(fuel_type=FuelTypeEnum.C7, bui=bui, ffmc=ffmc, pc=None)
-    cfb = cffdrs.crown_fraction_burned(fuel_type=FuelTypeEnum.C7, fmc=fmc,
-                                       sfc=sfc, ros=ros, cbh=cbh)
-
-    hfi = cffdrs.head_fire_intensity(fuel_type=FuelTypeEnum.C7,
-                                     percentage_conifer=None,
-                                     percentage_dead_balsam_fir=None,
-                                     ros=ros, cfb=cfb, cfl=cfl, sfc=sfc)
-
-    fire_type = get_fire_type(FuelTypeEnum.C7B, cfb)
-
-    intensity_group = calculate_intensity_group(hfi)
-
-    # TODO: not required for HFI, but for FireBat - we need to calculate 60 minute fire size, which
-    # will take a fair amount of peeking at the math.
-    # Some of the math in the c7b.rate_of_spread can be extracted, and the standard cffdrs math used.
     fire_behaviour_prediction = FireBehaviourPrediction(
         ros=ros,
         hfi=hfi,
-        intensity_group=intensity_group,
-        sixty_minute_fire_size=None,
-        fire_type=fire_type)
+        intensity_group=calculate_intensity_group(hfi),
+        sixty_minute_fire_size=c7b.sixty_minute_fire_size(ros, float(result.bros), float(result.lb), cfb),
+        fire_type=get_fire_type(FuelTypeEnum.C7B, cfb))
 
     return fire_behaviour_prediction
 
 
+def validate_fire_behaviour_prediction_input(fuel_type: FuelTypeEnum, bui: float, ffmc: float, cc: float):
+    """ Raise FireBehaviourPredictionInputError if a required input is missing. """
+    if bui is None:
+        raise FireBehaviourPredictionInputError('BUI is required')
+    if ffmc is None:
+        raise FireBehaviourPredictionInputError('FFMC is required')
+    if cc is None and is_grass_fuel_type(fuel_type):
+        raise FireBehaviourPredictionInputError('Grass Cure must be specified for grass fuel types')
+
+
 def calculate_fire_behaviour_prediction(latitude: float,
                                         longitude: float, elevation: float,
                                         fuel_type: FuelTypeEnum,
@@ -470,12 +531,7 @@ def calculate_fire_behaviour_prediction(latitude: float,
                                         pc: float,
                                         isi: float, pdf: float, cbh: float, cfl: float):
     """ Calculate the fire behaviour prediction. """
-    if bui is None:
-        raise FireBehaviourPredictionInputError('BUI is required')
-    if ffmc is None:
-        raise FireBehaviourPredictionInputError('FFMC is required')
-    if cc is None and is_grass_fuel_type(fuel_type):
-        raise FireBehaviourPredictionInputError('Grass Cure must be specified for grass fuel types')
+    validate_fire_behaviour_prediction_input(fuel_type, bui, ffmc, cc)
     if fuel_type == FuelTypeEnum.C7B:
         return calculate_fire_behaviour_prediction_using_c7b(
             latitude=latitude,
@@ -501,3 +557,91 @@ def calculate_fire_behaviour_prediction(latitude: float,
         pdf=pdf,
         cbh=cbh,
         cfl=cfl)
+
+
+class FireBehaviourPredictionInput(NamedTuple):
+    """ The inputs to calculate_fire_behaviour_prediction, for calculating many predictions at once. """
+    latitude: float
+    longitude: float
+    elevation: float
+    fuel_type: FuelTypeEnum
+    bui: float
+    ffmc: float
+    wind_speed: float
+    cc: float
+    pc: float
+    isi: float
+    pdf: float
+    cbh: float
+    cfl: float
+
+
+def calculate_fire_behaviour_predictions(
+        prediction_inputs: List[FireBehaviourPredictionInput]) -> List[Optional[FireBehaviourPrediction]]:
+    """ Calculate fire behaviour predictions for many station-days at once, making one batched call per
+    cffdrs equation (or one numpy pass, depending on the configured backend) rather than one per
+    station-day. Predictions that can't be calculated, because of missing or invalid input, are None.
+    C7B isn't part of cffdrs, so C7B predictions are calculated in a batch of their own.
+    """
+    predictions: List[Optional[FireBehaviourPrediction]] = [None] * len(prediction_inputs)
+    batch: List[int] = []
+    c7b_batch: List[int] = []
+    for index, prediction_input in enumerate(prediction_inputs):
+        try:
+            validate_fire_behaviour_prediction_input(
+                prediction_input.fuel_type, prediction_input.bui, prediction_input.ffmc, prediction_input.cc)
+            if prediction_input.fuel_type == FuelTypeEnum.C7B:
+                c7b_batch.append(index)
+            else:
+                batch.append(index)
+        except FireBehaviourPredictionInputError as error:
+            logger.info('Error calculating fire behaviour prediction for %s : %s', prediction_input, error)
+    if len(batch) == 0 and len(c7b_batch) == 0:
+        return predictions
+
+    engine = fbp if cffdrs.use_native_backend() else cffdrs.CFFDRS.instance()
+    for indices, calculate in ((batch, _calculate_fire_behaviour_batch), (c7b_batch, _calculate_c7b_fire_behaviour_batch)):
+        if len(indices) == 0:
+            continue
+        rows = [prediction_inputs[index] for index in indices]
+        ros, hfi, cfb, sixty_minute_fire_size = calculate(engine, rows)
+        for row_index, index in enumerate(indices):
+            values = tuple(float(output[row_index]) for output in (ros, hfi, cfb, sixty_minute_fire_size))
+            if any(math.isnan(value) for value in values):
+                logger.info('Error calculating fire behaviour prediction for %s', prediction_inputs[index])
+                continue
+            predictions[index] = FireBehaviourPrediction(
+                ros=values[0], hfi=values[1], intensity_group=calculate_intensity_group(values[1]),
+                sixty_minute_fire_size=values[3],
+                fire_type=get_fire_type(prediction_inputs[index].fuel_type, crown_fraction_burned=values[2]))
+    return predictions
+
+
+def _calculate_fire_behaviour_batch(engine, rows: List[FireBehaviourPredictionInput]):
+    """ ROS, HFI, CFB and 60 minute fire size for cffdrs fuel types. """
+    def column(name: str) -> list:
+        return [getattr(row, name) for row in rows]
+
+    fuel_types = [row.fuel_type.value for row in rows]
+    fmc = engine.foliar_moisture_content(column('latitude'), column('longitude'), column('elevation'),
+                                         get_julian_date_now())
+    result = engine.calculate_fire_behaviour(fuel_types, column('isi'), column('bui'), column('ffmc'),
+                                             column('wind_speed'), fmc, column('pc'), column('cc'),
+                                             column('pdf'), column('cbh'), column('cfl'))
+    # Fire size, as in get_fire_size.
+    fire_spread_distance = engine.fire_distance(fuel_types, result.ros + result.bros, 60, result.cfb)
+    length_to_breadth_at_time = engine.length_to_breadth_ratio_t(fuel_types, result.lb, 60, result.cfb)
+    sixty_minute_fire_size = math.pi / (4.0 * length_to_breadth_at_time) * fire_spread_distance ** 2 / 10000.0
+    return result.ros, result.hfi, result.cfb, sixty_minute_fire_size
+
+
+def _calculate_c7b_fire_behaviour_batch(engine, rows: List[FireBehaviourPredictionInput]):
+    """ ROS, HFI, CFB and 60 minute fire size for C7B. """
+    def column(name: str) -> list:
+        return [getattr(row, name) for row in rows]
+
+    fmc = engine.foliar_moisture_content(column('latitude'), column('longitude'), column('elevation'),
+                                         get_julian_date_now())
+    result = c7b.calculate_fire_behaviour(ffmc=column('ffmc'), bui=column('bui'), wind_speed=column('wind_speed'),
+                                          fmc=fmc, cc=column('cc'), cbh=column('cbh'), cfl=column('cfl'))
+    return result.ros, result.hfi, result.cfb, c7b.sixty_minute_fire_size(result.ros, result.bros, result.lb, result.cfb)
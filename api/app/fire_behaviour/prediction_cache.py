@@ -0,0 +1,134 @@
+""" Cache of fire behaviour predictions.
+
+The HFI calculator recalculates the fire behaviour for every station-day each time a user toggles a
+station, changes fire starts or reloads the page, but the dailies only change when WF1 updates them. The
+predictions are cached in memory (least recently used, with an expiry), and optionally in redis, so that
+the cache is shared by all the workers.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from app import config
+from app.fire_behaviour.prediction import FireBehaviourPrediction, FireBehaviourPredictionInput, FireTypeEnum
+from app.utils.redis import create_redis
+from app.utils.singleton import Singleton
+from app.utils.time import get_julian_date_now
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_EXPIRY = 3600  # 1 hour
+# Inputs are rounded to this many decimal places when building the key. WF1 reports indices to one
+# decimal place, so this only serves to absorb floating point noise.
+KEY_DECIMALS = 3
+
+
+def _quantize(value: Optional[float]) -> str:
+    return '' if value is None else f'{float(value):.{KEY_DECIMALS}f}'
+
+
+def build_key(station_code: int,
+              weather_timestamp: int,
+              last_update_timestamp: int,
+              prediction_input: FireBehaviourPredictionInput) -> str:
+    """ Build a cache key for a fire behaviour prediction for a station-day.
+    Foliar moisture content depends on the day the calculation is done, so the key includes today's date. """
+    inputs = ':'.join(_quantize(value) for name, value in prediction_input._asdict().items() if name != 'fuel_type')
+    return (f'fire_behaviour_prediction:{station_code}:{weather_timestamp}:{last_update_timestamp}:'
+            f'{get_julian_date_now()}:{prediction_input.fuel_type.value}:{inputs}')
+
+
+def _serialize(prediction: FireBehaviourPrediction) -> str:
+    return json.dumps({
+        'ros': prediction.ros,
+        'hfi': prediction.hfi,
+        'intensity_group': prediction.intensity_group,
+        'sixty_minute_fire_size': prediction.sixty_minute_fire_size,
+        'fire_type': None if prediction.fire_type is None else prediction.fire_type.value})
+
+
+def _deserialize(value: str) -> FireBehaviourPrediction:
+    values = json.loads(value)
+    fire_type = values['fire_type']
+    return FireBehaviourPrediction(ros=values['ros'],
+                                   hfi=values['hfi'],
+                                   intensity_group=values['intensity_group'],
+                                   sixty_minute_fire_size=values['sixty_minute_fire_size'],
+                                   fire_type=None if fire_type is None else FireTypeEnum(fire_type))
+
+
+@Singleton
+class FireBehaviourPredictionCache():
+    """ LRU cache, with an expiry, of fire behaviour predictions. Keeps count of hits and misses. """
+
+    def __init__(self):
+        self.max_size = int(config.get('FIRE_BEHAVIOUR_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+        self.expiry_seconds = int(config.get('FIRE_BEHAVIOUR_CACHE_EXPIRY', DEFAULT_CACHE_EXPIRY))
+        self.use_redis = config.get('FIRE_BEHAVIOUR_CACHE_REDIS', 'False') == 'True'
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (expires at, prediction)
+        self._entries: 'OrderedDict[str, Tuple[float, FireBehaviourPrediction]]' = OrderedDict()
+
+    def _get_local(self, key: str) -> Optional[FireBehaviourPrediction]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, prediction = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return prediction
+
+    def _put_local(self, key: str, prediction: FireBehaviourPrediction):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.expiry_seconds, prediction)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[FireBehaviourPrediction]:
+        """ Return the cached prediction, or None if there isn't one. """
+        prediction = self._get_local(key)
+        if prediction is None and self.use_redis:
+            try:
+                cached = create_redis().get(key)
+                if cached:
+                    prediction = _deserialize(cached.decode())
+                    self._put_local(key, prediction)
+            except Exception as error:
+                # redis failing isn't a critical failure, we can always calculate the prediction.
+                logger.error(error, exc_info=error)
+        with self._lock:
+            if prediction is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return prediction
+
+    def put(self, key: str, prediction: FireBehaviourPrediction):
+        """ Cache a prediction. """
+        self._put_local(key, prediction)
+        if self.use_redis:
+            try:
+                create_redis().set(key, _serialize(prediction).encode(), ex=self.expiry_seconds)
+            except Exception as error:
+                logger.error(error, exc_info=error)
+
+    def stats(self) -> Dict[str, int]:
+        """ Hit and miss counts, and the number of predictions held in memory. """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def clear(self):
+        """ Empty the in memory cache, and reset the counters. """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,119 @@
+""" A pool of worker processes, each with their own R session, for evaluating cffdrs concurrently.
+
+R is single threaded, and rpy2 binds a single embedded R interpreter to the process. Running cffdrs
+calculations inside the API process therefore serializes every request, and blocks the event loop while
+doing so. The pool below hands the work off to separate processes, each of which has cffdrs loaded
+up front, so that requests can be awaited and evaluated in parallel.
+
+The pool is disabled by default (R_WORKER_POOL_SIZE=0), in which case work is run inline.
+"""
+import asyncio
+import functools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+from app import config
+from app.fire_behaviour import cffdrs
+from app.utils.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_TASKS_PER_WORKER = 1000
+DEFAULT_HEALTH_CHECK_TIMEOUT = 30
+
+
+def _initialize_worker():
+    """ Load cffdrs when the worker starts, rather than on the first request it's given. """
+    cffdrs.CFFDRS.instance()
+
+
+def _ping() -> float:
+    """ Trivial cffdrs calculation, used to check that a worker is able to evaluate R. """
+    return cffdrs.initial_spread_index(90, 10)
+
+
+@Singleton
+class RWorkerPool():
+    """ Process pool of R workers.
+
+    Workers are recycled after processing R_WORKER_MAX_TASKS tasks (on average), keeping the memory
+    held on to by long lived R sessions in check. """
+
+    def __init__(self):
+        self.size = int(config.get('R_WORKER_POOL_SIZE', 0))
+        self.max_tasks_per_worker = int(config.get('R_WORKER_MAX_TASKS', DEFAULT_MAX_TASKS_PER_WORKER))
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._task_count = 0
+
+    @property
+    def enabled(self) -> bool:
+        """ True if work is handed off to worker processes, False if it's run inline. """
+        return self.size > 0
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        logger.info('starting R worker pool with %s workers', self.size)
+        # R does not survive being forked, so workers are spawned.
+        return ProcessPoolExecutor(max_workers=self.size,
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_initialize_worker)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """ Return the current executor, replacing it with a fresh one if it has done its share of work.
+        ProcessPoolExecutor only supports max_tasks_per_child from python 3.11, so the whole pool is
+        recycled instead. Tasks already submitted to the old pool are allowed to complete. """
+        with self._lock:
+            if self._executor is not None and self._task_count >= self.size * self.max_tasks_per_worker:
+                logger.info('recycling R worker pool after %s tasks', self._task_count)
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._executor is None:
+                self._executor = self._create_executor()
+                self._task_count = 0
+            self._task_count += 1
+            return self._executor
+
+    def reset(self):
+        """ Discard the current workers. New workers are started on the next submission. """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self._task_count = 0
+
+    async def submit(self, function: Callable[..., Any], *args) -> Any:
+        """ Evaluate function(*args) in a worker process, returning the result.
+        The function and its arguments must be picklable. """
+        if not self.enabled:
+            return function(*args)
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(executor, functools.partial(function, *args))
+        except BrokenProcessPool:
+            # A worker died (e.g. R segfaulted) - the pool is unusable, so start over with a new one.
+            logger.error('R worker pool is broken, resetting')
+            self.reset()
+            raise
+
+    async def health_check(self, timeout: float = DEFAULT_HEALTH_CHECK_TIMEOUT) -> bool:
+        """ Check that the workers are able to evaluate R, resetting the pool if they aren't. """
+        if not self.enabled:
+            return True
+        try:
+            await asyncio.wait_for(self.submit(_ping), timeout=timeout)
+            return True
+        except Exception as exception:
+            logger.error('R worker pool failed health check: %s', exception, exc_info=True)
+            self.reset()
+            return False
+
+    def shutdown(self):
+        """ Stop all the workers, waiting for them to finish. """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
@@ -11,7 +11,8 @@ from app.db.database import get_read_session_scope
 from app.db.models.hfi_calc import FuelType as FuelTypeModel
 from app.fire_behaviour.cffdrs import CFFDRSException
 from app.fire_behaviour.prediction import (
-    FireBehaviourPredictionInputError, calculate_fire_behaviour_prediction, FireBehaviourPrediction)
+    FireBehaviourPredictionInput, FireBehaviourPredictionInputError, calculate_fire_behaviour_prediction,
+    calculate_fire_behaviour_predictions, FireBehaviourPrediction)
 from app.schemas.hfi_calc import (DailyResult, DateRange,
                                   FireStartRange, HFIResultRequest,
                                   PlanningAreaResult,
@@ -21,6 +22,8 @@ from app.schemas.hfi_calc import (DailyResult, DateRange,
 from app.schemas.hfi_calc import (WeatherStationProperties,
                                   FuelType as FuelTypeSchema, FireCentre, PlanningArea, WeatherStation)
 from app.fire_behaviour.fuel_types import FUEL_TYPE_DEFAULTS, FuelTypeEnum
+from app.fire_behaviour.prediction_cache import FireBehaviourPredictionCache, build_key as build_cache_key
+from app.fire_behaviour.r_worker_pool import RWorkerPool
 from app.utils.time import get_hour_20_from_date, get_pst_now
 from app.wildfire_one.schema_parsers import WFWXWeatherStation
 from app.wildfire_one.wfwx_api import (get_auth_header, get_stations_by_codes,
@@ -34,40 +37,46 @@ from app.db.crud.hfi_calc import (get_fire_weather_stations,
 logger = logging.getLogger(__name__)
 
 
+def get_fire_behaviour_prediction_input(raw_daily: dict,
+                                        station: WFWXWeatherStation,
+                                        fuel_type: FuelTypeModel) -> FireBehaviourPredictionInput:
+    """ Extract the inputs for a fire behaviour prediction from the raw daily json object returned by wf1 """
+    return FireBehaviourPredictionInput(
+        latitude=station.lat,
+        longitude=station.long,
+        elevation=station.elevation,
+        fuel_type=FuelTypeEnum[fuel_type.fuel_type_code],
+        bui=raw_daily.get('buildUpIndex', None),
+        ffmc=raw_daily.get('fineFuelMoistureCode', None),
+        wind_speed=raw_daily.get('windSpeed', None),
+        cc=raw_daily.get('grasslandCuring', None),
+        pc=fuel_type.percentage_conifer,
+        isi=raw_daily.get('initialSpreadIndex', None),
+        pdf=fuel_type.percentage_dead_fir,
+        # we use the fuel type lookup to get default values.
+        cbh=FUEL_TYPE_DEFAULTS[fuel_type.fuel_type_code]["CBH"],
+        cfl=FUEL_TYPE_DEFAULTS[fuel_type.fuel_type_code]["CFL"])
+
+
 def generate_station_daily(raw_daily: dict,
                            station: WFWXWeatherStation,
-                           fuel_type: FuelTypeModel) -> StationDaily:
+                           fuel_type: FuelTypeModel,
+                           fire_behaviour_prediction: Optional[FireBehaviourPrediction] = None) -> StationDaily:
     """ Transform from the raw daily json object returned by wf1, to our daily object.
+    If the fire behaviour prediction has already been calculated (see calculate_station_dailies), it can be
+    passed in, otherwise it's calculated here.
     """
-    pc = fuel_type.percentage_conifer
-    pdf = fuel_type.percentage_dead_fir
-    # we use the fuel type lookup to get default values.
-    cbh = FUEL_TYPE_DEFAULTS[fuel_type.fuel_type_code]["CBH"]
-    cfl = FUEL_TYPE_DEFAULTS[fuel_type.fuel_type_code]["CFL"]
     isi = raw_daily.get('initialSpreadIndex', None)
     bui = raw_daily.get('buildUpIndex', None)
     ffmc = raw_daily.get('fineFuelMoistureCode', None)
-    cc = raw_daily.get('grasslandCuring', None)
-    wind_speed = raw_daily.get('windSpeed', None)
-
-    try:
-        fire_behaviour_prediction = calculate_fire_behaviour_prediction(
-            latitude=station.lat,
-            longitude=station.long,
-            elevation=station.elevation,
-            fuel_type=FuelTypeEnum[fuel_type.fuel_type_code],
-            bui=bui,
-            ffmc=ffmc,
-            wind_speed=wind_speed,
-            cc=cc,
-            pc=pc,
-            isi=isi,
-            pdf=pdf,
-            cbh=cbh,
-            cfl=cfl)
-    except (FireBehaviourPredictionInputError, CFFDRSException) as error:
-        logger.info("Error calculating fire behaviour prediction for station %s : %s", station.code, error)
-        fire_behaviour_prediction = FireBehaviourPrediction(None, None, None, None, None)
+
+    if fire_behaviour_prediction is None:
+        try:
+            fire_behaviour_prediction = calculate_fire_behaviour_prediction(
+                **get_fire_behaviour_prediction_input(raw_daily, station, fuel_type)._asdict())
+        except (FireBehaviourPredictionInputError, CFFDRSException) as error:
+            logger.info("Error calculating fire behaviour prediction for station %s : %s", station.code, error)
+            fire_behaviour_prediction = FireBehaviourPrediction(None, None, None, None, None)
 
     return StationDaily(
         code=station.code,
@@ -249,6 +258,9 @@ async def calculate_latest_hfi_results(
         raw_dailies: List[dict] = [raw_daily async for raw_daily in raw_dailies_generator]
         fuel_type_lookup: Dict[int, FuelTypeModel] = generate_fuel_type_lookup(orm_session)
 
+        fire_behaviour_predictions = await predict_fire_behaviour(
+            raw_dailies, wfwx_stations, request.planning_area_station_info, fuel_type_lookup)
+
         results = calculate_hfi_results(fuel_type_lookup,
                                         fire_centre_fire_start_ranges,
                                         request.planning_area_fire_starts,
@@ -257,7 +269,8 @@ async def calculate_latest_hfi_results(
                                         raw_dailies,
                                         valid_date_range.days_in_range(),
                                         request.planning_area_station_info,
-                                        valid_date_range.start_date)
+                                        valid_date_range.start_date,
+                                        fire_behaviour_predictions)
         return results, valid_date_range
 
 
@@ -334,19 +347,18 @@ def generate_fuel_type_lookup(orm_session: Session) -> Dict[int, FuelTypeModel]:
     return {fuel_type.id: fuel_type for fuel_type in fuel_types}
 
 
-def calculate_station_dailies(
+def get_selected_dailies(
         raw_dailies: List[dict],
         station_info_list: List[StationInfo],
         station_lookup: Dict[str, WFWXWeatherStation],
-        fuel_type_lookup: Dict[int, FuelTypeModel]) -> List[StationDaily]:
-    """ Build a list of dailies with results from the fire behaviour calculations. """
-    area_dailies: List[StationDaily] = []
-
+        fuel_type_lookup: Dict[int, FuelTypeModel]) -> List[Tuple[dict, WFWXWeatherStation, FuelTypeModel]]:
+    """ The dailies of the selected stations, each with its station and fuel type. """
     selected_station_codes = [
         station.station_code for station in filter(
             lambda station: (station.selected), station_info_list)]
     station_info_lookup = {station.station_code: station for station in station_info_list}
 
+    selected_dailies: List[Tuple[dict, WFWXWeatherStation, FuelTypeModel]] = []
     for raw_daily in raw_dailies:
         wfwx_station_id = raw_daily['stationId']
         wfwx_station = station_lookup[wfwx_station_id]
@@ -356,7 +368,71 @@ def calculate_station_dailies(
         if wfwx_station.code in selected_station_codes:
             station_info: StationInfo = station_info_lookup[wfwx_station.code]
             fuel_type = fuel_type_lookup[station_info.fuel_type_id]
-            area_dailies.append(generate_station_daily(raw_daily, wfwx_station, fuel_type))
+            selected_dailies.append((raw_daily, wfwx_station, fuel_type))
+    return selected_dailies
+
+
+def get_prediction_cache_key(raw_daily: dict,
+                             wfwx_station: WFWXWeatherStation,
+                             prediction_input: FireBehaviourPredictionInput) -> str:
+    """ The key of the fire behaviour prediction for a daily in the prediction cache. """
+    return build_cache_key(wfwx_station.code, raw_daily['weatherTimestamp'],
+                           raw_daily.get('lastEntityUpdateTimestamp'), prediction_input)
+
+
+async def predict_fire_behaviour(
+        raw_dailies: List[dict],
+        wfwx_stations: List[WFWXWeatherStation],
+        planning_area_station_info: Dict[int, List[StationInfo]],
+        fuel_type_lookup: Dict[int, FuelTypeModel]) -> Dict[str, Optional[FireBehaviourPrediction]]:
+    """ Get the fire behaviour predictions for the dailies of the selected stations of every planning area,
+    by prediction cache key. Predictions are looked up in the cache, and only the dailies that have changed
+    since we last calculated them are sent to the R workers, in one go. """
+    station_lookup: Dict[str, WFWXWeatherStation] = {station.wfwx_id: station for station in wfwx_stations}
+    prediction_inputs: Dict[str, FireBehaviourPredictionInput] = {}
+    for station_info_list in planning_area_station_info.values():
+        for raw_daily, wfwx_station, fuel_type in get_selected_dailies(
+                raw_dailies, station_info_list, station_lookup, fuel_type_lookup):
+            prediction_input = get_fire_behaviour_prediction_input(raw_daily, wfwx_station, fuel_type)
+            prediction_inputs[get_prediction_cache_key(raw_daily, wfwx_station, prediction_input)] = prediction_input
+
+    cache = FireBehaviourPredictionCache.instance()
+    fire_behaviour_predictions = {cache_key: cache.get(cache_key) for cache_key in prediction_inputs}
+    misses = [cache_key for cache_key, prediction in fire_behaviour_predictions.items() if prediction is None]
+    if len(misses) > 0:
+        calculated_predictions = await RWorkerPool.instance().submit(
+            calculate_fire_behaviour_predictions, [prediction_inputs[cache_key] for cache_key in misses])
+        for cache_key, prediction in zip(misses, calculated_predictions):
+            if prediction is not None:
+                cache.put(cache_key, prediction)
+            fire_behaviour_predictions[cache_key] = prediction
+    logger.info('fire behaviour prediction cache: %s', cache.stats())
+    return fire_behaviour_predictions
+
+
+def calculate_station_dailies(
+        raw_dailies: List[dict],
+        station_info_list: List[StationInfo],
+        station_lookup: Dict[str, WFWXWeatherStation],
+        fuel_type_lookup: Dict[int, FuelTypeModel],
+        fire_behaviour_predictions: Optional[Dict[str, Optional[FireBehaviourPrediction]]] = None) \
+        -> List[StationDaily]:
+    """ Build a list of dailies with results from the fire behaviour calculations.
+    The fire behaviour predictions, by prediction cache key, can be passed in (see predict_fire_behaviour),
+    otherwise they're calculated here, in one go. """
+    area_dailies: List[StationDaily] = []
+    selected_dailies = get_selected_dailies(raw_dailies, station_info_list, station_lookup, fuel_type_lookup)
+    prediction_inputs = [get_fire_behaviour_prediction_input(*selected_daily) for selected_daily in selected_dailies]
+    if fire_behaviour_predictions is None:
+        predictions = calculate_fire_behaviour_predictions(prediction_inputs)
+    else:
+        predictions = [
+            fire_behaviour_predictions.get(get_prediction_cache_key(raw_daily, wfwx_station, prediction_input))
+            for (raw_daily, wfwx_station, _), prediction_input in zip(selected_dailies, prediction_inputs)]
+    for (raw_daily, wfwx_station, fuel_type), fire_behaviour_prediction in zip(selected_dailies, predictions):
+        if fire_behaviour_prediction is None:
+            fire_behaviour_prediction = FireBehaviourPrediction(None, None, None, None, None)
+        area_dailies.append(generate_station_daily(raw_daily, wfwx_station, fuel_type, fire_behaviour_prediction))
     return area_dailies
 
 
@@ -368,7 +444,9 @@ def calculate_hfi_results(fuel_type_lookup: Dict[int, FuelTypeModel],
                           raw_dailies: List[dict],
                           num_prep_days: int,
                           planning_area_station_info: Dict[int, List[StationInfo]],
-                          start_date: date) -> List[PlanningAreaResult]:
+                          start_date: date,
+                          fire_behaviour_predictions: Optional[Dict[str, Optional[FireBehaviourPrediction]]] = None) \
+        -> List[PlanningAreaResult]:
     """ Computes HFI results based on parameter inputs """
     planning_area_to_dailies: List[PlanningAreaResult] = []
 
@@ -380,7 +458,8 @@ def calculate_hfi_results(fuel_type_lookup: Dict[int, FuelTypeModel],
         area_dailies = calculate_station_dailies(raw_dailies,
                                                  planning_area_station_info[area_id],
                                                  station_lookup,
-                                                 fuel_type_lookup)
+                                                 fuel_type_lookup,
+                                                 fire_behaviour_predictions)
 
         # Initialize with defaults if empty/wrong length
         # TODO: Sometimes initialize_planning_area_fire_starts is called twice. Look into this once
@@ -1,29 +1,36 @@
 import os
 import datetime
-from typing import List
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
 import logging
 import requests
-import numpy
-from pyproj import Geod
-from scipy.interpolate import griddata
+import numpy as np
 from geoalchemy2.shape import to_shape
 from sqlalchemy.orm import Session
 from app.db.crud.weather_models import (get_processed_file_record,
                                         get_processed_file_count,
                                         get_prediction_model_run_timestamp_records,
-                                        get_model_run_predictions_for_grid,
                                         get_grids_for_coordinate,
-                                        get_weather_station_model_prediction,
-                                        delete_model_run_grid_subset_predictions)
-from app.weather_models.machine_learning import StationMachineLearning
+                                        get_grid_subsets,
+                                        get_weather_station_model_precipitation,
+                                        upsert_weather_station_model_predictions,
+                                        create_model_run_grid_subset_prediction_partitions,
+                                        drop_model_run_grid_subset_prediction_partitions,
+                                        delete_model_run_grid_subset_prediction_arrays)
+from app.jobs.grib_cache import CachedFile, GribCache
+from app.jobs.grib_inventory import GribMessageFilter
+from app.weather_models.machine_learning import BiasAdjustment, StationMachineLearning, learn_bias_adjustment
 from app.weather_models import ModelEnum, construct_interpolated_noon_prediction
+from app.weather_models.grid_predictions import get_model_run_predictions_for_grid, pack_model_run
+from app.weather_models.station_grid_index import (StationGridCell, StationGridIndex, calculate_closest_index,
+                                                   calculate_interpolation_weights, interpolate)
 from app.schemas.stations import WeatherStation
 from app import config, configure_logging
 import app.utils.time as time_utils
-from app.utils.redis import create_redis
 from app.stations import get_stations_synchronously, StationSourceEnum
 from app.db.models.weather_models import (ProcessedModelRunUrl, PredictionModelRunTimestamp,
-                                          WeatherStationModelPrediction, ModelRunGridSubsetPrediction)
+                                          ModelRunGridSubsetPrediction,
+                                          PredictionModelGridSubset)
 import app.db.database
 
 # If running as its own process, configure logging appropriately.
@@ -32,6 +39,19 @@ if __name__ == "__main__":
 
 logger = logging.getLogger(__name__)
 
+# Size of the chunks in which downloads are written to disk.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Days of grid subset predictions to keep.
+DATA_RETENTION_DAYS = 21
+# Days ahead to create partitions for grid subset predictions: the longest forecast (GFS, 384 hours, i.e. 16
+# days) plus a day for model runs that are processed late.
+PARTITION_DAYS_AHEAD = 17
+# Seconds a cached download is used for, before checking with the server that it hasn't changed.
+DEFAULT_CACHE_EXPIRY = 21600
+
+# Prediction values that are interpolated to the station (wind is taken from the closest grid point).
+INTERPOLATED_VALUE_KEYS = ('tmp_tgl_2', 'rh_tgl_2', 'apcp_sfc_0')
+
 
 class UnhandledPredictionModelType(Exception):
     """ Exception raised when an unknown model type is encountered. """
@@ -41,13 +61,17 @@ class CompletedWithSomeExceptions(Exception):
     """ Exception raised when processing completed, but there were some non critical exceptions """
 
 
-def download(url: str, path: str, config_cache_var: str, model_name: str, config_cache_expiry_var=None) -> str:
+def download(url: str, path: str, config_cache_var: str, model_name: str, config_cache_expiry_var=None,
+             session: Optional[requests.Session] = None,
+             message_filter: Optional[GribMessageFilter] = None) -> str:
     """
-    Download a file from a url.
+    Download a file from a url, streaming it to disk.
     NOTE: was using wget library initially, but has the drawback of not being able to control where the
     temporary files are stored. This is problematic, as giving the application write access to /app
     is a security concern.
-    TODO: Would be nice to make this an async
+    Pass a session to re-use its (keep-alive) connections across downloads, see
+    app.jobs.download_pipeline for downloading many files at once.
+    Pass a message filter to download only some of the messages of a grib file (see app.jobs.grib_inventory).
     """
     if model_name == 'GFS':
         original_filename = os.path.split(url)[-1]
@@ -64,43 +88,60 @@ def download(url: str, path: str, config_cache_var: str, model_name: str, config
     # Construct target location for downloaded file.
     target = os.path.join(os.getcwd(), path, filename)
     # Get the file.
-    # We don't strictly need to use redis - but it helps a lot when debugging on a local machine, it
+    # We don't strictly need to cache - but it helps a lot when debugging on a local machine, it
     # saves having to re-download the file all the time.
-    # It also save a lot of bandwidth in our dev environment, where we have multiple workers downloading
-    # the same files over and over.
-    if config.get(config_cache_var) == 'True':
-        cache = create_redis()
+    # It also saves a lot of bandwidth when re-processing a model run, or retrying after a crash. The files
+    # are cached on local disk (see app.jobs.grib_cache), and revalidated with the server once they're older
+    # than the cache expiry.
+    cache = GribCache.instance() if config.get(config_cache_var) == 'True' else None
+    cached = None
+    if cache:
         try:
-            cached_object = cache.get(url)
+            cached = cache.get(url)
         except Exception as error:
-            cached_object = None
             logger.error(error)
-    else:
-        cached_object = None
-        cache = None
-    if cached_object:
-        logger.info('Cache hit %s', url)
-        # Store the cached object in a file
-        with open(target, 'wb') as file_object:
-            # Write the file.
-            file_object.write(cached_object)
-    else:
-        logger.info('Downloading %s', url)
-        # It's important to have a timeout on the get, otherwise the call may get stuck for an indefinite
-        # amount of time - there is no default value for timeout. During testing, it was observed that
-        # downloads usually complete in less than a second.
-        response = requests.get(url, timeout=60)
+    # A previous download may be linked to the cache, so it's removed rather than overwritten.
+    if os.path.exists(target):
+        os.remove(target)
+    max_age = float(config.get(config_cache_expiry_var, DEFAULT_CACHE_EXPIRY)) \
+        if config_cache_expiry_var else DEFAULT_CACHE_EXPIRY
+    if cached and cached.is_fresh(max_age):
+        if _copy_from_cache(cache, cached, target):
+            logger.info('Cache hit %s', url)
+            return target
+        # It can't be used, so it isn't revalidated either.
+        cached = None
+    if message_filter is not None:
+        # The messages of a file can't be revalidated, so they're downloaded again once stale.
+        target = message_filter.download(session or requests, url, target)
+        if target:
+            _add_to_cache(cache, url, target)
+        return target
+    logger.info('Downloading %s', url)
+    # It's important to have a timeout on the get, otherwise the call may get stuck for an indefinite
+    # amount of time - there is no default value for timeout. During testing, it was observed that
+    # downloads usually complete in less than a second.
+    response = (session or requests).get(url, timeout=60, stream=True,
+                                         headers=cached.revalidation_headers() if cached else None)
+    try:
+        if response.status_code == 304:
+            if _copy_from_cache(cache, cached, target, revalidated=True):
+                # Not modified since it was cached.
+                logger.info('Cache revalidated %s', url)
+                return target
+            # The cached file was evicted in the meantime (or the cache failed), so it has to be downloaded
+            # after all.
+            response.close()
+            response = (session or requests).get(url, timeout=60, stream=True)
         # If the response is 200/OK.
         if response.status_code == 200:
             # Store the response.
             with open(target, 'wb') as file_object:
-                # Write the file.
-                file_object.write(response.content)
+                # Write the file, without holding all of it in memory.
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    file_object.write(chunk)
             # Cache the response
-            if cache:
-                with open(target, 'rb') as file_object:
-                    # Cache for 6 hours (21600 seconds)
-                    cache.set(url, file_object.read(), ex=config.get(config_cache_expiry_var, 21600))
+            _add_to_cache(cache, url, target, response.headers.get('ETag'), response.headers.get('Last-Modified'))
         elif response.status_code == 404:
             # We expect this to happen frequently - just log for info.
             logger.info('404 error for %s', url)
@@ -108,22 +149,46 @@ def download(url: str, path: str, config_cache_var: str, model_name: str, config
         else:
             # Raise an exception
             response.raise_for_status()
-        # Return file location.
+    finally:
+        # Hand the connection back to the session.
+        response.close()
+    # Return file location.
     return target
 
 
+def _copy_from_cache(cache: GribCache, cached: CachedFile, target: str, revalidated: bool = False) -> bool:
+    """ Put a cached file at target (marking it fresh again if the server revalidated it), returning False if
+    it can't be, in which case it has to be downloaded. Failing to use the cache doesn't fail the download. """
+    try:
+        if not cache.copy_to(cached, target):
+            return False
+    except Exception as error:
+        logger.error(error)
+        if os.path.exists(target):
+            os.remove(target)
+        return False
+    if revalidated:
+        try:
+            cache.refresh(cached.url)
+        except Exception as error:
+            # The file is there all the same, it's just revalidated again next time.
+            logger.error(error)
+    return True
+
+
+def _add_to_cache(cache: Optional[GribCache], url: str, filename: str, etag: Optional[str] = None,
+                  last_modified: Optional[str] = None):
+    """ Cache a downloaded file, if caching. Failing to cache doesn't fail the download. """
+    if cache:
+        try:
+            cache.add(url, filename, etag, last_modified)
+        except Exception as error:
+            logger.error(error)
+
+
 def get_closest_index(coordinate: List, points: List):
     """ Get the index of the point closest to the coordinate """
-    # https://pyproj4.github.io/pyproj/stable/api/geod.html
-    # Use GRS80 ellipsoid (it's what NAD83 uses)
-    geod = Geod(ellps="GRS80")
-    # Calculate the distance each point is from the coordinate.
-    _, _, distances = geod.inv([coordinate[0] for _ in range(4)],
-                               [coordinate[1] for _ in range(4)],
-                               [x[0] for x in points],
-                               [x[1] for x in points])
-    # Return the index of the point with the shortest distance.
-    return numpy.argmin(distances)
+    return calculate_closest_index(points, coordinate)
 
 
 def flag_file_as_processed(url: str, session: Session):
@@ -150,6 +215,17 @@ def check_if_model_run_complete(session: Session, urls):
     return actual_count == expected_count and actual_count > 0
 
 
+def create_prediction_partitions():
+    """ Create the partitions the grid subset predictions are going to be stored in, ahead of processing
+    model runs: from the oldest data that's kept, to the end of the longest forecast. """
+    with app.db.database.get_write_session_scope() as session:
+        now = time_utils.get_utc_now()
+        create_model_run_grid_subset_prediction_partitions(
+            session,
+            now - datetime.timedelta(days=DATA_RETENTION_DAYS),
+            now + datetime.timedelta(days=PARTITION_DAYS_AHEAD))
+
+
 def apply_data_retention_policy():
     """
     We can't keep data forever, we just don't have the space.
@@ -161,8 +237,11 @@ def apply_data_retention_policy():
         # machine learning, but unfortunately takes a lot of space.
         # Currently we're using 19 days of data for machine learning, so
         # keeping 21 days (3 weeks) of historic data is sufficient.
-        oldest_to_keep = time_utils.get_utc_now() - datetime.timedelta(days=21)
-        delete_model_run_grid_subset_predictions(session, oldest_to_keep)
+        # The predictions are partitioned by week, and whole partitions are dropped, rather than deleting
+        # rows, so up to a week more than that is kept.
+        oldest_to_keep = time_utils.get_utc_now() - datetime.timedelta(days=DATA_RETENTION_DAYS)
+        drop_model_run_grid_subset_prediction_partitions(session, oldest_to_keep)
+        delete_model_run_grid_subset_prediction_arrays(session, oldest_to_keep)
 
 
 class ModelValueProcessor:
@@ -174,10 +253,36 @@ class ModelValueProcessor:
         self.session = session
         self.stations = get_stations_synchronously(station_source)
         self.station_count = len(self.stations)
+        # Location of the stations in the grid of the model being processed, keyed on station code.
+        self.station_grid_cells: Dict[int, StationGridCell] = {}
+        # Grid subsets the stations are in, keyed on id.
+        self.grid_subsets: Dict[int, PredictionModelGridSubset] = {}
+        # Closest vertex and interpolation weights of stations that aren't in the index, keyed on
+        # (station code, grid subset id).
+        self.station_locations: Dict[Tuple[int, int], Tuple[int, Optional[List[float]]]] = {}
+        # Predictions of the model run being processed, keyed on (station code, prediction timestamp).
+        self.station_predictions: Dict[Tuple[int, datetime.datetime], Dict] = {}
+        # Bias adjustment of the model being processed, for the stations in the index.
+        self.bias_adjustment = BiasAdjustment()
 
     def _process_model_run(self, model_run: PredictionModelRunTimestamp):
         """ Interpolate predictions in the provided model run for all stations. """
         logger.info('Interpolating values for model run: %s', model_run)
+        # Look up where the stations are in the model grid once, rather than for every station.
+        self.station_grid_cells = StationGridIndex.instance().get(self.session, model_run.prediction_model_id)
+        grid_subset_ids = {cell.prediction_model_grid_subset_id for cell in self.station_grid_cells.values()}
+        self.grid_subsets = {grid.id: grid for grid in get_grid_subsets(self.session, list(grid_subset_ids))}
+        # Learn the bias of the model for all the indexed stations at once (stations that aren't in the index
+        # learn their own, as they're processed).
+        station_grids = {}
+        for station in self.stations:
+            cell = self._get_indexed_cell(station)
+            if cell is not None:
+                station_grids[station.code] = (cell.prediction_model_grid_subset_id, cell.weights)
+        self.bias_adjustment = learn_bias_adjustment(
+            self.session, model_run.prediction_model_id, station_grids, model_run.prediction_run_timestamp)
+        # Predictions for all the stations are lined up, keyed on (station code, prediction timestamp).
+        self.station_predictions = {}
         # Iterate through stations.
         for index, station in enumerate(self.stations):
             logger.info('Interpolating model run %s (%s/%s) for %s:%s',
@@ -186,9 +291,11 @@ class ModelValueProcessor:
                         station.code, station.name)
             # Process this model run for station.
             self._process_model_run_for_station(model_run, station)
-        # Commit all the weather station model predictions (it's fast if we line them all up and commit
-        # them in one go.)
+        self._calculate_delta_precip(model_run)
+        # Write and commit all the weather station model predictions (it's fast if we line them all up and
+        # upsert them in one go.)
         logger.info('commit to database...')
+        upsert_weather_station_model_predictions(self.session, list(self.station_predictions.values()))
         self.session.commit()
         logger.info('done commit.')
 
@@ -196,10 +303,14 @@ class ModelValueProcessor:
                             prediction: ModelRunGridSubsetPrediction,
                             station: WeatherStation,
                             model_run: PredictionModelRunTimestamp,
-                            points: List,
-                            coordinate: List,
-                            machine: StationMachineLearning):
-        """ NOTE: Re. using griddata to interpolate:
+                            interpolated_values: Dict[str, float],
+                            closest_index: int,
+                            bias_adjusted_values: Dict[str, Optional[float]]):
+        """ interpolated_values are the scalar values of the prediction, interpolated to the station
+        (see _interpolate_predictions), and bias_adjusted_values the bias adjusted temperature and rh
+        (see _bias_adjust_predictions).
+
+        NOTE: Re. interpolating linearly between the grid points:
 
         We're interpolating using degrees, as such we're introducing a slight
         innacuracy since degrees != distance. (i.e. This distance between two
@@ -230,15 +341,15 @@ class ModelValueProcessor:
         More accuracy can be gained by taking into account altitude differences between
         points and adjusting accordingly.
         """
-        # If there's already a prediction, we want to update it
-        station_prediction = get_weather_station_model_prediction(
-            self.session, station.code, model_run.id, prediction.prediction_timestamp)
-        if station_prediction is None:
-            station_prediction = WeatherStationModelPrediction()
-        # Populate the weather station prediction object.
-        station_prediction.station_code = station.code
-        station_prediction.prediction_model_run_timestamp_id = model_run.id
-        station_prediction.prediction_timestamp = prediction.prediction_timestamp
+        # Populate the weather station prediction (if there's already a prediction, it's updated when
+        # the predictions are upserted.)
+        station_prediction = {
+            'station_code': station.code,
+            'prediction_model_run_timestamp_id': model_run.id,
+            'prediction_timestamp': prediction.prediction_timestamp,
+            'tmp_tgl_2': None,
+            'wind_tgl_10': None,
+            'wdir_tgl_10': None}
         # Calculate the interpolated values.
         # 2020 Dec 15, Sybrand: Encountered situation where tmp_tgl_2 was None, add this workaround for it.
         # NOTE: Not sure why this value would ever be None. This could happen if for whatever reason, the
@@ -246,8 +357,7 @@ class ModelValueProcessor:
         if prediction.tmp_tgl_2 is None:
             logger.warning('tmp_tgl_2 is None for ModelRunGridSubsetPrediction.id == %s', prediction.id)
         else:
-            station_prediction.tmp_tgl_2 = griddata(
-                points, prediction.tmp_tgl_2, coordinate, method='linear')[0]
+            station_prediction['tmp_tgl_2'] = interpolated_values['tmp_tgl_2']
 
         # 2020 Dec 10, Sybrand: Encountered situation where rh_tgl_2 was None, add this workaround for it.
         # NOTE: Not sure why this value would ever be None. This could happen if for whatever reason, the
@@ -255,59 +365,125 @@ class ModelValueProcessor:
         if prediction.rh_tgl_2 is None:
             # This is unexpected, so we log it.
             logger.warning('rh_tgl_2 is None for ModelRunGridSubsetPrediction.id == %s', prediction.id)
-            station_prediction.rh_tgl_2 = None
+            station_prediction['rh_tgl_2'] = None
         else:
-            station_prediction.rh_tgl_2 = griddata(
-                points, prediction.rh_tgl_2, coordinate, method='linear')[0]
+            station_prediction['rh_tgl_2'] = interpolated_values['rh_tgl_2']
         # Check that apcp_sfc_0 is None, since accumulated precipitation
         # does not exist for 00 hour.
         if prediction.apcp_sfc_0 is None:
-            station_prediction.apcp_sfc_0 = 0.0
+            station_prediction['apcp_sfc_0'] = 0.0
         else:
-            station_prediction.apcp_sfc_0 = griddata(
-                points, prediction.apcp_sfc_0, coordinate, method='linear')[0]
-        # Calculate the delta_precipitation based on station's previous prediction_timestamp
-        # for the same model run
-        self.session.flush()
-        station_prediction.delta_precip = self._calculate_delta_precip(
-            station, model_run, prediction, station_prediction)
+            station_prediction['apcp_sfc_0'] = interpolated_values['apcp_sfc_0']
 
         # Get the closest wind speed
         if prediction.wind_tgl_10 is not None:
-            station_prediction.wind_tgl_10 = prediction.wind_tgl_10[get_closest_index(coordinate, points)]
+            station_prediction['wind_tgl_10'] = prediction.wind_tgl_10[closest_index]
         # Get the closest wind direcion
         if prediction.wdir_tgl_10 is not None:
-            station_prediction.wdir_tgl_10 = prediction.wdir_tgl_10[get_closest_index(coordinate, points)]
-
-        # Predict the temperature
-        station_prediction.bias_adjusted_temperature = machine.predict_temperature(
-            station_prediction.tmp_tgl_2,
-            station_prediction.prediction_timestamp)
-        # Predict the rh
-        station_prediction.bias_adjusted_rh = machine.predict_rh(
-            station_prediction.rh_tgl_2, station_prediction.prediction_timestamp)
+            station_prediction['wdir_tgl_10'] = prediction.wdir_tgl_10[closest_index]
+
+        # The predicted (bias adjusted) temperature and rh
+        station_prediction.update(bias_adjusted_values)
         # Update the update time (this might be an update)
-        station_prediction.update_date = time_utils.get_utc_now()
-        # Add this prediction to the session (we'll commit it later.)
-        self.session.add(station_prediction)
+        station_prediction['update_date'] = time_utils.get_utc_now()
+        # Line this prediction up with the rest (we'll calculate delta precip, and write them all, later.)
+        self.station_predictions[(station.code, prediction.prediction_timestamp)] = station_prediction
 
-    def _calculate_delta_precip(self, station, model_run, prediction, station_prediction):
-        """ Calculate the station_prediction's delta_precip based on the previous precip
-        prediction for the station
+    def _calculate_delta_precip(self, model_run: PredictionModelRunTimestamp):
+        """ Calculate the delta_precip of each station prediction, based on the previous precip prediction
+        for the station in the model run (either one we've just calculated, or one that's already stored).
         """
-        results = self.session.query(WeatherStationModelPrediction).\
-            filter(WeatherStationModelPrediction.station_code == station.code).\
-            filter(WeatherStationModelPrediction.prediction_model_run_timestamp_id == model_run.id).\
-            filter(WeatherStationModelPrediction.prediction_timestamp < prediction.prediction_timestamp).\
-            order_by(WeatherStationModelPrediction.prediction_timestamp.desc()).\
-            limit(1).first()
-        # If there exists a previous prediction for the station from the same model run
-        if results is not None:
-            return station_prediction.apcp_sfc_0 - results.apcp_sfc_0
-        # If there is no prior prediction within the same model run, it means that station_prediction is
-        # the first prediction with apcp for the current model run (hour 001 or 003, depending on the
-        # model type). In this case, delta_precip will be equal to the apcp
-        return station_prediction.apcp_sfc_0
+        # Accumulated precipitation of each station, keyed on prediction timestamp.
+        timelines: Dict[int, Dict[datetime.datetime, float]] = defaultdict(dict)
+        for station_code, prediction_timestamp, apcp_sfc_0 in get_weather_station_model_precipitation(
+                self.session, model_run.id, [station.code for station in self.stations]):
+            timelines[station_code][prediction_timestamp] = apcp_sfc_0
+        for (station_code, prediction_timestamp), station_prediction in self.station_predictions.items():
+            timelines[station_code][prediction_timestamp] = station_prediction['apcp_sfc_0']
+
+        for station_code, timeline in timelines.items():
+            previous_apcp = None
+            for prediction_timestamp in sorted(timeline):
+                apcp = timeline[prediction_timestamp]
+                station_prediction = self.station_predictions.get((station_code, prediction_timestamp))
+                if station_prediction is not None:
+                    # If there is no prior prediction within the same model run, it means that this is the
+                    # first prediction with apcp for the current model run (hour 001 or 003, depending on the
+                    # model type). In this case, delta_precip will be equal to the apcp
+                    station_prediction['delta_precip'] = apcp if previous_apcp is None else apcp - previous_apcp
+                previous_apcp = apcp
+
+    def _interpolate_predictions(self,
+                                 predictions: List[ModelRunGridSubsetPrediction],
+                                 weights: Optional[List[float]]) -> List[Dict[str, float]]:
+        """ Interpolate the scalar values of all the predictions to the station, in a single matrix multiply.
+        Values that are None are left out. """
+        if not predictions:
+            return []
+        point_count = 4 if weights is None else len(weights)
+        missing = [np.nan] * point_count
+        values = np.array([[missing if getattr(prediction, key) is None else getattr(prediction, key)
+                            for key in INTERPOLATED_VALUE_KEYS] for prediction in predictions], dtype=float)
+        interpolated = interpolate(values, weights)
+        return [{key: float(value) for key, value in zip(INTERPOLATED_VALUE_KEYS, row)
+                 if getattr(prediction, key) is not None}
+                for prediction, row in zip(predictions, interpolated)]
+
+    def _bias_adjust_predictions(self,
+                                 station: WeatherStation,
+                                 predictions: List[ModelRunGridSubsetPrediction],
+                                 interpolated_values: List[Dict[str, float]],
+                                 bias_adjustment: BiasAdjustment) -> List[Dict[str, Optional[float]]]:
+        """ Predict the bias adjusted temperature and rh of all the predictions of a station at once. """
+        hours = [prediction.prediction_timestamp.hour for prediction in predictions]
+        temperatures = bias_adjustment.adjust(
+            station.code, 'temperature', [values.get('tmp_tgl_2') for values in interpolated_values], hours)
+        rhs = bias_adjustment.adjust(
+            station.code, 'relative_humidity', [values.get('rh_tgl_2') for values in interpolated_values], hours)
+        return [{'bias_adjusted_temperature': None if np.isnan(temperature) else float(temperature),
+                 'bias_adjusted_rh': None if np.isnan(rh) else float(rh)}
+                for temperature, rh in zip(temperatures, rhs)]
+
+    def _locate_station(self,
+                        station: WeatherStation,
+                        grid: PredictionModelGridSubset,
+                        points: List) -> Tuple[int, Optional[List[float]]]:
+        """ Return the index of the vertex closest to a station that isn't in the index, and the weights to
+        interpolate the vertices of the grid to the station. Only calculated once per station and grid. """
+        key = (station.code, grid.id)
+        location = self.station_locations.get(key)
+        if location is None:
+            coordinate = [station.long, station.lat]
+            location = (get_closest_index(coordinate, points), calculate_interpolation_weights(points, coordinate))
+            self.station_locations[key] = location
+        return location
+
+    def _get_indexed_cell(self, station: WeatherStation) -> Optional[StationGridCell]:
+        """ Return the location of the station in the grid, if it's in the index (and hasn't moved since). """
+        cell = self.station_grid_cells.get(station.code)
+        if cell is not None and cell.latitude == station.lat and cell.longitude == station.long \
+                and cell.prediction_model_grid_subset_id in self.grid_subsets:
+            return cell
+        return None
+
+    def _get_grids_for_station(self,
+                               model_run: PredictionModelRunTimestamp,
+                               station: WeatherStation) -> List[Tuple[PredictionModelGridSubset,
+                                                                      Optional[StationGridCell]]]:
+        """ Return the grids the station is in, along with the location of the station in the grid if
+        it's in the index. """
+        cell = self._get_indexed_cell(station)
+        if cell is not None:
+            return [(self.grid_subsets[cell.prediction_model_grid_subset_id], cell)]
+        # The station hasn't been indexed (it's new, or moved since the model run was processed).
+        coordinate = [station.long, station.lat]
+        # Lookup the grid our weather station is in.
+        logger.info("Getting grid for coordinate %s and model %s",
+                    coordinate, model_run.prediction_model)
+        # There should never be more than one grid per model - but it can happen.
+        # TODO: Re-factor away the need for the grid table entirely.
+        return [(grid, None) for grid in get_grids_for_coordinate(
+            self.session, model_run.prediction_model, coordinate)]
 
     def _process_model_run_for_station(self,
                                        model_run: PredictionModelRunTimestamp,
@@ -316,47 +492,50 @@ class ModelValueProcessor:
         """
         # Extract the coordinate.
         coordinate = [station.long, station.lat]
-        # Lookup the grid our weather station is in.
-        logger.info("Getting grid for coordinate %s and model %s",
-                    coordinate, model_run.prediction_model)
-        # There should never be more than one grid per model - but it can happen.
-        # TODO: Re-factor away the need for the grid table entirely.
-        grid_query = get_grids_for_coordinate(
-            self.session, model_run.prediction_model, coordinate)
-
-        for grid in grid_query:
+        for grid, cell in self._get_grids_for_station(model_run, station):
             # Convert the grid database object to a polygon object.
             poly = to_shape(grid.geom)
             # Extract the vertices of the polygon.
             points = list(poly.exterior.coords)[:-1]
-
-            machine = StationMachineLearning(
-                session=self.session,
-                model=model_run.prediction_model,
-                grid=grid,
-                points=points,
-                target_coordinate=coordinate,
-                station_code=station.code,
-                max_learn_date=model_run.prediction_run_timestamp)
-            machine.learn()
+            if cell is None:
+                closest_index, weights = self._locate_station(station, grid, points)
+                machine = StationMachineLearning(
+                    session=self.session,
+                    model=model_run.prediction_model,
+                    grid=grid,
+                    points=points,
+                    target_coordinate=coordinate,
+                    station_code=station.code,
+                    max_learn_date=model_run.prediction_run_timestamp,
+                    weights=weights)
+                machine.learn()
+                bias_adjustment = machine.bias_adjustment
+            else:
+                closest_index, weights = cell.closest_index, cell.weights
+                bias_adjustment = self.bias_adjustment
 
             # Get all the predictions associated to this particular model run, in the grid.
             query = get_model_run_predictions_for_grid(
                 self.session, model_run, grid)
 
-            # Iterate through all the predictions.
+            # Line up all the predictions (along with the noon predictions we make up in between).
+            predictions = []
             prev_prediction = None
             for prediction in query:
                 if (prev_prediction is not None
                         and prev_prediction.prediction_timestamp.hour == 18
                         and prediction.prediction_timestamp.hour == 21):
-                    noon_prediction = construct_interpolated_noon_prediction(prev_prediction, prediction)
-                    self._process_prediction(
-                        noon_prediction, station, model_run, points, coordinate, machine)
-                self._process_prediction(
-                    prediction, station, model_run, points, coordinate, machine)
+                    predictions.append(construct_interpolated_noon_prediction(prev_prediction, prediction))
+                predictions.append(prediction)
                 prev_prediction = prediction
 
+            # Interpolate them all to the station and bias adjust them at once, and iterate through them.
+            interpolated_values = self._interpolate_predictions(predictions, weights)
+            bias_adjusted_values = self._bias_adjust_predictions(
+                station, predictions, interpolated_values, bias_adjustment)
+            for prediction, values, bias_adjusted in zip(predictions, interpolated_values, bias_adjusted_values):
+                self._process_prediction(prediction, station, model_run, values, closest_index, bias_adjusted)
+
     def _mark_model_run_interpolated(self, model_run: PredictionModelRunTimestamp):
         """ Having completely processed a model run, we can mark it has having been interpolated.
         """
@@ -365,6 +544,14 @@ class ModelValueProcessor:
         self.session.add(model_run)
         self.session.commit()
 
+    def _pack_model_run(self, model_run: PredictionModelRunTimestamp):
+        """ Having interpolated a model run, its grid subset predictions are only read to learn from, so they
+        can be packed, a record per grid subset.
+        """
+        grid_count = pack_model_run(self.session, model_run)
+        logger.info('packed predictions of %s for %s grid subsets', model_run, grid_count)
+        self.session.commit()
+
     def process(self, model_type: ModelEnum):
         """ Entry point to start processing model runs that have not yet had their predictions interpolated
         """
@@ -378,3 +565,5 @@ class ModelValueProcessor:
             self._process_model_run(model_run)
             # Mark the model run as interpolated.
             self._mark_model_run_interpolated(model_run)
+            if config.get('PACK_GRID_SUBSET_PREDICTIONS') == 'True':
+                self._pack_model_run(model_run)
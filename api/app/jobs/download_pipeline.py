@@ -0,0 +1,137 @@
+""" Download many files at once, handing each one over for processing as soon as it's on disk.
+
+Model runs consist of hundreds of grib files. Downloading them one at a time, and only starting on the next
+download once the previous file has been processed, means most of a run is spent waiting on the network.
+DownloadPipeline keeps a number of downloads in flight (on a shared keep-alive session), while the caller
+processes the files that have already arrived:
+
+    pipeline = DownloadPipeline('REDIS_CACHE_ENV_CANADA', 'RDPS', 'REDIS_ENV_CANADA_CACHE_EXPIRY')
+    for downloaded in pipeline.download(urls):
+        if downloaded.exception is None and downloaded.filename is not None:
+            process(downloaded.filename)
+
+A downloaded file is deleted as soon as the caller moves on to the next one.
+"""
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional
+import requests
+from app import config
+from app.jobs.common_model_fetchers import download
+from app.jobs.grib_inventory import GribMessageFilter
+
+logger = logging.getLogger(__name__)
+
+# Number of downloads in flight at any one time.
+DEFAULT_CONCURRENCY = 4
+# Number of downloaded files that may be waiting to be processed.
+DEFAULT_QUEUE_SIZE = 4
+# Bytes of downloaded files that may be on disk waiting to be processed. No new downloads are started while
+# over budget.
+DEFAULT_DISK_BUDGET = 2 * 1024 * 1024 * 1024
+# Number of times a download is retried when the connection fails, or the server returns a 5xx.
+DEFAULT_RETRIES = 3
+# Seconds to wait before the first retry, doubling with every retry after that.
+DEFAULT_BACKOFF = 2.0
+
+
+class DownloadedFile(NamedTuple):
+    """ The outcome of downloading a url. filename is None if the file doesn't exist (404), exception
+    is set if the download failed. """
+    url: str
+    filename: Optional[str]
+    exception: Optional[Exception]
+
+
+def is_retryable(exception: Exception) -> bool:
+    """ Is it worth trying the download again? (i.e. the connection failed, or the server had a problem) """
+    if isinstance(exception, requests.HTTPError):
+        return exception.response is not None and exception.response.status_code >= 500
+    return isinstance(exception, (requests.ConnectionError, requests.Timeout))
+
+
+class DownloadPipeline():
+    """ Download urls concurrently, yielding each file as it completes. """
+
+    def __init__(self, config_cache_var: str, model_name: str, config_cache_expiry_var: Optional[str] = None,
+                 message_filter: Optional[GribMessageFilter] = None):
+        self.config_cache_var = config_cache_var
+        self.model_name = model_name
+        self.config_cache_expiry_var = config_cache_expiry_var
+        # If set, only some of the messages of each grib file are downloaded.
+        self.message_filter = message_filter
+        self.concurrency = max(1, int(config.get('GRIB_DOWNLOAD_CONCURRENCY', DEFAULT_CONCURRENCY)))
+        self.queue_size = max(0, int(config.get('GRIB_DOWNLOAD_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)))
+        self.disk_budget = int(config.get('GRIB_DOWNLOAD_DISK_BUDGET', DEFAULT_DISK_BUDGET))
+        self.retries = int(config.get('GRIB_DOWNLOAD_RETRIES', DEFAULT_RETRIES))
+        self.backoff = float(config.get('GRIB_DOWNLOAD_BACKOFF', DEFAULT_BACKOFF))
+        self._lock = threading.Lock()
+        self._bytes_on_disk = 0
+
+    def _download(self, session: requests.Session, url: str, path: str) -> Optional[str]:
+        """ Download the url, retrying with backoff. """
+        attempt = 0
+        while True:
+            try:
+                filename = download(url, path, self.config_cache_var, self.model_name, self.config_cache_expiry_var,
+                                    session=session, message_filter=self.message_filter)
+                break
+            except Exception as exception:
+                if attempt >= self.retries or not is_retryable(exception):
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                attempt += 1
+                logger.warning('download of %s failed (%s), retry %d/%d in %.1fs',
+                               url, exception, attempt, self.retries, delay)
+                time.sleep(delay)
+        if filename:
+            with self._lock:
+                self._bytes_on_disk += os.path.getsize(filename)
+        return filename
+
+    def remove(self, filename: str):
+        """ Delete a downloaded file, freeing up disk budget. """
+        size = os.path.getsize(filename)
+        os.remove(filename)
+        with self._lock:
+            self._bytes_on_disk -= size
+
+    def _can_start(self, pending: int) -> bool:
+        with self._lock:
+            return pending < self.concurrency + self.queue_size and self._bytes_on_disk < self.disk_budget
+
+    def download(self, urls: Iterable[str], path: Optional[str] = None,
+                 remove_processed: bool = True) -> Iterator[DownloadedFile]:
+        """ Download the urls to path (a temporary directory if not given), yielding each one as it completes
+        (not necessarily in order). The downloaded file is deleted when the next one is requested, unless
+        remove_processed is False, in which case the caller has to remove() it once it's done with it. """
+        urls = iter(urls)
+        with (tempfile.TemporaryDirectory() if path is None else nullcontext(path)) as path, \
+                requests.Session() as session, ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # Downloads either in flight, or done and waiting to be processed.
+            pending: Dict[Future, str] = {}
+            exhausted = False
+            while True:
+                while not exhausted and (not pending or self._can_start(len(pending))):
+                    url = next(urls, None)
+                    if url is None:
+                        exhausted = True
+                    else:
+                        pending[executor.submit(self._download, session, url, path)] = url
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = pending.pop(future)
+                    exception = future.exception()
+                    filename = None if exception else future.result()
+                    try:
+                        yield DownloadedFile(url, filename, exception)
+                    finally:
+                        if remove_processed and filename and os.path.exists(filename):
+                            self.remove(filename)
@@ -4,21 +4,23 @@ https://app.zenhub.com/workspaces/wildfire-predictive-services-5e321393e038fba5b
 import os
 import sys
 import datetime
-from typing import Generator
+import tempfile
+from typing import Generator, Iterable, Iterator, Tuple
 from urllib.parse import urlparse
 import logging
-import tempfile
 from sqlalchemy.orm import Session
 from app.db.crud.weather_models import (get_processed_file_record,
                                         get_prediction_model,
                                         get_prediction_run,
                                         update_prediction_run)
 from app.jobs.common_model_fetchers import (CompletedWithSomeExceptions, ModelValueProcessor, UnhandledPredictionModelType,
-                                            apply_data_retention_policy,
-                                            check_if_model_run_complete, download, flag_file_as_processed)
+                                            apply_data_retention_policy, create_prediction_partitions,
+                                            check_if_model_run_complete, flag_file_as_processed)
+from app.jobs.download_pipeline import DownloadPipeline, DownloadedFile
 from app.weather_models import ModelEnum, ProjectionEnum
 from app import configure_logging
 import app.utils.time as time_utils
+from app.weather_models.grib_worker_pool import GribWorkerPool
 from app.weather_models.process_grib import GribFileProcessor, ModelRunInfo
 import app.db.database
 from app.stations import StationSourceEnum
@@ -257,6 +259,7 @@ class EnvCanada():
         # We always work in UTC:
         self.now = time_utils.get_utc_now()
         self.grib_processor = GribFileProcessor(station_source)
+        self.grib_worker_pool = GribWorkerPool(self.grib_processor)
         self.model_type: ModelEnum = model_type
         # set projection based on model_type
         if self.model_type == ModelEnum.GDPS:
@@ -271,41 +274,56 @@ class EnvCanada():
     def process_model_run_urls(self, urls):
         """ Process the urls for a model run.
         """
-        for url in urls:
+        with app.db.database.get_write_session_scope() as session:
+            # check the database for a record of each file, files that have already been processed are skipped.
+            # NOTE: changing this to logger.debug causes too much noise in unit tests.
+            urls = [url for url in urls if not get_processed_file_record(session, url)]
+        # The files are downloaded in the background, and decoded by the grib workers, while the values of
+        # the files that have already been decoded are stored.
+        pipeline = DownloadPipeline('REDIS_CACHE_ENV_CANADA', self.model_type.value, 'REDIS_ENV_CANADA_CACHE_EXPIRY')
+        with tempfile.TemporaryDirectory() as path:
+            downloads = self.downloaded_files(pipeline, pipeline.download(urls, path, remove_processed=False))
+            for downloaded, extracted, exception in self.grib_worker_pool.extract(downloads):
+                try:
+                    if exception is not None:
+                        raise exception
+                    with app.db.database.get_write_session_scope() as session:
+                        self.grib_processor.store_station_values(extracted, session)
+                        # Flag the file as processed
+                        flag_file_as_processed(downloaded.url, session)
+                    self.files_processed += 1
+                except Exception as exception:
+                    self.exception_count += 1
+                    # We catch and log exceptions, but keep trying to process.
+                    # We intentionally catch a broad exception, as we want to try and process as much
+                    # as we can.
+                    logger.error('unexpected exception processing %s',
+                                 downloaded.url, exc_info=exception)
+                finally:
+                    pipeline.remove(downloaded.filename)
+
+    def downloaded_files(self, pipeline: DownloadPipeline, downloads: Iterable[DownloadedFile]) \
+            -> Iterator[Tuple[DownloadedFile, str, ModelRunInfo]]:
+        """ Yield (download, filename, model info) for each file that was downloaded ok. """
+        for downloaded in downloads:
+            if downloaded.exception is not None:
+                self.exception_count += 1
+                # We log failed downloads, but keep trying to download the rest.
+                logger.error('unexpected exception downloading %s', downloaded.url, exc_info=downloaded.exception)
+                continue
+            if downloaded.filename is None:
+                # The file doesn't exist (yet).
+                continue
+            self.files_downloaded += 1
             try:
-                with app.db.database.get_write_session_scope() as session:
-                    # check the database for a record of this file:
-                    processed_file_record = get_processed_file_record(session, url)
-                    if processed_file_record:
-                        # This file has already been processed - so we skip it.
-                        # NOTE: changing this to logger.debug causes too much noise in unit tests.
-                        logger.debug('file already processed %s', url)
-                    else:
-                        # extract model info from URL:
-                        model_info = parse_env_canada_filename(url)
-                        # download the file:
-                        with tempfile.TemporaryDirectory() as temporary_path:
-                            downloaded = download(url, temporary_path, 'REDIS_CACHE_ENV_CANADA', model_info.model_enum.value,
-                                                  'REDIS_ENV_CANADA_CACHE_EXPIRY')
-                            if downloaded:
-                                self.files_downloaded += 1
-                                # If we've downloaded the file ok, we can now process it.
-                                try:
-                                    self.grib_processor.process_grib_file(
-                                        downloaded, model_info, session)
-                                    # Flag the file as processed
-                                    flag_file_as_processed(url, session)
-                                    self.files_processed += 1
-                                finally:
-                                    # delete the file when done.
-                                    os.remove(downloaded)
+                # extract model info from URL:
+                model_info = parse_env_canada_filename(downloaded.url)
             except Exception as exception:
                 self.exception_count += 1
-                # We catch and log exceptions, but keep trying to download.
-                # We intentionally catch a broad exception, as we want to try and download as much
-                # as we can.
-                logger.error('unexpected exception processing %s',
-                             url, exc_info=exception)
+                logger.error('unexpected exception processing %s', downloaded.url, exc_info=exception)
+                pipeline.remove(downloaded.filename)
+                continue
+            yield downloaded, downloaded.filename, model_info
 
     def process_model_run(self, model_run_hour):
         """ Process a particular model run """
@@ -329,16 +347,20 @@ class EnvCanada():
 
     def process(self):
         """ Entry point for downloading and processing weather model grib files """
-        for hour in get_model_run_hours(self.model_type):
-            try:
-                self.process_model_run(hour)
-            except Exception as exception:
-                # We catch and log exceptions, but keep trying to process.
-                # We intentionally catch a broad exception, as we want to try to process as much as we can.
-                self.exception_count += 1
-                logger.error(
-                    'unexpected exception processing %s model run %d',
-                    self.model_type, hour, exc_info=exception)
+        try:
+            for hour in get_model_run_hours(self.model_type):
+                try:
+                    self.process_model_run(hour)
+                except Exception as exception:
+                    # We catch and log exceptions, but keep trying to process.
+                    # We intentionally catch a broad exception, as we want to try to process as much as we can.
+                    self.exception_count += 1
+                    logger.error(
+                        'unexpected exception processing %s model run %d',
+                        self.model_type, hour, exc_info=exception)
+        finally:
+            self.grib_worker_pool.shutdown()
+            self.grib_worker_pool.log_throughput()
 
 
 def process_models(station_source: StationSourceEnum = StationSourceEnum.UNSPECIFIED):
@@ -378,6 +400,7 @@ def process_models(station_source: StationSourceEnum = StationSourceEnum.UNSPECI
 def main():
     """ main script - process and download models, then do exception handling """
     try:
+        create_prediction_partitions()
         process_models()
         apply_data_retention_policy()
     except CompletedWithSomeExceptions:
@@ -0,0 +1,185 @@
+""" Cache of downloaded grib files on local disk.
+
+Files are stored by the sha256 of their content (so a file downloaded from many urls is only kept once), with
+an index (in sqlite) of the content of each url, along with the ETag and Last-Modified the server sent with
+it. A cached file is used as is for a while after it was downloaded; after that it's revalidated with a
+conditional request, and only downloaded again if it changed:
+
+    cache = GribCache.instance()
+    cached = cache.get(url)
+    if cached and cached.is_fresh(max_age) and cache.copy_to(cached, target):
+        return target
+    ... download to target, sending cached.revalidation_headers() ...
+    cache.add(url, target, etag, last_modified)
+
+Files are written to a temporary file and moved into place, so a crash never leaves a partial file in the
+cache, and once the cache grows past GRIB_CACHE_SIZE bytes, the least recently used files are evicted.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from typing import Dict, NamedTuple, Optional
+from app import config
+from app.utils.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'grib_cache')
+DEFAULT_CACHE_SIZE = 10 * 1024 * 1024 * 1024
+# Size of the chunks read when hashing a file.
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class CachedFile(NamedTuple):
+    """ The cached content of a url. """
+    url: str
+    digest: str
+    filename: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # When the content was downloaded (or last revalidated), in seconds since the epoch.
+    fetched_at: float
+
+    def is_fresh(self, max_age: float) -> bool:
+        """ Can the file be used without asking the server if it's changed? """
+        return time.time() - self.fetched_at < max_age
+
+    def revalidation_headers(self) -> Dict[str, str]:
+        """ Headers for a conditional request, to which the server responds with 304 if the file hasn't
+        changed. """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+def hash_file(filename: str) -> str:
+    """ Return the sha256 of the content of a file. """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file_object:
+        for chunk in iter(lambda: file_object.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(source: str, target: str):
+    """ Hard link source to target (replacing target), copying it if it can't be linked (e.g. it's on another
+    file system). """
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+@Singleton
+class GribCache():
+    """ Content addressed cache of grib files on local disk, evicting the least recently used files. """
+
+    def __init__(self):
+        self.path = config.get('GRIB_CACHE_PATH', DEFAULT_CACHE_PATH)
+        self.max_size = int(config.get('GRIB_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+        self._lock = threading.Lock()
+        self._initialized_path = None
+
+    def _object_filename(self, digest: str) -> str:
+        return os.path.join(self.path, 'objects', digest[:2], digest)
+
+    def _connect(self) -> sqlite3.Connection:
+        """ Open the index, creating it if it isn't there. Connections aren't shared between threads, so each
+        operation opens its own. """
+        with self._lock:
+            path = self.path
+            if self._initialized_path != path:
+                os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+            connection = sqlite3.connect(os.path.join(path, 'index.sqlite'), timeout=60)
+            if self._initialized_path != path:
+                with connection:
+                    connection.execute('CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, digest TEXT NOT NULL, '
+                                       'etag TEXT, last_modified TEXT, fetched_at REAL NOT NULL)')
+                    connection.execute('CREATE TABLE IF NOT EXISTS objects (digest TEXT PRIMARY KEY, '
+                                       'size INTEGER NOT NULL, used_at REAL NOT NULL)')
+                self._initialized_path = path
+        return connection
+
+    def get(self, url: str) -> Optional[CachedFile]:
+        """ Return the cached content of the url, or None if it isn't cached. """
+        with closing(self._connect()) as connection:
+            row = connection.execute('SELECT digest, etag, last_modified, fetched_at FROM urls WHERE url = ?',
+                                     (url,)).fetchone()
+        if row is None:
+            return None
+        digest, etag, last_modified, fetched_at = row
+        return CachedFile(url, digest, self._object_filename(digest), etag, last_modified, fetched_at)
+
+    def copy_to(self, cached: CachedFile, target: str) -> bool:
+        """ Put the cached file at target, returning False if it's no longer in the cache. """
+        try:
+            link_or_copy(cached.filename, target)
+        except FileNotFoundError:
+            # Evicted (or removed from disk) since it was looked up.
+            return False
+        with closing(self._connect()) as connection, connection:
+            connection.execute('UPDATE objects SET used_at = ? WHERE digest = ?', (time.time(), cached.digest))
+        return True
+
+    def refresh(self, url: str):
+        """ The server says the content of the url hasn't changed, so it's fresh again. """
+        with closing(self._connect()) as connection, connection:
+            connection.execute('UPDATE urls SET fetched_at = ? WHERE url = ?', (time.time(), url))
+
+    def add(self, url: str, filename: str, etag: Optional[str] = None,
+            last_modified: Optional[str] = None) -> CachedFile:
+        """ Cache a downloaded file as the content of the url. The file is left where it is. """
+        digest = hash_file(filename)
+        object_filename = self._object_filename(digest)
+        if not os.path.exists(object_filename):
+            os.makedirs(os.path.dirname(object_filename), exist_ok=True)
+            # Link (or copy) to a temporary name first, and then move into place, so that other processes
+            # never see a partial file.
+            file_descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(object_filename))
+            os.close(file_descriptor)
+            try:
+                link_or_copy(filename, temporary)
+                os.replace(temporary, object_filename)
+            finally:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+        now = time.time()
+        with closing(self._connect()) as connection, connection:
+            connection.execute('INSERT OR REPLACE INTO urls (url, digest, etag, last_modified, fetched_at) '
+                               'VALUES (?, ?, ?, ?, ?)', (url, digest, etag, last_modified, now))
+            connection.execute('INSERT OR REPLACE INTO objects (digest, size, used_at) VALUES (?, ?, ?)',
+                               (digest, os.path.getsize(object_filename), now))
+        self.evict(keep=digest)
+        return CachedFile(url, digest, object_filename, etag, last_modified, now)
+
+    def evict(self, keep: Optional[str] = None):
+        """ Remove the least recently used files until the cache fits in its size, keeping the given file. """
+        with closing(self._connect()) as connection, connection:
+            size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+            if size <= self.max_size:
+                return
+            for digest, object_size in connection.execute(
+                    'SELECT digest, size FROM objects ORDER BY used_at').fetchall():
+                if size <= self.max_size:
+                    break
+                if digest == keep:
+                    continue
+                connection.execute('DELETE FROM urls WHERE digest = ?', (digest,))
+                connection.execute('DELETE FROM objects WHERE digest = ?', (digest,))
+                try:
+                    os.remove(self._object_filename(digest))
+                except FileNotFoundError:
+                    pass
+                size -= object_size
+                logger.info('evicted %s (%s bytes) from the grib cache', digest, object_size)
@@ -0,0 +1,120 @@
+""" Download only some of the messages of a grib file, using its inventory.
+
+NOMADS publishes an inventory (.idx) next to every grib file, listing each message along with the byte it
+starts at, e.g.:
+
+    1:0:d=2023041200:TMP:surface:18 hour fcst:
+    2:1143962:d=2023041200:TMP:2 m above ground:18 hour fcst:
+
+GribMessageFilter reads the inventory, works out the byte ranges of the messages of the wanted variables and
+levels, and requests just those (with HTTP range requests), writing them one after the other into a slim
+local grib file. Messages are kept in the order they are in the original file, so the bands of the local file
+are the same as those of the grib filter (cgi-bin/filter_*.pl), given the same variables and levels.
+"""
+import logging
+from typing import Callable, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Size of the chunks written to disk while streaming a range.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class InventoryEntry(NamedTuple):
+    """ A message in a grib file, as listed in its inventory. end is None for the last message in the file. """
+    number: int
+    start: int
+    end: Optional[int]
+    variable: str
+    level: str
+
+
+class InventoryError(Exception):
+    """ Exception raised when the messages can't be picked out of a grib file with its inventory. """
+
+
+def parse_inventory(text: str) -> List[InventoryEntry]:
+    """ Parse a grib inventory, working out where each message ends from where the next one starts. """
+    lines = [line.split(':') for line in text.splitlines() if line.strip()]
+    starts = [int(fields[1]) for fields in lines]
+    if starts != sorted(starts):
+        raise InventoryError('inventory is not in the order of the file')
+    entries = []
+    for index, fields in enumerate(lines):
+        # Sub-messages (e.g. the U and V of a wind vector, numbered 3.1 and 3.2) share a start byte with the
+        # message they're a part of.
+        following = [start for start in starts[index + 1:] if start > starts[index]]
+        entries.append(InventoryEntry(number=int(fields[0].split('.')[0]),
+                                      start=starts[index],
+                                      end=following[0] - 1 if following else None,
+                                      variable=fields[3],
+                                      level=fields[4]))
+    return entries
+
+
+def select_byte_ranges(entries: Iterable[InventoryEntry], variables: Iterable[str],
+                       levels: Iterable[str]) -> List[Tuple[int, Optional[int]]]:
+    """ Return the (inclusive) byte ranges of the messages of any of the variables at any of the levels,
+    merging neighbouring messages into a single range. """
+    variables = set(variables)
+    levels = set(levels)
+    ranges: List[Tuple[int, Optional[int]]] = []
+    for entry in entries:
+        if entry.variable not in variables or entry.level not in levels:
+            continue
+        if ranges and ranges[-1][0] == entry.start:
+            # A sub-message of a message that's already in.
+            continue
+        if ranges and ranges[-1][1] is not None and ranges[-1][1] + 1 == entry.start:
+            ranges[-1] = (ranges[-1][0], entry.end)
+        else:
+            ranges.append((entry.start, entry.end))
+    return ranges
+
+
+class GribMessageFilter():
+    """ Download the messages of some variables and levels out of grib files, using their inventories. """
+
+    def __init__(self, variables: Iterable[str], levels: Iterable[str],
+                 grib_url: Optional[Callable[[str], str]] = None):
+        """
+        : param variables: Variables as named in the inventory, e.g. TMP.
+        : param levels: Levels as named in the inventory, e.g. 2 m above ground.
+        : param grib_url: Turns the url a file is known by into the url of the grib file (the inventory being
+            that url, with .idx appended). The url is used as is if not given.
+        """
+        self.variables = list(variables)
+        self.levels = list(levels)
+        self.grib_url = grib_url
+
+    def download(self, session, url: str, target: str) -> Optional[str]:
+        """ Download the messages of the grib file at url to target, returning target, or None if there's no
+        such grib file (yet). session is a requests.Session (or the requests module). """
+        if self.grib_url is not None:
+            url = self.grib_url(url)
+        response = session.get(f'{url}.idx', timeout=60)
+        try:
+            if response.status_code == 404:
+                logger.info('404 error for %s.idx', url)
+                return None
+            response.raise_for_status()
+            ranges = select_byte_ranges(parse_inventory(response.text), self.variables, self.levels)
+        finally:
+            response.close()
+        if not ranges:
+            raise InventoryError(f'none of {self.variables} at {self.levels} in {url}')
+        logger.info('Downloading %s byte ranges of %s', len(ranges), url)
+        with open(target, 'wb') as file_object:
+            for start, end in ranges:
+                response = session.get(url, timeout=60, stream=True,
+                                       headers={'Range': f'bytes={start}-{"" if end is None else end}'})
+                try:
+                    if response.status_code == 200:
+                        # The server ignored the range, and is sending the whole file.
+                        raise InventoryError(f'range requests not supported for {url}')
+                    response.raise_for_status()
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        file_object.write(chunk)
+                finally:
+                    response.close()
+        return target
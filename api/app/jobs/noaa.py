@@ -3,10 +3,11 @@
 import os
 import sys
 import datetime
+import tempfile
 import pytz
-from typing import Generator
+from functools import partial
+from typing import Generator, Iterable, Iterator, Optional, Tuple
 import logging
-import tempfile
 from sqlalchemy.orm import Session
 from urllib.parse import parse_qs, urlsplit
 from app.db.crud.weather_models import (get_processed_file_record,
@@ -15,10 +16,13 @@ from app.db.crud.weather_models import (get_processed_file_record,
                                         update_prediction_run)
 from app.jobs.common_model_fetchers import (CompletedWithSomeExceptions, ModelValueProcessor,
                                             apply_data_retention_policy, check_if_model_run_complete,
-                                            download, flag_file_as_processed)
-from app import configure_logging
+                                            create_prediction_partitions, flag_file_as_processed)
+from app import config, configure_logging
 import app.utils.time as time_utils
+from app.jobs.download_pipeline import DownloadPipeline, DownloadedFile
+from app.jobs.grib_inventory import GribMessageFilter
 from app.weather_models import ModelEnum, ProjectionEnum
+from app.weather_models.grib_worker_pool import GribWorkerPool
 from app.weather_models.process_grib import GribFileProcessor, ModelRunInfo
 import app.db.database
 from app.stations import StationSourceEnum
@@ -50,9 +54,36 @@ SUBREGION_TOP_LAT = 60
 SUBREGION_BOTTOM_LAT = 48
 SUBREGION_LEFT_LON = -139
 SUBREGION_RIGHT_LON = -114
+# Where the grib files (and their .idx inventories) of each model are on the NOMADS data server, for models
+# downloaded in byte ranges (see NOAA_BYTE_RANGE_MODELS) rather than through the grib filter.
+# GFS isn't one of them: the whole GFS grid runs from 0 to 360 degrees longitude, and it's the grib filter
+# cropping it (to SUBREGION_LEFT_LON) that gives the grid west of 180 the stations are looked up in, which
+# hasn't been verified without the crop.
+NOMADS_PUB_URL = 'https://nomads.ncep.noaa.gov/pub/data/nccf/com/'
+NOMADS_PUB_DIRECTORIES = {ModelEnum.NAM: 'nam/prod'}
 # -------------------------------------- #
 
 
+def get_grib_file_url(url: str, model_type: ModelEnum) -> str:
+    """ Get the url of the grib file on the NOMADS data server, that a grib filter url picks messages out of """
+    params = parse_qs(urlsplit(url).query)
+    pub_url = config.get('NOMADS_PUB_URL', NOMADS_PUB_URL).rstrip('/')
+    return f"{pub_url}/{NOMADS_PUB_DIRECTORIES[model_type]}{params['dir'][0]}/{params['file'][0]}"
+
+
+def get_grib_message_filter(model_type: ModelEnum) -> Optional[GribMessageFilter]:
+    """ Return a filter to download the messages of the weather variables and levels out of the grib files on
+    the NOMADS data server in byte ranges, or None if the model is downloaded through the grib filter. """
+    if model_type.value not in config.get('NOAA_BYTE_RANGE_MODELS', '').split(','):
+        return None
+    if model_type not in NOMADS_PUB_DIRECTORIES:
+        logger.warning('%s can\'t be downloaded in byte ranges, using the grib filter', model_type.value)
+        return None
+    # The inventories name levels with spaces, e.g. "2 m above ground".
+    return GribMessageFilter(WX_VARS, [level.replace('_', ' ') for level in LEVELS],
+                             grib_url=partial(get_grib_file_url, model_type=model_type))
+
+
 def get_gfs_and_nam_model_run_hours():
     """ Yield GFS and/or NAM model run hours (they're both on the same schedule)
      ("00", "06", "12", "18") """
@@ -276,53 +307,70 @@ class NOAA():
         # We always work in UTC:
         self.now = time_utils.get_utc_now()
         self.grib_processor = GribFileProcessor(station_source)
+        self.grib_worker_pool = GribWorkerPool(self.grib_processor)
         self.model_type: ModelEnum = model_type
         # projection depends on model type
         if self.model_type == ModelEnum.GFS:
             self.projection = ProjectionEnum.GFS_LONLAT
         elif self.model_type == ModelEnum.NAM:
             self.projection = ProjectionEnum.NAM_POLAR_STEREO
+        self.message_filter = get_grib_message_filter(self.model_type)
 
     def process_model_run_urls(self, urls):
         """ Process the urls for a model run.
         """
-        for url in urls:
+        with app.db.database.get_write_session_scope() as session:
+            # check the database for a record of each file, files that have already been processed are skipped.
+            # NOTE: changing this to logger.debug causes too much noise in unit tests.
+            urls = [url for url in urls if not get_processed_file_record(session, url)]
+        # The files are downloaded in the background, and decoded by the grib workers, while the values of
+        # the files that have already been decoded are stored.
+        pipeline = DownloadPipeline('REDIS_CACHE_NOAA', self.model_type.value, 'REDIS_NOAA_CACHE_EXPIRY',
+                                    message_filter=self.message_filter)
+        with tempfile.TemporaryDirectory() as path:
+            downloads = self.downloaded_files(pipeline, pipeline.download(urls, path, remove_processed=False))
+            for downloaded, extracted, exception in self.grib_worker_pool.extract(downloads):
+                try:
+                    if exception is not None:
+                        raise exception
+                    with app.db.database.get_write_session_scope() as session:
+                        self.grib_processor.store_station_values(extracted, session)
+                        # Flag the file as processed
+                        flag_file_as_processed(downloaded.url, session)
+                    self.files_processed += 1
+                except Exception as exception:
+                    self.exception_count += 1
+                    # We catch and log exceptions, but keep trying to process.
+                    # We intentionally catch a broad exception, as we want to try and process as much
+                    # as we can.
+                    logger.error('unexpected exception processing %s',
+                                 downloaded.url, exc_info=exception)
+                finally:
+                    pipeline.remove(downloaded.filename)
+
+    def downloaded_files(self, pipeline: DownloadPipeline, downloads: Iterable[DownloadedFile]) \
+            -> Iterator[Tuple[DownloadedFile, str, ModelRunInfo]]:
+        """ Yield (download, filename, model info) for each file that was downloaded ok. """
+        for downloaded in downloads:
+            if downloaded.exception is not None:
+                self.exception_count += 1
+                # We log failed downloads, but keep trying to download the rest.
+                logger.error('unexpected exception downloading %s', downloaded.url, exc_info=downloaded.exception)
+                continue
+            if downloaded.filename is None:
+                # The file doesn't exist (yet).
+                continue
+            self.files_downloaded += 1
             try:
-                with app.db.database.get_write_session_scope() as session:
-                    # check the database for a record of this file:
-                    processed_file_record = get_processed_file_record(session, url)
-                    if processed_file_record:
-                        # This file has already been processed - so we skip it.
-                        # NOTE: changing this to logger.debug causes too much noise in unit tests.
-                        logger.debug('file already processed %s', url)
-                    else:
-                        model_run_timestamp, prediction_timestamp = parse_url_for_timestamps(url, self.model_type)
-                        model_info = ModelRunInfo(self.model_type, self.projection,
-                                                  model_run_timestamp, prediction_timestamp)
-                        # download the file:
-                        with tempfile.TemporaryDirectory() as temporary_path:
-                            downloaded = download(url, temporary_path,
-                                                  'REDIS_CACHE_NOAA', self.model_type.value,
-                                                  'REDIS_NOAA_CACHE_EXPIRY')
-                            if downloaded:
-                                self.files_downloaded += 1
-                                # If we've downloaded the file ok, we can now process it.
-                                try:
-                                    self.grib_processor.process_grib_file(
-                                        downloaded, model_info, session)
-                                    # Flag the file as processed
-                                    flag_file_as_processed(url, session)
-                                    self.files_processed += 1
-                                finally:
-                                    # delete the file when done.
-                                    os.remove(downloaded)
+                model_run_timestamp, prediction_timestamp = parse_url_for_timestamps(downloaded.url, self.model_type)
+                model_info = ModelRunInfo(self.model_type, self.projection,
+                                          model_run_timestamp, prediction_timestamp)
             except Exception as exception:
                 self.exception_count += 1
-                # We catch and log exceptions, but keep trying to download.
-                # We intentionally catch a broad exception, as we want to try and download as much
-                # as we can.
-                logger.error('unexpected exception processing %s',
-                             url, exc_info=exception)
+                logger.error('unexpected exception processing %s', downloaded.url, exc_info=exception)
+                pipeline.remove(downloaded.filename)
+                continue
+            yield downloaded, downloaded.filename, model_info
 
     def process_model_run(self, model_run_hour):
         """ Process a particular model run """
@@ -349,16 +397,20 @@ class NOAA():
 
     def process(self):
         """ Entry point for downloading and processing weather model grib files """
-        for hour in get_gfs_and_nam_model_run_hours():
-            try:
-                self.process_model_run(hour)
-            except Exception as exception:
-                # We catch and log exceptions, but keep trying to process.
-                # We intentionally catch a broad exception, as we want to try to process as much as we can.
-                self.exception_count += 1
-                logger.error(
-                    'unexpected exception processing %s model run %s',
-                    self.model_type, hour, exc_info=exception)
+        try:
+            for hour in get_gfs_and_nam_model_run_hours():
+                try:
+                    self.process_model_run(hour)
+                except Exception as exception:
+                    # We catch and log exceptions, but keep trying to process.
+                    # We intentionally catch a broad exception, as we want to try to process as much as we can.
+                    self.exception_count += 1
+                    logger.error(
+                        'unexpected exception processing %s model run %s',
+                        self.model_type, hour, exc_info=exception)
+        finally:
+            self.grib_worker_pool.shutdown()
+            self.grib_worker_pool.log_throughput()
 
 
 def process_models(station_source: StationSourceEnum = StationSourceEnum.UNSPECIFIED):
@@ -397,6 +449,7 @@ def process_models(station_source: StationSourceEnum = StationSourceEnum.UNSPECI
 def main():
     """ main script - process and download models, then do exception handling """
     try:
+        create_prediction_partitions()
         process_models()
         apply_data_retention_policy()
     except CompletedWithSomeExceptions:
@@ -18,6 +18,7 @@ from app.rocketchat_notifications import send_rocketchat_notification
 from app.routers import (fba, forecasts, weather_models, c_haines, stations, hfi_calc,
                          fba_calc, sfms, morecast_v2)
 from app.fire_behaviour.cffdrs import CFFDRS
+from app.fire_behaviour.r_worker_pool import RWorkerPool
 
 
 configure_logging()
@@ -101,6 +102,12 @@ api.add_middleware(
 )
 api.middleware('http')(catch_exception_middleware)
 
+
+@api.on_event('shutdown')
+def shutdown_r_worker_pool():
+    """ Stop any R worker processes along with the api. """
+    RWorkerPool.instance().shutdown()
+
 api.include_router(forecasts.router, tags=["Forecasts"])
 api.include_router(weather_models.router, tags=["Weather Models"])
 api.include_router(c_haines.router, tags=["C Haines"])
@@ -137,6 +144,11 @@ async def get_health():
         if delta > 0.1:
             logger.info('%f seconds added by CFFDRS startup', delta)
 
+        # Make sure the R worker processes (if any) are able to do their job.
+        if not await RWorkerPool.instance().health_check():
+            health_check['healthy'] = False
+            health_check['message'] = f"{health_check.get('message')} R worker pool is unhealthy."
+
         return health_check
     except Exception as exception:
         logger.error(exception, exc_info=True)
@@ -2,6 +2,7 @@
 from datetime import datetime, time
 from urllib.parse import urljoin
 from app import config
+import numpy as np
 
 from aiohttp import ClientSession
 from collections import defaultdict
@@ -11,6 +12,7 @@ from typing import List, Optional, Tuple
 from sqlalchemy.orm import Session
 from app.db.crud.morecast_v2 import get_forecasts_in_range
 from app.db.models.morecast_v2 import MorecastForecastRecord
+from app.fire_behaviour.fwi import calculate_daily_fwi
 from app.schemas.morecast_v2 import MoreCastForecastOutput, StationDailyFromWF1, WF1ForecastRecordType, WF1PostForecast, WeatherIndeterminate
 from app.wildfire_one.schema_parsers import WFWXWeatherStation
 from app.wildfire_one.wfwx_api import get_auth_header, get_forecasts_for_stations_by_date_range, get_wfwx_stations_from_station_codes
@@ -107,3 +109,61 @@ def wf1_forecast_diff(start_date_of_interest: datetime, end_date_of_interest: da
 
     missing_dates.sort()
     return missing_dates[0], missing_dates[-1]
+
+
+def calculate_forecast_fwi_indices(actuals: List[WeatherIndeterminate],
+                                   forecasts: List[WeatherIndeterminate],
+                                   wfwx_stations: List[WFWXWeatherStation]) -> List[WeatherIndeterminate]:
+    """ Calculate the FWI System codes and indices for each station's forecasts, starting from the
+    codes of the last actual before the first forecast and carrying them forward day by day. All the
+    stations are calculated together, as a station x day matrix. Forecasts for stations without a
+    preceding actual are left without indices. """
+    latitude_by_station_code = {station.code: station.lat for station in wfwx_stations}
+    forecasts_by_station_code = defaultdict(list)
+    for forecast in sorted(forecasts, key=lambda forecast: forecast.utc_timestamp):
+        forecasts_by_station_code[forecast.station_code].append(forecast)
+
+    station_forecasts: List[List[WeatherIndeterminate]] = []
+    starting_actuals: List[WeatherIndeterminate] = []
+    for station_code, station_forecast in forecasts_by_station_code.items():
+        previous_actuals = [actual for actual in actuals if actual.station_code == station_code
+                            and actual.utc_timestamp < station_forecast[0].utc_timestamp]
+        if station_code not in latitude_by_station_code or len(previous_actuals) == 0:
+            continue
+        station_forecasts.append(station_forecast)
+        starting_actuals.append(max(previous_actuals, key=lambda actual: actual.utc_timestamp))
+    if len(station_forecasts) == 0:
+        return forecasts
+
+    # Stations with fewer forecast days are padded with NaN.
+    days = max(len(station_forecast) for station_forecast in station_forecasts)
+    shape = (len(station_forecasts), days)
+    temp, rh, wind_speed, precip, month = (np.full(shape, np.nan) for _ in range(5))
+    for row, station_forecast in enumerate(station_forecasts):
+        for column, forecast in enumerate(station_forecast):
+            temp[row, column] = np.nan if forecast.temperature is None else forecast.temperature
+            rh[row, column] = np.nan if forecast.relative_humidity is None else forecast.relative_humidity
+            wind_speed[row, column] = np.nan if forecast.wind_speed is None else forecast.wind_speed
+            precip[row, column] = np.nan if forecast.precipitation is None else forecast.precipitation
+            month[row, column] = forecast.utc_timestamp.month
+
+    indices = calculate_daily_fwi([actual.fine_fuel_moisture_code for actual in starting_actuals],
+                                  [actual.duff_moisture_code for actual in starting_actuals],
+                                  [actual.drought_code for actual in starting_actuals],
+                                  temp, rh, wind_speed, precip,
+                                  [latitude_by_station_code[station_forecast[0].station_code]
+                                   for station_forecast in station_forecasts],
+                                  month)
+
+    def as_optional(value: float) -> Optional[float]:
+        return None if np.isnan(value) else float(value)
+
+    for row, station_forecast in enumerate(station_forecasts):
+        for column, forecast in enumerate(station_forecast):
+            forecast.fine_fuel_moisture_code = as_optional(indices.ffmc[row, column])
+            forecast.duff_moisture_code = as_optional(indices.dmc[row, column])
+            forecast.drought_code = as_optional(indices.dc[row, column])
+            forecast.initial_spread_index = as_optional(indices.isi[row, column])
+            forecast.build_up_index = as_optional(indices.bui[row, column])
+            forecast.fire_weather_index = as_optional(indices.fwi[row, column])
+    return forecasts
@@ -1,22 +1,30 @@
 """ Routers for Fire Behaviour Advisory Calculator """
 
 import logging
+import math
 from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import numpy as np
 from aiohttp.client import ClientSession
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, status
 from app.auth import authentication_required, audit
-from app.fire_behaviour.advisory import (FBACalculatorWeatherStation, FireBehaviourAdvisory,
-                                         calculate_fire_behaviour_advisory)
+from app.fire_behaviour.advisory import (FBACalculatorWeatherStation, FireBehaviourAdvisory, FireBehaviourSweep,
+                                         calculate_fire_behaviour_advisory,
+                                         calculate_fire_behaviour_advisories,
+                                         calculate_fire_behaviour_sweep)
 from app.hourlies import get_hourly_readings_in_time_interval
-from app.schemas.fba_calc import (StationListRequest, StationRequest,
-                                  StationsListResponse, StationResponse)
+from app.schemas.fba_calc import (SensitivitySweepRequest, SensitivitySweepResponse, SensitivitySweepStationResponse,
+                                  StationListRequest, StationRequest, StationsListResponse, StationResponse,
+                                  SweepParameterEnum)
 from app.fire_behaviour import cffdrs
+from app.fire_behaviour.fwi import fine_fuel_moisture_code, fire_weather_index, initial_spread_index
+from app.fire_behaviour.r_worker_pool import RWorkerPool
 from app.utils.time import get_hour_20_from_date
 from app.wildfire_one.schema_parsers import WFWXWeatherStation
 from app.wildfire_one.wfwx_api import (get_auth_header,
                                        get_dailies_generator,
                                        get_wfwx_stations_from_station_codes)
-from app.fire_behaviour.prediction import build_hourly_rh_dict
+from app.fire_behaviour.prediction import build_hourly_rh_dict, get_fire_type
 
 
 router = APIRouter(
@@ -26,6 +34,9 @@ router = APIRouter(
 
 logger = logging.getLogger(__name__)
 
+# Upper limit on the number of wind speed and swept value combinations in a sensitivity sweep.
+MAX_SWEEP_SCENARIOS = 2500
+
 
 def prepare_response(
         requested_station: StationRequest,
@@ -86,15 +97,47 @@ def prepare_response(
     return station_response
 
 
-async def process_request(
+def calculate_wind_speed_adjusted_indices(
+        requested_stations: List[StationRequest],
+        wfwx_station_lookup: Dict[int, WFWXWeatherStation],
+        dailies_by_station_id: dict,
+        yesterday_dailies_by_station_id: dict
+) -> Dict[int, Tuple[float, float, float]]:
+    """ Re-calculate FFMC, ISI & FWI for every requested station that has a user-defined wind speed,
+    in one pass over all the stations. Returns (ffmc, isi, fwi) keyed on the index of the station in
+    the request. Values that can't be calculated are NaN. """
+    indices = [index for index, requested_station in enumerate(requested_stations)
+               if requested_station.wind_speed is not None and
+               wfwx_station_lookup[requested_station.station_code].wfwx_id in dailies_by_station_id]
+    if not indices:
+        return {}
+    wfwx_ids = [wfwx_station_lookup[requested_stations[index].station_code].wfwx_id for index in indices]
+    raw_dailies = [dailies_by_station_id[wfwx_id] for wfwx_id in wfwx_ids]
+    yesterday_ffmc = [yesterday_dailies_by_station_id.get(wfwx_id, {}).get('fineFuelMoistureCode', None)
+                      for wfwx_id in wfwx_ids]
+    wind_speed = [requested_stations[index].wind_speed for index in indices]
+
+    ffmc = fine_fuel_moisture_code(
+        yesterday_ffmc,
+        [raw_daily.get('temperature', None) for raw_daily in raw_dailies],
+        [raw_daily.get('relativeHumidity', None) for raw_daily in raw_dailies],
+        wind_speed,
+        [raw_daily.get('precipitation', None) for raw_daily in raw_dailies])
+    isi = initial_spread_index(ffmc, wind_speed)
+    fwi = fire_weather_index(isi, [raw_daily.get('buildUpIndex', None) for raw_daily in raw_dailies])
+    return {index: (float(ffmc[i]), float(isi[i]), float(fwi[i])) for i, index in enumerate(indices)}
+
+
+def prepare_fba_station(
         dailies_by_station_id: dict,
         yesterday_dailies_by_station_id: dict,
         hourly_observations_by_station_id: dict,
         wfwx_station: WFWXWeatherStation,
         requested_station: StationRequest,
-        time_of_interest: datetime
-) -> StationResponse:
-    """ Process a valid request """
+        time_of_interest: datetime,
+        wind_speed_adjusted_indices: Optional[Tuple[float, float, float]] = None
+) -> FBACalculatorWeatherStation:
+    """ Prepare the inputs for the fire behaviour advisory calculation of a valid request """
 
     raw_daily = dailies_by_station_id[wfwx_station.wfwx_id]
     raw_observations = hourly_observations_by_station_id[wfwx_station.code]
@@ -121,14 +164,17 @@ async def process_request(
         wind_speed = requested_station.wind_speed
         status = 'ADJUSTED'
 
-        ffmc = cffdrs.fine_fuel_moisture_code(
-            yesterday.get('fineFuelMoistureCode', None),
-            temperature,
-            relative_humidity,
-            precipitation,
-            wind_speed)
-        isi = cffdrs.initial_spread_index(ffmc, wind_speed)
-        fwi = cffdrs.fire_weather_index(isi, bui)
+        if wind_speed_adjusted_indices is None:
+            wind_speed_adjusted_indices = calculate_wind_speed_adjusted_indices(
+                [requested_station],
+                {wfwx_station.code: wfwx_station},
+                dailies_by_station_id,
+                yesterday_dailies_by_station_id)[0]
+        ffmc, isi, fwi = wind_speed_adjusted_indices
+        if math.isnan(ffmc):
+            raise cffdrs.CFFDRSException("Failed to calculate ffmc")
+        if math.isnan(fwi):
+            raise cffdrs.CFFDRSException("Failed to calculate fwi")
 
     # Prepare the inputs for the fire behaviour advisory calculation.
     # This is a combination of inputs from the front end, information about the station from wf1
@@ -156,13 +202,25 @@ async def process_request(
         relative_humidity=relative_humidity,
         precipitation=precipitation,
         last_observed_morning_rh_values=last_observed_morning_rh_values)
+    return fba_station
 
-    # Calculate the fire behaviour advisory.
-    fire_behaviour_advisory = calculate_fire_behaviour_advisory(fba_station)
 
-    # Prepare the response
-    return prepare_response(
-        requested_station, wfwx_station, fba_station, raw_daily, fire_behaviour_advisory)
+def calculate_advisories(fba_stations: List[FBACalculatorWeatherStation]) -> List[Optional[FireBehaviourAdvisory]]:
+    """ Calculate the fire behaviour advisories for all the stations at once, falling back to
+    calculating them one station at a time if the batch fails as a whole. """
+    try:
+        return calculate_fire_behaviour_advisories(fba_stations)
+    except Exception as exception:
+        logger.critical(exception, exc_info=True)
+    advisories: List[Optional[FireBehaviourAdvisory]] = []
+    for fba_station in fba_stations:
+        try:
+            advisories.append(calculate_fire_behaviour_advisory(fba_station))
+        except Exception as exception:
+            logger.error('fba station: %s', fba_station)
+            logger.critical(exception, exc_info=True)
+            advisories.append(None)
+    return advisories
 
 
 def process_request_without_observation(requested_station: StationRequest,
@@ -231,22 +289,31 @@ async def get_stations_data(
         # TODO: this is a bit silly, the call to get_wfwx_stations_from_station_codes repeats a lot of this!
         wfwx_station_lookup = {wfwx_station.code: wfwx_station for wfwx_station in wfwx_stations}
 
-        stations_response = []
+        # re-calculate the indices affected by a user specified wind speed for all the stations at once
+        wind_speed_adjusted_indices = calculate_wind_speed_adjusted_indices(
+            request.stations, wfwx_station_lookup, dailies_by_station_id, yesterday_dailies_by_station_id)
+
+        stations_response: List[Optional[StationResponse]] = []
+        # the stations for which we can calculate an advisory, along with their position in the response
+        valid_stations: List[Tuple[int, StationRequest, WFWXWeatherStation, FBACalculatorWeatherStation]] = []
         # for each station code in our station list.
-        for requested_station in request.stations:
+        for index, requested_station in enumerate(request.stations):
             # get the wfwx station
             wfwx_station = wfwx_station_lookup[requested_station.station_code]
+            station_response = None
             # get the raw daily response from wf1.
             if wfwx_station.wfwx_id in dailies_by_station_id and\
                     requested_station.station_code in hourly_obs_by_station_code:
                 try:
-                    station_response = await process_request(
+                    fba_station = prepare_fba_station(
                         dailies_by_station_id,
                         yesterday_dailies_by_station_id,
                         hourly_obs_by_station_code,
                         wfwx_station,
                         requested_station,
-                        time_of_interest)
+                        time_of_interest,
+                        wind_speed_adjusted_indices.get(index))
+                    valid_stations.append((index, requested_station, wfwx_station, fba_station))
                 except Exception as exception:
                     # If something goes wrong processing the request, then we return this station
                     # with an error response.
@@ -260,11 +327,151 @@ async def get_stations_data(
                 station_response = process_request_without_observation(
                     requested_station, wfwx_station, request.date, 'N/A')
 
-            # Add the response to our list of responses
+            # Add the response to our list of responses (stations with a valid request are filled in below)
             stations_response.append(station_response)
 
+        # Calculate the fire behaviour advisory for all the valid stations in one go.
+        advisories = await RWorkerPool.instance().submit(
+            calculate_advisories, [fba_station for _, _, _, fba_station in valid_stations])
+        for (index, requested_station, wfwx_station, fba_station), advisory in zip(valid_stations, advisories):
+            if advisory is None:
+                logger.error('request object: %s', request.__str__())
+                stations_response[index] = process_request_without_observation(
+                    requested_station, wfwx_station, request.date, 'ERROR')
+            else:
+                stations_response[index] = prepare_response(
+                    requested_station, wfwx_station, fba_station,
+                    dailies_by_station_id[wfwx_station.wfwx_id], advisory)
+
         return StationsListResponse(date=request.date, stations=stations_response)
     except Exception as exception:
         logger.error('request object: %s', request.__str__())
         logger.critical(exception, exc_info=True)
         raise
+
+
+def prepare_sweep_station(raw_daily: dict,
+                          yesterday: dict,
+                          wfwx_station: WFWXWeatherStation,
+                          requested_station: StationRequest,
+                          time_of_interest: datetime) -> FBACalculatorWeatherStation:
+    """ Prepare the inputs for a sensitivity sweep. The swept values take the place of the wind speed,
+    FFMC, ISI and grass cure, so those are left as reported by wf1. """
+    return FBACalculatorWeatherStation(
+        elevation=wfwx_station.elevation,
+        fuel_type=requested_station.fuel_type,
+        status=raw_daily.get('recordType').get('id'),
+        time_of_interest=time_of_interest,
+        percentage_conifer=requested_station.percentage_conifer,
+        percentage_dead_balsam_fir=requested_station.percentage_dead_balsam_fir,
+        grass_cure=requested_station.grass_cure,
+        crown_base_height=requested_station.crown_base_height,
+        crown_fuel_load=requested_station.crown_fuel_load,
+        lat=wfwx_station.lat,
+        long=wfwx_station.long,
+        bui=raw_daily.get('buildUpIndex', None),
+        ffmc=raw_daily.get('fineFuelMoistureCode', None),
+        isi=raw_daily.get('initialSpreadIndex', None),
+        fwi=raw_daily.get('fireWeatherIndex', None),
+        prev_day_daily_ffmc=yesterday.get('fineFuelMoistureCode', None),
+        wind_speed=raw_daily.get('windSpeed', None),
+        wind_direction=raw_daily.get('windDirection', None),
+        temperature=raw_daily.get('temperature', None),
+        relative_humidity=raw_daily.get('relativeHumidity', None),
+        precipitation=raw_daily.get('precipitation', None),
+        last_observed_morning_rh_values={})
+
+
+def calculate_sweep(request: SensitivitySweepRequest,
+                    fba_stations: List[FBACalculatorWeatherStation]) -> FireBehaviourSweep:
+    """ Calculate the fire behaviour of the stations for every combination of wind speed and swept value.
+
+    When sweeping FFMC, the FFMC is taken as given. When sweeping grass cure, the FFMC is re-calculated
+    for each wind speed, as is done when a wind speed is specified for a station on /fba-calc/stations.
+    """
+    wind_speed = np.reshape(request.wind_speeds, (1, -1, 1))
+    values = np.reshape(request.values, (1, 1, -1))
+
+    def column(name: str) -> np.ndarray:
+        return np.reshape([getattr(fba_station, name) for fba_station in fba_stations], (-1, 1, 1))
+
+    if request.parameter == SweepParameterEnum.FFMC:
+        ffmc = values
+        grass_cure = column('grass_cure')
+    else:
+        ffmc = fine_fuel_moisture_code(column('prev_day_daily_ffmc'), column('temperature'),
+                                       column('relative_humidity'), wind_speed, column('precipitation'))
+        grass_cure = values
+    return calculate_fire_behaviour_sweep(fba_stations, wind_speed, ffmc, grass_cure)
+
+
+def _matrix(values: np.ndarray) -> List[List[Optional[float]]]:
+    """ Turn a wind speed x swept value array into nested lists, with NaN mapped to None. """
+    return [[None if math.isnan(value) else float(value) for value in row] for row in values]
+
+
+@router.post('/sensitivity', response_model=SensitivitySweepResponse)
+async def get_sensitivity_sweep(
+        request: SensitivitySweepRequest,
+        _=Depends(authentication_required)
+):
+    """ Returns per-station HFI, ROS and fire type for every combination of the requested wind speeds and
+    FFMC (or grass cure) values. """
+    logger.info('/fba-calc/sensitivity')
+    if len(request.wind_speeds) * len(request.values) > MAX_SWEEP_SCENARIOS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f'Sweep is limited to {MAX_SWEEP_SCENARIOS} scenarios per station')
+    try:
+        unique_station_codes = list(dict.fromkeys(station.station_code for station in request.stations))
+        time_of_interest = get_hour_20_from_date(request.date)
+        prev_day = time_of_interest - timedelta(days=1)
+
+        async with ClientSession() as session:
+            header = await get_auth_header(session)
+            wfwx_stations = await get_wfwx_stations_from_station_codes(session, header, unique_station_codes)
+            dailies = await get_dailies_generator(session, header, wfwx_stations, time_of_interest, time_of_interest)
+            dailies_by_station_id = {raw_daily.get('stationId'): raw_daily async for raw_daily in dailies}
+            yesterday_response = await get_dailies_generator(session, header, wfwx_stations, prev_day, prev_day)
+            yesterday_dailies_by_station_id = {raw_daily.get('stationId'):
+                                               raw_daily async for raw_daily in yesterday_response}
+
+        wfwx_station_lookup = {wfwx_station.code: wfwx_station for wfwx_station in wfwx_stations}
+
+        def station_response(requested_station: StationRequest, station_status: str):
+            return SensitivitySweepStationResponse(
+                id=requested_station.id,
+                station_code=requested_station.station_code,
+                station_name=wfwx_station_lookup[requested_station.station_code].name,
+                fuel_type=requested_station.fuel_type,
+                status=station_status)
+
+        stations_response: List[SensitivitySweepStationResponse] = []
+        # the stations for which we can calculate a sweep, along with their response
+        valid_stations: List[Tuple[SensitivitySweepStationResponse, FBACalculatorWeatherStation]] = []
+        for requested_station in request.stations:
+            wfwx_station = wfwx_station_lookup[requested_station.station_code]
+            response = station_response(requested_station, 'N/A')
+            if wfwx_station.wfwx_id in dailies_by_station_id:
+                fba_station = prepare_sweep_station(dailies_by_station_id[wfwx_station.wfwx_id],
+                                                    yesterday_dailies_by_station_id.get(wfwx_station.wfwx_id, {}),
+                                                    wfwx_station, requested_station, time_of_interest)
+                response.status = fba_station.status
+                valid_stations.append((response, fba_station))
+            stations_response.append(response)
+
+        # Calculate every scenario, for all the stations, in one go.
+        sweep = await RWorkerPool.instance().submit(
+            calculate_sweep, request, [fba_station for _, fba_station in valid_stations])
+        for index, (response, fba_station) in enumerate(valid_stations):
+            response.head_fire_intensity = _matrix(sweep.hfi[index])
+            response.rate_of_spread = _matrix(sweep.ros[index])
+            response.fire_type = [[None if math.isnan(cfb) else get_fire_type(fba_station.fuel_type, cfb)
+                                   for cfb in row] for row in sweep.cfb[index]]
+
+        return SensitivitySweepResponse(date=request.date, wind_speeds=request.wind_speeds,
+                                        parameter=request.parameter, values=request.values,
+                                        stations=stations_response)
+    except Exception as exception:
+        logger.error('request object: %s', request.__str__())
+        logger.critical(exception, exc_info=True)
+        raise
@@ -1,7 +1,7 @@
 """ Routes for Morecast v2 """
 import logging
 from aiohttp.client import ClientSession
-from app.morecast_v2.forecasts import format_as_wf1_post_forecasts, wf1_forecast_diff
+from app.morecast_v2.forecasts import calculate_forecast_fwi_indices, format_as_wf1_post_forecasts, wf1_forecast_diff
 from app.utils.time import vancouver_tz
 from typing import List
 from datetime import date, datetime, time, timedelta, timezone
@@ -203,6 +203,8 @@ async def get_determinates_for_date_range(start_date: date,
             forecasts_from_db, wfwx_stations)
         wf1_forecasts.extend(transformed_forecasts)
 
+    wf1_forecasts = calculate_forecast_fwi_indices(wf1_actuals, wf1_forecasts, wfwx_stations)
+
     return IndeterminateDailiesResponse(
         actuals=wf1_actuals,
         predictions=predictions,
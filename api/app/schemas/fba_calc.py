@@ -1,5 +1,6 @@
 """ This module contains pydantic models related to Fire Behaviour Advisory Calculator. """
 
+from enum import Enum
 from typing import List, Optional
 from datetime import date
 from pydantic import BaseModel
@@ -71,3 +72,41 @@ class StationsListResponse(BaseModel):
     """ Response for all weather stations, in a list """
     date: date
     stations: List[StationResponse]
+
+
+class SweepParameterEnum(str, Enum):
+    """ Parameter swept against wind speed in a sensitivity sweep. """
+    FFMC = 'ffmc'
+    GRASS_CURE = 'grass_cure'
+
+
+class SensitivitySweepRequest(BaseModel):
+    """ Request for the fire behaviour of a list of stations over every combination of wind speed
+    and the swept parameter (FFMC or grass cure). Any wind speed set on a station is ignored. """
+    date: date
+    stations: List[StationRequest]
+    wind_speeds: List[float]
+    parameter: SweepParameterEnum
+    values: List[float]
+
+
+class SensitivitySweepStationResponse(BaseModel):
+    """ Sensitivity sweep for one individual weather station. Matrices are indexed by wind speed, then
+    by value of the swept parameter. """
+    id: Optional[int]
+    station_code: int
+    station_name: str
+    fuel_type: FuelTypeEnum
+    status: str
+    head_fire_intensity: Optional[List[List[Optional[float]]]]
+    rate_of_spread: Optional[List[List[Optional[float]]]]
+    fire_type: Optional[List[List[Optional[str]]]]
+
+
+class SensitivitySweepResponse(BaseModel):
+    """ Sensitivity sweep for all weather stations, in a list """
+    date: date
+    wind_speeds: List[float]
+    parameter: SweepParameterEnum
+    values: List[float]
+    stations: List[SensitivitySweepStationResponse]
@@ -49,18 +49,27 @@ class MockClientSession:
 class MockResponse:
     """ Stubbed response object. """
 
-    def __init__(self, text: str = None, json: dict = None, status_code=200, content=None):
+    def __init__(self, text: str = None, json: dict = None, status_code=200, content=None, headers=None):
         """ Initialize client response """
 
         self.text = text
         self.content = content
         self._json = json
         self.status_code = status_code
+        self.headers = {} if headers is None else headers
 
     def json(self) -> dict:
         """ Return json response """
         return self._json
 
+    def iter_content(self, chunk_size=1):
+        """ Return the content in chunks """
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        """ Release the connection """
+
 
 class MockAsyncResponse:
     """ Stubbed async response object.
@@ -1,4 +1,5 @@
 """ Global fixtures """
+import asyncio
 from datetime import timezone, datetime
 import logging
 from typing import Optional
@@ -22,6 +23,9 @@ import app.weather_models.process_grib
 from app.schemas.shared import WeatherDataRequest
 import app.wildfire_one.wildfire_fetchers
 import app.utils.redis
+from app.fire_behaviour.prediction_cache import FireBehaviourPredictionCache
+from app.weather_models.station_grid_index import StationGridIndex
+from app.jobs.grib_cache import GribCache
 from app.tests import load_json_file
 
 logger = logging.getLogger(__name__)
@@ -33,6 +37,21 @@ def anyio_backend():
     return 'asyncio'
 
 
+@pytest.fixture
+def new_singleton_instance():
+    """ Creates instances of singletons that aren't the shared instance, so that each test gets its own """
+    return lambda singleton: singleton._decorated()
+
+
+@pytest.fixture
+def run_until_complete():
+    """ Runs coroutines to completion on an event loop of their own, so that (unlike asyncio.run) the current
+    event loop is left alone for the tests that follow """
+    loop = asyncio.new_event_loop()
+    yield loop.run_until_complete
+    loop.close()
+
+
 @pytest.fixture(autouse=True)
 def mock_env(monkeypatch):
     """ Automatically mock environment variable """
@@ -105,6 +124,24 @@ def mock_redis(monkeypatch):
     monkeypatch.setattr(app.utils.redis, '_create_redis', create_mock_redis)
 
 
+@pytest.fixture(autouse=True)
+def clear_fire_behaviour_prediction_cache():
+    """ Don't let cached fire behaviour predictions leak from one test into another """
+    FireBehaviourPredictionCache.instance().clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_station_grid_index():
+    """ Don't let the location of stations in model grids leak from one test into another """
+    StationGridIndex.instance().clear()
+
+
+@pytest.fixture(autouse=True)
+def grib_cache_path(monkeypatch, tmp_path):
+    """ Don't let downloaded grib files leak from one test into another """
+    monkeypatch.setattr(GribCache.instance(), 'path', str(tmp_path / 'grib_cache'))
+
+
 @pytest.fixture(autouse=True)
 def mock_get_now(monkeypatch):
     """ Patch all calls to app.util.time: get_utc_now and get_pst_now  """
@@ -0,0 +1,79 @@
+""" Unit tests for calculating fire behaviour rasters """
+import numpy as np
+import pytest
+from osgeo import gdal, osr
+from app.auto_spatial_advisory.fire_behaviour_raster import (NODATA, SFMS_FUEL_TYPES,
+                                                             calculate_fire_behaviour_raster,
+                                                             calculate_fire_behaviour_window)
+from app.fire_behaviour import fbp
+from app.fire_behaviour.fuel_types import FUEL_TYPE_DEFAULTS, FuelTypeEnum
+from app.geospatial import NAD83_BC_ALBERS
+
+# The values of the SFMS fuel type raster: C-2, C-3, M-1/M-2, D-1/D-2, S-1, O-1a/O-1b, water and non fuel
+FUEL_TYPE_CODES = np.array([[2, 3, 14, 8], [9, 12, 102, 99]])
+
+
+def test_sfms_fuel_types():
+    """ The fuel types are those of the SFMS lookup table, non fuel and water have none """
+    assert SFMS_FUEL_TYPES[1] == FuelTypeEnum.C1
+    assert SFMS_FUEL_TYPES[7] == FuelTypeEnum.C7
+    assert SFMS_FUEL_TYPES[8] == FuelTypeEnum.D1
+    assert [SFMS_FUEL_TYPES[code] for code in (9, 10, 11)] == [FuelTypeEnum.S1, FuelTypeEnum.S2, FuelTypeEnum.S3]
+    assert SFMS_FUEL_TYPES[12] == FuelTypeEnum.O1A
+    assert SFMS_FUEL_TYPES[14] == FuelTypeEnum.M1
+    assert 99 not in SFMS_FUEL_TYPES
+    assert 102 not in SFMS_FUEL_TYPES
+
+
+def test_window_matches_fbp():
+    """ Each pixel gets the same fire behaviour as calculating it for a single station """
+    bui, ffmc, wind_speed, fmc, grass_cure = 80.0, 92.0, 20.0, 95.0, 60.0
+    result = calculate_fire_behaviour_window(FUEL_TYPE_CODES, bui, ffmc, wind_speed, fmc, grass_cure)
+    isi = fbp.initial_spread_index(ffmc, wind_speed)
+    for (row, column), fuel_type in zip(((0, 0), (0, 1), (0, 2), (0, 3), (1, 0), (1, 1)),
+                                        (FuelTypeEnum.C2, FuelTypeEnum.C3, FuelTypeEnum.M1, FuelTypeEnum.D1,
+                                         FuelTypeEnum.S1, FuelTypeEnum.O1A)):
+        defaults = FUEL_TYPE_DEFAULTS[fuel_type]
+        expected = fbp.calculate_fire_behaviour(fuel_type, isi, bui, ffmc, wind_speed, fmc, defaults['PC'],
+                                                grass_cure, defaults['PDF'], defaults['CBH'], defaults['CFL'])
+        assert result.hfi[row, column] == pytest.approx(expected.hfi, rel=1e-5)
+        assert result.ros[row, column] == pytest.approx(expected.ros, rel=1e-5)
+        assert result.cfb[row, column] == pytest.approx(expected.cfb, rel=1e-5)
+    assert result.hfi[1, 2] == NODATA
+    assert result.hfi[1, 3] == NODATA
+
+
+def test_missing_weather():
+    """ Pixels without weather have no fire behaviour """
+    bui = np.array([[80.0, np.nan, 80.0, 80.0], [80.0, 80.0, 80.0, 80.0]])
+    result = calculate_fire_behaviour_window(FUEL_TYPE_CODES, bui, 92.0, 20.0, 95.0, 60.0)
+    assert result.hfi[0, 1] == NODATA
+    assert result.hfi[0, 0] > 0
+
+
+def _create_raster(path: str, values: np.ndarray, pixel_size: float):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(NAD83_BC_ALBERS)
+    dataset = gdal.GetDriverByName('GTiff').Create(path, values.shape[1], values.shape[0], 1, gdal.GDT_Float32)
+    dataset.SetGeoTransform((1200000, pixel_size, 0, 700000, 0, -pixel_size))
+    dataset.SetProjection(srs.ExportToWkt())
+    dataset.GetRasterBand(1).WriteArray(values)
+    dataset.FlushCache()
+
+
+def test_raster_in_windows():
+    """ The raster is processed in windows, with weather on a coarser grid warped to the fuel type grid """
+    fuel_type_codes = np.tile(FUEL_TYPE_CODES, (4, 2))
+    _create_raster('/vsimem/fuel.tif', fuel_type_codes.astype(float), 2000)
+    for name, value in (('bui', 80), ('ffmc', 92), ('wind_speed', 20)):
+        _create_raster(f'/vsimem/{name}.tif', np.full((4, 5), value, dtype=float), 4000)
+    calculate_fire_behaviour_raster('/vsimem/fuel.tif', '/vsimem/bui.tif', '/vsimem/ffmc.tif',
+                                    '/vsimem/wind_speed.tif', '/vsimem/hfi.tif', day_of_year=200, grass_cure=60,
+                                    block_size=4)
+    hfi = gdal.Open('/vsimem/hfi.tif').GetRasterBand(1).ReadAsArray()
+    assert hfi.shape == fuel_type_codes.shape
+    # the same fuel type, with the same weather, has the same HFI in every window
+    c3_hfi = hfi[fuel_type_codes == 3]
+    assert np.all(c3_hfi > 0)
+    assert c3_hfi == pytest.approx(np.full(c3_hfi.shape, c3_hfi[0]), rel=1e-3)
+    assert np.all(hfi[fuel_type_codes == 102] == NODATA)
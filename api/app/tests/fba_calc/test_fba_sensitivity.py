@@ -0,0 +1,55 @@
+""" Unit tests for the fire behaviour advisory calculator sensitivity sweep. """
+from aiohttp import ClientSession
+from fastapi.testclient import TestClient
+import pytest
+import app.main
+from app.tests.common import default_mock_client_get
+
+HEADERS = {'Content-Type': 'application/json', 'Authorization': 'Bearer token'}
+
+
+def _request(parameter: str, values: list, wind_speeds=None) -> dict:
+    return {
+        'date': '2021-07-05',
+        'stations': [{'id': 0, 'station_code': 230, 'fuel_type': 'C1', 'crown_base_height': 2,
+                      'percentage_conifer': 100},
+                     {'id': 1, 'station_code': 230, 'fuel_type': 'O1A', 'grass_cure': 60}],
+        'wind_speeds': [0, 10, 20] if wind_speeds is None else wind_speeds,
+        'parameter': parameter,
+        'values': values}
+
+
+@pytest.mark.usefixtures('mock_jwt_decode')
+def test_ffmc_sweep(monkeypatch):
+    """ HFI increases with wind speed and FFMC """
+    monkeypatch.setattr(ClientSession, 'get', default_mock_client_get)
+    client = TestClient(app.main.app)
+    response = client.post('/api/fba-calc/sensitivity', headers=HEADERS, json=_request('ffmc', [85, 90, 95]))
+    assert response.status_code == 200
+    for station in response.json()['stations']:
+        hfi = station['head_fire_intensity']
+        assert len(hfi) == 3 and all(len(row) == 3 for row in hfi)
+        assert hfi[0][0] < hfi[0][2] < hfi[2][2]
+        assert len(station['fire_type']) == 3
+
+
+@pytest.mark.usefixtures('mock_jwt_decode')
+def test_grass_cure_sweep(monkeypatch):
+    """ Grass cure only affects grass fuel types """
+    monkeypatch.setattr(ClientSession, 'get', default_mock_client_get)
+    client = TestClient(app.main.app)
+    response = client.post('/api/fba-calc/sensitivity', headers=HEADERS, json=_request('grass_cure', [30, 90]))
+    assert response.status_code == 200
+    c1, o1a = response.json()['stations']
+    assert c1['head_fire_intensity'][1][0] == pytest.approx(c1['head_fire_intensity'][1][1])
+    assert o1a['head_fire_intensity'][1][0] < o1a['head_fire_intensity'][1][1]
+
+
+@pytest.mark.usefixtures('mock_jwt_decode')
+def test_sweep_too_large(monkeypatch):
+    """ Sweeps with too many scenarios are rejected """
+    monkeypatch.setattr(ClientSession, 'get', default_mock_client_get)
+    client = TestClient(app.main.app)
+    response = client.post('/api/fba-calc/sensitivity', headers=HEADERS,
+                           json=_request('ffmc', list(range(100)), wind_speeds=list(range(100))))
+    assert response.status_code == 400
@@ -0,0 +1 @@
+""" Fire behaviour tests """
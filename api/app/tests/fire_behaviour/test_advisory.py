@@ -0,0 +1,62 @@
+""" Tests for calculating many fire behaviour advisories at once """
+from datetime import date
+import numpy as np
+import pytest
+from app.fire_behaviour.advisory import (FBACalculatorWeatherStation, calculate_fire_behaviour_advisory,
+                                         calculate_fire_behaviour_advisories, calculate_fire_behaviour_sweep)
+from app.fire_behaviour.fuel_types import FuelTypeEnum
+from app.fire_behaviour.fwi import initial_spread_index
+
+MORNING_RH = {7.0: 80, 8.0: 70, 9.0: 60, 10.0: 50, 11.0: 40, 12.0: 35}
+
+
+def _station(fuel_type: FuelTypeEnum, pc=None, cc=None, cbh=None) -> FBACalculatorWeatherStation:
+    return FBACalculatorWeatherStation(
+        elevation=700, fuel_type=fuel_type, time_of_interest=date(2023, 7, 1), percentage_conifer=pc,
+        percentage_dead_balsam_fir=None, grass_cure=cc, crown_base_height=cbh, crown_fuel_load=None,
+        lat=52.3, long=-121.4, bui=80, ffmc=92, isi=12, fwi=30, wind_speed=20, wind_direction=180,
+        temperature=25, relative_humidity=30, precipitation=0, status='ACTUAL', prev_day_daily_ffmc=90,
+        last_observed_morning_rh_values=MORNING_RH)
+
+
+def test_batched_advisories_match_single():
+    """ Calculating advisories together gives the same result as calculating them one at a time """
+    stations = [_station(FuelTypeEnum.C2, pc=100, cbh=3),
+                _station(FuelTypeEnum.O1A, cc=60),
+                _station(FuelTypeEnum.C3, pc=100, cbh=8)]
+    for station, advisory in zip(stations, calculate_fire_behaviour_advisories(stations)):
+        expected = calculate_fire_behaviour_advisory(station)
+        assert advisory.hfi == pytest.approx(expected.hfi)
+        assert advisory.hfi_t == pytest.approx(expected.hfi_t)
+        assert advisory.sixty_minute_fire_size == pytest.approx(expected.sixty_minute_fire_size)
+        assert advisory.thirty_minute_fire_size == pytest.approx(expected.thirty_minute_fire_size)
+        assert advisory.fire_type == expected.fire_type
+        assert advisory.critical_hours_hfi_4000 == expected.critical_hours_hfi_4000
+
+
+def test_batched_advisory_missing_input():
+    """ A station that can't be calculated doesn't stop the others from being calculated """
+    advisories = calculate_fire_behaviour_advisories([_station(FuelTypeEnum.M1, cbh=6),
+                                                      _station(FuelTypeEnum.C2, pc=100, cbh=3)])
+    assert advisories[0] is None
+    assert advisories[1] is not None
+
+
+def test_sweep_matches_advisories():
+    """ Each scenario in a sweep has the same fire behaviour as an advisory calculated with those values """
+    stations = [_station(FuelTypeEnum.C2, pc=100, cbh=3), _station(FuelTypeEnum.O1A, cc=60)]
+    wind_speeds = [5, 20]
+    ffmcs = [88, 92]
+    sweep = calculate_fire_behaviour_sweep(stations, np.reshape(wind_speeds, (1, -1, 1)), np.reshape(ffmcs, (1, 1, -1)),
+                                           np.reshape([None, 60], (-1, 1, 1)))
+    assert sweep.hfi.shape == (2, 2, 2)
+    for wind_index, wind_speed in enumerate(wind_speeds):
+        for ffmc_index, ffmc in enumerate(ffmcs):
+            scenario_stations = [_station(FuelTypeEnum.C2, pc=100, cbh=3), _station(FuelTypeEnum.O1A, cc=60)]
+            for station in scenario_stations:
+                station.wind_speed = wind_speed
+                station.ffmc = ffmc
+                station.isi = float(initial_spread_index(ffmc, wind_speed))
+            for station_index, advisory in enumerate(calculate_fire_behaviour_advisories(scenario_stations)):
+                assert sweep.hfi[station_index, wind_index, ffmc_index] == pytest.approx(advisory.hfi)
+                assert sweep.ros[station_index, wind_index, ffmc_index] == pytest.approx(advisory.ros)
@@ -0,0 +1,70 @@
+""" Unit tests for the diurnal FFMC lookups and critical hours """
+import numpy as np
+import pytest
+from app.fire_behaviour.prediction import (FireBehaviourPredictionInputError, get_afternoon_overnight_diurnal_ffmc,
+                                           get_critical_hours_end, get_critical_hours_ends, get_critical_hours_start,
+                                           get_critical_hours_starts, get_morning_diurnal_ffmc, get_morning_rh_array)
+
+MORNING_RH = {7.0: 80, 8.0: 70, 9.0: 60, 10.0: 50, 11.0: 40, 12.0: 35}
+
+
+def test_afternoon_lookup():
+    """ Values are looked up in Red Book table 4.1, using the nearest daily FFMC and hour """
+    assert get_afternoon_overnight_diurnal_ffmc(13, 50) == 41
+    assert get_afternoon_overnight_diurnal_ffmc(13, 52) == 41
+    # 17:00 isn't in the table, the hour after it is used
+    assert get_afternoon_overnight_diurnal_ffmc(17, 50) == get_afternoon_overnight_diurnal_ffmc(18, 50)
+    # hours past midnight wrap around
+    assert get_afternoon_overnight_diurnal_ffmc(31, 50) == 43
+    np.testing.assert_array_equal(get_afternoon_overnight_diurnal_ffmc([13, 31], [[50], [60]]), [[41, 43], [48, 49]])
+
+
+def test_morning_lookup():
+    """ Values are looked up in Red Book table 4.2, using the RH range the RH falls in """
+    assert get_morning_diurnal_ffmc(7, 50, 68) == 54
+    assert get_morning_diurnal_ffmc(7, 50, 69) == 48
+    assert get_morning_diurnal_ffmc(7, 50, 100) == 43
+    assert np.isnan(get_morning_diurnal_ffmc(7, 50, None))
+    assert np.isnan(get_morning_diurnal_ffmc(7, 50, 101))
+
+
+DAILY_FFMC = [75, 88, 90, 92, 95, 98]
+PREV_DAY_DAILY_FFMC = [80, 85, 90, 90, 93, 99]
+
+
+# The critical hours (start, end) for each station, as determined one hour at a time by the original
+# implementation, walking the Red Book diurnal tables.
+@pytest.mark.parametrize('critical_ffmc, expected', [
+    (60, [(7, 6), (7, 7), (7, 7), (7, 7), (7, 7), (7, 7)]),
+    (80, [None, (11, 0), (10, 1), (10, 3), (8, 6), (7, 7)]),
+    (85, [None, (12, 20), (11, 22), (11, 23), (10, 2), (7, 5)]),
+    (88, [None, (17, 18), (12, 20), (12, 21), (11, 23), (8, 2)]),
+    (90, [None, None, (16, 18), (12, 20), (12, 22), (9, 1)]),
+    (91, [None, None, None, (15, 19), (12, 21), (10, 0)]),
+    (92, [None, None, None, (16, 18), (12, 20), (10, 23)]),
+    (95, [None, None, None, None, (16, 18), (11, 20)])])
+def test_critical_hours(critical_ffmc, expected):
+    """ Critical hours, for many stations at once or one at a time, are those of the Red Book tables """
+    starts, missing_rh = get_critical_hours_starts(critical_ffmc, DAILY_FFMC, PREV_DAY_DAILY_FFMC,
+                                                   get_morning_rh_array([MORNING_RH] * len(DAILY_FFMC)))
+    ends = get_critical_hours_ends(critical_ffmc, DAILY_FFMC, starts)
+    assert not missing_rh.any()
+    for index, (daily, prev_day) in enumerate(zip(DAILY_FFMC, PREV_DAY_DAILY_FFMC)):
+        start = get_critical_hours_start(critical_ffmc, daily, prev_day, MORNING_RH)
+        if expected[index] is None:
+            assert start is None
+            assert np.isnan(starts[index])
+            continue
+        assert (start, get_critical_hours_end(critical_ffmc, daily, start)) == expected[index]
+        assert (starts[index], ends[index]) == expected[index]
+
+
+def test_missing_morning_rh():
+    """ Critical hours that depend on a missing RH observation can't be determined """
+    rh_values = {**MORNING_RH, 12.0: None}
+    _, missing_rh = get_critical_hours_starts([80, 99], [95, 95], [95, 95], get_morning_rh_array([rh_values] * 2))
+    # critical hours start in the morning for the first station, and don't happen at all for the second.
+    np.testing.assert_array_equal(missing_rh, [True, False])
+    with pytest.raises(FireBehaviourPredictionInputError):
+        get_critical_hours_start(80, 95, 95, rh_values)
+    assert get_critical_hours_start(80, 95, 95, None) is None
@@ -0,0 +1,92 @@
+""" Parity tests for the numpy FBP implementation, checked against the cffdrs R package. """
+import numpy as np
+import pytest
+from app.fire_behaviour import cffdrs, fbp
+from app.fire_behaviour.fuel_types import FUEL_TYPE_DEFAULTS, FuelTypeEnum
+
+# C7B and D2 are not cffdrs fuel types.
+FUEL_TYPES = [fuel_type for fuel_type in FuelTypeEnum if fuel_type not in (FuelTypeEnum.C7B, FuelTypeEnum.D2)]
+# (ffmc, bui, wind_speed, grass cure)
+WEATHER = [(70.0, 10.0, 0.0, 30.0), (85.0, 40.0, 10.0, 60.0), (92.5, 95.0, 25.0, 90.0), (98.0, 180.0, 45.0, 100.0)]
+FMC = 95.0
+
+
+def _inputs(fuel_type: FuelTypeEnum):
+    defaults = FUEL_TYPE_DEFAULTS[fuel_type]
+    pc = 50 if fuel_type in (FuelTypeEnum.M1, FuelTypeEnum.M2) else defaults['PC']
+    pdf = 60 if fuel_type in (FuelTypeEnum.M3, FuelTypeEnum.M4) else defaults['PDF']
+    return pc, pdf, defaults['CBH'], defaults['CFL']
+
+
+@pytest.mark.parametrize('fuel_type', FUEL_TYPES)
+def test_fbp_parity_with_r(fuel_type: FuelTypeEnum):
+    """ Each primary output of the numpy implementation matches R """
+    pc, pdf, cbh, cfl = _inputs(fuel_type)
+    for ffmc, bui, wind_speed, cc in WEATHER:
+        isi = cffdrs.initial_spread_index(ffmc, wind_speed)
+        assert fbp.initial_spread_index(ffmc, wind_speed) == pytest.approx(isi)
+
+        sfc = cffdrs.surface_fuel_consumption(fuel_type, bui, ffmc, pc)
+        assert fbp.surface_fuel_consumption(fuel_type, bui, ffmc, pc) == pytest.approx(sfc)
+
+        ros = cffdrs.rate_of_spread(fuel_type, isi, bui, FMC, sfc, pc=pc, cc=cc, pdf=pdf, cbh=cbh)
+        assert fbp.rate_of_spread(fuel_type, isi, bui, FMC, sfc, pc, cc, pdf, cbh) == pytest.approx(ros)
+
+        cfb = cffdrs.crown_fraction_burned(fuel_type, fmc=FMC, sfc=sfc, ros=ros, cbh=cbh)
+        assert fbp.crown_fraction_burned(fuel_type, FMC, sfc, ros, cbh) == pytest.approx(cfb)
+
+        hfi = cffdrs.head_fire_intensity(fuel_type, pc, pdf, ros, cfb, cfl, sfc)
+        assert fbp.head_fire_intensity(fuel_type, pc, pdf, ros, cfb, cfl, sfc) == pytest.approx(hfi)
+
+        bros = cffdrs.back_rate_of_spread(fuel_type, ffmc, bui, wind_speed, FMC, sfc, pc, cc, pdf, cbh)
+        assert fbp.back_rate_of_spread(fuel_type, ffmc, bui, wind_speed, FMC, sfc, pc, cc, pdf,
+                                       cbh) == pytest.approx(bros)
+
+        lb = cffdrs.length_to_breadth_ratio(fuel_type, wind_speed)
+        assert fbp.length_to_breadth_ratio(fuel_type, wind_speed) == pytest.approx(lb)
+
+        assert fbp.rate_of_spread_t(fuel_type, ros, 60, cfb) == pytest.approx(
+            cffdrs.rate_of_spread_t(fuel_type, ros, 60, cfb))
+        assert fbp.length_to_breadth_ratio_t(fuel_type, lb, 60, cfb) == pytest.approx(
+            cffdrs.length_to_breadth_ratio_t(fuel_type, lb, 60, cfb))
+        assert fbp.fire_distance(fuel_type, ros + bros, 60, cfb) == pytest.approx(
+            cffdrs.fire_distance(fuel_type, ros + bros, 60, cfb))
+
+
+def test_fmc_parity_with_r():
+    """ Foliar moisture content matches R, at and above sea level, through the whole season """
+    for elevation in (0, 450, 1800):
+        for day_of_year in (60, 120, 150, 175, 200, 260):
+            expected = cffdrs.foliar_moisture_content(50.67, -120.45, elevation, day_of_year)
+            assert fbp.foliar_moisture_content(50.67, -120.45, elevation, day_of_year) == pytest.approx(expected)
+
+
+def test_vectorized_matches_scalar():
+    """ Evaluating many station-days at once gives the same result as one at a time """
+    fuel_types = np.array([fuel_type.value for fuel_type in FUEL_TYPES])
+    pc, pdf, cbh, cfl = (np.array(values, dtype=float) for values in zip(*map(_inputs, FUEL_TYPES)))
+    isi = fbp.initial_spread_index(92.5, 25.0)
+    result = fbp.calculate_fire_behaviour(fuel_types, isi, 95.0, 92.5, 25.0, FMC, pc, 90.0, pdf, cbh, cfl)
+    for index, fuel_type in enumerate(FUEL_TYPES):
+        sfc = fbp.surface_fuel_consumption(fuel_type, 95.0, 92.5, pc[index])
+        ros = fbp.rate_of_spread(fuel_type, isi, 95.0, FMC, sfc, pc[index], 90.0, pdf[index], cbh[index])
+        assert result.sfc[index] == pytest.approx(sfc)
+        assert result.ros[index] == pytest.approx(ros)
+
+
+def test_missing_input_is_nan():
+    """ A missing input that the fuel type needs results in NaN rather than a made up value """
+    assert np.isnan(fbp.rate_of_spread('M1', 10, 80, FMC, 2.0, None, None, None, 6))
+    assert np.isnan(fbp.rate_of_spread('O1A', 10, 80, FMC, 0.35, 0, None, 0, 1))
+    assert not np.isnan(fbp.rate_of_spread('C2', 10, 80, FMC, 2.0, None, None, None, 3))
+
+
+def test_native_backend(monkeypatch):
+    """ Setting FIRE_BEHAVIOUR_BACKEND to NUMPY routes the scalar cffdrs functions through numpy """
+    expected = cffdrs.rate_of_spread(FuelTypeEnum.C2, 10, 80, FMC, 2.0, pc=100, cc=None, pdf=0, cbh=3)
+    monkeypatch.setenv('FIRE_BEHAVIOUR_BACKEND', 'NUMPY')
+    assert cffdrs.get_backend() == cffdrs.FireBehaviourBackendEnum.NUMPY
+    assert cffdrs.rate_of_spread(FuelTypeEnum.C2, 10, 80, FMC, 2.0, pc=100, cc=None, pdf=0,
+                                 cbh=3) == pytest.approx(expected)
+    with pytest.raises(cffdrs.CFFDRSException):
+        cffdrs.rate_of_spread(FuelTypeEnum.M1, 10, 80, FMC, 2.0, pc=None, cc=None, pdf=0, cbh=6)
@@ -0,0 +1,73 @@
+""" Tests for the numpy FWI System implementation. """
+import numpy as np
+import pytest
+from app.fire_behaviour import fwi
+
+# Three consecutive days from the worked example in Van Wagner and Pickett (1985), starting from
+# FFMC 85, DMC 6 and DC 15 in April: (temp, rh, wind speed, precip).
+WEATHER = [(17.0, 42.0, 25.0, 0.0), (20.0, 21.0, 25.0, 2.4), (8.5, 40.0, 17.0, 0.0)]
+
+
+def test_first_day_of_worked_example():
+    """ The codes and indices for the first day match the published values """
+    result = fwi.calculate_fwi(85, 6, 15, *WEATHER[0], lat=45.98, month=4)
+    assert result.ffmc == pytest.approx(87.69, abs=0.01)
+    assert result.dmc == pytest.approx(8.55, abs=0.01)
+    assert result.dc == pytest.approx(19.01, abs=0.01)
+    assert result.isi == pytest.approx(10.85, abs=0.01)
+    assert result.bui == pytest.approx(8.49, abs=0.01)
+    assert result.fwi == pytest.approx(10.10, abs=0.01)
+
+
+def test_daily_matrix_carries_codes_forward():
+    """ Calculating a station x day matrix gives the same result as calculating one day at a time,
+    feeding each day's codes into the next """
+    temp, rh, ws, prec = (np.array([values, values]) for values in zip(*WEATHER))
+    result = fwi.calculate_daily_fwi([85, 85], [6, 6], [15, 15], temp, rh, ws, prec, [45.98, 45.98], 4)
+    assert result.ffmc.shape == (2, 3)
+    ffmc, dmc, dc = 85, 6, 15
+    for day, weather in enumerate(WEATHER):
+        expected = fwi.calculate_fwi(ffmc, dmc, dc, *weather, lat=45.98, month=4)
+        for field in fwi.FWIArrays._fields:
+            assert getattr(result, field)[:, day] == pytest.approx(float(getattr(expected, field)))
+        ffmc, dmc, dc = expected.ffmc, expected.dmc, expected.dc
+
+
+def test_missing_weather_is_nan_for_remaining_days():
+    """ A missing value makes that day, and every day after it, NaN """
+    temp = np.array([[17.0, None, 8.5]], dtype=object)
+    result = fwi.calculate_daily_fwi(85, 6, 15, temp, [[42, 21, 40]], [[25, 25, 17]], [[0, 2.4, 0]], 45.98, 4)
+    assert not np.isnan(result.fwi[0, 0])
+    assert np.isnan(result.fwi[0, 1:]).all()
+
+
+def test_rain_resets_codes():
+    """ Heavy rain lowers all the moisture codes """
+    result = fwi.calculate_fwi(92, 40, 300, 15, 90, 5, 25, lat=50, month=7)
+    assert result.ffmc < 92
+    assert result.dmc < 40
+    assert result.dc < 300
+
+
+def test_hourly_ffmc_series_carries_forward():
+    """ Each hour of the hourly FFMC series starts from the previous hour's FFMC """
+    temp = np.array([[20.0, 22.0, 25.0], [15.0, 15.0, 15.0]])
+    rh = np.array([[40.0, 35.0, 30.0], [90.0, 95.0, 95.0]])
+    prec = np.array([[0.0, 0.0, 0.0], [0.0, 1.5, 0.2]])
+    result = fwi.calculate_hourly_ffmc([85, 85], temp, rh, 10, prec)
+    for station in range(2):
+        ffmc = 85
+        for hour in range(3):
+            ffmc = fwi.hourly_fine_fuel_moisture_code(ffmc, temp[station, hour], rh[station, hour], 10,
+                                                      prec[station, hour])
+            assert result[station, hour] == pytest.approx(ffmc)
+    # drying on a warm dry day, wetting in the rain
+    assert np.all(np.diff(result[0]) > 0)
+    assert result[1, 1] < result[1, 0]
+
+
+def test_hourly_ffmc_approaches_equilibrium():
+    """ Given long enough, fuel drying out settles at the same FFMC, wherever it starts from """
+    result = fwi.hourly_fine_fuel_moisture_code([40, 60], 20, 40, 10, 0, 500)
+    assert result[0] == pytest.approx(result[1])
+    assert np.isnan(fwi.hourly_fine_fuel_moisture_code(85, None, 40, 10, 0))
@@ -0,0 +1,28 @@
+""" Tests for calculating many fire behaviour predictions at once """
+import pytest
+from app.fire_behaviour.fuel_types import FuelTypeEnum
+from app.fire_behaviour.prediction import (FireBehaviourPredictionInput, calculate_fire_behaviour_prediction,
+                                           calculate_fire_behaviour_predictions)
+
+
+def _input(fuel_type: FuelTypeEnum, cc=None, pc=None, cbh=None) -> FireBehaviourPredictionInput:
+    return FireBehaviourPredictionInput(latitude=52.3, longitude=-121.4, elevation=700, fuel_type=fuel_type, bui=80,
+                                        ffmc=92, wind_speed=15, cc=cc, pc=pc, isi=9.5, pdf=None, cbh=cbh, cfl=0.5)
+
+
+def test_c7b_batch_matches_single():
+    """ C7B predictions are calculated in a batch, alongside the other fuel types, with a fire size """
+    prediction_inputs = [_input(FuelTypeEnum.C7B, cc=60, cbh=10),
+                         _input(FuelTypeEnum.C2, pc=100, cbh=3),
+                         _input(FuelTypeEnum.C7B, cc=90, cbh=10),
+                         _input(FuelTypeEnum.C7B, cbh=10)]
+    predictions = calculate_fire_behaviour_predictions(prediction_inputs)
+    for prediction_input, prediction in zip(prediction_inputs[:3], predictions[:3]):
+        expected = calculate_fire_behaviour_prediction(**prediction_input._asdict())
+        assert prediction.hfi == pytest.approx(expected.hfi)
+        assert prediction.ros == pytest.approx(expected.ros)
+        assert prediction.sixty_minute_fire_size == pytest.approx(expected.sixty_minute_fire_size)
+        assert prediction.fire_type == expected.fire_type
+    assert predictions[0].sixty_minute_fire_size > 0
+    # C7B requires grass cure
+    assert predictions[3] is None
@@ -0,0 +1,50 @@
+""" Unit tests for the fire behaviour prediction cache """
+from app.fire_behaviour.fuel_types import FuelTypeEnum
+from app.fire_behaviour.prediction import FireBehaviourPrediction, FireBehaviourPredictionInput, FireTypeEnum
+from app.fire_behaviour.prediction_cache import FireBehaviourPredictionCache, build_key
+
+PREDICTION_INPUT = FireBehaviourPredictionInput(
+    latitude=50.67, longitude=-120.45, elevation=345, fuel_type=FuelTypeEnum.C3, bui=95.0, ffmc=92.5,
+    wind_speed=25.0, cc=None, pc=None, isi=20.1, pdf=None, cbh=8, cfl=1.15)
+
+
+def _prediction():
+    return FireBehaviourPrediction(ros=10.0, hfi=5000.0, intensity_group=5, sixty_minute_fire_size=20.0,
+                                   fire_type=FireTypeEnum.CONTINUOUS_CROWN)
+
+
+def test_key():
+    """ Keys ignore floating point noise, but change when WF1 updates the daily """
+    key = build_key(322, 1000, 2000, PREDICTION_INPUT)
+    assert key == build_key(322, 1000, 2000, PREDICTION_INPUT._replace(bui=95.0000001))
+    assert key != build_key(322, 1000, 2001, PREDICTION_INPUT)
+    assert key != build_key(322, 1000, 2000, PREDICTION_INPUT._replace(fuel_type=FuelTypeEnum.C5))
+
+
+def test_hits_and_misses(new_singleton_instance):
+    """ The cache counts hits and misses """
+    cache = new_singleton_instance(FireBehaviourPredictionCache)
+    assert cache.get('a') is None
+    cache.put('a', _prediction())
+    assert cache.get('a').hfi == 5000.0
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+
+def test_least_recently_used_evicted(monkeypatch, new_singleton_instance):
+    """ The least recently used prediction is dropped when the cache is full """
+    monkeypatch.setenv('FIRE_BEHAVIOUR_CACHE_SIZE', '2')
+    cache = new_singleton_instance(FireBehaviourPredictionCache)
+    cache.put('a', _prediction())
+    cache.put('b', _prediction())
+    cache.get('a')
+    cache.put('c', _prediction())
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+
+
+def test_expiry(monkeypatch, new_singleton_instance):
+    """ Predictions expire """
+    monkeypatch.setenv('FIRE_BEHAVIOUR_CACHE_EXPIRY', '-1')
+    cache = new_singleton_instance(FireBehaviourPredictionCache)
+    cache.put('a', _prediction())
+    assert cache.get('a') is None
@@ -0,0 +1,36 @@
+""" Unit tests for the pool of R workers """
+import operator
+from app.fire_behaviour.r_worker_pool import RWorkerPool
+
+
+class _MockExecutor():
+    """ Stand in for a process pool executor """
+
+    def __init__(self):
+        self.is_shutdown = False
+
+    def shutdown(self, **_):
+        """ Record that the executor was shut down """
+        self.is_shutdown = True
+
+
+def test_inline_when_disabled(monkeypatch, run_until_complete, new_singleton_instance):
+    """ With a pool size of 0, work is done in the calling process """
+    monkeypatch.setenv('R_WORKER_POOL_SIZE', '0')
+    pool = new_singleton_instance(RWorkerPool)
+    assert not pool.enabled
+    assert run_until_complete(pool.submit(operator.add, 1, 2)) == 3
+    assert pool._executor is None
+    assert run_until_complete(pool.health_check())
+
+
+def test_pool_is_recycled(monkeypatch, new_singleton_instance):
+    """ The pool is replaced once the workers have done their share of tasks """
+    monkeypatch.setenv('R_WORKER_POOL_SIZE', '1')
+    monkeypatch.setenv('R_WORKER_MAX_TASKS', '2')
+    pool = new_singleton_instance(RWorkerPool)
+    monkeypatch.setattr(pool, '_create_executor', _MockExecutor)
+    first = pool._get_executor()
+    assert pool._get_executor() is first
+    assert pool._get_executor() is not first
+    assert first.is_shutdown
@@ -4,10 +4,12 @@ import pytest
 import os
 import json
 from pytest_mock import MockerFixture
+import app.hfi.hfi_calc
 from app.hfi.hfi_calc import (calculate_hfi_results,
                               calculate_mean_intensity,
                               calculate_max_intensity_group,
                               calculate_prep_level,
+                              predict_fire_behaviour,
                               validate_date_range,
                               validate_station_daily)
 import app.db.models.hfi_calc as hfi_calc_models
@@ -21,6 +23,7 @@ from app.schemas.hfi_calc import (DailyResult, DateRange,
                                   WeatherStationProperties,
                                   required_daily_fields)
 from app.schemas.shared import FuelType
+from app.fire_behaviour.prediction import FireBehaviourPrediction
 from app.utils.time import get_pst_now, get_utc_now
 from app.wildfire_one.schema_parsers import WFWXWeatherStation
 from starlette.testclient import TestClient
@@ -123,6 +126,43 @@ def test_requested_fire_starts_unaltered(mocker: MockerFixture):
     assert result[0].daily_results[0].fire_starts == fire_start_ranges[-1]
 
 
+def test_predict_fire_behaviour_cached(monkeypatch, run_until_complete):
+    """ Only the dailies that aren't in the prediction cache are calculated """
+    monkeypatch.setenv('R_WORKER_POOL_SIZE', '0')
+    calculated = []
+
+    def mock_calculate_fire_behaviour_predictions(prediction_inputs):
+        calculated.append(len(prediction_inputs))
+        return [FireBehaviourPrediction(ros=1.0, hfi=100.0, intensity_group=1, sixty_minute_fire_size=1.0,
+                                        fire_type=None) for _ in prediction_inputs]
+    monkeypatch.setattr(app.hfi.hfi_calc, 'calculate_fire_behaviour_predictions',
+                        mock_calculate_fire_behaviour_predictions)
+    fuel_type_lookup = {
+        1: hfi_calc_models.FuelType(
+            id=1, abbrev='C1', description='C1', fuel_type_code='C1',
+            percentage_conifer=100, percentage_dead_fir=0)}
+    wfwx_stations = [WFWXWeatherStation(wfwx_id=code, code=code, name=f'station{code}', latitude=50.1,
+                                        longitude=-120.1, elevation=123, zone_code=1) for code in (1, 2)]
+    raw_dailies = [{'stationId': code, 'weatherTimestamp': 1000, 'lastEntityUpdateTimestamp': 2000,
+                    'buildUpIndex': 80, 'fineFuelMoistureCode': 90, 'windSpeed': 10} for code in (1, 2)]
+
+    predictions = run_until_complete(predict_fire_behaviour(
+        raw_dailies, wfwx_stations, planning_area_station_info, fuel_type_lookup))
+    assert len(predictions) == 2
+    raw_dailies[1]['lastEntityUpdateTimestamp'] = 3000
+    run_until_complete(predict_fire_behaviour(
+        raw_dailies, wfwx_stations, planning_area_station_info, fuel_type_lookup))
+    assert calculated == [2, 1]
+
+    result = calculate_hfi_results(fuel_type_lookup, fire_start_ranges, planning_area_fire_starts={},
+                                   fire_start_lookup=fire_start_lookup, wfwx_stations=wfwx_stations,
+                                   raw_dailies=raw_dailies, num_prep_days=1,
+                                   planning_area_station_info=planning_area_station_info,
+                                   start_date=datetime.now(), fire_behaviour_predictions=predictions)
+    assert calculated == [2, 1]
+    assert len(result) == 1
+
+
 def test_calculate_mean_intensity_basic():
     """ Calculates mean intensity """
     daily1 = StationDaily(
@@ -0,0 +1,65 @@
+""" Unit tests for the ModelValueProcessor in app/jobs/common_model_fetchers.py """
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+from geoalchemy2.shape import from_shape
+from app.db.models.weather_models import PredictionModel, PredictionModelGridSubset, PredictionModelRunTimestamp
+from app.db.crud import weather_models as weather_models_crud
+from app.jobs import common_model_fetchers
+from app.jobs.common_model_fetchers import ModelValueProcessor
+from app.tests.weather_models.test_models_common import mock_get_model_run_predictions, mock_get_stations, shape
+
+
+def test_process_model_run(monkeypatch):
+    """ Predictions are upserted in one go, with delta precip calculated across stored and new predictions """
+    model_run = PredictionModelRunTimestamp(id=1, prediction_model_id=1, prediction_model=PredictionModel(id=1),
+                                            prediction_run_timestamp=datetime(2023, 2, 21, 12))
+    upserted = []
+    monkeypatch.setattr(common_model_fetchers, 'get_stations_synchronously', mock_get_stations)
+    monkeypatch.setattr(common_model_fetchers, 'get_grids_for_coordinate', lambda *args: [
+        PredictionModelGridSubset(id=1, prediction_model_id=1, geom=from_shape(shape))])
+    monkeypatch.setattr(common_model_fetchers, 'get_model_run_predictions_for_grid', mock_get_model_run_predictions)
+    # A prediction stored by an earlier run of the processor.
+    monkeypatch.setattr(common_model_fetchers, 'get_weather_station_model_precipitation',
+                        lambda *args: [(123, datetime(2023, 2, 21, 15), 1.0)])
+    monkeypatch.setattr(common_model_fetchers, 'upsert_weather_station_model_predictions',
+                        lambda session, predictions: upserted.extend(predictions))
+    monkeypatch.setattr(common_model_fetchers.StationMachineLearning, 'learn', lambda self: None)
+
+    processor = ModelValueProcessor(MagicMock())
+    processor._process_model_run(model_run)
+
+    assert [prediction['prediction_timestamp'].hour for prediction in upserted] == [18, 20, 21]
+    precip = {prediction['prediction_timestamp'].hour: prediction['apcp_sfc_0'] for prediction in upserted}
+    deltas = {prediction['prediction_timestamp'].hour: prediction['delta_precip'] for prediction in upserted}
+    assert deltas[18] == precip[18] - 1.0
+    assert deltas[20] == precip[20] - precip[18]
+    assert deltas[21] == precip[21] - precip[20]
+    # The second hour 21 prediction has no rh.
+    assert upserted[2]['rh_tgl_2'] is None
+
+
+def test_prediction_partitions(monkeypatch):
+    """ Weekly partitions are created for the days ahead that are missing, and dropped once past retention """
+    now = datetime(2023, 5, 24, 10, tzinfo=timezone.utc)
+    existing = ['model_run_grid_subset_predictions_p20230424', 'model_run_grid_subset_predictions_p20230501']
+    session = MagicMock()
+    session.execute.return_value = [(name,) for name in existing]
+    monkeypatch.setattr(common_model_fetchers.time_utils, 'get_utc_now', lambda: now)
+    monkeypatch.setattr(common_model_fetchers.app.db.database, 'get_write_session_scope', MagicMock(
+        return_value=MagicMock(__enter__=MagicMock(return_value=session))))
+
+    assert weather_models_crud.get_prediction_partition_start(now) == datetime(2023, 5, 22, tzinfo=timezone.utc)
+    common_model_fetchers.create_prediction_partitions()
+    statements = [str(call.args[0]) for call in session.execute.call_args_list[1:]]
+    # From 21 days back (the week of the 1st) to 17 days ahead (the week of the 5th of June).
+    assert [statement.split()[5] for statement in statements] == [
+        'model_run_grid_subset_predictions_p20230508', 'model_run_grid_subset_predictions_p20230515', 'model_run_grid_subset_predictions_p20230522',
+        'model_run_grid_subset_predictions_p20230529', 'model_run_grid_subset_predictions_p20230605']
+    assert "FOR VALUES FROM ('2023-05-08T00:00:00+00:00') TO ('2023-05-15T00:00:00+00:00')" in statements[0]
+
+    # The week of the 24th of April ends before the oldest to keep (the 3rd of May), the week of the 1st doesn't.
+    session.execute.reset_mock()
+    common_model_fetchers.apply_data_retention_policy()
+    assert [str(call.args[0]) for call in session.execute.call_args_list[1:]] == [
+        'ALTER TABLE model_run_grid_subset_predictions DETACH PARTITION model_run_grid_subset_predictions_p20230424',
+        'DROP TABLE model_run_grid_subset_predictions_p20230424']
@@ -0,0 +1,92 @@
+""" Unit tests for app/jobs/download_pipeline.py """
+import os
+import threading
+import pytest
+import requests
+from app.jobs import download_pipeline
+from app.jobs.download_pipeline import DownloadPipeline
+from app.tests.common import MockResponse
+
+
+@pytest.fixture()
+def pipeline_config(monkeypatch):
+    """ Run 3 downloads at a time, without waiting between retries """
+    config = {'GRIB_DOWNLOAD_CONCURRENCY': '3', 'GRIB_DOWNLOAD_QUEUE_SIZE': '1', 'GRIB_DOWNLOAD_BACKOFF': '0',
+              'REDIS_CACHE_TEST': 'False'}
+    monkeypatch.setattr(download_pipeline.config, 'get', lambda key, default=None: config.get(key, default))
+    return config
+
+
+@pytest.mark.usefixtures('pipeline_config')
+def test_download_pipeline(monkeypatch):
+    """ Files are downloaded concurrently, on one session, and removed once processed """
+    lock = threading.Lock()
+    sessions = set()
+    in_flight = 0
+    max_in_flight = 0
+    attempts = {}
+
+    def mock_session_get(self, url, **kwargs):
+        nonlocal in_flight, max_in_flight
+        with lock:
+            sessions.add(id(self))
+            attempts[url] = attempts.get(url, 0) + 1
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        try:
+            if url.endswith('missing'):
+                return MockResponse(status_code=404)
+            if url.endswith('flaky') and attempts[url] == 1:
+                raise requests.ConnectionError('connection reset')
+            return MockResponse(status_code=200, content=url.encode() * 100)
+        finally:
+            with lock:
+                in_flight -= 1
+
+    monkeypatch.setattr(requests.Session, 'get', mock_session_get)
+
+    urls = [f'https://test/file_{index}' for index in range(10)] + ['https://test/missing', 'https://test/flaky']
+    results = {}
+    for downloaded in DownloadPipeline('REDIS_CACHE_TEST', 'TEST').download(urls):
+        assert downloaded.exception is None
+        if downloaded.filename:
+            with open(downloaded.filename, 'rb') as file_object:
+                assert file_object.read() == downloaded.url.encode() * 100
+        results[downloaded.url] = downloaded.filename
+
+    assert set(results) == set(urls)
+    assert results['https://test/missing'] is None
+    assert attempts['https://test/flaky'] == 2
+    assert len(sessions) == 1
+    assert max_in_flight <= 3
+    # every file is removed once it's been processed.
+    assert not any(filename and os.path.exists(filename) for filename in results.values())
+
+
+@pytest.mark.usefixtures('pipeline_config')
+def test_download_pipeline_gives_up(monkeypatch):
+    """ Downloads are retried, and then reported as failed """
+    attempts = []
+
+    def mock_session_get(self, url, **kwargs):
+        attempts.append(url)
+        raise requests.Timeout('timed out')
+
+    monkeypatch.setattr(requests.Session, 'get', mock_session_get)
+
+    downloaded = list(DownloadPipeline('REDIS_CACHE_TEST', 'TEST').download(['https://test/file']))
+    assert len(downloaded) == 1
+    assert isinstance(downloaded[0].exception, requests.Timeout)
+    assert len(attempts) == download_pipeline.DEFAULT_RETRIES + 1
+
+
+def test_download_pipeline_disk_budget(pipeline_config):
+    """ No new downloads are started while the downloaded files waiting to be processed are over budget,
+    or when too many downloads are pending """
+    pipeline_config['GRIB_DOWNLOAD_DISK_BUDGET'] = '1000'
+    pipeline = DownloadPipeline('REDIS_CACHE_TEST', 'TEST')
+    assert pipeline._can_start(pending=3)
+    # 3 downloads in flight, and 1 waiting to be processed.
+    assert not pipeline._can_start(pending=4)
+    pipeline._bytes_on_disk = 1000
+    assert not pipeline._can_start(pending=1)
@@ -0,0 +1,113 @@
+""" Unit tests for app/jobs/grib_cache.py """
+import os
+import sqlite3
+import pytest
+import requests
+from app.jobs.common_model_fetchers import download
+from app.jobs.grib_cache import GribCache
+from app.tests.common import MockResponse
+
+
+def mock_server(monkeypatch, content: bytes, etag: str):
+    """ Serve content with an ETag, responding 304 to a request for the same ETag. Returns the requests. """
+    requested = []
+
+    def mock_session_get(self, url, headers=None, **kwargs):
+        requested.append(headers or {})
+        if headers and headers.get('If-None-Match') == etag:
+            return MockResponse(status_code=304)
+        return MockResponse(status_code=200, content=content, headers={'ETag': etag})
+
+    monkeypatch.setattr(requests.Session, 'get', mock_session_get)
+    return requested
+
+
+def test_download_cached(monkeypatch, tmp_path):
+    """ A cached file is used without going to the server, until it expires, after which it's revalidated """
+    monkeypatch.setenv('REDIS_CACHE_TEST', 'True')
+    monkeypatch.setenv('TEST_CACHE_EXPIRY', '3600')
+    requested = mock_server(monkeypatch, b'grib' * 100, '"v1"')
+
+    with requests.Session() as session:
+        target = download('https://test/file.grib2', str(tmp_path), 'REDIS_CACHE_TEST', 'TEST',
+                          'TEST_CACHE_EXPIRY', session=session)
+        os.remove(target)
+        assert download('https://test/file.grib2', str(tmp_path), 'REDIS_CACHE_TEST', 'TEST',
+                        'TEST_CACHE_EXPIRY', session=session) == target
+        assert requested == [{}]
+
+        # Expired, the server is asked if it changed.
+        monkeypatch.setenv('TEST_CACHE_EXPIRY', '0')
+        download('https://test/file.grib2', str(tmp_path), 'REDIS_CACHE_TEST', 'TEST', 'TEST_CACHE_EXPIRY',
+                 session=session)
+        assert requested[1] == {'If-None-Match': '"v1"'}
+
+    with open(target, 'rb') as file:
+        assert file.read() == b'grib' * 100
+
+
+def test_download_revalidated_changed(monkeypatch, tmp_path):
+    """ A file that changed on the server is downloaded again, replacing the cached content """
+    monkeypatch.setenv('REDIS_CACHE_TEST', 'True')
+    monkeypatch.setenv('TEST_CACHE_EXPIRY', '0')
+    mock_server(monkeypatch, b'old', '"v1"')
+    with requests.Session() as session:
+        target = download('https://test/file.grib2', str(tmp_path), 'REDIS_CACHE_TEST', 'TEST',
+                          'TEST_CACHE_EXPIRY', session=session)
+        requested = mock_server(monkeypatch, b'new', '"v2"')
+        download('https://test/file.grib2', str(tmp_path), 'REDIS_CACHE_TEST', 'TEST', 'TEST_CACHE_EXPIRY',
+                 session=session)
+
+    assert requested == [{'If-None-Match': '"v1"'}]
+    with open(target, 'rb') as file:
+        assert file.read() == b'new'
+    with open(GribCache.instance().get('https://test/file.grib2').filename, 'rb') as file:
+        assert file.read() == b'new'
+
+
+@pytest.mark.parametrize('expiry', ['3600', '0'])
+def test_download_cache_failure(monkeypatch, tmp_path, expiry):
+    """ A cache that fails, whether on a fresh hit or on revalidation, falls back to downloading the file """
+    monkeypatch.setenv('REDIS_CACHE_TEST', 'True')
+    monkeypatch.setenv('TEST_CACHE_EXPIRY', expiry)
+    requested = mock_server(monkeypatch, b'grib', '"v1"')
+    with requests.Session() as session:
+        target = download('https://test/file.grib2', str(tmp_path), 'REDIS_CACHE_TEST', 'TEST',
+                          'TEST_CACHE_EXPIRY', session=session)
+
+        def fail(*args):
+            raise sqlite3.OperationalError('database is locked')
+        monkeypatch.setattr(GribCache.instance(), 'copy_to', fail)
+        assert download('https://test/file.grib2', str(tmp_path), 'REDIS_CACHE_TEST', 'TEST',
+                        'TEST_CACHE_EXPIRY', session=session) == target
+
+    # Fresh, it's downloaded without asking, expired, it's downloaded again after the 304.
+    assert requested[-1] == {}
+    assert len(requested) == (2 if expiry == '3600' else 3)
+    with open(target, 'rb') as file:
+        assert file.read() == b'grib'
+
+
+def test_least_recently_used_evicted(monkeypatch, tmp_path):
+    """ Files are stored once per content, and the least recently used evicted once over size """
+    cache = GribCache.instance()
+    monkeypatch.setattr(cache, 'max_size', 250)
+    files = {}
+    for name, content in (('a', b'a' * 100), ('b', b'b' * 100), ('c', b'a' * 100), ('d', b'd' * 100)):
+        files[name] = os.path.join(tmp_path, name)
+        with open(files[name], 'wb') as file:
+            file.write(content)
+
+    cached_a = cache.add('https://test/a', files['a'])
+    cached_b = cache.add('https://test/b', files['b'])
+    # Same content as a, under another url.
+    assert cache.add('https://test/c', files['c']).filename == cached_a.filename
+    # Using a makes b the least recently used.
+    assert cache.copy_to(cached_a, os.path.join(tmp_path, 'a_copy'))
+    cache.add('https://test/d', files['d'])
+
+    assert cache.get('https://test/b') is None
+    assert not os.path.exists(cached_b.filename)
+    assert cache.get('https://test/a') is not None
+    assert cache.get('https://test/c') is not None
+    assert cache.get('https://test/d') is not None
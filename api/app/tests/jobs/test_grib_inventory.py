@@ -0,0 +1,133 @@
+""" Unit tests for app/jobs/grib_inventory.py, against a local server standing in for NOMADS """
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import pytest
+import requests
+from app.jobs import noaa
+from app.jobs.grib_inventory import InventoryError, parse_inventory, select_byte_ranges
+from app.weather_models import ModelEnum
+
+# Messages of a made up grib file: (variable, level, content).
+MESSAGES = [('PRMSL', 'mean sea level', b'pressure' * 10),
+            ('TMP', 'surface', b'tmp surface' * 10),
+            ('TMP', '2 m above ground', b'tmp 2m' * 10),
+            ('RH', '2 m above ground', b'rh 2m' * 10),
+            ('TMP', '850 mb', b'tmp 850' * 10),
+            ('UGRD', '10 m above ground', b'u 10m' * 10),
+            ('VGRD', '10 m above ground', b'v 10m' * 10),
+            ('APCP', 'surface', b'apcp' * 10),
+            ('HGT', 'surface', b'height' * 10)]
+
+
+def make_grib_file():
+    """ Return the content of the made up grib file, and its inventory """
+    content = b''
+    inventory = ''
+    for number, (variable, level, message) in enumerate(MESSAGES, start=1):
+        inventory += f'{number}:{len(content)}:d=2023041400:{variable}:{level}:20 hour fcst:\n'
+        content += message
+    return content, inventory
+
+
+class NomadsHandler(BaseHTTPRequestHandler):
+    """ Serve the made up grib file and its inventory, supporting range requests like NOMADS """
+    files = {}
+    ranges = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ Respond with the file, or the requested range of it """
+        content = self.files.get(self.path)
+        if content is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(content) - 1
+            NomadsHandler.ranges.append((start, end))
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(content)}')
+            content = content[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """ Keep the test output quiet """
+
+
+@pytest.fixture()
+def nomads(monkeypatch):
+    """ Start a local server standing in for NOMADS, downloading NAM files from it in byte ranges """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), NomadsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    NomadsHandler.files = {}
+    NomadsHandler.ranges = []
+    config = {'NOAA_BYTE_RANGE_MODELS': 'NAM,GFS',
+              'NOMADS_PUB_URL': f'http://127.0.0.1:{server.server_address[1]}/pub/data/nccf/com/'}
+    monkeypatch.setattr(noaa.config, 'get', lambda key, default=None: config.get(key, default))
+    yield NomadsHandler
+    server.shutdown()
+    server.server_close()
+
+
+def test_select_byte_ranges():
+    """ Neighbouring messages are merged into a single range, and the last message is open ended """
+    _, inventory = make_grib_file()
+    entries = parse_inventory(inventory)
+    ranges = select_byte_ranges(entries, noaa.WX_VARS, ['surface', '2 m above ground', '10 m above ground'])
+    assert ranges == [(entries[1].start, entries[3].end), (entries[5].start, entries[7].end)]
+    assert select_byte_ranges(entries, ['HGT'], ['surface']) == [(entries[8].start, None)]
+
+
+def test_parse_inventory_sub_messages():
+    """ Sub-messages share the start byte of their message """
+    entries = parse_inventory('1:0:d=2023041400:TMP:surface:anl:\n'
+                              '2.1:100:d=2023041400:UGRD:10 m above ground:anl:\n'
+                              '2.2:100:d=2023041400:VGRD:10 m above ground:anl:\n'
+                              '3:250:d=2023041400:RH:2 m above ground:anl:\n')
+    assert [(entry.number, entry.start, entry.end) for entry in entries] == [
+        (1, 0, 99), (2, 100, 249), (2, 100, 249), (3, 250, None)]
+    assert select_byte_ranges(entries, ['UGRD', 'VGRD'], ['10 m above ground']) == [(100, 249)]
+
+
+def test_download_messages(nomads, tmp_path):
+    """ Only the messages of the weather variables and levels are downloaded, in the order of the file """
+    content, inventory = make_grib_file()
+    url = next(noaa.get_nam_model_run_download_urls(datetime(2023, 4, 14, 2, tzinfo=timezone.utc), '00'))
+    grib_path = urlsplit(noaa.get_grib_file_url(url, ModelEnum.NAM)).path
+    assert grib_path.startswith('/pub/data/nccf/com/nam/prod/nam.')
+    nomads.files = {grib_path: content, f'{grib_path}.idx': inventory.encode()}
+
+    message_filter = noaa.get_grib_message_filter(ModelEnum.NAM)
+    with requests.Session() as session:
+        target = message_filter.download(session, url, os.path.join(tmp_path, 'nam.grib2'))
+
+    with open(target, 'rb') as file:
+        downloaded = file.read()
+    assert downloaded == b''.join(message for variable, level, message in MESSAGES
+                                  if variable in noaa.WX_VARS and level != '850 mb')
+    assert len(nomads.ranges) == 2
+    # GFS is downloaded through the grib filter, even if it's configured to be downloaded in byte ranges.
+    assert noaa.get_grib_message_filter(ModelEnum.GFS) is None
+
+
+def test_download_messages_missing(nomads, tmp_path):
+    """ A grib file that isn't there yet has no inventory, and nothing is downloaded """
+    message_filter = noaa.get_grib_message_filter(ModelEnum.NAM)
+    url = next(noaa.get_nam_model_run_download_urls(datetime(2023, 4, 14, 2, tzinfo=timezone.utc), '00'))
+    with requests.Session() as session:
+        assert message_filter.download(session, url, os.path.join(tmp_path, 'nam.grib2')) is None
+        # An inventory without any of the wanted messages is an error.
+        grib_path = urlsplit(noaa.get_grib_file_url(url, ModelEnum.NAM)).path
+        nomads.files = {grib_path: b'height', f'{grib_path}.idx': b'1:0:d=2023041400:HGT:surface:anl:\n'}
+        with pytest.raises(InventoryError):
+            message_filter.download(session, url, os.path.join(tmp_path, 'nam.grib2'))
@@ -1,10 +1,12 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
 from unittest.mock import Mock, patch
 import pytest
 from app.db.models.morecast_v2 import MorecastForecastRecord
-from app.morecast_v2.forecasts import construct_wf1_forecast, construct_wf1_forecasts, get_forecasts
-from app.schemas.morecast_v2 import StationDailyFromWF1, WF1ForecastRecordType, WF1PostForecast
+from app.morecast_v2.forecasts import (calculate_forecast_fwi_indices, construct_wf1_forecast,
+                                      construct_wf1_forecasts, get_forecasts)
+from app.schemas.morecast_v2 import (StationDailyFromWF1, WeatherDeterminate, WeatherIndeterminate,
+                                     WF1ForecastRecordType, WF1PostForecast)
 from app.wildfire_one.schema_parsers import WFWXWeatherStation
 
 start_time = datetime(2022, 1, 1)
@@ -135,3 +137,22 @@ async def test_construct_wf1_forecasts_new(_, mock_get):
                         None,
                         None,
                         station_2_url, '2')
+
+
+def test_calculate_forecast_fwi_indices():
+    """ Forecast indices are carried forward from the last actual, and stations without an actual
+    are left alone """
+    actual = WeatherIndeterminate(station_code=1, station_name='station1', determinate=WeatherDeterminate.ACTUAL,
+                                  utc_timestamp=start_time, fine_fuel_moisture_code=85, duff_moisture_code=6,
+                                  drought_code=15)
+    forecasts = [WeatherIndeterminate(station_code=station_code, station_name=f'station{station_code}',
+                                      determinate=WeatherDeterminate.FORECAST,
+                                      utc_timestamp=start_time + timedelta(days=day),
+                                      temperature=17, relative_humidity=42, wind_speed=25, precipitation=0)
+                 for station_code in (1, 2) for day in (2, 1)]
+    result = calculate_forecast_fwi_indices([actual], forecasts, wfwx_weather_stations)
+    station_1 = sorted([forecast for forecast in result if forecast.station_code == 1],
+                       key=lambda forecast: forecast.utc_timestamp)
+    assert station_1[0].fine_fuel_moisture_code == pytest.approx(87.69, abs=0.01)
+    assert station_1[1].duff_moisture_code > station_1[0].duff_moisture_code
+    assert all(forecast.fire_weather_index is None for forecast in result if forecast.station_code == 2)
@@ -0,0 +1,79 @@
+""" Unit tests for batched REDapp calculations, and the REDapp worker """
+from datetime import datetime, timezone
+import numpy as np
+import pytest
+from app.utils import redapp
+from app.utils.redapp_worker import REDappWorker
+
+
+class _MockFBPCalculations():
+    """ Stand in for ca.cwfgm.fbp.FBPCalculations """
+
+    def FBPCalculateStatisticsCOM(self):
+        """ Fake calculation, echoing some of the inputs back out """
+        self.hfi = self.ffmc * self.windSpeed
+        self.cfb = 1.0 if self.useCrownBaseHeight else 0.0
+        self.isi = self.fuelType
+        for key in redapp.FBP_BATCH_OUTPUTS:
+            if not hasattr(self, key):
+                setattr(self, key, 0.0)
+
+
+class _MockCalendar():
+    """ Stand in for java.util.Calendar and java.util.TimeZone """
+
+    @staticmethod
+    def getInstance(_):
+        """ Return a calendar """
+        return _MockCalendar()
+
+    @staticmethod
+    def getTimeZone(_):
+        """ Return a time zone """
+
+    def set(self, *_):
+        """ Set the date """
+
+
+@pytest.fixture(name='mock_java')
+def fixture_mock_java(monkeypatch):
+    """ Replace the java classes """
+    classes = redapp.JavaClasses(Calendar=_MockCalendar, TimeZone=_MockCalendar,
+                                 FWICalculations=None, FBPCalculations=_MockFBPCalculations, CwfgmFwi=None)
+    monkeypatch.setattr(redapp, 'java_classes', lambda: classes)
+    monkeypatch.setattr(redapp, '_detach', lambda: None)
+
+
+@pytest.mark.usefixtures('mock_java')
+def test_fbp_batch():
+    """ Scalar inputs are broadcast, and optional inputs defaulted, for each calculation in the batch """
+    result = redapp.FBPCalculateStatisticsBatch(
+        elevation=700, latitude=50.7, longitude=-120.5, time_of_interest=datetime(2021, 7, 5, 20, tzinfo=timezone.utc),
+        fuel_type=['C2', 'O1A', 'C3'], ffmc=[90, 92, 94], dmc=40, dc=300, bui=60, wind_speed=10, wind_direction=180,
+        percentage_conifer=None, percentage_dead_balsam_fir=None, grass_cure=[None, 60, None],
+        crown_base_height=[3, None, 8])
+    assert result['hfi'] == pytest.approx(np.array([900, 920, 940]))
+    assert result['cfb'] == pytest.approx(np.array([1, 0, 1]))
+    assert result['isi'] == pytest.approx(np.array([1, 16, 2]))
+
+
+@pytest.mark.usefixtures('mock_java')
+def test_fbp_batch_unmapped_fuel_type():
+    """ An unmapped fuel type fails the whole batch """
+    with pytest.raises(redapp.UnmappedFuelType):
+        redapp.FBPCalculateStatisticsBatch(
+            700, 50.7, -120.5, datetime(2021, 7, 5, 20, tzinfo=timezone.utc), ['C2', 'X9'], 90, 40, 300, 60, 10, 180,
+            None, None, None, None)
+
+
+@pytest.mark.usefixtures('mock_java')
+def test_worker_inline_when_disabled(monkeypatch, run_until_complete, new_singleton_instance):
+    """ With the worker disabled, calculations are done in the calling process """
+    monkeypatch.setenv('REDAPP_WORKER_ENABLED', 'False')
+    worker = new_singleton_instance(REDappWorker)
+    result = run_until_complete(worker.calculate_fbp(
+        elevation=700, latitude=50.7, longitude=-120.5, time_of_interest=datetime(2021, 7, 5, 20, tzinfo=timezone.utc),
+        fuel_type='C2', ffmc=[90, 92], dmc=40, dc=300, bui=60, wind_speed=10, wind_direction=180,
+        percentage_conifer=None, percentage_dead_balsam_fir=None, grass_cure=None, crown_base_height=3))
+    assert result['hfi'] == pytest.approx(np.array([900, 920]))
+    assert worker._executor is None
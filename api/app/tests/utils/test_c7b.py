@@ -1,4 +1,7 @@
-from app.fire_behaviour import c7b
+import math
+import numpy as np
+import pytest
+from app.fire_behaviour import c7b, fbp
 
 
 def test_ros():
@@ -21,3 +24,28 @@ def test_ros():
     # spreadsheet example 2.66:
     assert c7b.rate_of_spread(ffmc=93.9, bui=201, wind_speed=10,
                               percentage_slope=0, cc=80) == 2.6636471840719254
+
+
+def test_ros_arrays():
+    # Calculating many rates of spread at once gives the same results as calculating them one at a time.
+    ffmc = np.array([93.9, 93.9, 93.9, 88.0])
+    bui = np.array([50, 100, 201, 80])
+    wind_speed = np.array([10, 10, 20, 5])
+    cc = np.array([20, 40, 100, 60])
+    ros = c7b.rate_of_spread(ffmc=ffmc, bui=bui, wind_speed=wind_speed, percentage_slope=0, cc=cc)
+    for index in range(len(ffmc)):
+        assert ros[index] == pytest.approx(c7b.rate_of_spread(
+            ffmc=ffmc[index], bui=bui[index], wind_speed=wind_speed[index], percentage_slope=0, cc=cc[index]))
+
+
+def test_fire_behaviour():
+    # With the curing factor at 1, C7b behaves as C7.
+    cc = 82 - math.log(1.25924 - 1) / 0.075
+    result = c7b.calculate_fire_behaviour(ffmc=[93.9, 90], bui=[150, 80], wind_speed=[10, 20], fmc=95, cc=cc,
+                                          cbh=10, cfl=0.5)
+    expected = fbp.calculate_fire_behaviour('C7', fbp.initial_spread_index([93.9, 90], [10, 20]), [150, 80],
+                                            [93.9, 90], [10, 20], 95, None, None, None, 10, 0.5)
+    for name in ('ros', 'sfc', 'cfb', 'hfi', 'bros', 'lb'):
+        assert getattr(result, name) == pytest.approx(getattr(expected, name), rel=1e-3)
+    fire_size = c7b.sixty_minute_fire_size(result.ros, result.bros, result.lb, result.cfb)
+    assert np.all(fire_size > 0)
@@ -1,7 +1,7 @@
 """ Unit testing for CFFDRS functions """
 import pytest
 from app.schemas.fba_calc import FuelTypeEnum
-from app.fire_behaviour import cffdrs
+from app.fire_behaviour import cffdrs, fwi
 
 
 def test_ros():
@@ -29,3 +29,63 @@ def test_ros_no_params():
     with pytest.raises(cffdrs.CFFDRSException):
         cffdrs.rate_of_spread(FuelTypeEnum.C7, None, None, None, None, pc=100, pdf=None,
                               cc=None, cbh=10)
+
+
+def test_batched_matches_scalar():
+    """ One batched call gives the same results as calling R once per station-day """
+    fuel_types = [FuelTypeEnum.C2, FuelTypeEnum.C7, FuelTypeEnum.O1A]
+    pc, cc, cbh, cfl = [100, 100, None], [None, None, 60], [3, 10, None], [0.8, 0.5, None]
+    fmc = 95.0
+    result = cffdrs.CFFDRS.instance().calculate_fire_behaviour(
+        [fuel_type.value for fuel_type in fuel_types], 10, 80, 90, 15, fmc, pc, cc, None, cbh, cfl)
+    for index, fuel_type in enumerate(fuel_types):
+        sfc = cffdrs.surface_fuel_consumption(fuel_type, 80, 90, pc[index])
+        ros = cffdrs.rate_of_spread(fuel_type, 10, 80, fmc, sfc, pc=pc[index], cc=cc[index], pdf=None,
+                                    cbh=cbh[index])
+        assert result.sfc[index] == pytest.approx(sfc)
+        assert result.ros[index] == pytest.approx(ros)
+        assert result.lb[index] == pytest.approx(cffdrs.length_to_breadth_ratio(fuel_type, 15))
+    # O1A has no crown, so no crown fraction burned.
+    assert result.cfb[2] == 0
+
+
+def test_ffmc_for_target_hfi():
+    """ The FFMC found results in an HFI within 1% of the target """
+    ffmc, hfi = cffdrs.get_ffmc_for_target_hfi(FuelTypeEnum.C3, 100, None, 80, 20, None, 8, 95, 0.5, 1.15, 4000)
+    assert hfi == pytest.approx(4000, rel=0.01)
+    assert cffdrs._head_fire_intensity_for_ffmc(FuelTypeEnum.C3, 100, None, 80, 20, None, 8, ffmc, 95, 0.5,
+                                                1.15) == pytest.approx(hfi)
+
+
+def test_ffmc_for_unreachable_target_hfi():
+    """ If even an FFMC of 101 doesn't reach the target, 101 is returned """
+    ffmc, hfi = cffdrs.get_ffmc_for_target_hfi(FuelTypeEnum.D1, None, None, 20, 0, None, None, 95, 0, 1.0, 10000)
+    assert ffmc == 101
+    assert hfi < 10000
+
+
+def test_ffmc_for_target_hfi_is_cached():
+    """ Inputs that only differ by less than the quantization step reuse the cached result """
+    cffdrs._solve_ffmc_for_target_hfi.cache_clear()
+    first = cffdrs.get_ffmc_for_target_hfi(FuelTypeEnum.C2, 100, None, 60, 15, None, 3, 95.01, 0.8, 0.8, 4000)
+    second = cffdrs.get_ffmc_for_target_hfi(FuelTypeEnum.C2, 100, None, 60, 15, None, 3, 95.02, 0.8, 0.8, 4000)
+    assert first == second
+    assert cffdrs._solve_ffmc_for_target_hfi.cache_info().hits == 1
+
+
+def test_hourly_ffmc_on_diurnal_curves():
+    """ The diurnal curves for many stations match computing one station-hour at a time """
+    curves = cffdrs.get_hourly_ffmc_on_diurnal_curves([90, 85], [25, 20], [30, 40], [15, 10], [0, 1], hours=[7, 13, 20])
+    for station, (ffmc, temp, rh, ws, precip) in enumerate([(90, 25, 30, 15, 0), (85, 20, 40, 10, 1)]):
+        for index, hour in enumerate([7, 13, 20]):
+            assert curves[station, index] == pytest.approx(
+                cffdrs.get_hourly_ffmc_on_diurnal_curve(ffmc, hour, temp, rh, ws, precip))
+
+
+def test_batched_hourly_ffmc_series():
+    """ A single hffmc call for many stations gives the same series as the numpy implementation """
+    temp = [[20.0, 22.0, 25.0], [15.0, 15.0, 15.0]]
+    rh = [[40.0, 35.0, 30.0], [90.0, 95.0, 95.0]]
+    prec = [[0.0, 0.0, 0.0], [0.0, 1.5, 0.2]]
+    result = cffdrs.CFFDRS.instance().calculate_hourly_ffmc([85, 80], temp, rh, 10, prec)
+    assert result == pytest.approx(fwi.calculate_hourly_ffmc([85, 80], temp, rh, 10, prec))
@@ -129,7 +129,7 @@ def mock_download(monkeypatch):
         with open(filename, 'rb') as file:
             content = file.read()
         return MockResponse(status_code=200, content=content)
-    monkeypatch.setattr(requests, 'get', mock_requests_get_gdps)
+    monkeypatch.setattr(requests.Session, 'get', mock_requests_get_gdps)
 
 
 @pytest.fixture()
@@ -138,7 +138,7 @@ def mock_download_fail(monkeypatch):
     def mock_requests_get(*args, **kwargs):
         """ mock env_canada download method """
         return MockResponse(status_code=400)
-    monkeypatch.setattr(requests, 'get', mock_requests_get)
+    monkeypatch.setattr(requests.Session, 'get', mock_requests_get)
 
 
 def test_get_gdps_download_urls():
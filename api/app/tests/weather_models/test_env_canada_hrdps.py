@@ -68,6 +68,9 @@ def mock_database(monkeypatch):
     monkeypatch.setattr(app.jobs.env_canada, 'get_processed_file_record', mock_get_processed_file_record)
     monkeypatch.setattr(app.jobs.common_model_fetchers, 'get_grids_for_coordinate', mock_get_grids_for_coordinate)
     monkeypatch.setattr(app.db.crud.weather_models, 'get_prediction_run', mock_get_prediction_run)
+    # None of the model run is packed.
+    monkeypatch.setattr(app.db.crud.weather_models, 'get_model_run_grid_subset_prediction_array',
+                        lambda *args: None)
 
 
 @pytest.fixture()
@@ -96,7 +99,7 @@ def mock_download(monkeypatch):
         with open(filename, 'rb') as file:
             content = file.read()
         return MockResponse(status_code=200, content=content)
-    monkeypatch.setattr(requests, 'get', mock_requests_get_hrdps)
+    monkeypatch.setattr(requests.Session, 'get', mock_requests_get_hrdps)
 
 
 def test_get_hrdps_download_urls():
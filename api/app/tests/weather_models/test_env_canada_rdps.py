@@ -65,6 +65,9 @@ def mock_database(monkeypatch):
     monkeypatch.setattr(app.jobs.env_canada, 'get_processed_file_record', mock_get_processed_file_record)
     monkeypatch.setattr(app.jobs.common_model_fetchers, 'get_grids_for_coordinate', mock_get_grids_for_coordinate)
     monkeypatch.setattr(app.db.crud.weather_models, 'get_prediction_run', mock_get_prediction_run)
+    # None of the model run is packed.
+    monkeypatch.setattr(app.db.crud.weather_models, 'get_model_run_grid_subset_prediction_array',
+                        lambda *args: None)
 
 
 @pytest.fixture()
@@ -93,7 +96,7 @@ def mock_download(monkeypatch):
         with open(filename, 'rb') as file:
             content = file.read()
         return MockResponse(status_code=200, content=content)
-    monkeypatch.setattr(requests, 'get', mock_requests_get_rdps)
+    monkeypatch.setattr(requests.Session, 'get', mock_requests_get_rdps)
 
 
 @pytest.fixture()
@@ -102,7 +105,7 @@ def mock_download_fail(monkeypatch):
     def mock_requests_get(*args, **kwargs):
         """ mock env_canada download method """
         return MockResponse(status_code=400)
-    monkeypatch.setattr(requests, 'get', mock_requests_get)
+    monkeypatch.setattr(requests.Session, 'get', mock_requests_get)
 
 
 def test_get_rdps_download_urls():
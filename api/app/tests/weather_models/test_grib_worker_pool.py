@@ -0,0 +1,67 @@
+""" Unit tests for app/weather_models/grib_worker_pool.py """
+import os
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+from app.weather_models import grib_worker_pool
+from app.weather_models.grib_worker_pool import GribWorkerPool
+
+
+class MockProcessor():
+    """ Stand in for GribFileProcessor, "extracting" the name of the file """
+    stations = []
+
+    def extract_station_values(self, filename, grib_info):
+        if filename.endswith('corrupt'):
+            raise ValueError('corrupt grib file')
+        return os.path.basename(filename)
+
+
+class BrokenExecutor():
+    """ Process pool in which every worker has died """
+
+    def submit(self, *args, **kwargs):
+        future = Future()
+        future.set_exception(BrokenProcessPool('worker died'))
+        return future
+
+    def shutdown(self, *args, **kwargs):
+        pass
+
+
+@pytest.fixture()
+def grib_files(tmpdir):
+    """ Some (empty) files to extract """
+    filenames = []
+    for name in ('a', 'corrupt', 'b'):
+        filename = os.path.join(tmpdir, name)
+        with open(filename, 'wb') as file:
+            file.write(b'grib')
+        filenames.append(filename)
+    return filenames
+
+
+def test_extract_inline(monkeypatch, grib_files):
+    """ Without workers, files are extracted in order, and failures are handed back rather than raised """
+    monkeypatch.setattr(grib_worker_pool.config, 'get', lambda key, default=None: default)
+    pool = GribWorkerPool(MockProcessor())
+
+    results = list(pool.extract((index, filename, None) for index, filename in enumerate(grib_files)))
+
+    assert [(key, extracted) for key, extracted, _ in results] == [(0, 'a'), (1, None), (2, 'b')]
+    assert isinstance(results[1][2], ValueError)
+    assert pool.throughput[os.getpid()].files == 2
+    assert pool.throughput[os.getpid()].file_size == 8
+
+
+def test_broken_pool_degrades_to_inline(monkeypatch, grib_files):
+    """ When the workers die, the files are extracted inline instead """
+    monkeypatch.setattr(grib_worker_pool.config, 'get',
+                        lambda key, default=None: '2' if key == 'GRIB_WORKER_POOL_SIZE' else default)
+    pool = GribWorkerPool(MockProcessor())
+    monkeypatch.setattr(pool, '_get_executor', BrokenExecutor)
+
+    results = list(pool.extract((filename, filename, None) for filename in grib_files[::2]))
+
+    assert [extracted for _, extracted, _ in results] == ['a', 'b']
+    assert pool.size == 0
@@ -0,0 +1,97 @@
+""" Unit tests for app/weather_models/grid_predictions.py """
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+import pytest
+from app.db.models.observations import HourlyActual
+from app.db.models.weather_models import (ModelRunGridSubsetPrediction, ModelRunGridSubsetPredictionArray,
+                                          PredictionModelGridSubset, PredictionModelRunTimestamp)
+from app.weather_models import grid_predictions
+
+RUN_TIMESTAMP = datetime(2023, 5, 29, 0, tzinfo=timezone.utc)
+
+
+def make_prediction(run_id: int, grid_id: int, hours: int, temperature: float, rh=None):
+    """ A prediction of the run for the grid, hours after RUN_TIMESTAMP """
+    return ModelRunGridSubsetPrediction(
+        prediction_model_run_timestamp_id=run_id, prediction_model_grid_subset_id=grid_id,
+        prediction_timestamp=RUN_TIMESTAMP + timedelta(hours=hours),
+        tmp_tgl_2=[temperature] * 4, rh_tgl_2=rh, apcp_sfc_0=[0.5, 1.5, 2.5, 3.5],
+        wdir_tgl_10=[90.0, 180.0, 270.0, 359.0], wind_tgl_10=[1.0, 2.0, 3.0, 4.0])
+
+
+def make_array(predictions) -> ModelRunGridSubsetPredictionArray:
+    """ Pack the predictions into an array record """
+    return ModelRunGridSubsetPredictionArray(**grid_predictions.pack_predictions(predictions))
+
+
+def test_pack_unpack():
+    """ Packed predictions unpack to the same values, in order of prediction timestamp """
+    predictions = [make_prediction(1, 2, 3, 10.25, [50.0, 51.0, 52.0, 53.0]), make_prediction(1, 2, 0, -2.75)]
+    array = make_array(predictions)
+    assert len(array.values) == 2 * 5 * 4 * 4
+    assert array.last_prediction_timestamp == RUN_TIMESTAMP + timedelta(hours=3)
+
+    unpacked = grid_predictions.unpack_predictions(array)
+    assert [prediction.prediction_timestamp for prediction in unpacked] == [
+        RUN_TIMESTAMP, RUN_TIMESTAMP + timedelta(hours=3)]
+    for prediction, expected in zip(unpacked, reversed(predictions)):
+        assert prediction.prediction_model_run_timestamp_id == 1
+        assert prediction.prediction_model_grid_subset_id == 2
+        for variable in grid_predictions.PACKED_VARIABLES:
+            assert getattr(prediction, variable) == getattr(expected, variable)
+
+
+def test_get_model_run_predictions_for_grid(monkeypatch):
+    """ Predictions stored as rows take the place of packed predictions for the same timestamp """
+    crud = grid_predictions.weather_models_crud
+    monkeypatch.setattr(crud, 'get_model_run_grid_subset_prediction_array', lambda *args: make_array(
+        [make_prediction(1, 2, hours, 10.0) for hours in (0, 3, 6)]))
+    monkeypatch.setattr(crud, 'get_model_run_predictions_for_grid', lambda *args: [
+        make_prediction(1, 2, 9, 30.0), make_prediction(1, 2, 3, 20.0)])
+
+    predictions = grid_predictions.get_model_run_predictions_for_grid(
+        MagicMock(), PredictionModelRunTimestamp(id=1), PredictionModelGridSubset(id=2))
+    assert [(prediction.prediction_timestamp.hour, prediction.tmp_tgl_2[0]) for prediction in predictions] == [
+        (0, 10.0), (3, 20.0), (6, 10.0), (9, 30.0)]
+
+
+def test_pack_model_run(monkeypatch):
+    """ The rows of a model run are packed a record per grid subset, and deleted """
+    crud = grid_predictions.weather_models_crud
+    upserted = []
+    deleted = []
+    monkeypatch.setattr(crud, 'get_model_run_grid_subset_prediction_arrays_for_run', lambda *args: [])
+    monkeypatch.setattr(crud, 'get_model_run_grid_subset_predictions', lambda *args: [
+        make_prediction(1, 2, 0, 10.0), make_prediction(1, 2, 3, 11.0), make_prediction(1, 4, 0, 12.0)])
+    monkeypatch.setattr(crud, 'upsert_model_run_grid_subset_prediction_arrays',
+                        lambda session, arrays: upserted.extend(arrays))
+    monkeypatch.setattr(crud, 'delete_model_run_grid_subset_predictions',
+                        lambda session, prediction_run: deleted.append(prediction_run.id))
+
+    assert grid_predictions.pack_model_run(MagicMock(), PredictionModelRunTimestamp(id=1)) == 2
+    assert [(array['prediction_model_grid_subset_id'], len(array['prediction_timestamps']))
+            for array in upserted] == [(2, 2), (4, 1)]
+    assert deleted == [1]
+
+
+@pytest.mark.parametrize('row_run_hours, expected_temperature', [(-6, 20.0), (6, 30.0)])
+def test_actuals_paired_with_packed_predictions(monkeypatch, row_run_hours, expected_temperature):
+    """ Actuals are paired with the prediction of the most recent model run, packed or not """
+    crud = grid_predictions.weather_models_crud
+    actuals = [HourlyActual(station_code=100, weather_date=RUN_TIMESTAMP + timedelta(hours=hours),
+                            temperature=15.0, relative_humidity=40.0) for hours in (3, 6, 9)]
+    # Run 2 (packed) is more recent than run 1 (packed), run 3 (rows) is either older or more recent.
+    run_timestamps = {1: RUN_TIMESTAMP - timedelta(hours=12), 2: RUN_TIMESTAMP,
+                      3: RUN_TIMESTAMP + timedelta(hours=row_run_hours)}
+    monkeypatch.setattr(grid_predictions.observations_crud, 'get_actuals_paired_with_predictions', lambda *args: [
+        (actuals[0], None), (actuals[1], make_prediction(3, 5, 6, 30.0)), (actuals[2], None)])
+    monkeypatch.setattr(crud, 'get_model_run_grid_subset_prediction_arrays', lambda *args: [
+        (make_array([make_prediction(1, 5, hours, 10.0) for hours in (3, 6, 9)]), run_timestamps[1]),
+        (make_array([make_prediction(2, 5, hours, 20.0) for hours in (3, 6)]), run_timestamps[2])])
+    monkeypatch.setattr(crud, 'get_prediction_run_timestamps',
+                        lambda session, ids: {run_id: run_timestamps[run_id] for run_id in ids})
+
+    rows = grid_predictions.get_actuals_paired_with_predictions(
+        MagicMock(), 1, {100: 5}, RUN_TIMESTAMP, RUN_TIMESTAMP + timedelta(hours=9))
+    assert [actual for actual, _ in rows] == actuals
+    assert [prediction.tmp_tgl_2[0] for _, prediction in rows] == [20.0, expected_temperature, 10.0]
@@ -2,10 +2,11 @@
 result.
 """
 from datetime import datetime
+import numpy as np
 import pytest
 from pytest_bdd import scenario, given, parsers, then, when
 from app.tests import _load_json_file
-from app.db.models.weather_models import PredictionModel, PredictionModelGridSubset
+from app.db.models.weather_models import PredictionModel, PredictionModelGridSubset, PredictionModelBiasCoefficient
 from app.weather_models import machine_learning
 from app.tests.weather_models.crud import get_actuals_left_outer_join_with_predictions
 from app.tests.common import str2float
@@ -72,3 +73,88 @@ def assert_rh(instance: machine_learning.StationMachineLearning,
     """ Assert that the ML algorithm predicts the relative humidity correctly """
     result = instance.predict_rh(model_rh, timestamp)
     assert result == bias_adjusted_rh
+
+
+def test_learn_bias_adjustment_reuses_stored_coefficients(monkeypatch):
+    """ Only stations with new actuals are refitted, from a single query, and their coefficients stored """
+    latest_actual = datetime(2020, 10, 11, 21)
+    stored = [PredictionModelBiasCoefficient(station_code=1, prediction_model_grid_subset_id=10, hour=21,
+                                             variable='temperature', intercept=1.0, slope=2.0, sample_count=5,
+                                             latest_actual_date=latest_actual),
+              PredictionModelBiasCoefficient(station_code=2, prediction_model_grid_subset_id=20, hour=21,
+                                             variable='temperature', intercept=1.0, slope=2.0, sample_count=5,
+                                             latest_actual_date=datetime(2020, 10, 10, 21))]
+    queried = []
+    saved = []
+
+    def mock_get_actuals_paired_with_predictions(session, model_id, station_grids, start_date, end_date):
+        queried.append(station_grids)
+        rows = get_actuals_left_outer_join_with_predictions()
+        for actual, _ in rows:
+            actual.station_code = 2
+        return rows
+
+    monkeypatch.setattr(machine_learning, 'get_latest_actual_dates',
+                        lambda *args: [(1, latest_actual), (2, latest_actual)])
+    monkeypatch.setattr(machine_learning, 'get_bias_coefficients', lambda *args: stored)
+    monkeypatch.setattr(machine_learning, 'get_actuals_paired_with_predictions',
+                        mock_get_actuals_paired_with_predictions)
+    monkeypatch.setattr(machine_learning, 'save_bias_coefficients',
+                        lambda session, model_id, station_codes, coefficients: saved.append((station_codes, coefficients)))
+    weights = [0.25, 0.25, 0.25, 0.25]
+
+    bias_adjustment = machine_learning.learn_bias_adjustment(
+        None, 1, {1: (10, weights), 2: (20, weights), 3: (30, weights)}, latest_actual)
+
+    # station 1 is up to date, station 2 has new actuals, and station 3 doesn't have any actuals.
+    assert queried == [{2: 20}]
+    assert saved[0][0] == [2]
+    assert {coefficient['hour'] for coefficient in saved[0][1]} == {18, 20, 21}
+    assert bias_adjustment.predict_temperature(1, 20, datetime(2020, 10, 12, 21)) == 41
+    assert bias_adjustment.predict_temperature(2, 20, datetime(2020, 10, 12, 21)) == pytest.approx(30)
+    assert bias_adjustment.predict_temperature(3, 20, datetime(2020, 10, 12, 21)) is None
+    adjusted = bias_adjustment.adjust(1, 'temperature', [10, None], [21, 21])
+    assert adjusted[0] == 21 and np.isnan(adjusted[1])
+
+
+def test_learn_bias_adjustment_incrementally(monkeypatch):
+    """ Only the actuals since the last update are added to the stored statistics, which fade out """
+    monkeypatch.setenv('BIAS_ADJUSTMENT_INCREMENTAL', 'True')
+    monkeypatch.setenv('BIAS_ADJUSTMENT_HALF_LIFE_DAYS', '1')
+    updated = datetime(2020, 10, 10, 21)
+    latest_actual = datetime(2020, 10, 11, 21)
+    # The 21h sample of the first day (x is the interpolated prediction, y the actual).
+    stored = [PredictionModelBiasCoefficient(station_code=None, prediction_model_grid_subset_id=10, hour=21,
+                                             variable='temperature', intercept=30.0, slope=0.0, sample_count=1,
+                                             sample_weight=1.0, sum_x=2.5, sum_y=30.0, sum_xx=6.25, sum_xy=75.0,
+                                             latest_actual_date=updated)]
+    queried = []
+    saved = []
+
+    def mock_get_actuals_paired_with_predictions(session, model_id, station_grids, start_date, end_date):
+        queried.append((station_grids, start_date))
+        return get_actuals_left_outer_join_with_predictions()
+
+    monkeypatch.setattr(machine_learning, 'get_latest_actual_dates', lambda *args: [(None, latest_actual)])
+    monkeypatch.setattr(machine_learning, 'get_bias_coefficients', lambda *args: stored)
+    monkeypatch.setattr(machine_learning, 'get_actuals_paired_with_predictions',
+                        mock_get_actuals_paired_with_predictions)
+    monkeypatch.setattr(machine_learning, 'save_bias_coefficients',
+                        lambda session, model_id, station_codes, coefficients: saved.extend(coefficients))
+
+    bias_adjustment = machine_learning.learn_bias_adjustment(
+        None, 1, {None: (10, [0.25, 0.25, 0.25, 0.25])}, latest_actual)
+
+    # Going back far enough to interpolate noon of the first new day.
+    assert queried == [({None: 10}, datetime(2020, 10, 10, 18))]
+    saved = {(coefficient['hour'], coefficient['variable']): coefficient for coefficient in saved}
+    # The stored sample is a day old, so has half the weight of the new one.
+    assert saved[(21, 'temperature')]['sample_weight'] == pytest.approx(1.5)
+    assert saved[(21, 'temperature')]['sum_y'] == pytest.approx(45)
+    assert saved[(21, 'temperature')]['sample_count'] == 2
+    # Only the new day's samples are added for the other hours, weighted by how long before the latest actual.
+    assert saved[(20, 'temperature')]['sample_count'] == 1
+    assert saved[(18, 'temperature')]['sum_y'] == pytest.approx(20 * 0.5 ** (3 / 24))
+    assert all(coefficient['latest_actual_date'] == latest_actual for coefficient in saved.values())
+    assert bias_adjustment.predict_temperature(None, 20, datetime(2020, 10, 12, 21)) == pytest.approx(30)
+    assert bias_adjustment.predict_temperature(None, 20, datetime(2020, 10, 12, 20)) == pytest.approx(27)
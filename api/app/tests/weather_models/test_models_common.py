@@ -8,9 +8,18 @@ from app.db.models.weather_models import (ProcessedModelRunUrl,
 class MockResponse:
     """ Mocked out request.Response object """
 
-    def __init__(self, status_code, content=None):
+    def __init__(self, status_code, content=None, headers=None):
         self.status_code = status_code
         self.content = content
+        self.headers = {} if headers is None else headers
+
+    def iter_content(self, chunk_size=1):
+        """ Return the content in chunks """
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        """ Release the connection """
 
 
 def mock_get_model_run_predictions(*args):
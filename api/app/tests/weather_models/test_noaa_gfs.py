@@ -75,7 +75,7 @@ def mock_download(monkeypatch):
         with open(filename, 'rb') as file:
             content = file.read()
         return MockResponse(status_code=200, content=content)
-    monkeypatch.setattr(requests, 'get', mock_requests_get_gfs)
+    monkeypatch.setattr(requests.Session, 'get', mock_requests_get_gfs)
 
 
 def test_get_gfs_model_run_download_urls_for_00_utc():
@@ -2,10 +2,15 @@ import pytest
 import os
 from osgeo import gdal
 from datetime import datetime, timezone
+from types import SimpleNamespace
+import numpy as np
+from pyproj import CRS
 import requests
 
+from app.geospatial import NAD83_CRS
 from app.weather_models import process_grib
 from app.weather_models import ModelEnum, ProjectionEnum
+from app.stations import StationSourceEnum
 from app.jobs import noaa
 from app.tests.weather_models.test_models_common import MockResponse
 
@@ -48,3 +53,69 @@ def test_calculate_wind_direction_from_uv():
         calculated_wind_direction = process_grib.calculate_wind_dir_from_u_v(
             test_case['u_float'], test_case['v_float'])
         assert round(calculated_wind_direction, 0) == test_case['expected_wind_direction']
+
+
+def test_calculate_wind_from_uv_arrays():
+    u = np.array([test_case['u_float'] for test_case in sample_values_json])
+    v = np.array([test_case['v_float'] for test_case in sample_values_json])
+    assert np.round(process_grib.calculate_wind_speeds_from_u_v(u, v), 2).tolist() == \
+        [test_case['expected_wind_speed'] for test_case in sample_values_json]
+    assert np.round(process_grib.calculate_wind_dirs_from_u_v(u, v), 0).tolist() == \
+        [test_case['expected_wind_direction'] for test_case in sample_values_json]
+
+
+def test_yield_data_for_stations_matches_surrounding_grid():
+    """ Values for all the stations, read in one go, match reading the grid around each station """
+    filename = os.path.join(os.path.dirname(__file__),
+                            'CMC_hrdps_continental_RH_TGL_2_ps2.5km_2020100700_P007-00.grib2')
+    dataset = process_grib.open_grib(filename)
+    raster_band = dataset.GetRasterBand(1)
+    processor = process_grib.GribFileProcessor.__new__(process_grib.GribFileProcessor)
+    processor.stations = [SimpleNamespace(code=code, long=long, lat=lat) for code, long, lat in (
+        (1, -120.4816667, 50.6733333), (2, -123.1, 49.3), (3, -127.5, 54.8), (4, 10.0, -80.0))]
+    processor.padf_transform = process_grib.get_dataset_geometry(filename)
+    processor.geo_to_raster_transformer = process_grib.get_transformer(
+        NAD83_CRS, CRS.from_string(dataset.GetProjection()))
+    processor.station_pixels_cache = {}
+
+    expected = []
+    for station in processor.stations[:3]:
+        x, y = process_grib.calculate_raster_coordinate(
+            station.long, station.lat, processor.padf_transform, processor.geo_to_raster_transformer)
+        expected.append(process_grib.get_surrounding_grid(raster_band, x, y))
+    # the last station isn't in the raster.
+    assert list(processor.yield_data_for_stations(raster_band)) == expected
+
+
+def test_store_station_values_upserts_once(monkeypatch):
+    """ All the values of a grib file are stored in a single upsert, keyed on the grid subset of each station """
+    upserts = []
+
+    def mock_upsert(session, prediction_model_run_timestamp_id, prediction_timestamp, predictions):
+        upserts.append((prediction_model_run_timestamp_id, prediction_timestamp, predictions))
+
+    monkeypatch.setattr(process_grib, 'upsert_model_run_grid_subset_predictions', mock_upsert)
+    monkeypatch.setattr(process_grib, 'get_prediction_model', lambda *args: SimpleNamespace(id=1))
+    monkeypatch.setattr(process_grib, 'get_or_create_prediction_run', lambda *args: SimpleNamespace(id=42))
+
+    processor = process_grib.GribFileProcessor(StationSourceEnum.TEST, stations=[
+        SimpleNamespace(code=code) for code in (101, 102, 103)])
+    grid_index = {101: SimpleNamespace(prediction_model_grid_subset_id=1),
+                  103: SimpleNamespace(prediction_model_grid_subset_id=2)}
+    monkeypatch.setattr(processor, 'get_station_grid_index', lambda session, x_size, y_size: grid_index)
+    # the second station isn't in the raster.
+    station_pixels = process_grib.StationPixels(np.array([0, 2]), np.array([0, 5]), np.array([0, 5]), 0, 0, 7, 7)
+    session = SimpleNamespace(commits=0)
+    session.commit = lambda: setattr(session, 'commits', session.commits + 1)
+    timestamp = datetime(2020, 10, 7, 7, tzinfo=timezone.utc)
+    grib_info = process_grib.ModelRunInfo(model_enum=ModelEnum.GFS, prediction_timestamp=timestamp)
+    extracted = process_grib.ExtractedGribValues(
+        grib_info, NAD83_CRS.to_wkt(), process_grib.Affine.identity().to_gdal(), 10, 10, station_pixels,
+        {'tmp_tgl_2': np.array([[1.0, 2.0, 3.0, 4.0], [5.0, 6.0, 7.0, 8.0]]),
+         'rh_tgl_2': np.array([[10.0, 20.0, 30.0, 40.0], [50.0, 60.0, 70.0, 80.0]])})
+
+    processor.store_station_values(extracted, session)
+
+    assert session.commits == 1
+    assert upserts == [(42, timestamp, {1: {'tmp_tgl_2': [1.0, 2.0, 3.0, 4.0], 'rh_tgl_2': [10.0, 20.0, 30.0, 40.0]},
+                                        2: {'tmp_tgl_2': [5.0, 6.0, 7.0, 8.0], 'rh_tgl_2': [50.0, 60.0, 70.0, 80.0]}})]
@@ -0,0 +1,84 @@
+""" Unit tests for app/weather_models/station_grid_index.py """
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from scipy.interpolate import griddata
+from affine import Affine
+from app.weather_models import station_grid_index
+from app.weather_models.station_grid_index import (StationGridCell, StationGridIndex, calculate_closest_index,
+                                                   calculate_interpolation_weights, get_grid_geometry, interpolate)
+
+points = [[-120.525, 50.775], [-120.375, 50.775], [-120.375, 50.625], [-120.525, 50.625]]
+
+
+@pytest.mark.parametrize('coordinate', [[-120.425, 50.7], [-120.5, 50.65], [-120.4, 50.76], [-120.525, 50.775]])
+def test_interpolation_weights_match_griddata(coordinate):
+    """ Interpolating with the weights is the same as interpolating with griddata """
+    weights = calculate_interpolation_weights(points, coordinate)
+    for values in ([2, 3, 4, 5], [10, 20, 30, 40], [0.5, 0.1, 3.2, 0.0]):
+        assert np.dot(weights, values) == pytest.approx(griddata(points, values, coordinate, method='linear')[0])
+
+
+def test_interpolation_weights_outside_grid():
+    assert calculate_interpolation_weights(points, [-121, 50.7]) is None
+
+
+def test_interpolate_all_at_once():
+    """ Rows of values (e.g. every variable of every prediction) are interpolated in one go """
+    coordinate = [-120.425, 50.7]
+    values = np.array([[[2, 3, 4, 5], [10, 20, 30, 40]], [[0.5, 0.1, 3.2, 0.0], [np.nan] * 4]])
+    interpolated = interpolate(values, calculate_interpolation_weights(points, coordinate))
+    assert interpolated.shape == (2, 2)
+    for index in np.ndindex(2, 2):
+        expected = griddata(points, values[index], coordinate, method='linear')[0]
+        assert interpolated[index] == pytest.approx(expected, nan_ok=True)
+    assert np.isnan(interpolate(values, None)).all()
+
+
+def test_closest_index():
+    assert calculate_closest_index(points, [-120.5, 50.65]) == 3
+    assert calculate_closest_index(points, [-120.4, 50.76]) == 1
+
+
+def test_grid_geometry():
+    """ Grids are only the same if their transform, projection and size are """
+    transform = Affine(0.15, 0, -180, 0, -0.15, 90)
+    geometry = get_grid_geometry(transform, 'proj=longlat', 2400, 1201)
+    assert geometry == get_grid_geometry(Affine(0.15, 0, -180, 0, -0.15, 90), 'proj=longlat', 2400, 1201)
+    assert geometry != get_grid_geometry(transform, 'proj=longlat', 2400, 1200)
+    assert geometry != get_grid_geometry(transform, 'proj=stere', 2400, 1201)
+
+
+def _cell(station_code: int, grid_geometry: str, grid_subset_id: int) -> StationGridCell:
+    return StationGridCell(station_code=station_code, grid_geometry=grid_geometry, latitude=50.7, longitude=-120.425,
+                           prediction_model_grid_subset_id=grid_subset_id, x_index=1, y_index=2,
+                           weights=[0.25, 0.25, 0.25, 0.25], closest_index=0)
+
+
+def test_index_loads_once_and_replaces_other_geometries(monkeypatch):
+    """ The index is only loaded from the database once, and saving a new geometry discards the old one """
+    loads = []
+    saves = []
+
+    def mock_get_station_grid_indexes(session, prediction_model_id):
+        loads.append(prediction_model_id)
+        return [SimpleNamespace(**_cell(1, 'old', 10)._asdict()), SimpleNamespace(**_cell(2, 'old', 11)._asdict())]
+
+    def mock_save_station_grid_indexes(session, prediction_model_id, grid_geometry, station_grid_indexes):
+        saves.append((prediction_model_id, grid_geometry, [record['station_code'] for record in station_grid_indexes]))
+
+    monkeypatch.setattr(station_grid_index, 'get_station_grid_indexes', mock_get_station_grid_indexes)
+    monkeypatch.setattr(station_grid_index, 'save_station_grid_indexes', mock_save_station_grid_indexes)
+
+    index = StationGridIndex.instance()
+    assert index.get(None, 1)[2].prediction_model_grid_subset_id == 11
+    assert index.get(None, 1)[1].prediction_model_grid_subset_id == 10
+    assert loads == [1]
+
+    cells = index.save(None, 1, 'new', [_cell(1, 'new', 20)])
+    assert saves == [(1, 'new', [1])]
+    assert cells == {1: _cell(1, 'new', 20)}
+    assert index.get(None, 1) == cells
+    assert loads == [1]
+    assert _cell(1, 'new', 20).is_valid_for('new', 50.7, -120.425)
+    assert not _cell(1, 'new', 20).is_valid_for('new', 50.8, -120.425)
@@ -2,14 +2,53 @@
 
 If jnius wasn't prone throwing segmentation faults, we wouldn't need this level of indirection.
 """
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Sequence, Union
 from datetime import datetime, date, timedelta, timezone
+import numpy as np
 import jnius_config
 # import jnius - importing jnius on this level causes an segmentation fault.
 from app import config
 
 jnius_config.set_classpath(config.get('CLASSPATH'))
 
+# Outputs copied back from ca.cwfgm.fwi.FWICalculations by FWICalculateDailyStatisticsBatch
+FWI_BATCH_OUTPUTS = ('dlyFFMC', 'dlyDMC', 'dlyDC', 'dlyISI', 'dlyBUI', 'dlyFWI', 'dlyDSR',
+                     'hlyHFFMC', 'hlyHISI', 'hlyHFWI')
+# Outputs copied back from ca.cwfgm.fbp.FBPCalculations by FBPCalculateStatisticsBatch
+FBP_BATCH_OUTPUTS = ('ros_t', 'ros_eq', 'fros', 'bros', 'rso', 'hfi', 'ffi', 'bfi', 'area', 'perimeter',
+                     'distanceHead', 'distanceFlank', 'distanceBack', 'lb', 'csi', 'cfb', 'sfc', 'tfc', 'cfc',
+                     'isi', 'fmc', 'wsv', 'raz')
+
+
+class JavaClasses(NamedTuple):
+    """ Handles on the java classes used to call REDapp """
+    Calendar: object
+    TimeZone: object
+    FWICalculations: object
+    FBPCalculations: object
+    CwfgmFwi: object
+
+
+@lru_cache(maxsize=1)
+def java_classes() -> JavaClasses:
+    """ Look up the java classes once per process, rather than on every call. """
+    # we have to do a late import, otherwise we get a segmentation fault.
+    import jnius
+    return JavaClasses(Calendar=jnius.autoclass('java.util.Calendar'),
+                       TimeZone=jnius.autoclass('java.util.TimeZone'),
+                       FWICalculations=jnius.autoclass('ca.cwfgm.fwi.FWICalculations'),
+                       FBPCalculations=jnius.autoclass('ca.cwfgm.fbp.FBPCalculations'),
+                       CwfgmFwi=jnius.autoclass('ca.cwfgm.fwi.CwfgmFwi'))
+
+
+def _detach():
+    """ Each time you create a native thread in Python and use Pyjnius, any call to Pyjnius
+    methods will force attachment of the native thread to the current JVM. But you must
+    detach it before leaving the thread, and Pyjnius cannot do it for you. """
+    import jnius
+    jnius.detach()
+
 
 def _python_date_to_java_calendar(value: datetime, Calendar, TimeZone):
     """ Take a python datetime object and return a java Calendar object """
@@ -87,14 +126,12 @@ def FWICalculateDailyStatisticsCOM(longitude: float,
     ca.cwfgm.fwi.FWICalculations. Then call FWICalculateDailyStatisticsCOM on instance, and
     copy results into response object.
     """
-    # we have to do a late import, otherwise we get a segmentation fault.
-    import jnius
     try:
-        Calendar = jnius.autoclass('java.util.Calendar')
-        TimeZone = jnius.autoclass('java.util.TimeZone')
-        FWICalculationsClass = jnius.autoclass('ca.cwfgm.fwi.FWICalculations')
+        classes = java_classes()
+        Calendar = classes.Calendar
+        TimeZone = classes.TimeZone
 
-        fwi = FWICalculationsClass()
+        fwi = classes.FWICalculations()
         fwi.setLatitude(latitude)
         fwi.setLongitude(longitude)
         fwi.ystrdyFFMC = yesterday_ffmc
@@ -128,10 +165,88 @@ def FWICalculateDailyStatisticsCOM(longitude: float,
         return copy
 
     finally:
-        # Each time you create a native thread in Python and use Pyjnius, any call to Pyjnius
-        # methods will force attachment of the native thread to the current JVM. But you must
-        # detach it before leaving the thread, and Pyjnius cannot do it for you.
-        jnius.detach()
+        _detach()
+
+
+def _broadcast(length: Optional[int] = None, **inputs) -> Dict[str, np.ndarray]:
+    """ Broadcast scalar and array inputs to one dimensional float arrays of the same length, with None
+    mapped to NaN. """
+    arrays = {name: np.atleast_1d(np.asarray(value, dtype=object)) for name, value in inputs.items()}
+    arrays = {name: np.where(np.equal(value, None), np.nan, value).astype(float) for name, value in arrays.items()}
+    shape = np.broadcast_shapes(*(array.shape for array in arrays.values()), (length or 1,))
+    return {name: np.broadcast_to(array, shape) for name, array in arrays.items()}
+
+
+def _broadcast_times(time_of_interest: Union[datetime, Sequence[datetime]], length: int) -> Sequence[datetime]:
+    """ Broadcast a single time of interest to a sequence of the given length, a sequence is returned as is. """
+    if isinstance(time_of_interest, datetime):
+        return [time_of_interest] * length
+    return time_of_interest
+
+
+def FWICalculateDailyStatisticsBatch(longitude,
+                                     latitude,
+                                     yesterday_ffmc,
+                                     yesterday_dmc,
+                                     yesterday_dc,
+                                     noon_temp,
+                                     noon_rh,
+                                     noon_precip,
+                                     noon_wind_speed,
+                                     calc_hourly: bool,
+                                     hourly_temp,
+                                     hourly_rh,
+                                     hourly_precip,
+                                     hourly_wind_speed,
+                                     previous_hourly_ffmc,
+                                     use_van_wagner: bool,
+                                     use_lawson_previous_hour: bool,
+                                     time_of_interest: Union[datetime, Sequence[datetime]]) -> Dict[str, np.ndarray]:
+    """ Batched equivalent of FWICalculateDailyStatisticsCOM. Inputs may be scalars or arrays (one element
+    per calculation). Returns an array for each of FWI_BATCH_OUTPUTS.
+
+    Only the outputs are copied back from java, and the thread is detached from the JVM once for the
+    whole batch.
+    """
+    inputs = _broadcast(
+        None if isinstance(time_of_interest, datetime) else len(time_of_interest),
+        longitude=longitude, latitude=latitude, yesterday_ffmc=yesterday_ffmc, yesterday_dmc=yesterday_dmc,
+        yesterday_dc=yesterday_dc, noon_temp=noon_temp, noon_rh=noon_rh, noon_precip=noon_precip,
+        noon_wind_speed=noon_wind_speed, hourly_temp=hourly_temp, hourly_rh=hourly_rh, hourly_precip=hourly_precip,
+        hourly_wind_speed=hourly_wind_speed, previous_hourly_ffmc=previous_hourly_ffmc)
+    length = len(inputs['longitude'])
+    times = _broadcast_times(time_of_interest, length)
+    outputs = {key: np.full(length, np.nan) for key in FWI_BATCH_OUTPUTS}
+    try:
+        classes = java_classes()
+        for index in range(length):
+            fwi = classes.FWICalculations()
+            fwi.setLatitude(float(inputs['latitude'][index]))
+            fwi.setLongitude(float(inputs['longitude'][index]))
+            fwi.ystrdyFFMC = float(inputs['yesterday_ffmc'][index])
+            fwi.ystrdyDMC = float(inputs['yesterday_dmc'][index])
+            fwi.ystrdyDC = float(inputs['yesterday_dc'][index])
+            fwi.noonTemp = float(inputs['noon_temp'][index])
+            fwi.noonRH = float(inputs['noon_rh'][index])
+            fwi.noonPrecip = float(inputs['noon_precip'][index])
+            fwi.noonWindSpeed = float(inputs['noon_wind_speed'][index])
+            fwi.calcHourly = calc_hourly
+            fwi.hrlyTemp = float(inputs['hourly_temp'][index])
+            fwi.hrlyRH = float(inputs['hourly_rh'][index])
+            fwi.hrlyPrecip = float(inputs['hourly_precip'][index])
+            fwi.hrlyWindSpeed = float(inputs['hourly_wind_speed'][index])
+            fwi.prvhlyFFMC = float(inputs['previous_hourly_ffmc'][index])
+            fwi.useVanWagner = use_van_wagner
+            fwi.useLawsonPreviousHour = use_lawson_previous_hour
+            fwi.m_date = _python_date_to_java_calendar(times[index], classes.Calendar, classes.TimeZone)
+
+            fwi.FWICalculateDailyStatisticsCOM()
+
+            for key in FWI_BATCH_OUTPUTS:
+                outputs[key][index] = getattr(fwi, key)
+        return outputs
+    finally:
+        _detach()
 
 
 class FBPCalculations:
@@ -409,12 +524,10 @@ def FBPCalculateStatisticsCOM(elevation: float,
         public void FBPCalculateStatisticsCOM()
     }
     """
-    # we have to do a late import, otherwise we get a segmentation fault.
-    import jnius
     try:
-        Calendar = jnius.autoclass('java.util.Calendar')
-        TimeZone = jnius.autoclass('java.util.TimeZone')
-        FBPCalculationsClass = jnius.autoclass('ca.cwfgm.fbp.FBPCalculations')
+        classes = java_classes()
+        Calendar = classes.Calendar
+        TimeZone = classes.TimeZone
 
         if percentage_dead_balsam_fir is None:
             percentage_dead_balsam_fir = 0.0
@@ -428,7 +541,7 @@ def FBPCalculateStatisticsCOM(elevation: float,
         if percentage_conifer is None:
             percentage_conifer = 0.0
 
-        fbp = FBPCalculationsClass()
+        fbp = classes.FBPCalculations()
         fbp.elevation = elevation
         fbp.latitude = latitude
         fbp.longitude = longitude
@@ -464,10 +577,78 @@ def FBPCalculateStatisticsCOM(elevation: float,
 
         return copy
     finally:
-        # Each time you create a native thread in Python and use Pyjnius, any call to Pyjnius
-        # methods will force attachment of the native thread to the current JVM. But you must
-        # detach it before leaving the thread, and Pyjnius cannot do it for you.
-        jnius.detach()
+        _detach()
+
+
+def FBPCalculateStatisticsBatch(elevation,
+                                latitude,
+                                longitude,
+                                time_of_interest: Union[datetime, Sequence[datetime]],
+                                fuel_type: Union[str, Sequence[str]],
+                                ffmc,
+                                dmc,
+                                dc,
+                                bui,
+                                wind_speed,
+                                wind_direction,
+                                percentage_conifer,
+                                percentage_dead_balsam_fir,
+                                grass_cure,
+                                crown_base_height) -> Dict[str, np.ndarray]:
+    """ Batched equivalent of FBPCalculateStatisticsCOM. Inputs may be scalars or arrays (one element
+    per calculation), and missing (None or NaN) optional inputs get the same defaults as for a single
+    calculation. Returns an array for each of FBP_BATCH_OUTPUTS.
+    """
+    length = None
+    if not isinstance(time_of_interest, datetime):
+        length = len(time_of_interest)
+    elif not isinstance(fuel_type, str):
+        length = len(fuel_type)
+    inputs = _broadcast(
+        length, elevation=elevation, latitude=latitude, longitude=longitude, ffmc=ffmc, dmc=dmc, dc=dc, bui=bui,
+        wind_speed=wind_speed, wind_direction=wind_direction, percentage_conifer=percentage_conifer,
+        percentage_dead_balsam_fir=percentage_dead_balsam_fir, grass_cure=grass_cure,
+        crown_base_height=crown_base_height)
+    length = len(inputs['elevation'])
+    times = _broadcast_times(time_of_interest, length)
+    fuel_types = [fuel_type] * length if isinstance(fuel_type, str) else fuel_type
+    # fuel types are mapped up front, so that an unmapped fuel type fails the batch before calling java.
+    fuel_type_indices = [_fbp_fuel_type_map(value) for value in fuel_types]
+    outputs = {key: np.full(length, np.nan) for key in FBP_BATCH_OUTPUTS}
+    try:
+        classes = java_classes()
+        for index in range(length):
+            crown_base_height_value = float(inputs['crown_base_height'][index])
+
+            fbp = classes.FBPCalculations()
+            fbp.elevation = float(inputs['elevation'][index])
+            fbp.latitude = float(inputs['latitude'][index])
+            fbp.longitude = float(inputs['longitude'][index])
+            fbp.ffmc = float(inputs['ffmc'][index])
+            fbp.dmc = float(inputs['dmc'][index])
+            fbp.dc = float(inputs['dc'][index])
+            fbp.useBui = True
+            fbp.useBuildup = True
+            fbp.bui = float(inputs['bui'][index])
+            fbp.windSpeed = float(inputs['wind_speed'][index])
+            fbp.windDirection = float(inputs['wind_direction'][index])
+            fbp.fuelType = fuel_type_indices[index]
+            fbp.conifMixedWood = float(np.nan_to_num(inputs['percentage_conifer'][index]))
+            fbp.deadBalsam = float(np.nan_to_num(inputs['percentage_dead_balsam_fir'][index]))
+            fbp.grassCuring = float(np.nan_to_num(inputs['grass_cure'][index]))
+            fbp.crownBase = float(np.nan_to_num(crown_base_height_value))
+
+            fbp.useSlope = False
+            fbp.useCrownBaseHeight = not np.isnan(crown_base_height_value)
+
+            fbp.m_date = _python_date_to_java_calendar(times[index], classes.Calendar, classes.TimeZone)
+            fbp.FBPCalculateStatisticsCOM()
+
+            for key in FBP_BATCH_OUTPUTS:
+                outputs[key][index] = getattr(fbp, key)
+        return outputs
+    finally:
+        _detach()
 
 
 def hourlyFFMCLawson(prevFFMC: float,
@@ -475,9 +656,7 @@ def hourlyFFMCLawson(prevFFMC: float,
                      rh: float,
                      seconds_into_day: int) -> float:
     """ Ok - great - but what does this even do? """
-    import jnius
     try:
-        CwfgmFwi = jnius.autoclass('ca.cwfgm.fwi.CwfgmFwi')
-        return CwfgmFwi.hourlyFFMCLawson(prevFFMC, currFFMC, rh, seconds_into_day)
+        return java_classes().CwfgmFwi.hourlyFFMCLawson(prevFFMC, currFFMC, rh, seconds_into_day)
     finally:
-        jnius.detach()
+        _detach()
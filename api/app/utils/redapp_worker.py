@@ -0,0 +1,84 @@
+""" A long lived worker process for REDapp calculations.
+
+REDapp is called through jnius, which is prone to segmentation faults. Running it in a separate process
+means a crash takes down the worker rather than the api, and keeps the JVM (along with the java class
+handles) alive between calls, rather than paying for them on every request.
+
+The worker is enabled by default. With REDAPP_WORKER_ENABLED=False, calculations are run inline.
+"""
+import asyncio
+import functools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+import numpy as np
+from app import config
+from app.utils import redapp
+from app.utils.singleton import Singleton
+
+logger = logging.getLogger(__name__)
+
+
+def _initialize_worker():
+    """ Start the JVM and look up the java classes when the worker starts. """
+    redapp.java_classes()
+
+
+@Singleton
+class REDappWorker():
+    """ Single process in which all REDapp calculations are run. """
+
+    def __init__(self):
+        self.enabled = config.get('REDAPP_WORKER_ENABLED', 'True') == 'True'
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                logger.info('starting REDapp worker')
+                # The JVM does not survive being forked, so the worker is spawned.
+                self._executor = ProcessPoolExecutor(max_workers=1,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_initialize_worker)
+            return self._executor
+
+    def reset(self):
+        """ Discard the current worker. A new worker is started on the next submission. """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    async def submit(self, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """ Evaluate function(*args, **kwargs) in the worker process, returning the result.
+        The function and its arguments must be picklable. """
+        if not self.enabled:
+            return function(*args, **kwargs)
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(executor, functools.partial(function, *args, **kwargs))
+        except BrokenProcessPool:
+            # The worker died (most likely jnius segfaulted) - start over with a new one.
+            logger.error('REDapp worker is broken, resetting')
+            self.reset()
+            raise
+
+    async def calculate_fwi(self, **inputs) -> Dict[str, np.ndarray]:
+        """ Calculate FWI for arrays of inputs (see redapp.FWICalculateDailyStatisticsBatch). """
+        return await self.submit(redapp.FWICalculateDailyStatisticsBatch, **inputs)
+
+    async def calculate_fbp(self, **inputs) -> Dict[str, np.ndarray]:
+        """ Calculate fire behaviour for arrays of inputs (see redapp.FBPCalculateStatisticsBatch). """
+        return await self.submit(redapp.FBPCalculateStatisticsBatch, **inputs)
+
+    def shutdown(self):
+        """ Stop the worker, waiting for it to finish. """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
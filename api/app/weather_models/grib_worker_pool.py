@@ -0,0 +1,164 @@
+""" A pool of worker processes for reading station values out of grib files.
+
+Decoding a grib file, and picking out the grid surrounding each station, is cpu bound, and holds the GIL
+for most of the time, so a single process can't make use of more than one core. GribWorkerPool hands
+the extraction (see GribFileProcessor.extract_station_values) to a pool of worker processes, while the
+database writes stay in the calling process, so that there is only ever one writer:
+
+    for key, extracted, exception in pool.extract((key, filename, grib_info) for ...):
+        grib_processor.store_station_values(extracted, session)
+
+Each worker keeps its own GribFileProcessor (with its transformers and station pixels) and GDAL block cache
+between files. The number of workers is set with GRIB_WORKER_POOL_SIZE; with the default of 0, files are
+extracted inline, one at a time. If the pool breaks (e.g. a worker segfaults in gdal), extraction carries
+on inline.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Deque, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+from osgeo import gdal
+from app import config
+from app.stations import StationSourceEnum
+from app.weather_models.process_grib import ExtractedGribValues, GribFileProcessor, ModelRunInfo
+
+logger = logging.getLogger(__name__)
+
+# Size (in MB) of the GDAL block cache of each worker.
+DEFAULT_GDAL_CACHE_MB = 256
+
+# The processor of a worker process, kept for the lifetime of the worker.
+_processor: Optional[GribFileProcessor] = None
+
+
+class WorkerResult(NamedTuple):
+    """ The values extracted from a grib file, along with who extracted them, and how long it took. """
+    extracted: ExtractedGribValues
+    pid: int
+    seconds: float
+    file_size: int
+
+
+class WorkerThroughput():
+    """ Running totals of the files extracted by a worker. """
+
+    def __init__(self):
+        self.files = 0
+        self.seconds = 0.0
+        self.file_size = 0
+
+
+def _initialize_worker(stations: list, gdal_cache_mb: int):
+    """ Set up the processor (and the GDAL cache) of a worker process when it starts. """
+    global _processor  # pylint: disable=global-statement
+    gdal.SetCacheMax(gdal_cache_mb * 1024 * 1024)
+    _processor = GribFileProcessor(StationSourceEnum.UNSPECIFIED, stations=stations)
+
+
+def extract_station_values(processor: GribFileProcessor, filename: str, grib_info: ModelRunInfo) -> WorkerResult:
+    """ Extract the station values from a grib file, timing the extraction. """
+    start = time.perf_counter()
+    extracted = processor.extract_station_values(filename, grib_info)
+    return WorkerResult(extracted, os.getpid(), time.perf_counter() - start, os.path.getsize(filename))
+
+
+def _extract_in_worker(filename: str, grib_info: ModelRunInfo) -> WorkerResult:
+    return extract_station_values(_processor, filename, grib_info)
+
+
+class GribWorkerPool():
+    """ Extract station values from grib files, in worker processes. """
+
+    def __init__(self, grib_processor: GribFileProcessor):
+        # Used for extracting inline, and for the list of stations handed to the workers.
+        self.grib_processor = grib_processor
+        self.size = max(0, int(config.get('GRIB_WORKER_POOL_SIZE', 0)))
+        self.gdal_cache_mb = int(config.get('GRIB_WORKER_GDAL_CACHE_MB', DEFAULT_GDAL_CACHE_MB))
+        self.throughput: Dict[int, WorkerThroughput] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                logger.info('starting %s grib workers', self.size)
+                # gdal doesn't survive being forked with open datasets, so the workers are spawned.
+                self._executor = ProcessPoolExecutor(max_workers=self.size,
+                                                     mp_context=multiprocessing.get_context('spawn'),
+                                                     initializer=_initialize_worker,
+                                                     initargs=(self.grib_processor.stations, self.gdal_cache_mb))
+            return self._executor
+
+    def _submit(self, filename: str, grib_info: ModelRunInfo) -> Future:
+        if self.size > 0:
+            try:
+                return self._get_executor().submit(_extract_in_worker, filename, grib_info)
+            except BrokenProcessPool:
+                self._degrade()
+        future = Future()
+        try:
+            future.set_result(extract_station_values(self.grib_processor, filename, grib_info))
+        except Exception as exception:  # pylint: disable=broad-except
+            future.set_exception(exception)
+        return future
+
+    def _result(self, future: Future, filename: str, grib_info: ModelRunInfo) -> ExtractedGribValues:
+        try:
+            result: WorkerResult = future.result()
+        except (BrokenProcessPool, CancelledError):
+            # A worker died - the files it was given are extracted again, inline.
+            if self.size > 0:
+                self._degrade()
+            result = extract_station_values(self.grib_processor, filename, grib_info)
+        throughput = self.throughput.setdefault(result.pid, WorkerThroughput())
+        throughput.files += 1
+        throughput.seconds += result.seconds
+        throughput.file_size += result.file_size
+        return result.extracted
+
+    def _degrade(self):
+        """ Give up on the worker processes, and carry on inline. """
+        logger.error('grib worker pool is broken, extracting inline from here on')
+        self.size = 0
+        self.shutdown(wait=False)
+
+    def extract(self, files: Iterable[Tuple[Any, str, ModelRunInfo]]) \
+            -> Iterator[Tuple[Any, Optional[ExtractedGribValues], Optional[Exception]]]:
+        """ Extract the station values from (key, filename, grib_info) files, yielding
+        (key, extracted values, exception) in the order the files were given. Up to two files per worker are
+        in flight at a time, so that the workers don't sit idle while the caller stores the values. """
+        in_flight: Deque[Tuple[Any, str, ModelRunInfo, Future]] = deque()
+
+        def next_result():
+            key, filename, grib_info, future = in_flight.popleft()
+            try:
+                return key, self._result(future, filename, grib_info), None
+            except Exception as exception:  # pylint: disable=broad-except
+                return key, None, exception
+
+        for key, filename, grib_info in files:
+            in_flight.append((key, filename, grib_info, self._submit(filename, grib_info)))
+            while len(in_flight) > self.size * 2:
+                yield next_result()
+        while in_flight:
+            yield next_result()
+
+    def log_throughput(self):
+        """ Log how many files each worker extracted, and how fast. """
+        for pid, throughput in self.throughput.items():
+            logger.info('grib worker %s extracted %s files (%.1f MB) in %.1fs (%.2f files/s, %.1f MB/s)',
+                        pid, throughput.files, throughput.file_size / 1024 / 1024, throughput.seconds,
+                        throughput.files / throughput.seconds if throughput.seconds else 0,
+                        throughput.file_size / 1024 / 1024 / throughput.seconds if throughput.seconds else 0)
+
+    def shutdown(self, wait: bool = True):
+        """ Stop the workers. New workers are started if more files are submitted. """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=not wait)
+                self._executor = None
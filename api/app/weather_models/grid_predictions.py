@@ -0,0 +1,172 @@
+""" Access to the predictions of model runs for grid subsets, whichever way they're stored.
+
+While a model run comes in, its predictions are stored a row per grid subset and prediction timestamp
+(ModelRunGridSubsetPrediction), as every grib file is a single prediction timestamp. With
+PACK_GRID_SUBSET_PREDICTIONS, once the run has been interpolated, all of its predictions for a grid subset are
+packed into a single record (ModelRunGridSubsetPredictionArray): the values of every prediction timestamp and
+variable as one float32 array, instead of a row (with its indexes) per prediction timestamp.
+
+The functions here read from both, handing out ModelRunGridSubsetPrediction either way (made up, and not in
+the session, for packed predictions), so the code interpolating and learning from predictions doesn't need to
+know how they're stored.
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from app.db.crud import observations as observations_crud
+from app.db.crud import weather_models as weather_models_crud
+from app.db.models.observations import HourlyActual
+from app.db.models.weather_models import (ModelRunGridSubsetPrediction, ModelRunGridSubsetPredictionArray,
+                                          PredictionModelGridSubset, PredictionModelRunTimestamp)
+
+# The variables of a packed prediction, in the order they're packed.
+PACKED_VARIABLES = ('tmp_tgl_2', 'rh_tgl_2', 'apcp_sfc_0', 'wdir_tgl_10', 'wind_tgl_10')
+# Every grid subset has 4 vertices.
+VERTEX_COUNT = 4
+PACKED_DTYPE = np.dtype('<f4')
+
+
+def pack_predictions(predictions: Sequence[ModelRunGridSubsetPrediction]) -> Dict:
+    """ Pack the predictions of a model run for a grid subset into the columns of a
+    ModelRunGridSubsetPredictionArray. Variables that are None are packed as NaN. """
+    predictions = sorted(predictions, key=lambda prediction: prediction.prediction_timestamp)
+    values = np.full((len(predictions), len(PACKED_VARIABLES), VERTEX_COUNT), np.nan, dtype=PACKED_DTYPE)
+    for index, prediction in enumerate(predictions):
+        for variable_index, variable in enumerate(PACKED_VARIABLES):
+            variable_values = getattr(prediction, variable)
+            if variable_values is not None:
+                values[index, variable_index] = variable_values
+    return {'prediction_model_run_timestamp_id': predictions[0].prediction_model_run_timestamp_id,
+            'prediction_model_grid_subset_id': predictions[0].prediction_model_grid_subset_id,
+            'prediction_timestamps': [prediction.prediction_timestamp for prediction in predictions],
+            'last_prediction_timestamp': predictions[-1].prediction_timestamp,
+            'values': values.tobytes()}
+
+
+def _unpack_values(array: ModelRunGridSubsetPredictionArray) -> np.ndarray:
+    """ The values of packed predictions, of shape (prediction timestamp, variable, vertex). """
+    return np.frombuffer(array.values, dtype=PACKED_DTYPE).reshape(
+        len(array.prediction_timestamps), len(PACKED_VARIABLES), VERTEX_COUNT)
+
+
+def _make_prediction(array: ModelRunGridSubsetPredictionArray, values: np.ndarray,
+                     index: int) -> ModelRunGridSubsetPrediction:
+    """ Make up the prediction of the index'th prediction timestamp of packed predictions. """
+    prediction = ModelRunGridSubsetPrediction(
+        prediction_model_run_timestamp_id=array.prediction_model_run_timestamp_id,
+        prediction_model_grid_subset_id=array.prediction_model_grid_subset_id,
+        prediction_timestamp=array.prediction_timestamps[index])
+    for variable, variable_values in zip(PACKED_VARIABLES, values[index]):
+        setattr(prediction, variable,
+                None if np.isnan(variable_values).all() else variable_values.astype(float).tolist())
+    return prediction
+
+
+def unpack_predictions(array: ModelRunGridSubsetPredictionArray) -> List[ModelRunGridSubsetPrediction]:
+    """ Unpack the predictions of a model run for a grid subset, in order of prediction timestamp. """
+    values = _unpack_values(array)
+    return [_make_prediction(array, values, index) for index in range(len(array.prediction_timestamps))]
+
+
+def get_model_run_predictions_for_grid(session: Session,
+                                       prediction_run: PredictionModelRunTimestamp,
+                                       grid: PredictionModelGridSubset) -> List[ModelRunGridSubsetPrediction]:
+    """ Get all the predictions of a model run for a grid subset, in order of prediction timestamp. Predictions
+    that are stored as rows take the place of packed predictions for the same timestamp (a file of the run
+    was processed again after it was packed). """
+    predictions: Dict[datetime, ModelRunGridSubsetPrediction] = {}
+    array = weather_models_crud.get_model_run_grid_subset_prediction_array(session, prediction_run, grid)
+    if array is not None:
+        for prediction in unpack_predictions(array):
+            predictions[prediction.prediction_timestamp] = prediction
+    for prediction in weather_models_crud.get_model_run_predictions_for_grid(session, prediction_run, grid):
+        predictions[prediction.prediction_timestamp] = prediction
+    return [predictions[timestamp] for timestamp in sorted(predictions)]
+
+
+def pack_model_run(session: Session, prediction_run: PredictionModelRunTimestamp) -> int:
+    """ Pack the predictions of a model run that are stored as rows (along with any it already has packed),
+    and delete the rows, without committing. Returns the number of grid subsets packed. """
+    grids: Dict[int, Dict[datetime, ModelRunGridSubsetPrediction]] = defaultdict(dict)
+    for array in weather_models_crud.get_model_run_grid_subset_prediction_arrays_for_run(session, prediction_run):
+        for prediction in unpack_predictions(array):
+            grids[array.prediction_model_grid_subset_id][prediction.prediction_timestamp] = prediction
+    row_count = 0
+    for prediction in weather_models_crud.get_model_run_grid_subset_predictions(session, prediction_run):
+        grids[prediction.prediction_model_grid_subset_id][prediction.prediction_timestamp] = prediction
+        row_count += 1
+    if row_count == 0:
+        return 0
+    weather_models_crud.upsert_model_run_grid_subset_prediction_arrays(
+        session, [pack_predictions(list(predictions.values())) for predictions in grids.values()])
+    weather_models_crud.delete_model_run_grid_subset_predictions(session, prediction_run)
+    return len(grids)
+
+
+def _pair_with_packed_predictions(session: Session,
+                                  rows: Iterable[Tuple[HourlyActual, Optional[ModelRunGridSubsetPrediction]]],
+                                  prediction_model_id: int,
+                                  station_grids: Dict[int, int],
+                                  start_date: datetime,
+                                  end_date: datetime) \
+        -> Iterable[Tuple[HourlyActual, Optional[ModelRunGridSubsetPrediction]]]:
+    """ Pair each actual (of actuals left outer joined with the predictions stored as rows, ordered by station,
+    date and most recent model run) with the prediction of the most recent model run, whether it's stored as a
+    row or packed. Only the first row of each actual is kept. """
+    arrays = list(weather_models_crud.get_model_run_grid_subset_prediction_arrays(
+        session, prediction_model_id, list(set(station_grids.values())), start_date, end_date))
+    if not arrays:
+        return rows
+    rows = list(rows)
+    wanted = {(station_grids[actual.station_code], actual.weather_date) for actual, _ in rows}
+    # The most recent packed prediction for each (grid subset, prediction timestamp) that has an actual, as
+    # (run timestamp, array, unpacked values, index of the prediction timestamp).
+    latest: Dict[Tuple[int, datetime], tuple] = {}
+    for array, run_timestamp in arrays:
+        values = None
+        for index, prediction_timestamp in enumerate(array.prediction_timestamps):
+            key = (array.prediction_model_grid_subset_id, prediction_timestamp)
+            if key in wanted and (key not in latest or latest[key][0] < run_timestamp):
+                if values is None:
+                    values = _unpack_values(array)
+                latest[key] = (run_timestamp, array, values, index)
+    run_timestamps = weather_models_crud.get_prediction_run_timestamps(
+        session, list({prediction.prediction_model_run_timestamp_id for _, prediction in rows
+                       if prediction is not None}))
+
+    paired = []
+    prev_actual = None
+    for actual, prediction in rows:
+        if actual is prev_actual:
+            continue
+        prev_actual = actual
+        packed = latest.get((station_grids[actual.station_code], actual.weather_date))
+        if packed is not None and (prediction is None or
+                                   run_timestamps[prediction.prediction_model_run_timestamp_id] < packed[0]):
+            prediction = _make_prediction(*packed[1:])
+        paired.append((actual, prediction))
+    return paired
+
+
+def get_actuals_left_outer_join_with_predictions(
+        session: Session, model_id: int, grid_id: int, station_code: int,
+        start_date: datetime, end_date: datetime):
+    """ Get the valid actuals of a station, with the predictions of the model for the grid subset left outer
+    joined (see app.db.crud.observations.get_actuals_left_outer_join_with_predictions), including those that
+    are packed. """
+    rows = observations_crud.get_actuals_left_outer_join_with_predictions(
+        session, model_id, grid_id, station_code, start_date, end_date)
+    return _pair_with_packed_predictions(session, rows, model_id, {station_code: grid_id}, start_date, end_date)
+
+
+def get_actuals_paired_with_predictions(
+        session: Session, model_id: int, station_grids: Dict[int, int],
+        start_date: datetime, end_date: datetime):
+    """ Get the valid actuals of many stations, each paired with the most recent prediction of the model for
+    the grid subset of the station (see app.db.crud.observations.get_actuals_paired_with_predictions),
+    including those that are packed. """
+    rows = observations_crud.get_actuals_paired_with_predictions(
+        session, model_id, station_grids, start_date, end_date)
+    return _pair_with_packed_predictions(session, rows, model_id, station_grids, start_date, end_date)
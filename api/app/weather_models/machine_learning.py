@@ -1,19 +1,32 @@
 """ Module for calculating the bias for a weather station use basic Machine Learning through Linear
 Regression.
+
+For each station, hour of the day and weather variable, observed values are regressed on the predicted values
+(observed = intercept + slope * predicted). The regressions are fitted in closed form, for all the stations of
+a model at once, and the coefficients are stored, only to be refitted once new actuals come in for a station.
+
+With BIAS_ADJUSTMENT_INCREMENTAL, the sufficient statistics of the regressions (the sums of the samples) are
+stored along with the coefficients, and only the samples that came in since the last update are added to them.
+Older samples are faded out exponentially, with a half life of BIAS_ADJUSTMENT_HALF_LIFE_DAYS, so the cost of an
+update depends on the number of new actuals, rather than on the size of the window learnt from.
 """
 from datetime import datetime, timedelta
 from collections import defaultdict
-from typing import List
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
 from logging import getLogger
-from sklearn.linear_model import LinearRegression
-from scipy.interpolate import griddata
 import numpy as np
 from sqlalchemy.orm import Session
+from app import config
 from app.weather_models import SCALAR_MODEL_VALUE_KEYS, construct_interpolated_noon_prediction
 from app.db.models.weather_models import (
     PredictionModel, PredictionModelGridSubset, ModelRunGridSubsetPrediction)
 from app.db.models.observations import HourlyActual
-from app.db.crud.observations import get_actuals_left_outer_join_with_predictions
+from app.db.crud.observations import get_latest_actual_dates
+from app.db.crud.weather_models import get_bias_coefficients, save_bias_coefficients
+from app.weather_models.grid_predictions import (get_actuals_left_outer_join_with_predictions,
+                                                 get_actuals_paired_with_predictions)
+from app.weather_models.station_grid_index import calculate_interpolation_weights
+import app.utils.time as time_utils
 
 
 logger = getLogger(__name__)
@@ -21,93 +34,367 @@ logger = getLogger(__name__)
 # Corresponding key values on HourlyActual and SampleCollection
 SAMPLE_VALUE_KEYS = ('temperature', 'relative_humidity')
 
+# Maximum number of days to try to learn from. Experimentation has shown that
+# about two weeks worth of data starts giving fairly good results compared to human forecasters.
+# NOTE: This could be an environment variable.
+MAX_DAYS_TO_LEARN = 19
+# Half life (in days) of the samples learnt from, when updating incrementally.
+DEFAULT_HALF_LIFE_DAYS = 7
+# When updating incrementally, the actuals are queried from a few hours before the last update, so that the
+# predictions needed to interpolate noon (for the GLOBAL model) are there.
+NOON_INTERPOLATION_LOOKBACK = timedelta(hours=3)
+# Rounding leaves a little variance in x even when it doesn't vary, anything within this (relative to the
+# mean of x²) is taken to be none.
+VARIANCE_TOLERANCE = 1e-10
+
+
+class BiasCoefficient(NamedTuple):
+    """ Coefficients of a fitted linear regression. """
+    intercept: float
+    slope: float
+    sample_count: int
+
+
+def fit_linear_regressions(keys: np.ndarray, x: np.ndarray, y: np.ndarray) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ Fit y = intercept + slope * x by least squares, separately for the samples of each key (a row of keys),
+    all at once. Returns the unique keys, and the intercept, slope and number of samples of each.
+    As with sklearn's LinearRegression, the slope is 0 if x doesn't vary (e.g. there's only one sample). """
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    count = np.bincount(inverse)
+    mean_x = np.bincount(inverse, x) / count
+    mean_y = np.bincount(inverse, y) / count
+    dx = x - mean_x[inverse]
+    sum_xx = np.bincount(inverse, dx * dx)
+    sum_xy = np.bincount(inverse, dx * (y - mean_y[inverse]))
+    slope = np.divide(sum_xy, sum_xx, out=np.zeros_like(sum_xy), where=sum_xx > 0)
+    return unique_keys, mean_y - slope * mean_x, slope, count
+
+
+class RegressionStatistics(NamedTuple):
+    """ Sufficient statistics of a weighted linear regression: the total weight of the samples, and the
+    weighted sums of x, y, x² and xy. Samples can be added, and old ones faded out, without keeping them. """
+    weight: float
+    sum_x: float
+    sum_y: float
+    sum_xx: float
+    sum_xy: float
+
+    def decay(self, factor: float) -> 'RegressionStatistics':
+        """ Scale down the weight of all the samples. """
+        return RegressionStatistics(*(value * factor for value in self))
+
+    def combine(self, other: 'RegressionStatistics') -> 'RegressionStatistics':
+        """ The statistics of the samples of both. """
+        return RegressionStatistics(*(value + other_value for value, other_value in zip(self, other)))
+
+    def solve(self) -> Tuple[float, float]:
+        """ Return the intercept and slope of y = intercept + slope * x. As with fit_linear_regressions, the
+        slope is 0 if x doesn't vary. """
+        mean_x = self.sum_x / self.weight
+        mean_y = self.sum_y / self.weight
+        variance = self.sum_xx / self.weight - mean_x * mean_x
+        if variance <= VARIANCE_TOLERANCE * self.sum_xx / self.weight:
+            return mean_y, 0.0
+        slope = (self.sum_xy / self.weight - mean_x * mean_y) / variance
+        return mean_y - slope * mean_x, slope
+
+
+def sum_regression_statistics(keys: np.ndarray, x: np.ndarray, y: np.ndarray, weights: np.ndarray) \
+        -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Sum up the weighted samples of each key (a row of keys), all at once. Returns the unique keys, the
+    statistics (a row of RegressionStatistics per key) and the number of samples of each. """
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    statistics = np.column_stack([np.bincount(inverse, value)
+                                  for value in (weights, weights * x, weights * y, weights * x * x, weights * x * y)])
+    return unique_keys, statistics, np.bincount(inverse)
+
+
+def decay_factor(age: timedelta, half_life: timedelta) -> float:
+    """ How much the weight of a sample of the given age has faded. """
+    return 0.5 ** (age / half_life)
 
-class LinearRegressionWrapper:
-    """ Class wrapping LinearRegression.
-    This class just adds in a handy boolean to indicate if this linear regression model is good to use.
-    """
-
-    def __init__(self):
-        self.model = LinearRegression()
-        self.good_model = False  # Flag if regression model is "good" (usable).
-
-
-class RegressionModels:
-    """ Class for storing regression models.
-    For each different reading, we have a seperate LinearRegression model.
-    """
 
-    keys = ('temperature_wrapper', 'relative_humidity_wrapper')
+class Samples:
+    """ (predicted, observed) pairs of many stations, put together in hour buckets. """
 
     def __init__(self):
-        self.temperature_wrapper = LinearRegressionWrapper()
-        self.relative_humidity_wrapper = LinearRegressionWrapper()
+        self.station_codes: List[int] = []
+        self.hours: List[int] = []
+        self.variables: List[int] = []
+        # The values of the grid surrounding the station, interpolated when the samples are fitted.
+        self.model_values: List[List[float]] = []
+        self.actual_values: List[float] = []
+        self.dates: List[datetime] = []
+
+    def add(self, station_code: int, prediction: ModelRunGridSubsetPrediction, actual: HourlyActual):
+        """ Take the provided prediction and observed value, adding them to the samples """
+        # TODO: add precip and wind speed/direction to SAMPLE_VALUE_KEYS
+        for variable, (model_key, sample_key) in enumerate(zip(SCALAR_MODEL_VALUE_KEYS, SAMPLE_VALUE_KEYS)):
+            model_value = getattr(prediction, model_key)
+            if model_value is not None:
+                actual_value = getattr(actual, sample_key)
+                if actual_value is None or np.isnan(actual_value):
+                    # If for whatever reason we don't have an actual value, we skip this one.
+                    logger.warning('no actual value for %s', sample_key)
+                    continue
+                self.station_codes.append(station_code)
+                self.hours.append(actual.weather_date.hour)
+                self.variables.append(variable)
+                self.model_values.append(model_value)
+                self.actual_values.append(actual_value)
+                self.dates.append(actual.weather_date)
+            else:
+                # Sometimes, for reasons that probably need investigation, model values
+                # are None.
+                logger.warning('no model value for %s->%s', model_key, sample_key)
 
+    def collect(self,
+                rows: Iterable[Tuple[HourlyActual, Optional[ModelRunGridSubsetPrediction]]],
+                station_code: Optional[int] = None,
+                after: Optional[Dict[int, datetime]] = None):
+        """ Collect samples from actuals with predictions left outer joined (so if there isn't a prediction,
+        prediction is None), ordered by station and date. The station code is taken from the actuals, unless
+        given. If after is given, only actuals of a station after its date (in after) are taken as samples, the
+        earlier ones are only there to interpolate noon from. """
+        # We need to keep track of previous so that we can do interpolation for the global model.
+        prev_actual = None
+        prev_prediction = None
+        for actual, prediction in rows:
+            if prev_actual is not None and prev_actual.station_code != actual.station_code:
+                prev_actual = None
+                prev_prediction = None
+            code = actual.station_code if station_code is None else station_code
+            if prev_actual != actual and prediction is not None:
+                if after is None or after.get(code) is None or actual.weather_date > after[code]:
+                    if (prev_actual is not None
+                            and prev_prediction is not None
+                            and prev_actual.weather_date.hour == 20
+                            and prediction.prediction_timestamp.hour == 21
+                            and prev_prediction.prediction_timestamp.hour == 18):
+                        # If there's a gap in the data (like with the GLOBAL model) - then make up
+                        # a noon prediction using interpolation, and add it as a sample. (It can only be made
+                        # up once the actual after it is in, so it's new along with that actual.)
+                        noon_prediction = construct_interpolated_noon_prediction(prev_prediction, prediction)
+                        self.add(code, noon_prediction, prev_actual)
+
+                    self.add(code, prediction, actual)
+                prev_prediction = prediction
+            prev_actual = actual
 
-class Samples:
-    """ Class for storing samples in buckets of hours.
-    e.g. a temperature sample consists of an x axis (predicted values) and a y axis (observed values) put
-    together in hour buckets.
-    """
+    def _interpolate(self, weights: Dict[int, Optional[List[float]]]) \
+            -> Tuple[List[int], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """ Interpolate the predicted values to the stations (using the interpolation weights of each station).
+        Returns the station codes (numbered by their position), and the keys (station number, hour, variable),
+        x, y and position of the samples that could be interpolated. """
+        model_values = np.array(self.model_values, dtype=float)
+        missing = [np.nan] * model_values.shape[1]
+        sample_weights = np.array([missing if weights.get(code) is None else weights[code]
+                                   for code in self.station_codes], dtype=float)
+        x = np.einsum('ij,ij->i', model_values, sample_weights)
+        y = np.array(self.actual_values, dtype=float)
+        # Station codes are numbered, so that the keys can be fitted as an integer array.
+        station_codes = list(dict.fromkeys(self.station_codes))
+        station_numbers = {station_code: number for number, station_code in enumerate(station_codes)}
+        keys = np.column_stack(([station_numbers[code] for code in self.station_codes], self.hours, self.variables))
+        # Samples that can't be interpolated (the station is outside of the grid) can't be learnt from.
+        usable = np.flatnonzero(np.isfinite(x))
+        if len(usable) < len(x):
+            logger.warning('%s samples could not be interpolated', len(x) - len(usable))
+        return station_codes, keys[usable], x[usable], y[usable], usable
+
+    def fit(self, weights: Dict[int, Optional[List[float]]]) -> Dict[Tuple[int, int, str], BiasCoefficient]:
+        """ Interpolate the predicted values to the stations (using the interpolation weights of each station),
+        and fit the regressions, returning coefficients keyed on (station code, hour, variable). """
+        if not self.station_codes:
+            return {}
+        station_codes, keys, x, y, _ = self._interpolate(weights)
+        if len(keys) == 0:
+            return {}
+        unique_keys, intercept, slope, count = fit_linear_regressions(keys, x, y)
+        return {(station_codes[number], int(hour), SAMPLE_VALUE_KEYS[variable]):
+                BiasCoefficient(float(intercept[index]), float(slope[index]), int(count[index]))
+                for index, (number, hour, variable) in enumerate(unique_keys)}
+
+    def statistics(self,
+                   weights: Dict[int, Optional[List[float]]],
+                   reference_dates: Dict[int, datetime],
+                   half_life: timedelta) -> Dict[Tuple[int, int, str], Tuple[RegressionStatistics, int]]:
+        """ Interpolate the predicted values to the stations, and sum up the samples, each weighted by how
+        long before the reference date of its station it was observed. Returns the statistics, and the
+        number of samples, keyed on (station code, hour, variable). """
+        if not self.station_codes:
+            return {}
+        station_codes, keys, x, y, usable = self._interpolate(weights)
+        if len(keys) == 0:
+            return {}
+        ages = np.array([(reference_dates[self.station_codes[index]] - self.dates[index]).total_seconds()
+                         for index in usable], dtype=float)
+        sample_weights = 0.5 ** (ages / half_life.total_seconds())
+        unique_keys, statistics, count = sum_regression_statistics(keys, x, y, sample_weights)
+        return {(station_codes[number], int(hour), SAMPLE_VALUE_KEYS[variable]):
+                (RegressionStatistics(*(float(value) for value in statistics[index])), int(count[index]))
+                for index, (number, hour, variable) in enumerate(unique_keys)}
+
+
+class BiasAdjustment:
+    """ Bias adjust model predictions, using regression coefficients keyed on (station code, hour, variable). """
+
+    def __init__(self, coefficients: Optional[Dict[Tuple[int, int, str], BiasCoefficient]] = None):
+        self.coefficients = {} if coefficients is None else coefficients
+
+    def adjust(self, station_code: int, variable: str,
+               values: Sequence[Optional[float]], hours: Sequence[int]) -> np.ndarray:
+        """ Bias adjust many values of a variable for a station at once. The result is nan where the value
+        is None, or there's no regression for the hour. """
+        coefficients = [self.coefficients.get((station_code, hour, variable)) for hour in hours]
+        intercept = np.array([np.nan if coefficient is None else coefficient.intercept
+                              for coefficient in coefficients], dtype=float)
+        slope = np.array([np.nan if coefficient is None else coefficient.slope
+                          for coefficient in coefficients], dtype=float)
+        values = np.array([np.nan if value is None else value for value in values], dtype=float)
+        return intercept + slope * values
+
+    def predict_temperature(self, station_code: int, model_temperature: Optional[float],
+                            timestamp: datetime) -> Optional[float]:
+        """ Predict the bias adjusted temperature for a given point in time, given a corresponding model
+        temperature. None if there's no regression for the hour. """
+        if model_temperature is None:
+            logger.warning('model temperature for %s was None', timestamp)
+            return None
+        return self._predict(station_code, 'temperature', model_temperature, timestamp)
 
-    def __init__(self):
-        self._x = defaultdict(list)
-        self._y = defaultdict(list)
-
-    def hours(self):
-        """ Return all the hours used to bucket samples together. """
-        return self._x.keys()
-
-    def append_x(self, value, timestamp: datetime):
-        """ Append another predicted value. """
-        self._x[timestamp.hour].append(value)
-
-    def append_y(self, value, timestamp: datetime):
-        """ Append another observered values. """
-        self._y[timestamp.hour].append(value)
-
-    def np_x(self, hour):
-        """ Return numpy array of the predicted values, reshaped appropriately. """
-        return np.array(self._x[hour]).reshape((-1, 1))
-
-    def np_y(self, hour):
-        """ Return a numpy array of the observed values """
-        return np.array(self._y[hour])
-
-    def add_sample(self,
-                   points: List,
-                   target_point: List,
-                   model_values: List,
-                   actual_value: float,
-                   timestamp: datetime,
-                   model_key: str,
-                   sample_key: str):
-        """ Add a sample, interpolating the model values spatially """
-        # Interpolate spatially, to get close to our actual position:
-        try:
-            interpolated_value = griddata(
-                points, model_values, target_point, method='linear')
-        except:
-            # Additional logging to assist with finding errors:
-            logger.error('for %s->%s griddata failed with points: %s, model_values %s, target_point: %s',
-                         model_key, sample_key, points, model_values, target_point)
-            raise
-        # Add to the data we're going to learn from:
-        # Using two variables, the interpolated temperature value, and the hour of the day.
-        self.append_x(interpolated_value[0], timestamp)
-        self.append_y(actual_value, timestamp)
-
-
-class SampleCollection:
-    """ Class for storing different kinds of samples """
+    def predict_rh(self, station_code: int, model_rh: Optional[float], timestamp: datetime) -> Optional[float]:
+        """ Predict the bias adjusted rh for a given point in time, given a corresponding model rh.
+        None if there's no regression for the hour. """
+        if model_rh is None:
+            return None
+        return self._predict(station_code, 'relative_humidity', model_rh, timestamp)
 
-    def __init__(self):
-        self.temperature = Samples()
-        self.relative_humidity = Samples()
+    def _predict(self, station_code: int, variable: str, value: float, timestamp: datetime) -> Optional[float]:
+        coefficient = self.coefficients.get((station_code, timestamp.hour, variable))
+        if coefficient is None:
+            return None
+        return coefficient.intercept + coefficient.slope * value
+
+
+def _statistics_columns(statistics: Optional[RegressionStatistics]) -> Dict[str, Optional[float]]:
+    """ The columns of a stored bias coefficient holding the statistics it was solved from (none when
+    refitting). """
+    if statistics is None:
+        return dict(sample_weight=None, sum_x=None, sum_y=None, sum_xx=None, sum_xy=None)
+    return dict(sample_weight=statistics.weight, sum_x=statistics.sum_x, sum_y=statistics.sum_y,
+                sum_xx=statistics.sum_xx, sum_xy=statistics.sum_xy)
+
+
+def learn_bias_adjustment(session: Session,
+                          prediction_model_id: int,
+                          station_grids: Dict[int, Tuple[int, Optional[List[float]]]],
+                          max_learn_date: datetime) -> BiasAdjustment:
+    """ Return the bias adjustment of a prediction model for many stations. station_grids is keyed on station
+    code, each value the grid subset the station is in, and the weights to interpolate the grid to the station.
+    Stored coefficients are used for stations that haven't had any new actuals since they were fitted, the
+    rest are refitted (from a single query), or, when updating incrementally, have their new actuals added to
+    the stored statistics, and stored (without committing). """
+    if not station_grids:
+        return BiasAdjustment()
+    incremental = config.get('BIAS_ADJUSTMENT_INCREMENTAL', 'False') == 'True'
+    half_life = timedelta(days=float(config.get('BIAS_ADJUSTMENT_HALF_LIFE_DAYS', DEFAULT_HALF_LIFE_DAYS)))
+    # Calculate the date to start learning from. Updating incrementally, samples fade out instead of dropping
+    # out of the window, so the window can be a lot longer.
+    days_to_learn = int(config.get('BIAS_ADJUSTMENT_WINDOW_DAYS', MAX_DAYS_TO_LEARN)) \
+        if incremental else MAX_DAYS_TO_LEARN
+    start_date = max_learn_date - timedelta(days=days_to_learn)
+    station_codes = list(station_grids)
+    latest_actual_dates = dict(get_latest_actual_dates(session, station_codes, start_date, max_learn_date))
+    stored = defaultdict(list)
+    for record in get_bias_coefficients(session, prediction_model_id, station_codes):
+        stored[record.station_code].append(record)
+
+    coefficients = {}
+    # Stations that need to be refitted, keyed on station code, the value being the grid subset id.
+    stale: Dict[int, int] = {}
+    # Stations that have stored statistics to add their new actuals to, keyed on station code, the value being
+    # the grid subset id.
+    updatable: Dict[int, int] = {}
+    for station_code, (grid_subset_id, _) in station_grids.items():
+        latest_actual_date = latest_actual_dates.get(station_code)
+        if latest_actual_date is None:
+            # There's nothing to learn from.
+            continue
+        records = stored.get(station_code)
+        same_grid = records and all(record.prediction_model_grid_subset_id == grid_subset_id for record in records)
+        if same_grid and all(record.latest_actual_date == latest_actual_date for record in records):
+            coefficients.update({(station_code, record.hour, record.variable):
+                                 BiasCoefficient(record.intercept, record.slope, record.sample_count)
+                                 for record in records})
+        elif incremental and same_grid and all(record.sample_weight is not None
+                                               and record.latest_actual_date < latest_actual_date
+                                               for record in records):
+            updatable[station_code] = grid_subset_id
+        else:
+            stale[station_code] = grid_subset_id
+
+    fitted: Dict[Tuple[int, int, str], BiasCoefficient] = {}
+    statistics: Dict[Tuple[int, int, str], Tuple[RegressionStatistics, int]] = {}
+    if stale:
+        logger.info('fitting bias coefficients for %s stations', len(stale))
+        samples = Samples()
+        samples.collect(get_actuals_paired_with_predictions(
+            session, prediction_model_id, stale, start_date, max_learn_date))
+        weights = {station_code: station_grids[station_code][1] for station_code in stale}
+        if incremental:
+            statistics.update(samples.statistics(weights, latest_actual_dates, half_life))
+        else:
+            fitted.update(samples.fit(weights))
+    if updatable:
+        logger.info('updating bias coefficients for %s stations', len(updatable))
+        updated_dates = {station_code: stored[station_code][0].latest_actual_date for station_code in updatable}
+        samples = Samples()
+        samples.collect(get_actuals_paired_with_predictions(
+            session, prediction_model_id, updatable,
+            min(updated_dates.values()) - NOON_INTERPOLATION_LOOKBACK, max_learn_date), after=updated_dates)
+        new_statistics = samples.statistics(
+            {station_code: station_grids[station_code][1] for station_code in updatable},
+            latest_actual_dates, half_life)
+        for station_code in updatable:
+            factor = decay_factor(latest_actual_dates[station_code] - updated_dates[station_code], half_life)
+            for record in stored[station_code]:
+                key = (station_code, record.hour, record.variable)
+                old = RegressionStatistics(record.sample_weight, record.sum_x, record.sum_y,
+                                           record.sum_xx, record.sum_xy).decay(factor)
+                new, count = new_statistics.pop(key, (None, 0))
+                statistics[key] = (old if new is None else old.combine(new), record.sample_count + count)
+        # Hours (or variables) that didn't have any samples before.
+        statistics.update(new_statistics)
+    for key, (regression_statistics, count) in statistics.items():
+        if regression_statistics.weight > 0:
+            fitted[key] = BiasCoefficient(*regression_statistics.solve(), count)
+
+    if stale or updatable:
+        update_date = time_utils.get_utc_now()
+        grid_subset_ids = {**stale, **updatable}
+        save_bias_coefficients(session, prediction_model_id, list(grid_subset_ids), [
+            dict(prediction_model_id=prediction_model_id,
+                 station_code=station_code,
+                 prediction_model_grid_subset_id=grid_subset_ids[station_code],
+                 hour=hour,
+                 variable=variable,
+                 intercept=coefficient.intercept,
+                 slope=coefficient.slope,
+                 sample_count=coefficient.sample_count,
+                 **_statistics_columns(statistics.get((station_code, hour, variable), (None, 0))[0]),
+                 latest_actual_date=latest_actual_dates[station_code],
+                 update_date=update_date)
+            for (station_code, hour, variable), coefficient in fitted.items()])
+        coefficients.update(fitted)
+    return BiasAdjustment(coefficients)
 
 
 class StationMachineLearning:
-    """ Wrap away machine learning in an easy to use class. """
+    """ Wrap away machine learning for a single station in an easy to use class. """
 
     def __init__(self,
                  session: Session,
@@ -116,7 +403,8 @@ class StationMachineLearning:
                  points: List,
                  target_coordinate: List[float],
                  station_code: int,
-                 max_learn_date: datetime):
+                 max_learn_date: datetime,
+                 weights: Optional[List[float]] = None):
         """
         : param session: Database session.
         : param model: Prediction model, e.g. GDPS
@@ -125,95 +413,31 @@ class StationMachineLearning:
         : param target_coordinate: Coordinate we're interested in .
         : param station_code: Code of the weather station.
         : param max_learn_date: Maximum date up to which to learn.
+        : param weights: Weights to interpolate the grid points to the coordinate (calculated if not given).
         """
         self.session = session
         self.model = model
         self.grid = grid
         self.points = points
         self.target_coordinate = target_coordinate
+        self.weights = calculate_interpolation_weights(points, target_coordinate) if weights is None else weights
         self.station_code = station_code
-        self.regression_models = defaultdict(RegressionModels)
+        self.bias_adjustment = BiasAdjustment()
         self.max_learn_date = max_learn_date
-        # Maximum number of days to try to learn from. Experimentation has shown that
-        # about two weeks worth of data starts giving fairly good results compared to human forecasters.
-        # NOTE: This could be an environment variable.
-        self.max_days_to_learn = 19
-
-    def _add_sample_to_collection(self,
-                                  prediction: ModelRunGridSubsetPrediction,
-                                  actual: HourlyActual,
-                                  sample_collection: SampleCollection):
-        """ Take the provided prediction and observed value, adding them to the collection of samples """
-        # TODO: add precip and wind speed/direction to SAMPLE_VALUE_KEYS
-        for model_key, sample_key in zip(SCALAR_MODEL_VALUE_KEYS, SAMPLE_VALUE_KEYS):
-            model_value = getattr(prediction, model_key)
-            if model_value is not None:
-                actual_value = getattr(actual, sample_key)
-                if np.isnan(actual_value):
-                    # If for whatever reason we don't have an actual value, we skip this one.
-                    logger.warning('no actual value for %s', sample_key)
-                    continue
-                sample_value = getattr(sample_collection, sample_key)
-                sample_value.add_sample(self.points, self.target_coordinate, model_value,
-                                        actual_value, actual.weather_date, model_key, sample_key)
-            else:
-                # Sometimes, for reasons that probably need investigation, model values
-                # are None.
-                logger.warning('no model value for %s->%s', model_key, sample_key)
+        self.max_days_to_learn = MAX_DAYS_TO_LEARN
 
-    def _collect_data(self):
-        """ Collect data to use for machine learning.
+    def learn(self):
+        """ Collect data and perform linear regression.
         """
         # Calculate the date to start learning from.
-        start_date = self.max_learn_date - \
-            timedelta(days=self.max_days_to_learn)
-        # Create a convenient structure to store samples in.
-        sample_collection = SampleCollection()
-
+        start_date = self.max_learn_date - timedelta(days=self.max_days_to_learn)
         # Query actuals, with prediction left outer joined (so if there isn't a prediction, you'll
         # get an actual, but prediction will be None)
         query = get_actuals_left_outer_join_with_predictions(
             self.session, self.model.id, self.grid.id, self.station_code, start_date, self.max_learn_date)
-        # We need to keep track of previous so that we can do interpolation for the global model.
-        prev_actual = None
-        prev_prediction = None
-        for actual, prediction in query:
-            if prev_actual != actual and prediction is not None:
-                if (prev_actual is not None
-                        and prev_prediction is not None
-                        and prev_actual.weather_date.hour == 20
-                        and prediction.prediction_timestamp.hour == 21
-                        and prev_prediction.prediction_timestamp.hour == 18):
-                    # If there's a gap in the data (like with the GLOBAL model) - then make up
-                    # a noon prediction using interpolation, and add it as a sample.
-                    noon_prediction = construct_interpolated_noon_prediction(prev_prediction, prediction)
-                    self._add_sample_to_collection(
-                        noon_prediction, prev_actual, sample_collection)
-
-                self._add_sample_to_collection(
-                    prediction, actual, sample_collection)
-                prev_prediction = prediction
-            prev_actual = actual
-        return sample_collection
-
-    def learn(self):
-        """ Collect data and perform linear regression.
-        """
-        # collect data
-        data = self._collect_data()
-
-        # iterate through the data, creating a regression model for each variable
-        # and each hour.
-        for sample_key, wrapper_key in zip(SAMPLE_VALUE_KEYS, RegressionModels.keys):
-            sample = getattr(data, sample_key)
-            for hour in sample.hours():
-                regression_model = getattr(
-                    self.regression_models[hour], wrapper_key)
-                regression_model.model.fit(
-                    sample.np_x(hour), sample.np_y(hour))
-                # NOTE: We could get fancy here, and evaluate how good the regression actually worked,
-                # how much sample data we actually had etc., and then not mark the model as being "good".
-                regression_model.good_model = True
+        samples = Samples()
+        samples.collect(query, self.station_code)
+        self.bias_adjustment = BiasAdjustment(samples.fit({self.station_code: self.weights}))
 
     def predict_temperature(self, model_temperature, timestamp):
         """ Predict the bias adjusted temperature for a given point in time, given a corresponding model
@@ -222,13 +446,7 @@ class StationMachineLearning:
         : param timestamp: Datetime value for the predicted value.
         : return: The bias adjusted temperature as predicted by the linear regression model.
         """
-        if model_temperature is None:
-            logger.warning('model temperature for %s was None', timestamp)
-            return None
-        hour = timestamp.hour
-        if self.regression_models[hour].temperature_wrapper.good_model:
-            return self.regression_models[hour].temperature_wrapper.model.predict([[model_temperature]])[0]
-        return None
+        return self.bias_adjustment.predict_temperature(self.station_code, model_temperature, timestamp)
 
     def predict_rh(self, model_rh: float, timestamp: datetime):
         """ Predict the bias adjusted rh for a given point in time, given a corresponding model rh.
@@ -236,7 +454,4 @@ class StationMachineLearning:
         : param timestamp: Datetime value for the predicted value.
         : return: The bias adjusted RH as predicted by the linear regression model.
         """
-        hour = timestamp.hour
-        if self.regression_models[hour].relative_humidity_wrapper.good_model and model_rh is not None:
-            return self.regression_models[hour].relative_humidity_wrapper.model.predict([[model_rh]])[0]
-        return None
+        return self.bias_adjustment.predict_rh(self.station_code, model_rh, timestamp)
@@ -6,8 +6,8 @@ import math
 import struct
 import logging
 import logging.config
-from typing import List, Tuple, Optional
-from sqlalchemy.dialects.postgresql import array
+from typing import Dict, Iterator, List, NamedTuple, Tuple, Optional
+import numpy as np
 from sqlalchemy.orm import Session
 from osgeo import gdal
 from pyproj import CRS, Transformer
@@ -17,10 +17,13 @@ from rasterio.io import DatasetReader
 from app.geospatial import NAD83_CRS
 from app.stations import get_stations_synchronously, StationSourceEnum
 from app.db.models.weather_models import (
-    PredictionModel, PredictionModelRunTimestamp, ModelRunGridSubsetPrediction)
+    PredictionModel, PredictionModelRunTimestamp)
 from app.db.crud.weather_models import (
-    get_prediction_model, get_or_create_prediction_run, get_or_create_grid_subset)
+    get_prediction_model, get_or_create_prediction_run, get_or_create_grid_subset,
+    upsert_model_run_grid_subset_predictions)
 from app.weather_models import ModelEnum, ProjectionEnum
+from app.weather_models.station_grid_index import (StationGridCell, StationGridIndex, get_grid_geometry,
+                                                   calculate_interpolation_weights, calculate_closest_index)
 
 
 logger = logging.getLogger(__name__)
@@ -79,10 +82,7 @@ def get_surrounding_grid(
     values.append(row_two[1])
     values.append(row_two[0])
 
-    points = [[x_index, y_index], [x_index + 1, y_index],
-              [x_index + 1, y_index + 1], [x_index, y_index + 1]]
-
-    return points, values
+    return get_grid_points(x_index, y_index), values
 
 
 def calculate_raster_coordinate(
@@ -101,6 +101,35 @@ def calculate_raster_coordinate(
     return (math.floor(i_index), math.floor(j_index))
 
 
+def calculate_raster_coordinates(
+        longitudes: np.ndarray,
+        latitudes: np.ndarray,
+        transform: Affine,
+        transformer: Transformer) -> Tuple[np.ndarray, np.ndarray]:
+    """ As calculate_raster_coordinate, for many geographic coordinates at once. """
+    raster_longs, raster_lats = transformer.transform(np.asarray(longitudes, dtype=float),
+                                                      np.asarray(latitudes, dtype=float))
+    reverse = ~transform
+    i_indices, j_indices = reverse * (np.asarray(raster_longs), np.asarray(raster_lats))
+    return np.floor(i_indices).astype(int), np.floor(j_indices).astype(int)
+
+
+def get_surrounding_grids(raster: np.ndarray, x_indices: np.ndarray, y_indices: np.ndarray) -> np.ndarray:
+    """ Get the values surrounding many raster coordinates at once, as get_surrounding_grid does for
+    one. Returns an array of shape (number of coordinates, 4), with the values of each grid ordered
+    clockwise from the top left. """
+    return np.stack((raster[y_indices, x_indices],
+                     raster[y_indices, x_indices + 1],
+                     raster[y_indices + 1, x_indices + 1],
+                     raster[y_indices + 1, x_indices]), axis=1)
+
+
+def get_grid_points(x_index: int, y_index: int) -> List[List[int]]:
+    """ Points of the grid with its top left at the given raster coordinate, ordered clockwise. """
+    return [[x_index, y_index], [x_index + 1, y_index],
+            [x_index + 1, y_index + 1], [x_index, y_index + 1]]
+
+
 def calculate_geographic_coordinate(point: Tuple[int],
                                     transform: Affine,
                                     transformer: Transformer):
@@ -158,77 +187,130 @@ def calculate_wind_dir_from_u_v(u: float, v: float):
     return calc if calc > 0 else 360 + calc
 
 
+def calculate_wind_speeds_from_u_v(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """ As calculate_wind_speed_from_u_v, for arrays of u and v """
+    return np.sqrt(np.power(u, 2) + np.power(v, 2))
+
+
+def calculate_wind_dirs_from_u_v(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+    """ As calculate_wind_dir_from_u_v, for arrays of u and v """
+    calc = 90 - (np.arctan2(u, v) * 180 / np.pi + 180)
+    return np.where(calc > 0, calc, 360 + calc)
+
+
+class StationPixels(NamedTuple):
+    """ Raster coordinates (top left of the surrounding grid) of the stations that fall within a raster,
+    along with the window of the raster that contains all of their grids. """
+    station_indices: np.ndarray
+    x_indices: np.ndarray
+    y_indices: np.ndarray
+    x_offset: int
+    y_offset: int
+    x_size: int
+    y_size: int
+
+
+class ExtractedGribValues(NamedTuple):
+    """ The values of the grid surrounding each station, for each weather variable in a grib file, along with
+    the geometry of the grid they were read from. Everything needed to store the file, without the file. """
+    grib_info: ModelRunInfo
+    # Projection (wkt) and transform (in gdal order) of the grid.
+    projection: str
+    transform: Tuple[float, ...]
+    x_size: int
+    y_size: int
+    station_pixels: StationPixels
+    # variable name (e.g. tmp_tgl_2) -> array of shape (number of stations, 4)
+    values: Dict[str, np.ndarray]
+
+
 class GribFileProcessor():
     """ Instances of this object can be used to process and ingest a grib file.
     """
 
-    def __init__(self, station_source: StationSourceEnum):
+    def __init__(self, station_source: StationSourceEnum, stations: Optional[list] = None):
         # Get list of stations we're interested in, and store it so that we only call it once.
-        self.stations = get_stations_synchronously(station_source)
+        self.stations = get_stations_synchronously(station_source) if stations is None else stations
         self.padf_transform = None
         self.raster_to_geo_transformer = None
         self.geo_to_raster_transformer = None
         self.prediction_model: PredictionModel = None
-
-    def yield_data_for_stations(self, raster_band: gdal.Dataset):
+        self.station_grid_index: Dict[int, StationGridCell] = {}
+        # Transformers to and from geographic coordinates, keyed on the projection of the grid.
+        self.transformer_cache: Dict[str, Tuple[Transformer, Transformer]] = {}
+        # Raster coordinates of the stations, keyed on the geometry of the grid.
+        self.station_pixels_cache: Dict[tuple, StationPixels] = {}
+        # Grid subset ids, keyed on the model, the grid geometry and the raster points of the subset.
+        self.grid_subset_cache: Dict[tuple, int] = {}
+
+    def get_station_pixels(self, x_size: int, y_size: int) -> StationPixels:
+        """ Calculate the raster coordinates of all the stations in one go. Every file of a model run
+        shares the same grid, so the result is cached on the grid geometry. """
+        key = (self.padf_transform.to_gdal(), self.geo_to_raster_transformer.definition, x_size, y_size)
+        station_pixels = self.station_pixels_cache.get(key)
+        if station_pixels is None:
+            x_indices, y_indices = calculate_raster_coordinates(
+                [station.long for station in self.stations], [station.lat for station in self.stations],
+                self.padf_transform, self.geo_to_raster_transformer)
+            # The whole of the 2x2 grid surrounding the station has to be in the raster.
+            in_raster = (0 <= x_indices) & (x_indices < x_size - 1) & \
+                (0 <= y_indices) & (y_indices < y_size - 1)
+            for index in np.flatnonzero(~in_raster):
+                logger.warning('coordinate not in raster - %s', self.stations[index])
+            station_indices = np.flatnonzero(in_raster)
+            x_indices, y_indices = x_indices[in_raster], y_indices[in_raster]
+            if len(station_indices) == 0:
+                station_pixels = StationPixels(station_indices, x_indices, y_indices, 0, 0, 0, 0)
+            else:
+                x_offset, y_offset = int(x_indices.min()), int(y_indices.min())
+                station_pixels = StationPixels(station_indices, x_indices, y_indices, x_offset, y_offset,
+                                               int(x_indices.max()) - x_offset + 2, int(y_indices.max()) - y_offset + 2)
+            self.station_pixels_cache[key] = station_pixels
+        return station_pixels
+
+    def read_station_values(self, raster_band: gdal.Dataset) -> Tuple[StationPixels, np.ndarray]:
+        """ Read the window of the band containing the stations into memory, in a single read, and pick out
+        the values of the grid surrounding each station. """
+        station_pixels = self.get_station_pixels(raster_band.XSize, raster_band.YSize)
+        if len(station_pixels.station_indices) == 0:
+            return station_pixels, np.empty((0, 4))
+        window = raster_band.ReadAsArray(xoff=station_pixels.x_offset, yoff=station_pixels.y_offset,
+                                         win_xsize=station_pixels.x_size, win_ysize=station_pixels.y_size,
+                                         buf_type=gdal.GDT_Float32)
+        return station_pixels, get_surrounding_grids(window,
+                                                     station_pixels.x_indices - station_pixels.x_offset,
+                                                     station_pixels.y_indices - station_pixels.y_offset)
+
+    def yield_data_for_stations(self, raster_band: gdal.Dataset) -> Iterator[Tuple[List[List[int]], List[float]]]:
         """ Given a list of stations, and a gdal dataset, yield relevant data
         """
-        for station in self.stations:
-            longitude = station.long
-            latitude = station.lat
-
-            x_coordinate, y_coordinate = calculate_raster_coordinate(
-                longitude, latitude, self.padf_transform, self.geo_to_raster_transformer)
-
-            if 0 <= x_coordinate < raster_band.XSize and 0 <= y_coordinate < raster_band.YSize:
-                points, values = get_surrounding_grid(
-                    raster_band, x_coordinate, y_coordinate)
-            else:
-                logger.warning('coordinate not in raster - %s', station)
-                continue
-
-            yield (points, values)
+        station_pixels, values = self.read_station_values(raster_band)
+        for x_index, y_index, station_values in zip(station_pixels.x_indices, station_pixels.y_indices, values):
+            yield get_grid_points(int(x_index), int(y_index)), station_values.tolist()
+
+    def read_uv_wind_values(self, u_raster_band: gdal.Dataset, v_raster_band: gdal.Dataset,
+                            variable: str) -> Tuple[StationPixels, Optional[np.ndarray]]:
+        """ Calculate the wind direction (wdir_tgl_10) or wind speed (wind_tgl_10) of the grid surrounding each
+        station, from the u-component and v-component of wind. """
+        station_pixels, u_values = self.read_station_values(u_raster_band)
+        v_station_pixels, v_values = self.read_station_values(v_raster_band)
+        assert np.array_equal(station_pixels.station_indices, v_station_pixels.station_indices)
+
+        if variable == 'wdir_tgl_10':
+            return station_pixels, calculate_wind_dirs_from_u_v(u_values.astype(float), v_values.astype(float))
+        if variable == 'wind_tgl_10':
+            return station_pixels, calculate_wind_speeds_from_u_v(u_values.astype(float), v_values.astype(float))
+        return station_pixels, None
 
     def yield_uv_wind_data_for_stations(self, u_raster_band: gdal.Dataset, v_raster_band: gdal.Dataset, variable: str):
         """ Given a list of stations and 2 gdal datasets (one for u-component of wind, one for v-component
         of wind), yield relevant data 
         """
-        for station in self.stations:
-            longitude = station.long
-            latitude = station.lat
-
-            x_coordinate, y_coordinate = calculate_raster_coordinate(
-                longitude, latitude, self.padf_transform, self.geo_to_raster_transformer)
-
-            if 0 <= x_coordinate < u_raster_band.XSize and 0 <= x_coordinate < v_raster_band.XSize and\
-                    0 <= y_coordinate < u_raster_band.YSize and 0 <= y_coordinate < v_raster_band.YSize:
-                u_points, u_values = get_surrounding_grid(u_raster_band, x_coordinate, y_coordinate)
-                v_points, v_values = get_surrounding_grid(v_raster_band, x_coordinate, y_coordinate)
-
-                assert u_points == v_points
-
-                zipped_uv_values = list(zip(u_values, v_values))
-
-                if variable == 'wdir_tgl_10':
-                    yield self.get_wind_dir_values(u_points, zipped_uv_values)
-                elif variable == 'wind_tgl_10':
-                    yield self.get_wind_speed_values(u_points, zipped_uv_values)
-            else:
-                logger.warning('coordinate not in u/v wind rasters - %s', station)
-
-    def get_wind_dir_values(self, u_points: List[int], zipped_uv_values):
-        """ Get calculated wind direction values for list of points and zipped u,v values """
-        wind_dir_values = []
-        for u, v in zipped_uv_values:
-            wind_dir_values.append(calculate_wind_dir_from_u_v(u, v))
-        return (u_points, wind_dir_values)
-
-    def get_wind_speed_values(self, u_points: List[int], zipped_uv_values):
-        """ Get calculated wind speed values for list of points and zipped u,v values """
-        wind_speed_values = []
-        for u, v in zipped_uv_values:
-            wind_speed_values.append(calculate_wind_speed_from_u_v(u, v))
-        return (u_points, wind_speed_values)
+        station_pixels, values = self.read_uv_wind_values(u_raster_band, v_raster_band, variable)
+        if values is None:
+            return
+        for x_index, y_index, station_values in zip(station_pixels.x_indices, station_pixels.y_indices, values):
+            yield get_grid_points(int(x_index), int(y_index)), station_values.tolist()
 
     def get_variable_name(self, grib_info: ModelRunInfo) -> str:
         """ Return the name of the weather variable as it is used in our database,
@@ -253,50 +335,85 @@ class GribFileProcessor():
 
         return variable_name
 
-    def store_bounding_values(self,
-                              points,
-                              values,
-                              preduction_model_run: PredictionModelRunTimestamp,
-                              grib_info: ModelRunInfo,
-                              session: Session):
-        """ Store the values around the area of interest.
-        """
-        # Convert points to geographic coordinates:
-        geographic_points = []
-        for point in points:
-            geographic_points.append(
-                calculate_geographic_coordinate(point, self.padf_transform, self.raster_to_geo_transformer))
-        # Get the grid subset, i.e. the relevant bounding area for this particular model.
-        grid_subset = get_or_create_grid_subset(
-            session, self.prediction_model, geographic_points)
-
-        # Load the record if it exists.
-        prediction = session.query(ModelRunGridSubsetPrediction).\
-            filter(
-                ModelRunGridSubsetPrediction.prediction_model_run_timestamp_id == preduction_model_run.id).\
-            filter(ModelRunGridSubsetPrediction.prediction_timestamp == grib_info.prediction_timestamp).\
-            filter(ModelRunGridSubsetPrediction.prediction_model_grid_subset_id ==
-                   grid_subset.id).first()
-        if not prediction:
-            # Record doesn't exist, so we create it.
-            prediction = ModelRunGridSubsetPrediction()
-            prediction.prediction_model_run_timestamp_id = preduction_model_run.id
-            prediction.prediction_timestamp = grib_info.prediction_timestamp
-            prediction.prediction_model_grid_subset_id = grid_subset.id
-
-        variable_name = self.get_variable_name(grib_info)
-        setattr(prediction, variable_name, array(values))
-        session.add(prediction)
+    def get_grid_subset_id(self, points, session: Session) -> int:
+        """ Return the id of the grid subset (the relevant bounding area for this particular model) around
+        the given raster points. Grid subsets never change, so they are only looked up once per model. """
+        key = (self.prediction_model.id, self.padf_transform.to_gdal(), tuple(map(tuple, points)))
+        grid_subset_id = self.grid_subset_cache.get(key)
+        if grid_subset_id is None:
+            # Convert points to geographic coordinates:
+            geographic_points = []
+            for point in points:
+                geographic_points.append(
+                    calculate_geographic_coordinate(point, self.padf_transform, self.raster_to_geo_transformer))
+            grid_subset_id = get_or_create_grid_subset(session, self.prediction_model, geographic_points).id
+            self.grid_subset_cache[key] = grid_subset_id
+        return grid_subset_id
+
+    def get_station_grid_index(self, session: Session, x_size: int, y_size: int) -> Dict[int, StationGridCell]:
+        """ Return the location of each station in the grid of the model, keyed on station code.
+        The location of a station is only calculated when it isn't already in the index for the geometry
+        of this grid (the first time a model grid is seen, or when the station is new or has moved). """
+        grid_geometry = get_grid_geometry(self.padf_transform, self.geo_to_raster_transformer.definition,
+                                          x_size, y_size)
+        station_grid_index = StationGridIndex.instance()
+        cells = station_grid_index.get(session, self.prediction_model.id)
+        station_pixels = self.get_station_pixels(x_size, y_size)
+        new_cells = []
+        for station_index, x_index, y_index in zip(station_pixels.station_indices,
+                                                   station_pixels.x_indices, station_pixels.y_indices):
+            station = self.stations[station_index]
+            cell = cells.get(station.code)
+            if cell is not None and cell.is_valid_for(grid_geometry, station.lat, station.long):
+                continue
+            points = get_grid_points(int(x_index), int(y_index))
+            geographic_points = [calculate_geographic_coordinate(point, self.padf_transform, self.raster_to_geo_transformer)
+                                 for point in points]
+            coordinate = [station.long, station.lat]
+            new_cells.append(StationGridCell(
+                station_code=station.code,
+                grid_geometry=grid_geometry,
+                latitude=station.lat,
+                longitude=station.long,
+                prediction_model_grid_subset_id=self.get_grid_subset_id(points, session),
+                x_index=int(x_index),
+                y_index=int(y_index),
+                weights=calculate_interpolation_weights(geographic_points, coordinate),
+                closest_index=calculate_closest_index(geographic_points, coordinate)))
+        if new_cells:
+            logger.info('indexing %s stations in the %s grid', len(new_cells), self.prediction_model.abbreviation)
+            cells = station_grid_index.save(session, self.prediction_model.id, grid_geometry, new_cells)
+            session.commit()
+        return cells
+
+    def collect_station_values(self,
+                               station_pixels: StationPixels,
+                               values: np.ndarray,
+                               variable_name: str,
+                               predictions: Dict[int, Dict[str, List[float]]]):
+        """ Add the values of the grid surrounding each station to predictions, keyed on grid subset id. """
+        for station_index, station_values in zip(station_pixels.station_indices, values):
+            cell = self.station_grid_index[self.stations[station_index].code]
+            predictions.setdefault(cell.prediction_model_grid_subset_id, {})[variable_name] = station_values.tolist()
+
+    def store_predictions(self,
+                          predictions: Dict[int, Dict[str, List[float]]],
+                          prediction_run: PredictionModelRunTimestamp,
+                          grib_info: ModelRunInfo,
+                          session: Session):
+        """ Store all the values collected for a grib file, in a single transaction. """
+        if not predictions:
+            return
+        upsert_model_run_grid_subset_predictions(
+            session, prediction_run.id, grib_info.prediction_timestamp, predictions)
         session.commit()
 
-    def process_env_can_grib_file(self, session: Session, dataset, grib_info: ModelRunInfo,
-                                  prediction_run: PredictionModelRunTimestamp):
+    def read_env_can_values(self, dataset, grib_info: ModelRunInfo) -> Tuple[StationPixels, Dict[str, np.ndarray]]:
+        """ Read the station values of a GDPS, RDPS or HRDPS grib file """
         # for GDPS, RDPS, HRDPS models, always only ever 1 raster band in the dataset
         raster_band = dataset.GetRasterBand(1)
-        # Iterate through stations:
-        for (points, values) in self.yield_data_for_stations(raster_band):
-            self.store_bounding_values(
-                points, values, prediction_run, grib_info, session)
+        station_pixels, values = self.read_station_values(raster_band)
+        return station_pixels, {self.get_variable_name(grib_info): values}
 
     def get_raster_bands(self, dataset, grib_info: ModelRunInfo):
         """ Returns raster bands of dataset for temperature, RH, U/V wind components, and 
@@ -322,41 +439,57 @@ class GribFileProcessor():
 
         return (tmp_raster_band, rh_raster_band, u_wind_raster_band, v_wind_raster_band, precip_raster_band)
 
-    def process_noaa_grib_file(self, session: Session, dataset, grib_info: ModelRunInfo,
-                               prediction_run: PredictionModelRunTimestamp):
+    def read_noaa_values(self, dataset, grib_info: ModelRunInfo) -> Tuple[StationPixels, Dict[str, np.ndarray]]:
+        """ Read the station values of all the variables in a GFS or NAM grib file """
         tmp_raster_band, rh_raster_band, u_wind_raster_band, v_wind_raster_band, precip_raster_band = self.get_raster_bands(
             dataset, grib_info)
 
-        for (tmp_points, tmp_values) in self.yield_data_for_stations(tmp_raster_band):
-            grib_info.variable_name = 'tmp_tgl_2'
-            self.store_bounding_values(tmp_points, tmp_values, prediction_run, grib_info, session)
-        for (rh_points, rh_values) in self.yield_data_for_stations(rh_raster_band):
-            grib_info.variable_name = 'rh_tgl_2'
-            self.store_bounding_values(rh_points, rh_values, prediction_run, grib_info, session)
-        if precip_raster_band:
-            for (apcp_points, apcp_values) in self.yield_data_for_stations(precip_raster_band):
-                grib_info.variable_name = 'apcp_sfc_0'
-                self.store_bounding_values(apcp_points, apcp_values, prediction_run, grib_info, session)
-        for wdir_points, wdir_values in self.yield_uv_wind_data_for_stations(u_wind_raster_band, v_wind_raster_band, 'wdir_tgl_10'):
-            grib_info.variable_name = 'wdir_tgl_10'
-            self.store_bounding_values(wdir_points, wdir_values, prediction_run, grib_info, session)
-        for (wind_points, wind_values) in self.yield_uv_wind_data_for_stations(u_wind_raster_band, v_wind_raster_band, 'wind_tgl_10'):
-            grib_info.variable_name = 'wind_tgl_10'
-            self.store_bounding_values(wind_points, wind_values, prediction_run, grib_info, session)
-
-    def process_grib_file(self, filename, grib_info: ModelRunInfo, session: Session):
-        """ Process a grib file, extracting and storing relevant information. """
-        logger.info('processing %s', filename)
+        values = {}
+        for variable_name, raster_band in (('tmp_tgl_2', tmp_raster_band),
+                                           ('rh_tgl_2', rh_raster_band),
+                                           ('apcp_sfc_0', precip_raster_band)):
+            if raster_band:
+                station_pixels, values[variable_name] = self.read_station_values(raster_band)
+        for variable_name in ('wdir_tgl_10', 'wind_tgl_10'):
+            station_pixels, values[variable_name] = self.read_uv_wind_values(
+                u_wind_raster_band, v_wind_raster_band, variable_name)
+        return station_pixels, values
+
+    def set_grid_geometry(self, projection: str, transform: Affine):
+        """ Prepare the transformers to and from the grid of a grib file. """
+        transformers = self.transformer_cache.get(projection)
+        if transformers is None:
+            # Ensure that grib file uses EPSG:4269 (NAD83) coordinate system
+            # (this step is included because HRDPS grib files are in another coordinate system)
+            crs = CRS.from_string(projection)
+            transformers = (get_transformer(crs, NAD83_CRS), get_transformer(NAD83_CRS, crs))
+            self.transformer_cache[projection] = transformers
+        self.raster_to_geo_transformer, self.geo_to_raster_transformer = transformers
+        self.padf_transform = transform
+
+    def extract_station_values(self, filename, grib_info: ModelRunInfo) -> ExtractedGribValues:
+        """ Read the values relevant to the stations out of a grib file. This is the cpu bound part of
+        processing a file, and doesn't touch the database, so can be done in a worker process
+        (see app.weather_models.grib_worker_pool). """
         # Open grib file
         dataset = open_grib(filename)
-        # Ensure that grib file uses EPSG:4269 (NAD83) coordinate system
-        # (this step is included because HRDPS grib files are in another coordinate system)
-        wkt = dataset.GetProjection()
-        crs = CRS.from_string(wkt)
-        self.raster_to_geo_transformer = get_transformer(crs, NAD83_CRS)
-        self.geo_to_raster_transformer = get_transformer(NAD83_CRS, crs)
-
-        self.padf_transform = get_dataset_geometry(filename)
+        projection = dataset.GetProjection()
+        self.set_grid_geometry(projection, get_dataset_geometry(filename))
+        x_size, y_size = dataset.RasterXSize, dataset.RasterYSize
+
+        if grib_info.model_enum in (ModelEnum.GDPS, ModelEnum.RDPS, ModelEnum.HRDPS):
+            station_pixels, values = self.read_env_can_values(dataset, grib_info)
+        elif grib_info.model_enum in (ModelEnum.GFS, ModelEnum.NAM):
+            station_pixels, values = self.read_noaa_values(dataset, grib_info)
+        else:
+            station_pixels, values = self.get_station_pixels(x_size, y_size), {}
+        return ExtractedGribValues(grib_info, projection, self.padf_transform.to_gdal(), x_size, y_size,
+                                   station_pixels, values)
+
+    def store_station_values(self, extracted: ExtractedGribValues, session: Session):
+        """ Store the values extracted from a grib file, in a single transaction. """
+        grib_info = extracted.grib_info
+        self.set_grid_geometry(extracted.projection, Affine.from_gdal(*extracted.transform))
         # get the model (.e.g. GPDS/RDPS latlon24x.24):
         self.prediction_model = get_prediction_model(
             session, grib_info.model_enum, grib_info.projection)
@@ -365,11 +498,21 @@ class GribFileProcessor():
                 'Could not find this prediction model in the database',
                 grib_info.model_enum, grib_info.projection)
 
+        # get the location of the stations in the grid of the model:
+        self.station_grid_index = self.get_station_grid_index(session, extracted.x_size, extracted.y_size)
+
         # get the model run (e.g. GDPS latlon24x.24 for 2020 07 07 12h00):
         prediction_run = get_or_create_prediction_run(
             session, self.prediction_model, grib_info.model_run_timestamp)
 
-        if self.prediction_model.abbreviation in ['GDPS', 'RDPS', 'HRDPS']:
-            self.process_env_can_grib_file(session, dataset, grib_info, prediction_run)
-        elif self.prediction_model.abbreviation in ['GFS', 'NAM']:
-            self.process_noaa_grib_file(session, dataset, grib_info, prediction_run)
+        predictions = {}
+        for variable_name, values in extracted.values.items():
+            if values is not None:
+                self.collect_station_values(extracted.station_pixels, values, variable_name, predictions)
+        # All the variables of a prediction hour are written at once.
+        self.store_predictions(predictions, prediction_run, grib_info, session)
+
+    def process_grib_file(self, filename, grib_info: ModelRunInfo, session: Session):
+        """ Process a grib file, extracting and storing relevant information. """
+        logger.info('processing %s', filename)
+        self.store_station_values(self.extract_station_values(filename, grib_info), session)
@@ -0,0 +1,129 @@
+""" Precomputed location of weather stations in the grids of the prediction models.
+
+Every file of every model run shares the same grid, so for each (prediction model, station) we calculate
+the grid subset the station falls in, where that subset is in the raster, the weights to interpolate its
+vertices to the station, and the closest vertex, once. The index is persisted, and cached in-process, and
+only recalculated when the grid geometry of a model changes or a station is added or moved.
+"""
+import hashlib
+import threading
+from typing import Dict, List, NamedTuple, Optional, Sequence
+import numpy as np
+from pyproj import Geod
+from scipy.spatial import Delaunay
+from sqlalchemy.orm import Session
+from affine import Affine
+from app.db.crud.weather_models import get_station_grid_indexes, save_station_grid_indexes
+from app.utils.singleton import Singleton
+import app.utils.time as time_utils
+
+
+class StationGridCell(NamedTuple):
+    """ The location of a weather station in the grid of a prediction model. """
+    station_code: int
+    grid_geometry: str
+    latitude: float
+    longitude: float
+    prediction_model_grid_subset_id: int
+    x_index: int
+    y_index: int
+    # Linear interpolation weights of the grid subset vertices, None if the station is outside the subset.
+    weights: Optional[List[float]]
+    closest_index: int
+
+    def is_valid_for(self, grid_geometry: str, latitude: float, longitude: float) -> bool:
+        """ Is this location still valid for the given grid geometry and station location? """
+        return self.grid_geometry == grid_geometry and self.latitude == latitude and self.longitude == longitude
+
+
+def get_grid_geometry(padf_transform: Affine, crs_definition: str, x_size: int, y_size: int) -> str:
+    """ Identify the geometry of a grid: the transform, the projection and the size of the raster. """
+    geometry = repr((padf_transform.to_gdal(), crs_definition, x_size, y_size))
+    return hashlib.sha1(geometry.encode()).hexdigest()
+
+
+def calculate_interpolation_weights(points: Sequence[Sequence[float]], coordinate: Sequence[float]) -> Optional[List[float]]:
+    """ Weights such that the weighted sum of values at the points is the linear interpolation of those values
+    at the coordinate, i.e. the same as griddata(points, values, coordinate, method='linear').
+    Returns None if the coordinate is outside of the points. """
+    # griddata triangulates the points, and interpolates within the triangle containing the coordinate,
+    # using the barycentric coordinates of the coordinate as weights.
+    triangulation = Delaunay(np.asarray(points, dtype=float))
+    coordinate = np.asarray(coordinate, dtype=float)
+    simplex = int(triangulation.find_simplex(coordinate))
+    if simplex < 0:
+        return None
+    transform = triangulation.transform[simplex]
+    barycentric = transform[:2].dot(coordinate - transform[2])
+    weights = np.zeros(len(points))
+    weights[triangulation.simplices[simplex]] = np.append(barycentric, 1 - barycentric.sum())
+    return weights.tolist()
+
+
+def interpolate(values: np.ndarray, weights: Optional[Sequence[float]]) -> np.ndarray:
+    """ Interpolate values at the points (the last axis of values) to the coordinate the weights were
+    calculated for, in a single matrix multiply. As with griddata, the result is nan if the coordinate is
+    outside of the points (i.e. there are no weights). """
+    values = np.asarray(values, dtype=float)
+    if weights is None:
+        return np.full(values.shape[:-1], np.nan)
+    return values @ np.asarray(weights, dtype=float)
+
+
+def calculate_closest_index(points: Sequence[Sequence[float]], coordinate: Sequence[float]) -> int:
+    """ Get the index of the point closest to the coordinate """
+    # Use GRS80 ellipsoid (it's what NAD83 uses)
+    geod = Geod(ellps="GRS80")
+    _, _, distances = geod.inv([coordinate[0]] * len(points), [coordinate[1]] * len(points),
+                               [point[0] for point in points], [point[1] for point in points])
+    return int(np.argmin(distances))
+
+
+@Singleton
+class StationGridIndex():
+    """ In-process cache of the persisted location of each station in the grid of each prediction model. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # prediction model id -> station code -> location
+        self._cells: Dict[int, Dict[int, StationGridCell]] = {}
+
+    def get(self, session: Session, prediction_model_id: int) -> Dict[int, StationGridCell]:
+        """ Return the location of the stations in the grid of the model, keyed on station code. """
+        with self._lock:
+            cells = self._cells.get(prediction_model_id)
+        if cells is None:
+            cells = {record.station_code: StationGridCell(
+                station_code=record.station_code,
+                grid_geometry=record.grid_geometry,
+                latitude=record.latitude,
+                longitude=record.longitude,
+                prediction_model_grid_subset_id=record.prediction_model_grid_subset_id,
+                x_index=record.x_index,
+                y_index=record.y_index,
+                weights=record.weights,
+                closest_index=record.closest_index)
+                for record in get_station_grid_indexes(session, prediction_model_id)}
+            with self._lock:
+                self._cells[prediction_model_id] = cells
+        return cells
+
+    def save(self, session: Session, prediction_model_id: int, grid_geometry: str,
+             cells: List[StationGridCell]) -> Dict[int, StationGridCell]:
+        """ Persist new station locations for a model (without committing), returning the updated index.
+        Locations in any other geometry of the grid are discarded. """
+        update_date = time_utils.get_utc_now()
+        save_station_grid_indexes(session, prediction_model_id, grid_geometry,
+                                  [dict(cell._asdict(), prediction_model_id=prediction_model_id, update_date=update_date)
+                                   for cell in cells])
+        with self._lock:
+            existing = self._cells.get(prediction_model_id, {})
+            updated = {code: cell for code, cell in existing.items() if cell.grid_geometry == grid_geometry}
+            updated.update({cell.station_code: cell for cell in cells})
+            self._cells[prediction_model_id] = updated
+        return updated
+
+    def clear(self):
+        """ Forget all cached locations, they will be reloaded from the database. """
+        with self._lock:
+            self._cells.clear()
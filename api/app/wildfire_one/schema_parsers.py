@@ -90,7 +90,13 @@ async def weather_indeterminate_list_mapper(raw_dailies: Generator[dict, None, N
                 relative_humidity=raw_daily.get('relativeHumidity'),
                 precipitation=raw_daily.get('precipitation'),
                 wind_direction=raw_daily.get('windDirection'),
-                wind_speed=raw_daily.get('windSpeed')
+                wind_speed=raw_daily.get('windSpeed'),
+                fine_fuel_moisture_code=raw_daily.get('fineFuelMoistureCode'),
+                duff_moisture_code=raw_daily.get('duffMoistureCode'),
+                drought_code=raw_daily.get('droughtCode'),
+                initial_spread_index=raw_daily.get('initialSpreadIndex'),
+                build_up_index=raw_daily.get('buildUpIndex'),
+                fire_weather_index=raw_daily.get('fireWeatherIndex')
             ))
         elif is_station_valid(raw_daily.get('stationData')) and raw_daily.get('recordType').get('id') == "FORECAST":
             forecasts.append(WeatherIndeterminate(